@@ -0,0 +1,144 @@
+# 配对引擎模拟：对比随机抽样与 game/pairing.py 的排名收敛速度
+# 在项目根目录运行：python _for_developers/pairing_simulation.py --participants 200
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from game.pairing import PairingEngine  # noqa: E402
+
+LINEUP_SIZE = 7
+BLUE_COUNT = 4  # 4 名蓝方（好人）对 3 名红方
+INITIAL_ELO = 1200
+K_FACTOR = 100  # 与 database/action.py 中的 ELO 计算一致
+
+
+def spearman(xs, ys):
+    """Spearman 秩相关系数（无并列名次的简化版本）"""
+
+    def ranks(values):
+        order = sorted(range(len(values)), key=lambda i: values[i])
+        result = [0] * len(values)
+        for rank, i in enumerate(order):
+            result[i] = rank
+        return result
+
+    rx, ry = ranks(xs), ranks(ys)
+    n = len(xs)
+    d2 = sum((a - b) ** 2 for a, b in zip(rx, ry))
+    return 1 - 6 * d2 / (n * (n * n - 1))
+
+
+def play(lineup, skills, ratings, rng):
+    """按真实水平模拟一局，并按线上规则更新 ELO（不含 token 惩罚）"""
+    roles = list(lineup)
+    rng.shuffle(roles)  # 裁判随机分配角色
+    blue, red = roles[:BLUE_COUNT], roles[BLUE_COUNT:]
+
+    def mean(values):
+        return sum(values) / len(values)
+
+    blue_true = mean([skills[p] for p in blue])
+    red_true = mean([skills[p] for p in red])
+    blue_wins = rng.random() < 1 / (1 + 10 ** ((red_true - blue_true) / 400))
+
+    # 线上使用调和平均
+    def team_avg(team):
+        return len(team) / sum(1 / max(1, ratings[p]) for p in team)
+
+    blue_avg, red_avg = team_avg(blue), team_avg(red)
+    blue_expected = 1 / (1 + 10 ** ((red_avg - blue_avg) / 400))
+    for team, expected, won in (
+        (blue, blue_expected, blue_wins),
+        (red, 1 - blue_expected, not blue_wins),
+    ):
+        delta = K_FACTOR * ((1.0 if won else 0.0) - min(1, expected * 0.9))
+        for p in team:
+            ratings[p] = max(round(ratings[p] + delta), 100)
+
+
+def simulate(strategy, args, seed):
+    rng = random.Random(seed)
+    players = list(range(args.participants))
+    skills = {p: rng.gauss(1500, args.skill_sd) for p in players}
+    ratings = {p: INITIAL_ELO for p in players}
+    engine = None
+    if strategy == "balanced":
+        engine = PairingEngine(
+            lineup_size=LINEUP_SIZE,
+            window=args.window,
+            elo_scale=args.elo_scale,
+            rng=random.Random(seed + 1),
+        )
+        engine.update_participants(ratings)
+
+    truth = [skills[p] for p in players]
+    history = []
+    converged_at = None
+    stable = 0
+    for game in range(1, args.max_games + 1):
+        if engine is not None:
+            if game % args.refresh_every == 0:
+                # 与 AutoMatchInstance 一致：定期从数据库刷新 ELO
+                engine.update_participants(ratings)
+            lineup = engine.next_lineup()
+        else:
+            lineup = rng.sample(players, LINEUP_SIZE)
+        play(lineup, skills, ratings, rng)
+
+        if game % args.checkpoint == 0:
+            rho = spearman([ratings[p] for p in players], truth)
+            history.append((game, rho))
+            # 连续 3 个检查点达到阈值视为收敛
+            stable = stable + 1 if rho >= args.threshold else 0
+            if stable >= 3 and converged_at is None:
+                converged_at = game - 2 * args.checkpoint
+                if not args.full:
+                    break
+    return converged_at, history
+
+
+def main():
+    parser = argparse.ArgumentParser(description="配对策略收敛速度模拟")
+    parser.add_argument("--participants", type=int, default=200)
+    parser.add_argument("--max-games", type=int, default=60000)
+    parser.add_argument("--checkpoint", type=int, default=200)
+    parser.add_argument("--threshold", type=float, default=0.75)
+    parser.add_argument("--skill-sd", type=float, default=200)
+    parser.add_argument("--window", type=int, default=28)
+    parser.add_argument("--elo-scale", type=float, default=200)
+    parser.add_argument("--refresh-every", type=int, default=10)
+    parser.add_argument("--seeds", type=int, default=3)
+    parser.add_argument(
+        "--full", action="store_true", help="收敛后继续模拟到 max-games"
+    )
+    args = parser.parse_args()
+
+    print(
+        f"参与者 {args.participants}，收敛判据：ELO 与真实水平的 Spearman 相关系数"
+        f"连续 3 个检查点 >= {args.threshold}"
+    )
+    for strategy in ("random", "balanced"):
+        results = []
+        for seed in range(args.seeds):
+            converged_at, history = simulate(strategy, args, seed)
+            results.append(converged_at)
+            final_rho = history[-1][1] if history else float("nan")
+            shown = converged_at if converged_at is not None else "未收敛"
+            print(
+                f"[{strategy}] seed={seed} 收敛局数: {shown}  最终相关系数: {final_rho:.3f}"
+            )
+        done = [r for r in results if r is not None]
+        if done:
+            avg = sum(done) / len(done)
+            print(
+                f"[{strategy}] 平均收敛局数: {avg:.0f}"
+                f"（人均 {avg * LINEUP_SIZE / args.participants:.1f} 场），"
+                f"收敛 {len(done)}/{len(results)}"
+            )
+
+
+if __name__ == "__main__":
+    main()
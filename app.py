@@ -8,12 +8,18 @@ from datetime import timedelta, datetime
 import logging
 import os
 import shutil
-from utils.battle_manager_utils import init_battle_manager_utils
+from utils.battle_manager_utils import (
+    init_battle_manager_utils,
+    get_battle_manager,
+    is_battle_host,
+)
 from utils.automatch_utils import init_automatch_utils, get_automatch
+from game.battle_queue import is_durable_queue_enabled
+from game.battle_ipc import get_battle_service_config
 from blueprints.ai_editing_control import ai_editing_control
 
 from database.base import db, login_manager
-from database import initialize_database
+from database import initialize_database, create_missing_indexes
 from database import (
     get_user_by_email,
     create_user,
@@ -293,16 +299,26 @@ def initialize_default_data(app):
 
 
 def cleanup_stale_battles(app):
-    """在服务器启动时删除所有标记为playing、waiting或cancelled状态的对局"""
+    """
+    在服务器启动时删除所有标记为playing、waiting或cancelled状态的对局
+    启用持久化队列时，仍有未完成任务的对局会被保留并在重启后继续执行
+    """
     with app.app_context():
         try:
-            from database.models import Battle, GameStats, BattlePlayer, db
-            from database.action import delete_battle
+            from database.models import Battle, BattleJob, GameStats, BattlePlayer, db
+            from database.action import delete_battle, ACTIVE_JOB_STATES
 
             # 修改查询条件，也包括已取消的对局
-            stale_battles = Battle.query.filter(
+            stale_query = Battle.query.filter(
                 Battle.status.in_(["playing", "waiting", "cancelled"])
-            ).all()
+            )
+            if is_durable_queue_enabled():
+                # 排队中或执行中的任务由租约机制恢复，不能删除
+                active_jobs = db.session.query(BattleJob.battle_id).filter(
+                    BattleJob.state.in_(ACTIVE_JOB_STATES)
+                )
+                stale_query = stale_query.filter(~Battle.id.in_(active_jobs))
+            stale_battles = stale_query.all()
 
             if not stale_battles:
                 app.logger.info("✅ 没有发现需要清理的对局")
@@ -419,6 +435,7 @@ def create_app(config_object=Config):
     from blueprints.docs import docs_bp
     from blueprints.admin import admin_bp
     from blueprints.performance import performance_bp
+    from blueprints.metrics import metrics_bp
 
     # 将蓝图注册到应用
     app.register_blueprint(main_bp)
@@ -433,10 +450,12 @@ def create_app(config_object=Config):
     app.register_blueprint(docs_bp, url_prefix="/docs")
     app.register_blueprint(admin_bp)
     app.register_blueprint(performance_bp, url_prefix="/performance")
+    app.register_blueprint(metrics_bp)
 
     # 创建数据库表
     with app.app_context():
         db.create_all()
+        create_missing_indexes()
 
     # 配置日志
     logging.basicConfig(level=app.config["LOG_LEVEL"])
@@ -462,7 +481,18 @@ def create_app(config_object=Config):
     automatch.terminate_all_and_clear()  # 确保应用启动时没有遗留的运行实例
 
     # 再清理意外中断的对局
-    cleanup_stale_battles(app)
+    # host 模式下只由当选的执行进程清理，避免新启动的 worker 删除执行进程中正在进行的对局；
+    # runner 模式下由 battle_runner.py 启动时清理
+    service_mode = get_battle_service_config()["mode"]
+    if service_mode == "local" or (service_mode == "host" and is_battle_host()):
+        cleanup_stale_battles(app)
+    if service_mode == "host" or (
+        service_mode == "local" and is_durable_queue_enabled()
+    ):
+        # 立即启动对战管理器：继续执行持久化队列中遗留的对战，并确保本机已有执行进程
+        get_battle_manager()
+    # 接管持有进程已退出的自动对战运行（AUTOMATCH_STATE.resume 开启时）
+    automatch.start_resume_watcher()
     # 清理文件不存在的AI代码记录
     cleanup_invalid_ai_codes(app)
     if is_debug:
@@ -484,3 +514,21 @@ def create_app(config_object=Config):
 
     app.logger.info("Flask应用初始化完成")
     return app
+
+
+def create_script_app(config_object=Config):
+    """
+    为离线维护脚本（recompute_elo.py、backfill_battle_summaries.py）创建最小应用：
+    只加载配置、初始化数据库并补建缺少的表与索引。
+    不注册蓝图，也不执行 create_app 的启动流程（终止自动对战、清理中断的对局、
+    启动对战管理器与接管监视），可以在服务运行时执行而不影响正在进行的对局
+    """
+    app = Flask(__name__)
+    app.config.from_object(config_object)
+    initialize_database(app)
+    with app.app_context():
+        db.create_all()
+        create_missing_indexes()
+    logging.basicConfig(level=app.config["LOG_LEVEL"])
+    app.logger.setLevel(app.config["LOG_LEVEL"])
+    return app
@@ -0,0 +1,39 @@
+# 对战列表摘要补建入口
+"""
+backfill-battle-summaries：为升级前已结束、还没有列表摘要的对战补建 battle_summaries
+
+部署新增 battle_summaries 的版本后运行一次即可（可在服务运行时执行，重复运行只处理仍缺少摘要的对战）；
+之后结束的对战在提交时自动写入摘要。实现见 database/battle_summary.py。
+
+用法：
+    python backfill_battle_summaries.py [--batch-size N]
+"""
+
+import argparse
+import sys
+
+from app import create_script_app
+from database.battle_summary import backfill_battle_summaries
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="为历史对战补建列表摘要")
+    parser.add_argument(
+        "--batch-size", type=int, default=500, help="每个事务补建的对战数"
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    app = create_script_app()
+    with app.app_context():
+        total = backfill_battle_summaries(batch_size=args.batch_size)
+    if total is None:
+        print("补建失败，详见日志；重新运行会继续补建剩余的对战")
+        sys.exit(1)
+    print(f"已补建 {total} 场对战的列表摘要")
+
+
+if __name__ == "__main__":
+    main()
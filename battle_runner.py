@@ -0,0 +1,98 @@
+# 独立对战执行进程入口
+"""
+battle-runner：在 web 进程之外执行对战
+
+在 config.yaml 中设置 BATTLE_SERVICE.mode: runner 后，web 进程不再执行对战，
+只通过 Unix socket 调用本进程启动、取消对战并查询状态与快照；
+本进程持有 BattleManager、ClientManager 与对局日志写入，结果写回数据库。
+web 部署与重启不会中断正在进行的对局，对战负载也不会影响 HTTP 延迟。
+
+收到 SIGTERM/SIGINT 时停止接受新对战（web 进程收到 429），等待进行中的对局结束后退出。
+配合 DURABLE_BATTLE_QUEUE 使用时，未领取的对战保留在数据库中，可启动多个执行进程
+（各自使用不同的 --socket-path 与 --lock-path）共同消费同一队列。
+
+用法：
+    python battle_runner.py [--socket-path PATH] [--lock-path PATH] [--drain-seconds N]
+"""
+
+import argparse
+import logging
+import signal
+import sys
+import threading
+
+from app import create_app, cleanup_stale_battles
+from game.avalon_game_helper import shutdown_helpers
+from game.battle_ipc import get_battle_service_config
+from game.client_manager import get_client_manager
+from utils.battle_manager_utils import (
+    is_battle_host,
+    start_battle_runner,
+    stop_battle_runner,
+)
+
+logger = logging.getLogger("BattleRunner")
+
+
+def parse_args():
+    service_config = get_battle_service_config()
+    parser = argparse.ArgumentParser(description="阿瓦隆对战独立执行进程")
+    parser.add_argument(
+        "--socket-path",
+        default=service_config["socket_path"],
+        help="web 进程连接的 Unix socket 路径",
+    )
+    parser.add_argument(
+        "--lock-path",
+        default=service_config["lock_path"],
+        help="保证同一 socket 只有一个执行进程的锁文件路径",
+    )
+    parser.add_argument(
+        "--drain-seconds",
+        type=float,
+        default=float(service_config.get("drain_seconds", 600)),
+        help="收到 SIGTERM 后等待进行中对局结束的最长时间（秒）",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    app = create_app()
+
+    if get_battle_service_config()["mode"] != "runner":
+        logger.warning("BATTLE_SERVICE.mode 不是 runner，web 进程仍会自行执行对战")
+
+    if not is_battle_host(args.lock_path):
+        logger.error(f"{args.lock_path} 已被其他执行进程持有，退出")
+        sys.exit(1)
+
+    # 当选后、开始执行前清理上次中断的对局（web 进程在 runner 模式下不清理）
+    cleanup_stale_battles(app)
+    start_battle_runner(args.socket_path, args.lock_path)
+    logger.info(f"对战执行进程已启动，socket：{args.socket_path}")
+
+    stop_event = threading.Event()
+
+    def handle_signal(signum, frame):
+        logger.info(f"收到信号 {signum}，开始排空进行中的对局")
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    # 使用带超时的等待，使主线程能及时处理信号
+    while not stop_event.wait(1.0):
+        pass
+
+    drained = stop_battle_runner(args.drain_seconds)
+    shutdown_helpers()
+    client_manager = get_client_manager()
+    if client_manager:
+        client_manager.shutdown()
+    logger.info("对战执行进程已退出" if drained else "对战执行进程排空超时，强制退出")
+    sys.exit(0 if drained else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -13,8 +13,9 @@ from database.promotion import (
     reset_ranking,
     reset_stats,
 )
-from database import db
+from database import db, mark_battle_summaries_stale
 from utils.automatch_utils import get_automatch
+from game.client_manager import PRIORITY_HIGH
 
 # 管理员蓝图
 admin_bp = Blueprint("admin", __name__)
@@ -87,6 +88,19 @@ def delete_user(user_id):
         # 1. 处理用户关联的AI代码和BattlePlayer记录
         ai_code_ids = [ai.id for ai in AICode.query.filter_by(user_id=target.id).all()]
 
+        # 批量删除参与者不经过会话事件，登记这些对战以便提交前重写列表摘要
+        affected_battles = (
+            db.session.query(BattlePlayer.battle_id)
+            .filter(
+                (BattlePlayer.user_id == target.id)
+                | BattlePlayer.selected_ai_code_id.in_(ai_code_ids)
+            )
+            .distinct()
+        )
+        mark_battle_summaries_stale(
+            db.session, [row.battle_id for row in affected_battles]
+        )
+
         # 删除AI代码关联的BattlePlayer（不触发ELO回滚）
         BattlePlayer.query.filter(
             BattlePlayer.selected_ai_code_id.in_(ai_code_ids)
@@ -269,6 +283,7 @@ def _handle_match_operation(
     operation_method_name,
     success_verb,
     failure_detail_verb,
+    **operation_kwargs,
 ):
     """
     处理多个榜单的自动对战操作
@@ -279,6 +294,7 @@ def _handle_match_operation(
         operation_method_name: 要调用的方法名，如'start_automatch_for_ranking'
         success_verb: 成功信息动词
         failure_detail_verb: 失败信息动词
+        operation_kwargs: 透传给操作方法的额外参数，如 priority
 
     返回:
         JSON响应和HTTP状态码
@@ -300,7 +316,7 @@ def _handle_match_operation(
     for ranking_id in ranking_ids:
         try:
             method_to_call = getattr(automatch, operation_method_name)
-            if method_to_call(ranking_id):
+            if method_to_call(ranking_id, **operation_kwargs):
                 success_count += 1
                 results[ranking_id] = "success"
                 logging.info(f"榜单 {ranking_id} {success_verb}")
@@ -350,6 +366,35 @@ def _handle_match_operation(
         )
 
 
+TOURNAMENT_OPTIONS = (
+    "mode",
+    "confidence_z",
+    "min_games",
+    "max_games",
+    "max_games_per_participant",
+    "advance_ratio",
+)
+
+
+def _select_start_operation(full_ranking=False, **operation_kwargs):
+    """
+    根据请求体选择启动方式，返回 (方法名, 参数)
+    请求体为 {"scheduler": "tournament"} 时启动锦标赛（排名确定后自动停止），
+    并可覆盖 TOURNAMENT_OPTIONS 中的配置；否则启动自动对战，
+    可用 {"target_battles": N} 指定启动 N 局后自动结束
+    """
+    data = request.get_json(silent=True) or {}
+    if data.get("scheduler") != "tournament":
+        if data.get("target_battles"):
+            operation_kwargs["target_battles"] = int(data["target_battles"])
+        return "start_automatch_for_ranking", operation_kwargs
+    operation_kwargs["full_ranking"] = full_ranking
+    for key in TOURNAMENT_OPTIONS:
+        if data.get(key) is not None:
+            operation_kwargs[key] = data[key]
+    return "start_tournament_for_ranking", operation_kwargs
+
+
 # Helper function for terminate action (slightly different success message and no failure branch from method call)
 def _handle_terminate_operation(get_automatch_func, ranking_id_iterator):
     """
@@ -407,12 +452,14 @@ def _handle_terminate_operation(get_automatch_func, ranking_id_iterator):
 @admin_required
 def start_auto_test_match():
     primary_ids = range(1)
+    method_name, operation_kwargs = _select_start_operation()
     return _handle_match_operation(
         get_automatch,
         primary_ids,
-        "start_automatch_for_ranking",
+        method_name,
         "已启动",
         "已在运行。",
+        **operation_kwargs,
     )
 
 
@@ -492,12 +539,14 @@ def start_auto_primary_match():
     primary_ids = range(
         PRIMARY_RANKING_START_ID, PRIMARY_RANKING_START_ID + PRIMARY_PARTITION
     )
+    method_name, operation_kwargs = _select_start_operation()
     return _handle_match_operation(
         get_automatch,
         primary_ids,
-        "start_automatch_for_ranking",
+        method_name,
         "已启动",
         "已在运行。",
+        **operation_kwargs,
     )
 
 
@@ -606,12 +655,14 @@ def start_auto_semi_match():
 
     # 2. 启动半决赛榜单的自动对战
     semi_ids = range(SEMI_RANKING_START_ID, SEMI_RANKING_START_ID + SEMI_PARTITION)
+    method_name, operation_kwargs = _select_start_operation()
     return _handle_match_operation(
         get_automatch,
         semi_ids,
-        "start_automatch_for_ranking",
+        method_name,
         "已启动（已完成选手晋级）",
         "已在运行。",
+        **operation_kwargs,
     )
 
 
@@ -712,14 +763,19 @@ def start_auto_final_match():
             for error in result["errors"]:
                 logging.warning(f"榜单 {ranking_id} 晋级错误: {error}")
 
-    # 2. 启动决赛榜单的自动对战
+    # 2. 启动决赛榜单的自动对战（决赛对局使用高优先级，保证LLM延迟稳定）
     final_ids = range(FINAL_RANKING_START_ID, FINAL_RANKING_START_ID + FINAL_PARTITION)
+    # 锦标赛模式下决赛需要确定完整排名
+    method_name, operation_kwargs = _select_start_operation(
+        full_ranking=True, priority=PRIORITY_HIGH
+    )
     return _handle_match_operation(
         get_automatch,
         final_ids,
-        "start_automatch_for_ranking",
+        method_name,
         "已启动（已完成选手晋级）",
         "已在运行。",
+        **operation_kwargs,
     )
 
 
@@ -793,6 +849,35 @@ def reset_auto_final_match():
         )
 
 
+@admin_bp.route("/admin/automatch_capacity", methods=["GET", "POST"])
+@admin_required
+def automatch_capacity():
+    """
+    查看或调整各榜单共享的自动对战容量分配
+    POST 请求体（字段均可选）：
+    {"enabled": true, "total_slots": 60, "follow_battle_manager": false, "weights": {"21": 3}}
+    """
+    automatch = get_automatch()
+    if request.method == "GET":
+        return jsonify(
+            {"status": "success", "capacity": automatch.get_capacity_status()}
+        )
+
+    data = request.get_json(silent=True) or {}
+    try:
+        capacity = automatch.configure_capacity(
+            enabled=data.get("enabled"),
+            total_slots=data.get("total_slots") or None,
+            follow_battle_manager=bool(data.get("follow_battle_manager")),
+            weights=data.get("weights"),
+        )
+    except (TypeError, ValueError) as e:
+        return jsonify({"status": "error", "message": f"参数错误: {str(e)}"}), 400
+    return jsonify(
+        {"status": "success", "message": "容量分配已更新", "capacity": capacity}
+    )
+
+
 @admin_bp.route("/admin/toggle_admin/<string:user_id>", methods=["POST"])
 @login_required
 @admin_required
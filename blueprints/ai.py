@@ -22,7 +22,6 @@ from flask import (
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
 import time
-import json
 
 # 导入 database 操作函数
 from database import (
@@ -39,24 +38,26 @@ from database import (
     update_battle_player_count,
     add_player_to_battle,
     create_battle_instance,
-    update_battle,
+    create_battles_bulk as db_create_battles_bulk,
+    mark_battle_as_cancelled as db_mark_battle_as_cancelled,
     get_game_stats_by_user_id,
     create_game_stats,
     safe_delete,
 )
-from database.models import AICode, BattlePlayer  # 仍然需要模型用于类型提示或特定查询
+from database.models import AICode  # 仍然需要模型用于类型提示或特定查询
 from blueprints.ai_editing_control import ai_editing_control
 from datetime import datetime
 import importlib.util
 import sys
 import inspect
 import pickle
-import json
 import time
 
 PARTITION_NUMBER = 6
 RANKING_IDS = [0, 1, 2, 3, 4, 5, 6, 11, 21]
-from utils.battle_manager_utils import get_battle_manager
+from utils.battle_manager_utils import get_battle_manager, busy_response
+from game.client_manager import PRIORITY_LOW
+from game.battle_manager import BattleQueueFullError
 
 # 创建蓝图
 ai_bp = Blueprint("ai", __name__)
@@ -777,204 +778,86 @@ def start_ai_series_test():
     battle_manager = get_battle_manager()
 
     MAX_PLAYERS = 7
-    # 将7个位置分成3批次处理
-    BATCH_SIZE = 3
     positions_to_test = list(range(1, MAX_PLAYERS + 1))
-    batches = [
-        positions_to_test[i : i + BATCH_SIZE]
-        for i in range(0, len(positions_to_test), BATCH_SIZE)
-    ]
 
-    battles_created_ids = []
+    # 对战队列容纳不下整组测试时直接返回429，不创建任何对战记录
+    try:
+        battle_manager.check_admission(MAX_PLAYERS)
+    except BattleQueueFullError as e:
+        current_app.logger.warning(f"系列测试：对战队列已满，拒绝请求。{e}")
+        return busy_response(e)
+
+    # 1. 为每个位置准备一组参与者：被测试的AI在该位置，其余位置由Smart AI填充
+    if len(available_smart_ais) < MAX_PLAYERS - 1:
+        current_app.logger.info(
+            f"智能AI不足，启用重复使用模式。使用 {len(available_smart_ais)} 个智能AI填充 {MAX_PLAYERS-1} 个位置"
+        )
+    lineups = []
+    for position_of_test_ai in positions_to_test:
+        if len(available_smart_ais) < MAX_PLAYERS - 1:
+            # 当Smart AI不足6个时，允许重复使用
+            smart_ais_to_fill = [
+                available_smart_ais[i % len(available_smart_ais)]
+                for i in range(MAX_PLAYERS - 1)
+            ]
+        else:
+            # 如果足够，仍然使用不重复的
+            smart_ais_to_fill = random.sample(available_smart_ais, k=MAX_PLAYERS - 1)
+        smart_ais_to_fill.insert(position_of_test_ai - 1, ai_to_test)
+        lineups.append(
+            [{"user_id": ai.user_id, "ai_code_id": ai.id} for ai in smart_ais_to_fill]
+        )
 
-    # 分批处理位置测试
-    for batch_index, batch_positions in enumerate(batches):
-        # 处理当前批次的位置
-        for position_of_test_ai in batch_positions:
-            try:
-                # 1. 创建对战实例
-                # 注意：create_battle_instance 只是创建了Battle记录，并不添加玩家
-                # ranking_id可以设为特殊值，或者依赖 is_elo_exempt
-                battle = create_battle_instance(
-                    created_by=current_user.id, ranking_id=0
-                )  # 或一个特殊的ranking_id for tests
-                if not battle:
-                    current_app.logger.error(
-                        f"系列测试：为位置 {position_of_test_ai} 创建Battle记录失败。"
-                    )
-                    continue  # 跳过这个位置的测试
-
-                # 2. 更新Battle记录为ELO豁免和测试类型
-                update_success = update_battle(
-                    battle, is_elo_exempt=True, battle_type="ai_series_test"
-                )
-                if not update_success:
-                    current_app.logger.error(
-                        f"系列测试：更新Battle {battle.id} 的豁免状态失败。"
-                    )
-                    # 可以选择删除已创建的battle或标记为错误
-
-                # 3. 准备参与者数据列表
-                participant_data_for_bm = []  # 用于传递给 BattleManager
-                players_for_db_battle = []  # 用于直接操作BattlePlayer表 (如果需要的话)
-
-                # 添加被测试的AI
-                # add_player_to_battle 会创建 BattlePlayer 记录
-                player_added = add_player_to_battle(
-                    battle_id=battle.id,
-                    user_id=ai_to_test.user_id,  # AI的拥有者
-                    position=position_of_test_ai,
-                    ai_code_id=ai_to_test.id,
-                )
-                if not player_added:
-                    current_app.logger.error(
-                        f"系列测试：无法将测试AI {ai_to_test.id} 添加到对战 {battle.id} 的位置 {position_of_test_ai}。"
-                    )
-                    # 可能需要清理这个battle
-                    continue
-                participant_data_for_bm.append(
-                    {"user_id": ai_to_test.user_id, "ai_code_id": ai_to_test.id}
-                )
+    # 2. 一次性创建全部对战记录（ELO豁免的测试赛）
+    battle_ids = db_create_battles_bulk(
+        lineups, ranking_id=0, is_elo_exempt=True, battle_type="ai_series_test"
+    )
+    if battle_ids is None:
+        current_app.logger.error(
+            f"系列测试：为AI {ai_to_test.id} 批量创建对战记录失败。"
+        )
+        battle_ids = []
 
-                # 填充剩余的Smart AI
-                if len(available_smart_ais) < 6:
-                    # 当Smart AI不足6个时，允许重复使用
-                    smart_ais_to_fill = []
-                    while len(smart_ais_to_fill) < MAX_PLAYERS - 1:
-                        # 循环添加AI直到数量足够
-                        for ai in available_smart_ais:
-                            if len(smart_ais_to_fill) < MAX_PLAYERS - 1:
-                                smart_ais_to_fill.append(ai)
-                    current_app.logger.info(
-                        f"智能AI不足，启用重复使用模式。使用 {len(available_smart_ais)} 个智能AI填充 {MAX_PLAYERS-1} 个位置"
-                    )
-                else:
-                    # 如果足够，仍然使用不重复的
-                    smart_ais_to_fill = random.sample(
-                        available_smart_ais, k=MAX_PLAYERS - 1
-                    )
-
-                current_smart_ai_index = 0
-                for pos in range(1, MAX_PLAYERS + 1):
-                    if pos == position_of_test_ai:
-                        continue  # 跳过测试AI的位置
-
-                    if current_smart_ai_index >= len(smart_ais_to_fill):
-                        current_app.logger.error(
-                            f"系列测试：Smart AI 样本不足以填充位置 {pos} (对战 {battle.id})。"
-                        )
-                        # 这个情况理论上不应该发生，因为前面检查了数量并用了sample
-                        break
-
-                    smart_ai_opponent = smart_ais_to_fill[current_smart_ai_index]
-                    current_smart_ai_index += 1
-
-                    opponent_added = add_player_to_battle(
-                        battle_id=battle.id,
-                        user_id=smart_ai_opponent.user_id,  # Smart AI的拥有者
-                        position=pos,
-                        ai_code_id=smart_ai_opponent.id,
-                    )
-                    if not opponent_added:
-                        current_app.logger.error(
-                            f"系列测试：无法将Smart AI {smart_ai_opponent.id} 添加到对战 {battle.id} 的位置 {pos}。"
-                        )
-                        # 标记此battle为失败并跳过启动
-                        update_battle(
-                            battle,
-                            status="error",
-                            results=json.dumps(
-                                {"error": f"Failed to add Smart AI to pos {pos}"}
-                            ),
-                        )
-                        break  # 中断这个battle的填充
-                    participant_data_for_bm.append(
-                        {
-                            "user_id": smart_ai_opponent.user_id,
-                            "ai_code_id": smart_ai_opponent.id,
-                        }
-                    )
-
-                # 如果填充参与者过程中断，跳过启动
-                if len(participant_data_for_bm) != MAX_PLAYERS:
-                    current_app.logger.error(
-                        f"系列测试：未能为对战 {battle.id} 集齐 {MAX_PLAYERS} 位玩家。实际数量: {len(participant_data_for_bm)}"
-                    )
-                    if battle.status != "error":  # 如果之前没标记错误
-                        update_battle(
-                            battle,
-                            status="error",
-                            results=json.dumps(
-                                {"error": f"Failed to gather {MAX_PLAYERS} players."}
-                            ),
-                        )
-                    continue  # 跳到下一个位置的测试
-
-                # 4. 启动对战 (通过BattleManager)
-                # BattleManager 的 start_battle 需要完整的 participant_data (包含user_id和ai_code_id)
-                # 它内部会根据ai_code_id去获取路径
-                # 注意：participant_data_for_bm 中的顺序可能不重要，因为 BattleManager/Referee 会根据 BattlePlayer 表中的 position 来安排
-                # 但最好是按照位置顺序来组织，尽管 add_player_to_battle 已经按位置创建了记录
-
-                # 获取实际创建的 BattlePlayer 记录，确保顺序和数据正确
-                # db_battle_players = BattlePlayer.query.filter_by(battle_id=battle.id).order_by(BattlePlayer.position).all()
-                # final_participant_data_for_bm = [
-                #     {"user_id": bp.user_id, "ai_code_id": bp.selected_ai_code_id} for bp in db_battle_players
-                # ]
-                # 为简化，我们假设 add_player_to_battle 成功后，BattleManager能正确处理
-                # BattleManager 的 start_battle 现在只需要 battle_id 和 participant_data (包含user_id, ai_code_id)
-
-                # 重新从数据库获取完整的参与者信息，确保顺序和信息正确传递给BattleManager
-                final_participants_from_db = []
-                battle_players_for_this_game = (
-                    BattlePlayer.query.filter_by(battle_id=battle.id)
-                    .order_by(BattlePlayer.position)
-                    .all()
+    # 3. 依次交给 BattleManager 启动
+    battles_created_ids = []
+    busy_error = None
+    for index, (battle_id, participant_data) in enumerate(zip(battle_ids, lineups)):
+        if not battle_id:
+            current_app.logger.error(
+                f"系列测试：位置 {index + 1} 的参与者数据无效，跳过该对战。"
+            )
+            continue
+        if busy_error:
+            # 队列已满，取消尚未启动的对战记录
+            db_mark_battle_as_cancelled(battle_id, f"系统繁忙：{busy_error}")
+            continue
+        try:
+            # 用户测试对局使用低优先级，避免挤占正式赛的LLM配额
+            start_success = battle_manager.start_battle(
+                battle_id,
+                participant_data,
+                priority=PRIORITY_LOW,
+                owner_id=current_user.id,
+            )
+            if start_success:
+                battles_created_ids.append(battle_id)
+                current_app.logger.info(
+                    f"系列测试：对战 {battle_id} (测试AI位置: {index + 1}) 已成功启动。"
                 )
-                if len(battle_players_for_this_game) == MAX_PLAYERS:
-                    for bp_db in battle_players_for_this_game:
-                        final_participants_from_db.append(
-                            {
-                                "user_id": bp_db.user_id,
-                                "ai_code_id": bp_db.selected_ai_code_id,
-                                # BattleManager的start_battle会用ai_code_id获取路径
-                            }
-                        )
-
-                    start_success = battle_manager.start_battle(
-                        battle.id, final_participants_from_db
-                    )
-                    if start_success:
-                        battles_created_ids.append(battle.id)
-                        current_app.logger.info(
-                            f"系列测试：对战 {battle.id} (测试AI位置: {position_of_test_ai}) 已成功启动。"
-                        )
-                    else:
-                        current_app.logger.error(
-                            f"系列测试：启动对战 {battle.id} 失败。BattleManager返回错误。"
-                        )
-                        # BattleManager内部应该已经标记了错误状态
-                else:
-                    current_app.logger.error(
-                        f"系列测试：对战 {battle.id} 玩家数量不足 ({len(battle_players_for_this_game)}/{MAX_PLAYERS})，无法启动。"
-                    )
-                    update_battle(
-                        battle,
-                        status="error",
-                        results=json.dumps(
-                            {"error": "Player count mismatch before start."}
-                        ),
-                    )
-
-                # # 可选：在创建每个对战之间加入短暂延时，避免瞬间大量请求
-                # time.sleep(0.5)  # 0.5秒延时
-
-            except Exception as e:
+            else:
+                # BattleManager内部已经标记了错误状态
                 current_app.logger.error(
-                    f"为AI {ai_to_test.name} 创建位置 {position_of_test_ai} 的系列测试赛时发生严重错误: {str(e)}",
-                    exc_info=True,
+                    f"系列测试：启动对战 {battle_id} 失败。BattleManager返回错误。"
                 )
-                # 这里可以记录更详细的错误到某个地方或返回给用户
+        except BattleQueueFullError as e:
+            # 检查之后队列被其他请求占满，BattleManager 已取消该对战
+            current_app.logger.warning(f"系列测试：对战队列已满，停止创建。{e}")
+            busy_error = e
+        except Exception as e:
+            current_app.logger.error(
+                f"为AI {ai_to_test.name} 启动位置 {index + 1} 的系列测试赛时发生严重错误: {str(e)}",
+                exc_info=True,
+            )
 
     if battles_created_ids:
         return jsonify(
@@ -984,6 +867,8 @@ def start_ai_series_test():
                 "battle_ids": battles_created_ids,
             }
         )
+    elif busy_error:
+        return busy_response(busy_error)
     else:
         return (
             jsonify(
@@ -31,15 +31,19 @@ from database import (
     get_battle_players_for_battle as db_get_battle_players_for_battle,
     get_user_ai_codes as db_get_user_ai_codes,
     get_battles_paginated_filtered,
+    get_battles_after,
     get_available_ai_instances,
     create_battle_instance,
     add_player_to_battle,
     get_recent_battles as db_get_recent_battles,
 )
 from database.models import Battle, BattlePlayer, User, AICode
+from database.pagination import COUNT_MODES
 from database import db
-from utils.battle_manager_utils import get_battle_manager
+from utils.battle_manager_utils import get_battle_manager, busy_response
+from game.battle_manager import BattleQueueFullError
 from utils.automatch_utils import get_automatch
+from game.client_manager import PRIORITY_LOW, PRIORITY_NORMAL
 from datetime import datetime  # For date filtering
 
 game_bp = Blueprint("game", __name__)
@@ -916,6 +920,14 @@ def create_battle_action():
                 {"success": False, "message": "普通用户只能创建测试对战（排行榜0）"}
             )
 
+        # 对战队列已满时直接返回429，不创建数据库记录
+        battle_manager = get_battle_manager()
+        try:
+            battle_manager.check_admission()
+        except BattleQueueFullError as e:
+            current_app.logger.warning(f"创建对战被拒绝，对战队列已满：{e}")
+            return busy_response(e)
+
         # 调用数据库操作创建 Battle 和 BattlePlayer 记录
         # 使用 db_ 前缀以明确区分
         battle = db_create_battle(
@@ -928,8 +940,19 @@ def create_battle_action():
             )  # 修改日志记录器
             # 对战创建成功后，可以立即开始，或者等待某种触发条件
             # 这里我们假设创建后就尝试启动
-            battle_manager = get_battle_manager()
-            start_success = battle_manager.start_battle(battle.id, participant_data)
+            # 测试对战（排行榜0）使用低优先级
+            try:
+                start_success = battle_manager.start_battle(
+                    battle.id,
+                    participant_data,
+                    priority=PRIORITY_LOW if ranking_id == 0 else PRIORITY_NORMAL,
+                    owner_id=current_user.id,
+                    ranking_id=ranking_id,
+                )
+            except BattleQueueFullError as e:
+                # 检查之后队列被占满，BattleManager 已将该对战标记为取消
+                current_app.logger.warning(f"对战 {battle.id} 无法入队：{e}")
+                return busy_response(e)
 
             if start_success:
                 return jsonify(
@@ -982,6 +1005,11 @@ def get_game_status(battle_id):
             else:
                 return jsonify({"success": False, "message": "对战不存在"})
 
+        # 排队中的对战返回排队位置与预计开始时间
+        queue_info = None
+        if status == "waiting":
+            queue_info = battle_manager.get_queue_position(battle_id)
+
         # 获取对战快照 (只对进行中的游戏有意义)
         snapshots = []
         if status == "playing":  # 或者 'running' 取决于 battle_manager 的状态定义
@@ -1011,6 +1039,7 @@ def get_game_status(battle_id):
                 "status": status,
                 "snapshots": snapshots,
                 "result": result,
+                "queue": queue_info,
             }
         )
 
@@ -1031,9 +1060,13 @@ def get_battles():
     # 简化：只返回最近完成的
     battles_data = []
     for battle in recent_completed:
-        players_info = [
-            bp.to_dict() for bp in db_get_battle_players_for_battle(battle.id)
-        ]
+        # 已结束的对战直接使用随对战读取的列表摘要，没有摘要时逐场查询参与者
+        if battle.summary:
+            players_info = battle.summary.get_participants()
+        else:
+            players_info = [
+                bp.to_dict() for bp in db_get_battle_players_for_battle(battle.id)
+            ]
         battles_data.append(
             {
                 "id": battle.id,
@@ -1043,7 +1076,8 @@ def get_battles():
                 ),
                 "ended_at": battle.ended_at.isoformat() if battle.ended_at else None,
                 "players": players_info,
-                # 可以添加获胜方等摘要信息
+                "winner": battle.summary.winner if battle.summary else None,
+                "has_error": battle.summary.has_error if battle.summary else None,
             }
         )
 
@@ -1277,12 +1311,54 @@ def get_battles_stats():
         return jsonify({"success": False, "message": f"获取统计数据失败: {str(e)}"})
 
 
+def _battle_list_item(battle):
+    """对战列表API中的一行"""
+    return {
+        "id": battle.id,
+        "status": battle.status,
+        "battle_type": battle.battle_type,
+        "ranking_id": battle.ranking_id,
+        "is_elo_exempt": battle.is_elo_exempt,
+        "created_at": (
+            battle.created_at.strftime("%Y-%m-%d %H:%M") if battle.created_at else "-"
+        ),
+        "ended_at": (
+            battle.ended_at.strftime("%Y-%m-%d %H:%M") if battle.ended_at else "-"
+        ),
+    }
+
+
 @game_bp.route("/api/battles/list", methods=["GET"])
 def get_battles_list():
-    """获取分页的对战列表API"""
+    """
+    获取分页的对战列表API
+
+    默认按页码分页（page）；传入 cursor 参数（第一页为空字符串）时按 (created_at, id) 键集分页，
+    响应中的 next_cursor 原样传回即得到下一页，翻到多深都不会变慢。
+    count 控制键集分页的总数统计：exact、approximate（有上限的计数）或 none（默认）；页码分页总是精确计数。
+    """
     try:
         page = request.args.get("page", 1, type=int)
         per_page = request.args.get("per_page", 5, type=int)
+        cursor = request.args.get("cursor", None, type=str)
+        count_mode = request.args.get(
+            "count", "exact" if cursor is None else "none", type=str
+        )
+        if count_mode not in COUNT_MODES:
+            return jsonify(
+                {
+                    "success": False,
+                    "message": f"count 参数无效，可选值: {', '.join(COUNT_MODES)}",
+                }
+            )
+        if cursor is None and count_mode != "exact":
+            # 页码分页的总页数与 has_next 依赖精确总数
+            return jsonify(
+                {
+                    "success": False,
+                    "message": "按页码分页时 count 只能为 exact，近似计数或不计数请使用 cursor 分页",
+                }
+            )
         status_filter = request.args.get("status", None, type=str)
         date_from_str = request.args.get("date_from", None, type=str)
         date_to_str = request.args.get("date_to", None, type=str)
@@ -1308,32 +1384,35 @@ def get_battles_list():
         if player_filters:
             filters["players"] = player_filters
 
+        if cursor is not None:
+            try:
+                result = get_battles_after(
+                    filters=filters,
+                    cursor=cursor or None,
+                    per_page=per_page,
+                    count=count_mode,
+                )
+            except ValueError:
+                return jsonify({"success": False, "message": "分页游标无效"})
+            return jsonify(
+                {
+                    "success": True,
+                    "battles": [_battle_list_item(b) for b in result["battles"]],
+                    "pagination": {
+                        "next_cursor": result["next_cursor"],
+                        "has_next": result["next_cursor"] is not None,
+                        "total": result["total"],
+                        "total_is_lower_bound": result["total_is_lower_bound"],
+                    },
+                }
+            )
+
         battles_pagination = get_battles_paginated_filtered(
             filters=filters, page=page, per_page=per_page
         )
 
         # 格式化分页数据为JSON
-        battles_data = []
-        for battle in battles_pagination.items:
-            battles_data.append(
-                {
-                    "id": battle.id,
-                    "status": battle.status,
-                    "battle_type": battle.battle_type,
-                    "ranking_id": battle.ranking_id,
-                    "is_elo_exempt": battle.is_elo_exempt,
-                    "created_at": (
-                        battle.created_at.strftime("%Y-%m-%d %H:%M")
-                        if battle.created_at
-                        else "-"
-                    ),
-                    "ended_at": (
-                        battle.ended_at.strftime("%Y-%m-%d %H:%M")
-                        if battle.ended_at
-                        else "-"
-                    ),
-                }
-            )
+        battles_data = [_battle_list_item(b) for b in battles_pagination.items]
 
         return jsonify(
             {
@@ -0,0 +1,18 @@
+from flask import Blueprint, Response, abort, request
+
+from game.metrics import get_metrics_config, render
+
+# 创建蓝图
+metrics_bp = Blueprint("metrics", __name__)
+
+
+@metrics_bp.route("/metrics")
+def metrics():
+    """汇总本机所有进程的运行指标（Prometheus 文本格式）"""
+    config = get_metrics_config()
+    if not config["enabled"]:
+        abort(404)
+    token = config.get("token")
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        abort(401)
+    return Response(render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
@@ -4,12 +4,13 @@
 # description: 用户个人资料蓝图，包含用户资料和对战历史的路由。
 # 包含页面html: profile/profile.html, profile/battle_history.html
 
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
 from flask_login import login_required, current_user
 from database.models import User, GameStats, Battle, db
 from database.action import (
     get_game_stats_by_user_id,
     get_user_battle_history as db_get_user_battle_history,
+    get_user_battle_history_after,
     get_user_by_username,
 )
 
@@ -130,3 +131,64 @@ def public_battle_history(user_id):
         total_pages=total_pages,
         total_battles=total,
     )
+
+
+def _history_item(battle, user_id):
+    """对战历史API中的一行：对战信息与该用户在对战中的参与记录"""
+    if battle.summary:
+        player = battle.summary.participant(user_id)
+    else:
+        player = battle.get_player_battlestats(user_id)
+        player = player.to_dict() if player else None
+    return {
+        "id": battle.id,
+        "status": battle.status,
+        "battle_type": battle.battle_type,
+        "ranking_id": battle.ranking_id,
+        "created_at": (
+            battle.created_at.strftime("%Y-%m-%d %H:%M") if battle.created_at else "-"
+        ),
+        "ended_at": (
+            battle.ended_at.strftime("%Y-%m-%d %H:%M") if battle.ended_at else "-"
+        ),
+        "player": player,
+    }
+
+
+def _battle_history_json(user_id):
+    """
+    按 (created_at, id) 键集分页返回用户的对战历史。
+    cursor 为上一页响应中的 next_cursor，第一页不传；不统计总数，翻到多深都不会变慢。
+    """
+    cursor = request.args.get("cursor", None, type=str)
+    per_page = min(max(request.args.get("per_page", 10, type=int), 1), 50)
+    try:
+        battles, next_cursor = get_user_battle_history_after(
+            user_id, cursor=cursor or None, per_page=per_page
+        )
+    except ValueError:
+        return jsonify({"success": False, "message": "分页游标无效"})
+    return jsonify(
+        {
+            "success": True,
+            "battles": [_history_item(b, user_id) for b in battles],
+            "pagination": {
+                "next_cursor": next_cursor,
+                "has_next": next_cursor is not None,
+            },
+        }
+    )
+
+
+@profile_bp.route("/api/battle-history")
+@login_required
+def battle_history_api():
+    """当前用户的对战历史API（游标分页）"""
+    return _battle_history_json(current_user.id)
+
+
+@profile_bp.route("/api/battle-history/<string:user_id>")
+def public_battle_history_api(user_id):
+    """指定用户的公开对战历史API（游标分页）"""
+    user = User.query.get_or_404(user_id)
+    return _battle_history_json(user.id)
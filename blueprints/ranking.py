@@ -1,6 +1,12 @@
 from flask import Blueprint, render_template, jsonify, request, current_app
 from flask_login import current_user
-from database.action import get_leaderboard, get_game_stats_by_user_id, get_user_by_id
+from database.action import (
+    get_leaderboard,
+    get_leaderboard_after,
+    get_user_rank,
+    get_game_stats_by_user_id,
+    get_user_by_id,
+)
 from database.models import User, GameStats
 from functools import lru_cache
 import time  # 确保导入time模块
@@ -95,9 +101,6 @@ def show_ranking():
         f"Request params: page={page}, per_page={per_page}, ranking_id={ranking_id}, min_games={min_games}, is_ajax={is_ajax}"
     )
 
-    # 创建缓存键，包含分页信息
-    cache_key = f"ranking_page:{ranking_id}:{page}:{per_page}:{min_games}"
-
     def fetch_ranking_page_data():
         try:
             # 使用数据库层面的分页获取排行榜数据
@@ -152,9 +155,12 @@ def show_ranking():
             current_app.logger.error(f"Error fetching leaderboard data: {e}")
             return [], 0
 
-    # 从缓存获取数据或重新获取
-    leaderboard_items, total_count = get_cached_data(
-        cache_key, fetch_ranking_page_data, timeout=60
+    # 排行榜快照由所有 worker 共享，按名次区间取页，无需进程内缓存
+    leaderboard_items, total_count = fetch_ranking_page_data()
+    my_rank = (
+        get_user_rank(current_user.id, ranking_id=ranking_id)
+        if current_user.is_authenticated
+        else None
     )
 
     # 计算分页相关信息
@@ -183,6 +189,7 @@ def show_ranking():
                 "items": leaderboard_items,
                 "pagination": pagination_data,
                 "ranking_id": ranking_id,
+                "my_rank": my_rank,
             }
         )
 
@@ -202,72 +209,69 @@ def show_ranking():
         current_user=current_user,
         all_ranking_ids=all_ranking_ids,
         current_ranking_id=ranking_id,
+        my_rank=my_rank,
     )
 
 
 @ranking_bp.route("/api/ranking")
 def get_ranking_data():
-    """获取排行榜数据（API）"""
+    """
+    获取排行榜数据（API）。按名次键集翻页：下一页传入上一页返回的 next_after，
+    rank 为榜单内的名次（按场次筛选时不重新编号）
+    """
     limit = request.args.get("limit", 100, type=int)
     min_games = request.args.get("min_games", 1, type=int)
     ranking_id = request.args.get("ranking_id", 0, type=int)
     sort_by = request.args.get("sort_by", "score")
+    after = max(request.args.get("after", 0, type=int), 0)
 
     # 限制最大查询数量，防止过大查询
     if limit > 500:
         limit = 500
+    limit = max(limit, 1)
 
-    cache_key = f"ranking:{ranking_id}:{min_games}:{limit}:{sort_by}"
-
-    def fetch_ranking_data():
-        try:
-            # 获取排行榜数据，如果失败则返回空列表
-            leaderboard_data_raw, _ = get_leaderboard(
-                ranking_id=ranking_id, limit=limit, min_games_played=min_games
-            ) or ([], 0)
-
-            # 处理数据并添加必要字段
-            ranking_list_api = []
-            for idx, data in enumerate(leaderboard_data_raw):
-                # 预先计算胜率，避免重复计算
-                total = data.get("games_played", data.get("total", 0))
-                win_rate = data.get("win_rate", 0)
-                if "win_rate" not in data and total > 0:
-                    win_rate = round((data.get("wins", 0) / total) * 100, 1)
-
-                entry = {
-                    "rank": idx + 1,
-                    "user_id": data.get("user_id"),
-                    "username": data.get("username"),
-                    "score": data.get("elo_score", data.get("score", 0)),
-                    "wins": data.get("wins", 0),
-                    "losses": data.get("losses", 0),
-                    "draws": data.get("draws", 0),
-                    "total": total,
-                    "win_rate": win_rate,
-                }
-                ranking_list_api.append(entry)
-
-            return {
+    try:
+        leaderboard_data, next_after = get_leaderboard_after(
+            ranking_id=ranking_id,
+            after_rank=after,
+            limit=limit,
+            min_games_played=min_games,
+        )
+        ranking_list_api = [
+            {
+                "rank": data["rank"],
+                "user_id": data["user_id"],
+                "username": data["username"],
+                "score": data["elo_score"],
+                "wins": data["wins"],
+                "losses": data["losses"],
+                "draws": data["draws"],
+                "total": data["games_played"],
+                "win_rate": data["win_rate"],
+            }
+            for data in leaderboard_data
+        ]
+        return jsonify(
+            {
                 "ranking_id": ranking_id,
                 "sort_by": sort_by,
                 "rankings": ranking_list_api,
                 "count": len(ranking_list_api),
+                "next_after": next_after,
             }
-        except Exception as e:
-            current_app.logger.error(f"Error in get_ranking_data: {e}")
-            return {
+        )
+    except Exception as e:
+        current_app.logger.error(f"Error in get_ranking_data: {e}")
+        return jsonify(
+            {
                 "ranking_id": ranking_id,
                 "sort_by": sort_by,
                 "rankings": [],
                 "count": 0,
+                "next_after": None,
                 "error": str(e),
             }
-
-    result = get_cached_data(
-        cache_key, fetch_ranking_data, timeout=10
-    )  # 排行榜数据缓存10秒
-    return jsonify(result)
+        )
 
 
 @ranking_bp.route("/api/user_stats/<string:user_id>")
@@ -286,6 +290,7 @@ def get_user_stats(user_id):
                 return {"success": False, "message": "用户不存在"}, 404
 
             stat = get_game_stats_by_user_id(user_id, ranking_id=ranking_id)
+            entry = get_user_rank(user_id, ranking_id=ranking_id)
 
             if not stat:
                 return {
@@ -309,6 +314,7 @@ def get_user_stats(user_id):
                 "user_id": user_id,
                 "username": user.username,
                 "ranking_id": ranking_id,
+                "rank": entry["rank"] if entry else None,
                 "stats": {
                     "score": stat.elo_score,
                     "wins": stat.wins,
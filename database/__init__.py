@@ -7,7 +7,24 @@
 from .base import db, login_manager
 
 # 从 models.py 导出所有模型类
-from .models import User, AICode, GameStats, Battle, BattlePlayer
+from .models import (
+    User,
+    AICode,
+    GameStats,
+    Battle,
+    BattlePlayer,
+    BattleJob,
+    BattleRunner,
+    AutoMatchRun,
+    LeaderboardEntry,
+    BattleSummary,
+)
+
+from .engine import configure_engine, install_sqlite_pragmas
+from .writer import init_database_writer, serialized_write
+
+# 导入即注册维护列表摘要的会话事件
+from .battle_summary import backfill_battle_summaries, mark_battle_summaries_stale
 
 from flask import current_app
 
@@ -15,11 +32,26 @@ from flask import current_app
 # 定义数据库初始化函数
 def initialize_database(app):
     """初始化数据库并关联应用"""
+    # 连接池与 SQLite 参数（DATABASE_ENGINE）需在创建引擎前写入配置
+    configure_engine(app)
     db.init_app(app)
+    with app.app_context():
+        install_sqlite_pragmas(db.engine)
+    init_database_writer(app)
     # login_manager 也可以在这里初始化，如果它依赖于 app 配置
     # login_manager.init_app(app)
 
 
+def create_missing_indexes():
+    """
+    创建模型中声明但数据库中还没有的索引（需要应用上下文）。
+    db.create_all() 只为新建的表创建索引，已有的表上新增的索引需要在这里补建
+    """
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+
+
 # 从 action.py 和 promotion.py 导出所有需要外部使用的数据库操作函数
 from .action import (
     # 基础工具 (如果需要在外部使用)
@@ -35,6 +67,7 @@ from .action import (
     delete_user,
     # AI 代码 (AICode) 操作
     get_ai_code_by_id,
+    get_ai_codes_by_ids,
     get_user_ai_codes,
     get_user_active_ai_code,
     create_ai_code,
@@ -48,15 +81,21 @@ from .action import (
     create_game_stats,
     update_game_stats,
     get_leaderboard,
+    get_leaderboard_after,
+    get_user_rank,
+    get_ranking_ratings,
     # 对战 (Battle) 及 对战参与者 (BattlePlayer) 操作
     create_battle,
+    create_battles_bulk,
     create_battle_instance,
     get_battle_by_id,
     update_battle,
     delete_battle,
     get_battle_players_for_battle,
     process_battle_results_and_update_stats,
+    record_battle_results_batch,
     get_user_battle_history,
+    get_user_battle_history_after,
     get_recent_battles,
     get_battle_player_by_id,
     update_battle_player,
@@ -64,12 +103,34 @@ from .action import (
     mark_battle_as_cancelled,
     handle_cancelled_battle_stats,
     get_battles_paginated_filtered,
+    get_battles_after,
     get_available_ai_instances,
     update_battle_player_count,
     add_player_to_battle,
     create_battle_instance,
     load_initial_users_from_config,
     safe_delete,
+    # 持久化对战队列 (BattleJob) 操作
+    enqueue_battle_job,
+    claim_battle_job,
+    mark_battle_job_running,
+    heartbeat_battle_jobs,
+    finish_battle_job,
+    requeue_expired_battle_jobs,
+    count_queued_battle_jobs,
+    get_battle_job_position,
+    heartbeat_battle_runner,
+    get_battle_runners,
+    prune_battle_runners,
+    # 自动对战运行状态 (AutoMatchRun) 操作
+    claim_automatch_run,
+    save_automatch_run,
+    release_automatch_run,
+    request_automatch_run_stop,
+    get_automatch_runs,
+    get_orphaned_automatch_runs,
+    get_battle_statuses,
+    get_battle_results,
 )
 
 # 从 promotion.py 导出晋级相关函数
@@ -93,6 +154,8 @@ __all__ = [
     "db",
     "login_manager",
     "initialize_database",
+    "create_missing_indexes",
+    "serialized_write",
     "load_user",
     # 模型
     "User",
@@ -100,6 +163,11 @@ __all__ = [
     "GameStats",
     "Battle",
     "BattlePlayer",
+    "BattleJob",
+    "BattleRunner",
+    "AutoMatchRun",
+    "LeaderboardEntry",
+    "BattleSummary",
     # 用户操作
     "get_user_by_id",
     "get_user_by_username",
@@ -109,6 +177,7 @@ __all__ = [
     "delete_user",
     # AI 操作
     "get_ai_code_by_id",
+    "get_ai_codes_by_ids",
     "get_user_ai_codes",
     "get_user_active_ai_code",
     "create_ai_code",
@@ -122,22 +191,51 @@ __all__ = [
     "create_game_stats",
     "update_game_stats",
     "get_leaderboard",
+    "get_leaderboard_after",
+    "get_user_rank",
+    "get_ranking_ratings",
     # 对战操作
     "create_battle",
+    "create_battles_bulk",
     "get_battle_by_id",
     "create_battle_instance",
     "update_battle",
     "delete_battle",
     "get_battle_players_for_battle",
     "process_battle_results_and_update_stats",
+    "record_battle_results_batch",
     "get_user_battle_history",
+    "get_user_battle_history_after",
     "get_recent_battles",
+    "backfill_battle_summaries",
+    "mark_battle_summaries_stale",
     "get_battle_player_by_id",
     "update_battle_player",
     "get_available_ai_instances",
     "update_battle_player_count",
     "add_player_to_battle",
     "create_battle_instance",
+    # 持久化对战队列操作
+    "enqueue_battle_job",
+    "claim_battle_job",
+    "mark_battle_job_running",
+    "heartbeat_battle_jobs",
+    "finish_battle_job",
+    "requeue_expired_battle_jobs",
+    "count_queued_battle_jobs",
+    "get_battle_job_position",
+    "heartbeat_battle_runner",
+    "get_battle_runners",
+    "prune_battle_runners",
+    # 自动对战运行状态操作
+    "claim_automatch_run",
+    "save_automatch_run",
+    "release_automatch_run",
+    "request_automatch_run_stop",
+    "get_automatch_runs",
+    "get_orphaned_automatch_runs",
+    "get_battle_statuses",
+    "get_battle_results",
     # 晋级相关函数
     "get_top_players_from_ranking",
     "promote_players_to_ranking",
@@ -20,12 +20,12 @@ from flask import current_app
 import threading, time
 
 # 准备好后面一千多行的冲击吧！
-MAX_TOKEN_ALLOWED = 3000
 
 from .base import db
 import logging
 from sqlalchemy import select, update, or_, func
-from datetime import datetime
+from sqlalchemy.orm import joinedload
+from datetime import datetime, timedelta
 import json
 import math
 import uuid
@@ -35,8 +35,23 @@ from .models import (
     GameStats,
     AICode,
     BattlePlayer,
+    BattleJob,
+    BattleRunner,
+    AutoMatchRun,
+    LeaderboardEntry,
     db,
 )  # 移除Room, RoomParticipant
+from .result_summary import summarize_public_log
+from .leaderboard import ensure_leaderboard
+from .pagination import keyset_page, count_rows
+from .elo import (
+    team_rating,
+    expected_score,
+    token_proportions,
+    elo_delta,
+    apply_delta,
+    error_penalty,
+)
 
 # 配置 Logger
 logger = logging.getLogger(__name__)
@@ -250,6 +265,17 @@ def get_ai_code_by_id(ai_code_id):
         return None
 
 
+def get_ai_codes_by_ids(ai_code_ids):
+    """根据ID列表批量获取AI代码记录，不存在的ID被忽略，出错时返回空列表。"""
+    if not ai_code_ids:
+        return []
+    try:
+        return AICode.query.filter(AICode.id.in_(list(ai_code_ids))).all()
+    except Exception as e:
+        logger.error(f"批量获取AI代码失败: {e}", exc_info=True)
+        return []
+
+
 def get_user_index_in_battle(battle_id, user_id):
     """根据battle_id获取用户index"""
     battle_players = get_battle_players_for_battle(battle_id)
@@ -583,77 +609,93 @@ def update_game_stats(stats, **kwargs):
 
 
 def get_leaderboard(ranking_id=0, page=1, per_page=15, min_games_played=0):
-    """获取排行榜数据，支持分页"""
-    # 基本查询条件
-    base_query = GameStats.query.filter_by(ranking_id=ranking_id)
+    """
+    获取排行榜数据，支持分页。读取 leaderboard_entries 快照（见 leaderboard.py），不再连接 User 表：
+    不筛选场次时直接按名次区间取页；筛选场次时按名次顺序跳过前面的行，名次为筛选后的序号。
+    """
+    ensure_leaderboard(ranking_id)
+    query = LeaderboardEntry.query.filter_by(ranking_id=ranking_id)
+    offset = (page - 1) * per_page
 
     if min_games_played > 0:
-        base_query = base_query.filter(GameStats.games_played >= min_games_played)
-
-    # 计算总记录数
-    total_count = base_query.count()
-
-    # 先执行JOIN，再做排序和分页
-    query = (
-        base_query.join(User)  # 先JOIN再分页
-        .with_entities(
-            GameStats.user_id,
-            User.username,
-            GameStats.elo_score,
-            GameStats.wins,
-            GameStats.losses,
-            GameStats.draws,
-            GameStats.games_played,
+        query = query.filter(LeaderboardEntry.games_played >= min_games_played)
+        total_count = query.count()
+        entries = (
+            query.order_by(LeaderboardEntry.rank).offset(offset).limit(per_page).all()
+        )
+    else:
+        # 名次从1开始连续，最大名次即总人数
+        total_count = (
+            db.session.query(func.max(LeaderboardEntry.rank))
+            .filter(LeaderboardEntry.ranking_id == ranking_id)
+            .scalar()
+            or 0
+        )
+        entries = (
+            query.filter(LeaderboardEntry.rank.between(offset + 1, offset + per_page))
+            .order_by(LeaderboardEntry.rank)
+            .all()
         )
-        .order_by(GameStats.elo_score.desc())  # 排序
+
+    result = []
+    for rank, entry in enumerate(entries, start=offset + 1):
+        item = entry.to_dict()
+        item["rank"] = rank
+        result.append(item)
+    return result, total_count
+
+
+def get_leaderboard_after(ranking_id=0, after_rank=0, limit=100, min_games_played=0):
+    """
+    按名次键集翻页读取排行榜快照：返回名次大于 after_rank 的前 limit 人。
+    名次为榜单内的全局名次（筛选场次时不重新编号）。
+
+    返回:
+        tuple: (条目列表, 下一页的 after_rank；没有下一页时为 None)
+    """
+    ensure_leaderboard(ranking_id)
+    query = LeaderboardEntry.query.filter(
+        LeaderboardEntry.ranking_id == ranking_id,
+        LeaderboardEntry.rank > after_rank,
     )
+    if min_games_played > 0:
+        query = query.filter(LeaderboardEntry.games_played >= min_games_played)
+    entries = query.order_by(LeaderboardEntry.rank).limit(limit + 1).all()
+    next_after_rank = entries[limit - 1].rank if len(entries) > limit else None
+    return [entry.to_dict() for entry in entries[:limit]], next_after_rank
 
-    # 然后应用分页
-    offset = (page - 1) * per_page
-    paginated_query = query.offset(offset).limit(per_page)
 
-    # 获取结果
-    stats_with_users = paginated_query.all()
+def get_user_rank(user_id, ranking_id=0):
+    """
+    获取玩家在榜单中的名次与战绩（排行榜快照的一次主键查找）。
 
-    # 格式化返回数据
-    result = []
-    for rank, (
-        user_id,
-        username,
-        elo_score,
-        wins,
-        losses,
-        draws,
-        games_played,
-    ) in enumerate(stats_with_users, start=offset + 1):
-        win_rate = round(wins / (losses + wins) * 100, 1) if (losses + wins) > 0 else 0
-        win_rate_for_container = (
-            round(wins / games_played * 100, 1) if games_played > 0 else 0
-        )
-        loss_rate_for_container = (
-            round(losses / games_played * 100, 1) if games_played > 0 else 0
-        )
-        draw_rate_for_container = (
-            round(draws / games_played * 100, 1) if games_played > 0 else 0
-        )
-        result.append(
-            {
-                "rank": rank,
-                "user_id": user_id,
-                "username": username,
-                "elo_score": elo_score,
-                "wins": wins,
-                "losses": losses,
-                "draws": draws,
-                "games_played": games_played,
-                "win_rate": win_rate,
-                "draw_rate_for_container": draw_rate_for_container,
-                "loss_rate_for_container": loss_rate_for_container,
-                "win_rate_for_container": win_rate_for_container,
-            }
-        )
+    返回:
+        dict: 与 get_leaderboard 的条目格式相同；玩家不在榜单中时返回 None。
+    """
+    ensure_leaderboard(ranking_id)
+    entry = db.session.get(LeaderboardEntry, (ranking_id, user_id))
+    return entry.to_dict() if entry else None
 
-    return result, total_count
+
+def get_ranking_ratings(ranking_id=0):
+    """
+    获取排行榜中所有用户的 ELO 与已赛场次（单次查询，供自动对战配对使用）
+
+    返回:
+        dict: {user_id: (elo_score, games_played)}，出错时返回空字典。
+    """
+    try:
+        rows = (
+            db.session.query(
+                GameStats.user_id, GameStats.elo_score, GameStats.games_played
+            )
+            .filter(GameStats.ranking_id == ranking_id)
+            .all()
+        )
+        return {user_id: (elo or 1200, games or 0) for user_id, elo, games in rows}
+    except Exception as e:
+        logger.error(f"获取排行榜 {ranking_id} 的ELO失败: {e}", exc_info=True)
+        return {}
 
 
 # -----------------------------------------------------------------------------------------
@@ -744,6 +786,106 @@ def create_battle(
         return None
 
 
+def create_battles_bulk(
+    lineups,
+    ranking_id=0,
+    status="waiting",
+    is_elo_exempt=False,
+    battle_type=None,
+):
+    """
+    批量创建对战记录及参与者记录，在一个事务中提交。
+
+    与逐场调用 create_battle 相比，所有涉及的用户、AI代码与 GameStats 各用一次 IN 查询预取，
+    Battle 与 BattlePlayer 以批量插入写入。
+
+    参数:
+        lineups (list): 每个元素为一场对战的参与者列表，格式同 create_battle 的
+                        participant_data_list，列表顺序即玩家位置。
+        ranking_id (int): 对战所属的排行榜ID。默认为0。
+        status (str): 初始状态。默认为 'waiting'。
+        is_elo_exempt (bool): 是否不计入ELO和统计。
+        battle_type (str, optional): 对战类型，例如 "ai_series_test"。
+
+    返回:
+        list: 与 lineups 一一对应的对战ID，参与者数据无效的对战为 None；
+              数据库操作失败时返回 None。
+    """
+    try:
+        user_ids = {data.get("user_id") for lineup in lineups for data in lineup}
+        ai_code_ids = {data.get("ai_code_id") for lineup in lineups for data in lineup}
+        user_ids.discard(None)
+        ai_code_ids.discard(None)
+
+        existing_users = {
+            row.id for row in db.session.query(User.id).filter(User.id.in_(user_ids))
+        }
+        ai_code_owners = {
+            row.id: row.user_id
+            for row in db.session.query(AICode.id, AICode.user_id).filter(
+                AICode.id.in_(ai_code_ids)
+            )
+        }
+        elo_by_user = {
+            row.user_id: row.elo_score
+            for row in db.session.query(GameStats.user_id, GameStats.elo_score).filter(
+                GameStats.ranking_id == ranking_id, GameStats.user_id.in_(user_ids)
+            )
+        }
+
+        now = datetime.now()
+        battle_ids = []
+        battle_rows = []
+        player_rows = []
+        for lineup in lineups:
+            valid = bool(lineup) and all(
+                data.get("user_id") in existing_users
+                and ai_code_owners.get(data.get("ai_code_id")) == data.get("user_id")
+                for data in lineup
+            )
+            if not valid:
+                logger.error(f"批量创建对战: 跳过无效的参与者数据 {lineup}")
+                battle_ids.append(None)
+                continue
+
+            battle_id = str(uuid.uuid4())
+            battle_ids.append(battle_id)
+            battle_rows.append(
+                {
+                    "id": battle_id,
+                    "status": status,
+                    "ranking_id": ranking_id,
+                    "created_at": now,
+                    "is_elo_exempt": is_elo_exempt,
+                    "battle_type": battle_type,
+                }
+            )
+            for i, data in enumerate(lineup):
+                player_rows.append(
+                    {
+                        "id": str(uuid.uuid4()),
+                        "battle_id": battle_id,
+                        "user_id": data["user_id"],
+                        "selected_ai_code_id": data["ai_code_id"],
+                        "position": i + 1,
+                        "initial_elo": elo_by_user.get(data["user_id"]) or 1200,
+                        "join_time": now,
+                    }
+                )
+
+        if battle_rows:
+            db.session.execute(Battle.__table__.insert(), battle_rows)
+            db.session.execute(BattlePlayer.__table__.insert(), player_rows)
+            if not safe_commit():
+                return None
+        logger.info(f"批量创建对战 {len(battle_rows)}/{len(lineups)} 场")
+        return battle_ids
+    except Exception as e:
+        logger.error(f"批量创建对战失败: {e}", exc_info=True)
+        db.session.rollback()
+        return None
+
+
 def get_battle_by_id(battle_id):
     """
     根据ID获取对战记录。
@@ -847,7 +989,7 @@ def get_battle_players_for_battle(battle_id):
         return []
 
 
-def process_battle_results_and_update_stats(battle_id, results_data):
+def process_battle_results_and_update_stats(battle_id, results_data, commit=True):
     """
     处理4v3对战结果，更新玩家对战记录及ELO评分。
 
@@ -865,8 +1007,12 @@ def process_battle_results_and_update_stats(battle_id, results_data):
                 "error": bool,           # 新增错误标识（可选）
                 "public_log_file": str,  # 新增公共日志路径（可选）
                 "roles": {...},          # 角色分配信息
+                "summary": {...},        # 裁判生成的结算摘要（可选，旧结果没有，
+                                         # 此时读取 public_log_file 生成）
                 # 其他可选字段（如game_log_uuid等）
             }
+        commit (bool): 是否提交事务。为False时只 flush，不提交也不回滚，
+            异常直接抛出，由调用方（如批量结果写入）统一提交或回滚
 
     返回:
         bool: 处理成功返回True，否则False
@@ -954,6 +1100,9 @@ def process_battle_results_and_update_stats(battle_id, results_data):
                     bp.elo_change = 0  # 明确ELO变化为0 for exempt battles
                     db.session.add(bp)
 
+            if not commit:
+                db.session.flush()
+                return True
             if safe_commit():
                 logger.info(
                     f"[Battle {battle_id}] ELO豁免的对战结果已记录，无统计更新。"
@@ -971,97 +1120,48 @@ def process_battle_results_and_update_stats(battle_id, results_data):
             logger.info(f"[Battle {battle_id}] 对战已处理，跳过重复操作")
             return True  # 幂等性处理
 
-        # 获取对战玩家记录（按加入顺序排列）
-        battle_players = get_battle_players_for_battle(battle_id)
+        # 获取对战玩家记录（按座位排列，与角色、错误PID的座位编号对应；
+        # 查询本身不保证顺序，走 (battle_id, user_id) 索引时会按用户ID排列）
+        battle_players = sorted(
+            get_battle_players_for_battle(battle_id),
+            key=lambda bp: bp.position or 0,
+        )
         if len(battle_players) != 7:
             logger.error(
                 f"[Battle {battle_id}] 玩家数量异常（预期7人，实际{len(battle_players)}人）"
             )
             return False
 
-        # 初始化错误处理相关变量
         err_user_id = None
-        error_pid_in_game = None
-        error_type = None
-        error_code_method = None
-        error_msg = None
-
-        # 验证公共日志文件路径
-        PUBLIC_LIB_FILE_DIR = results_data.get("public_log_file")
-        if not PUBLIC_LIB_FILE_DIR:
-            logger.error(f"[Battle {battle_id}] 缺少公共日志文件路径")
-            return False
 
-        # 读取公共日志获取错误玩家
-        try:
-            with open(PUBLIC_LIB_FILE_DIR, "r", encoding="utf-8") as plib:
-                data = json.load(plib)
-                # 遍历日志条目，查找错误记录
-                for record in reversed(data):  # 从最新记录开始查找
-                    # 检查是否是错误记录
-                    if "type" in record and record["type"] in [
-                        "critical_player_ERROR",
-                        "player_ruturn_ERROR",
-                    ]:
-                        error_type = record.get("type")
-                        error_pid_in_game = record.get("error_code_pid")
-                        error_code_method = record.get("error_code_method")
-                        error_msg = record.get("error_msg")
-
-                        # 检查错误玩家ID有效性
-                        if (
-                            error_pid_in_game is not None
-                            and 1 <= error_pid_in_game <= 7
-                        ):
-                            logger.info(
-                                f"[Battle {battle_id}] 找到错误玩家PID: {error_pid_in_game}, 错误类型: {error_type}, 错误方法: {error_code_method}"
-                            )
-                            break
-
-                # 如果没有找到有效的错误记录
-                if error_pid_in_game is None or not (1 <= error_pid_in_game <= 7):
-                    # 检查最后一条记录是否有错误信息但格式不同
-                    last_record = data[-1] if data else None
-                    if last_record and "error" in last_record:
-                        logger.warning(
-                            f"[Battle {battle_id}] 找到非标准错误记录: {last_record}"
-                        )
-                        # 尝试从非标准错误记录中提取信息
-                        if isinstance(
-                            last_record.get("error"), str
-                        ) and "Player" in last_record.get("error"):
-                            # 尝试从错误消息中提取玩家ID
-                            import re
-
-                            match = re.search(r"Player (\d+)", last_record.get("error"))
-                            if match:
-                                error_pid_in_game = int(match.group(1))
-                                error_type = "extracted_error"
-                                error_msg = last_record.get("error")
-
-                                # 尝试提取错误方法
-                                method_match = re.search(
-                                    r"method '([^']+)'|executing ([^ ]+)",
-                                    last_record.get("error"),
-                                )
-                                if method_match:
-                                    error_code_method = method_match.group(
-                                        1
-                                    ) or method_match.group(2)
-
-                                logger.info(
-                                    f"[Battle {battle_id}] 从错误消息中提取出玩家ID: {error_pid_in_game}, 方法: {error_code_method}"
-                                )
-
-                    # 如果仍然没有找到错误玩家
-                    if error_pid_in_game is None or not (1 <= error_pid_in_game <= 7):
-                        logger.error(f"[Battle {battle_id}] 无法找到有效的错误玩家PID")
-                        # 此时不返回False，而是继续处理，但不执行ELO扣分
-        except Exception as e:
-            logger.error(
-                f"[Battle {battle_id}] 读取公共日志失败: {str(e)}", exc_info=True
+        # 结算摘要由裁判随结果返回；没有摘要的旧结果流式读取一遍公共日志生成
+        summary = results_data.get("summary")
+        if not summary:
+            PUBLIC_LIB_FILE_DIR = results_data.get("public_log_file")
+            if not PUBLIC_LIB_FILE_DIR:
+                logger.error(f"[Battle {battle_id}] 缺少结算摘要与公共日志文件路径")
+                return False
+            try:
+                summary = summarize_public_log(PUBLIC_LIB_FILE_DIR, results_data)
+            except Exception as e:
+                logger.error(
+                    f"[Battle {battle_id}] 读取公共日志失败: {str(e)}", exc_info=True
+                )
+                # 继续处理，但不执行ELO扣分
+                summary = {}
+
+        error_record = summary.get("error") or {}
+        error_type = error_record.get("type")
+        error_pid_in_game = error_record.get("pid")
+        error_code_method = error_record.get("method")
+        error_msg = error_record.get("msg")
+        if error_pid_in_game is not None and 1 <= error_pid_in_game <= 7:
+            logger.info(
+                f"[Battle {battle_id}] 找到错误玩家PID: {error_pid_in_game}, 错误类型: {error_type}, 错误方法: {error_code_method}"
             )
-            # 继续处理，但不执行ELO扣分
+        elif error_record:
+            logger.error(f"[Battle {battle_id}] 无法找到有效的错误玩家PID")
+            # 此时不返回False，而是继续处理，但不执行ELO扣分
 
         # 获取错误玩家信息
         if error_pid_in_game is not None and 1 <= error_pid_in_game <= 7:
@@ -1188,21 +1288,12 @@ def process_battle_results_and_update_stats(battle_id, results_data):
         # ----------------------------------
 
         # 这里获取对局token数
-        tokens = []
-        try:
-            with open(PUBLIC_LIB_FILE_DIR, "r", encoding="utf-8") as plib:
-                data = json.load(plib)
-                for line in data[::-1]:
-                    if line.get("type") == "tokens":
-                        tokens = line.get(
-                            "result", []
-                        )  # [{"input": 0, "output": 0} for i in range(7)]
-                        break
-            logger.info(f"[Battle {battle_id}] 获取到的tokens数据: {tokens}")
-        except Exception as e:
-            logger.warning(f"[Battle {battle_id}] 获取tokens数据失败: {str(e)}")
+        tokens = summary.get("tokens") or []
+        if len(tokens) < 7:
+            logger.warning(f"[Battle {battle_id}] 缺少tokens数据，按0计算")
             # 创建默认tokens
             tokens = [{"input": 0, "output": 0} for i in range(7)]
+        logger.info(f"[Battle {battle_id}] 获取到的tokens数据: {tokens}")
 
         involved_user_ids = list(user_outcomes.keys())
         user_stats_map = {
@@ -1232,38 +1323,14 @@ def process_battle_results_and_update_stats(battle_id, results_data):
                 for team, scores in team_elos.items()
             }
 
-            # 计算惩罚值 - 改进的惩罚计算逻辑
-            # 对于代码错误，基础惩罚为30分，加上队伍差距的10%
-            base_penalty = 30
-            team_diff_penalty = abs(team_avg[BLUE_TEAM] - team_avg[RED_TEAM]) * 0.1
-
-            # 根据错误类型调整惩罚
-            error_type_multiplier = 1.0
-            if error_type == "critical_player_ERROR":
-                error_type_multiplier = 1.5  # 严重错误
-            elif error_type == "player_ruturn_ERROR":
-                error_type_multiplier = 1.2  # 返回值错误
-
-            # 根据错误方法调整惩罚
-            method_penalty = 0
-            if error_code_method == "walk":  # 移动错误
-                method_penalty = 10
-            elif error_code_method == "decide_mission_member":  # 队伍选择错误
-                method_penalty = 15
-            elif error_code_method == "mission_vote2":  # 投票错误
-                method_penalty = 20
-
-            total_reduction = round(
-                (base_penalty + team_diff_penalty) * error_type_multiplier
-                + method_penalty
+            # 计算惩罚值：基础惩罚加队伍差距，按错误类型与方法调整，限制在20~100分
+            total_reduction, penalty = error_penalty(
+                team_avg[BLUE_TEAM], team_avg[RED_TEAM], error_type, error_code_method
             )
 
-            # 确保惩罚至少为20分，最多为100分
-            total_reduction = max(20, min(total_reduction, 100))
-
             logger.info(
-                f"[Battle {battle_id}] 错误惩罚计算: 基础={base_penalty}, 队伍差异={team_diff_penalty:.1f}, "
-                + f"类型系数={error_type_multiplier}, 方法惩罚={method_penalty}, 总计={total_reduction}"
+                f"[Battle {battle_id}] 错误惩罚计算: 基础={penalty['base']}, 队伍差异={penalty['team_diff']:.1f}, "
+                + f"类型系数={penalty['type_multiplier']}, 方法惩罚={penalty['method_penalty']}, 总计={total_reduction}"
             )
 
             # 更新所有玩家数据
@@ -1279,7 +1346,7 @@ def process_battle_results_and_update_stats(battle_id, results_data):
                 # 错误玩家特殊处理
                 if user_id == err_user_id:
                     stats.losses += 1
-                    new_elo = max(round(stats.elo_score - total_reduction), 100)
+                    new_elo = apply_delta(stats.elo_score, -total_reduction)
                     bp.elo_change = new_elo - stats.elo_score
                     stats.elo_score = new_elo
                     logger.info(
@@ -1297,41 +1364,20 @@ def process_battle_results_and_update_stats(battle_id, results_data):
 
         # 正常处理分支
         else:
-            # ELO计算逻辑
-            # 看玩家tokens数占全局tokens比例proportion,
-            # 若proportion<1,按照1计算，>1,
-            # 则胜率 = min{1, 胜率 * (1 + (max{proportion,1} - 1) / 3)}
+            # ELO计算逻辑，规则见 database/elo.py
             team_elos = {RED_TEAM: [], BLUE_TEAM: []}
             for user_id, stats in user_stats_map.items():
                 team = team_map.get(user_id)
                 if team in team_elos:
                     team_elos[team].append(stats.elo_score)
 
-            tokens_standard = [
-                (tokens[ui - 1]["input"] + 3 * tokens[ui - 1]["output"]) / 4
-                for ui in range(1, 8)
-            ]  # 一倍输入和三倍输出的和
+            proportion = token_proportions(tokens[:7])  # 各座位token用量比例
 
-            tokens_avg = max(
-                MAX_TOKEN_ALLOWED, sum(tokens_standard) / 7
-            )  # 均值, 该常量以下必不惩罚
-
-            proportion = [token / tokens_avg for token in tokens_standard]  # 比例
-
-            team_avg = {
-                team: (
-                    len(scores) / sum([min(1, 1 / score) for score in scores])
-                )  # 防止分母为0
-                for team, scores in team_elos.items()
-            }  # 这里改为调和平均，给有大蠢蛋参与队伍的强者发点补助
+            # 这里改为调和平均，给有大蠢蛋参与队伍的强者发点补助
+            team_avg = {team: team_rating(scores) for team, scores in team_elos.items()}
 
-            K_FACTOR = 100
-            red_expected = 1 / (
-                1 + 10 ** ((team_avg[BLUE_TEAM] - team_avg[RED_TEAM]) / 400)
-            )
-            blue_expected = 1 / (
-                1 + 10 ** ((team_avg[RED_TEAM] - team_avg[BLUE_TEAM]) / 400)
-            )
+            red_expected = expected_score(team_avg[RED_TEAM], team_avg[BLUE_TEAM])
+            blue_expected = expected_score(team_avg[BLUE_TEAM], team_avg[RED_TEAM])
 
             actual_score = {
                 RED_TEAM: 1.0 if results_data.get("winner") == RED_TEAM else 0.0,
@@ -1345,10 +1391,7 @@ def process_battle_results_and_update_stats(battle_id, results_data):
                 idx = bp.position - 1  # position为1~7，proportion下标为0~6
                 team = team_map[user_id]
                 expected = red_expected if team == RED_TEAM else blue_expected
-                delta = K_FACTOR * (
-                    actual_score[team]
-                    - min(1, expected * (0.9 + (max(proportion[idx] - 1, 0) / 3)))
-                )
+                delta = elo_delta(actual_score[team], expected, proportion[idx])
 
                 stats.games_played += 1
                 if team_outcomes[team] == "win":
@@ -1356,7 +1399,7 @@ def process_battle_results_and_update_stats(battle_id, results_data):
                 else:
                     stats.losses += 1
 
-                new_elo = max(round(stats.elo_score + delta), 100)
+                new_elo = apply_delta(stats.elo_score, delta)
                 bp.initial_elo = stats.elo_score
                 bp.elo_change = new_elo - stats.elo_score
                 stats.elo_score = new_elo
@@ -1370,6 +1413,10 @@ def process_battle_results_and_update_stats(battle_id, results_data):
         # ----------------------------------
         # 阶段6：最终提交
         # ----------------------------------
+        if not commit:
+            db.session.flush()
+            logger.info(f"[Battle {battle_id}] 处理成功，等待批量提交")
+            return True
         if safe_commit():
             logger.info(f"[Battle {battle_id}] 处理成功")
             return True
@@ -1379,11 +1426,89 @@ def process_battle_results_and_update_stats(battle_id, results_data):
             return False
 
     except Exception as e:
+        if not commit:
+            raise
         db.session.rollback()
         logger.error(f"[Battle {battle_id}] 处理异常: {str(e)}", exc_info=True)
         return False
 
 
+def _begin_sqlite_transaction():
+    """
+    pysqlite 不会在 SAVEPOINT 前开启事务，最外层保存点的 RELEASE 会直接提交。
+    使用保存点前显式开启事务（并获取写锁），使整批写入仍在同一个事务中提交或回滚
+    """
+    connection = db.session.connection()
+    if (
+        connection.dialect.name == "sqlite"
+        and not connection.connection.driver_connection.in_transaction
+    ):
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def _process_results_in_savepoint(battle_id, results_data):
+    """
+    在保存点中处理一场对战的结果（commit=False）。
+    处理中途返回 False 时已写入的部分（对战状态、玩家记录、GameStats）随保存点回滚，
+    再由调用方写入兜底状态，同一批次中其他对战的写入不受影响；异常直接抛出
+    """
+    savepoint = db.session.begin_nested()
+    if process_battle_results_and_update_stats(battle_id, results_data, commit=False):
+        savepoint.commit()
+        return True
+    savepoint.rollback()
+    return False
+
+
+def record_battle_results_batch(items):
+    """
+    在一个事务中写入一批对战结果（对战状态、玩家对战记录、GameStats 与 ELO）。
+    按给定顺序依次处理，同一排行榜的 ELO 更新顺序与对战完成顺序一致；
+    每项的处理方式与 BattleService.mark_battle_as_completed / mark_battle_as_error 相同。
+
+    参数:
+        items (list): [(kind, battle_id, results_data)]，kind 为 "completed" 或 "error"。
+
+    返回:
+        list: 每项是否处理成功；整批出错时回滚并返回None，由调用方逐个重试。
+    """
+    outcomes = []
+    try:
+        _begin_sqlite_transaction()
+        for kind, battle_id, results_data in items:
+            if kind == "error":
+                battle = get_battle_by_id(battle_id)
+                if not battle:
+                    logger.error(f"数据库：尝试更新错误状态时未找到对战 {battle_id}")
+                    outcomes.append(False)
+                    continue
+                battle.status = "error"
+                battle.results = json.dumps(results_data)
+                if battle.ended_at is None:
+                    battle.ended_at = datetime.now()
+                outcomes.append(_process_results_in_savepoint(battle_id, results_data))
+            elif _process_results_in_savepoint(battle_id, results_data):
+                outcomes.append(True)
+            else:
+                logger.error(f"数据库：对战 {battle_id} 结果处理或统计更新失败")
+                # 标记为 completed 但记录错误
+                battle = get_battle_by_id(battle_id)
+                if battle:
+                    battle.status = "completed"
+                    battle.results = json.dumps(
+                        {"error": "结果处理失败", **results_data}
+                    )
+                    if battle.ended_at is None:
+                        battle.ended_at = datetime.now()
+                outcomes.append(False)
+        db.session.commit()
+        return outcomes
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"批量写入 {len(items)} 场对战结果失败: {e}", exc_info=True)
+        return None
+
+
 def get_user_battle_history(user_id, page=1, per_page=10):
     """
     获取用户参与过的对战历史记录 (分页)。
@@ -1397,26 +1522,21 @@ def get_user_battle_history(user_id, page=1, per_page=10):
         tuple: (对战列表, 总记录数)。出错返回 ([], 0)。
     """
     try:
-        # 查询 BattlePlayer 记录，筛选出指定用户的参与记录
-        # 然后加载关联的 Battle 和 User (为了获取用户名)
-        # 使用 joinedload 可以减少查询次数
-        query = (
-            BattlePlayer.query.filter_by(user_id=user_id)
-            .join(BattlePlayer.battle)
-            .order_by(Battle.created_at.desc())
-        )
+        # 直接查询用户参与过的对战，并随对战一起读取列表摘要，
+        # 页面渲染参与者与胜负时不再逐场查询
+        query = Battle.query.filter(_participated_by(user_id))
 
         # 获取总数
         total = query.count()
 
         # 应用分页
-        battle_players_page = query.offset((page - 1) * per_page).limit(per_page).all()
-
-        # 提取关联的 Battle 对象
-        # 使用 set 去重，因为一个 Battle 可能有多个 BattlePlayer (不是 1v1 的情况)
-        # 但实际上这里因为是按 BattlePlayer 查，每个 BattlePlayer 只对应一个 Battle。
-        # 转换为 battle 列表方便处理
-        battles = [bp.battle for bp in battle_players_page if bp.battle]
+        battles = (
+            query.options(joinedload(Battle.summary))
+            .order_by(Battle.created_at.desc(), Battle.id.desc())
+            .offset((page - 1) * per_page)
+            .limit(per_page)
+            .all()
+        )
 
         return battles, total
     except Exception as e:
@@ -1424,6 +1544,45 @@ def get_user_battle_history(user_id, page=1, per_page=10):
         return [], 0
 
 
+def _participated_by(user_id):
+    """筛选用户参与过的对战：沿 battle_players 的 (battle_id, user_id) 索引逐场判断"""
+    return (
+        select(BattlePlayer.id)
+        .where(BattlePlayer.battle_id == Battle.id, BattlePlayer.user_id == user_id)
+        .exists()
+    )
+
+
+def get_user_battle_history_after(user_id, cursor=None, per_page=10):
+    """
+    按 (created_at, id) 键集翻页获取用户参与过的对战（从新到旧）。
+
+    参数:
+        user_id (str): 用户ID。
+        cursor (str): 上一页返回的游标，第一页为 None。
+        per_page (int): 每页记录数。
+
+    返回:
+        tuple: (对战列表, 下一页游标；没有下一页时为 None)。游标无效时抛出 ValueError，其他错误返回 ([], None)。
+    """
+    try:
+        # 沿 battles 的 (created_at, id) 索引从新到旧扫描，逐行判断是否参与，凑满一页即停止
+        return keyset_page(
+            Battle.query.filter(_participated_by(user_id)).options(
+                joinedload(Battle.summary)
+            ),
+            Battle.created_at,
+            Battle.id,
+            cursor=cursor,
+            per_page=per_page,
+        )
+    except ValueError:
+        raise
+    except Exception as e:
+        logger.error(f"获取用户 {user_id} 的对战历史失败: {e}", exc_info=True)
+        return [], None
+
+
 def get_recent_battles(limit=20):
     """
     获取最近结束的对战列表。
@@ -1436,7 +1595,12 @@ def get_recent_battles(limit=20):
     """
     try:
         # 过滤已完成的对战，按结束时间降序排列
-        return Battle.query.order_by(Battle.ended_at.desc()).limit(limit).all()
+        return (
+            Battle.query.options(joinedload(Battle.summary))
+            .order_by(Battle.ended_at.desc())
+            .limit(limit)
+            .all()
+        )
     except Exception as e:
         logger.error(f"获取最近对战失败: {e}", exc_info=True)
         return []
@@ -1638,15 +1802,11 @@ def handle_cancelled_battle_stats(battle_id):
 from sqlalchemy import desc, or_, and_  # Import and_ if needed, or_ is key here
 
 
-def get_battles_paginated_filtered(filters=None, page=1, per_page=10, error_out=False):
+def _filtered_battles_query(filters=None):
     """
-    Fetches battles with optional filters and pagination. Supports multi-player filtering.
+    Builds the battle query for the given filters (shared by page and keyset pagination).
 
     :param filters: A dictionary with possible keys: 'status', 'date_from', 'date_to', 'players'.
-    :param page: Current page number.
-    :param per_page: Items per page.
-    :param error_out: If True, raises an error for invalid page numbers.
-    :return: A Flask-SQLAlchemy Pagination object.
     """
     query = Battle.query
 
@@ -1717,12 +1877,49 @@ def get_battles_paginated_filtered(filters=None, page=1, per_page=10, error_out=
                 # No valid players found, return no results
                 query = query.filter(False)
 
-    # Default ordering
-    query = query.order_by(desc(Battle.created_at))
+    return query
+
+
+def get_battles_paginated_filtered(filters=None, page=1, per_page=10, error_out=False):
+    """
+    Fetches battles with optional filters and pagination. Supports multi-player filtering.
+
+    :param filters: A dictionary with possible keys: 'status', 'date_from', 'date_to', 'players'.
+    :param page: Current page number.
+    :param per_page: Items per page.
+    :param error_out: If True, raises an error for invalid page numbers.
+    :return: A Flask-SQLAlchemy Pagination object.
+    """
+    query = _filtered_battles_query(filters)
+
+    # Default ordering (id breaks ties so the order matches keyset pagination)
+    query = query.order_by(desc(Battle.created_at), desc(Battle.id))
 
     return query.paginate(page=page, per_page=per_page, error_out=error_out)
 
 
+def get_battles_after(filters=None, cursor=None, per_page=10, count="none"):
+    """
+    按 (created_at, id) 键集翻页获取对战列表，筛选条件同 get_battles_paginated_filtered。
+
+    返回:
+        dict: {"battles": 对战列表, "next_cursor": 下一页游标或 None,
+               "total": 总数或 None, "total_is_lower_bound": 近似计数是否达到上限}。
+        游标无效时抛出 ValueError。
+    """
+    query = _filtered_battles_query(filters)
+    battles, next_cursor = keyset_page(
+        query, Battle.created_at, Battle.id, cursor=cursor, per_page=per_page
+    )
+    total, is_lower_bound = count_rows(db.session, query, count)
+    return {
+        "battles": battles,
+        "next_cursor": next_cursor,
+        "total": total,
+        "total_is_lower_bound": is_lower_bound,
+    }
+
+
 def create_battle_instance(created_by, ranking_id=0):
     """
     创建新的对战实例
@@ -1968,6 +2165,693 @@ def get_available_ai_instances(username_prefix=None, specific_usernames=None):
         return []
 
 
+# -----------------------------------------------------------------------------------------
+# 持久化对战队列 (BattleJob) 操作
+# 任务状态流转: queued -> leased -> running -> done/failed
+# 租约过期 (持有进程崩溃或重启) 的 leased/running 任务会被重新置为 queued
+
+ACTIVE_JOB_STATES = ["queued", "leased", "running"]
+CLAIM_CANDIDATES = 5  # 每次领取时尝试的候选任务数，减少多个进程争抢同一任务的失败
+
+
+def enqueue_battle_job(battle_id, participant_data, priority=1, tenant=""):
+    """
+    将对战加入持久化队列。对同一对战重复入队是幂等的。
+
+    参数:
+        battle_id (str): 对战ID。
+        participant_data (list): 补全后的参与者数据。
+        priority (int): 优先级，数值越小越优先。
+        tenant (str): 公平调度的租户，如 "user:12" 或 "ranking:1"。
+
+    返回:
+        BattleJob: 任务对象，失败返回None。
+    """
+    try:
+        job = BattleJob.query.filter_by(battle_id=battle_id).first()
+        if job and job.state in ACTIVE_JOB_STATES:
+            logger.info(f"对战 {battle_id} 已在持久化队列中 (状态: {job.state})")
+            return job
+
+        if job is None:
+            job = BattleJob(battle_id=battle_id)
+            db.session.add(job)
+        # 已结束的任务重新入队时重置租约与尝试次数
+        job.participant_data = json.dumps(participant_data)
+        job.priority = priority
+        job.tenant = tenant or ""
+        job.state = "queued"
+        job.lease_owner = None
+        job.lease_expires_at = None
+        job.heartbeat_at = None
+        job.attempts = 0
+        job.last_error = None
+
+        if safe_commit():
+            return job
+        return None
+    except Exception as e:
+        logger.error(f"对战 {battle_id} 加入持久化队列失败: {e}", exc_info=True)
+        db.session.rollback()
+        return None
+
+
+def _tenant_at_cap(tenant, running, max_running_per_user, max_running_per_ranking):
+    """租户执行中的任务数是否已达上限 (上限为0表示不限制)"""
+    if tenant.startswith("user:"):
+        limit = max_running_per_user
+    elif tenant.startswith("ranking:"):
+        limit = max_running_per_ranking
+    else:
+        limit = 0
+    return bool(limit) and running >= limit
+
+
+def claim_battle_job(
+    owner,
+    lease_seconds,
+    weights=None,
+    max_running_per_user=0,
+    max_running_per_ranking=0,
+):
+    """
+    按租户公平地领取一个排队中的任务并获得租约。
+    在所有节点范围内，优先领取 执行中任务数/权重 最小的租户的最早任务，
+    执行中任务数已达上限的租户跳过 (并发领取时可能略微超出，为软限制)。
+    通过带状态条件的原子 UPDATE 抢占，多个进程同时领取同一任务时只有一个成功；
+    PostgreSQL 下额外使用 FOR UPDATE SKIP LOCKED。
+
+    参数:
+        owner (str): 租约持有者标识。
+        lease_seconds (int): 租约时长 (秒)。
+        weights (dict): 优先级 -> 权重，未配置的优先级权重为1。
+        max_running_per_user (int): 每个用户同时执行的任务上限，0表示不限制。
+        max_running_per_ranking (int): 每个排行榜自动对战同时执行的任务上限，0表示不限制。
+
+    返回:
+        BattleJob: 领取到的任务，没有可领取的任务返回None。
+    """
+    weights = weights or {}
+    try:
+        running = dict(
+            db.session.query(BattleJob.tenant, func.count(BattleJob.id))
+            .filter(BattleJob.state.in_(["leased", "running"]))
+            .group_by(BattleJob.tenant)
+            .all()
+        )
+        heads = (
+            db.session.query(
+                BattleJob.tenant, BattleJob.priority, func.min(BattleJob.id)
+            )
+            .filter(BattleJob.state == "queued")
+            .group_by(BattleJob.tenant, BattleJob.priority)
+            .all()
+        )
+        eligible = []
+        for tenant, priority, job_id in heads:
+            tenant_running = running.get(tenant, 0)
+            if _tenant_at_cap(
+                tenant, tenant_running, max_running_per_user, max_running_per_ranking
+            ):
+                continue
+            share = tenant_running / max(1, weights.get(priority, 1))
+            eligible.append((share, priority, job_id))
+        eligible.sort()
+        candidates = [job_id for _, _, job_id in eligible[:CLAIM_CANDIDATES]]
+        if candidates and db.engine.dialect.name == "postgresql":
+            # 跳过其他节点正在领取的行，避免多节点同时争抢同一任务
+            locked = {
+                job_id
+                for (job_id,) in db.session.query(BattleJob.id)
+                .filter(BattleJob.id.in_(candidates), BattleJob.state == "queued")
+                .with_for_update(skip_locked=True)
+                .all()
+            }
+            candidates = [job_id for job_id in candidates if job_id in locked]
+        now = datetime.now()
+        for job_id in candidates:
+            result = db.session.execute(
+                update(BattleJob)
+                .where(BattleJob.id == job_id, BattleJob.state == "queued")
+                .values(
+                    state="leased",
+                    lease_owner=owner,
+                    lease_expires_at=now + timedelta(seconds=lease_seconds),
+                    heartbeat_at=now,
+                    attempts=BattleJob.attempts + 1,
+                    updated_at=now,
+                )
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount == 1:
+                db.session.commit()
+                return BattleJob.query.get(job_id)
+        db.session.rollback()
+        return None
+    except Exception as e:
+        logger.error(f"领取持久化队列任务失败: {e}", exc_info=True)
+        db.session.rollback()
+        return None
+
+
+def mark_battle_job_running(battle_id, owner):
+    """
+    将持有租约的任务标记为 running。
+
+    返回:
+        bool: 租约仍由 owner 持有且更新成功返回True。
+    """
+    try:
+        result = db.session.execute(
+            update(BattleJob)
+            .where(
+                BattleJob.battle_id == battle_id,
+                BattleJob.lease_owner == owner,
+                BattleJob.state == "leased",
+            )
+            .values(state="running", updated_at=datetime.now())
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        return result.rowcount == 1
+    except Exception as e:
+        logger.error(f"标记任务 {battle_id} 为 running 失败: {e}", exc_info=True)
+        db.session.rollback()
+        return False
+
+
+def heartbeat_battle_jobs(owner, battle_ids, lease_seconds):
+    """
+    为 owner 持有的任务续约。
+
+    参数:
+        owner (str): 租约持有者标识。
+        battle_ids (list): 需要续约的对战ID。
+        lease_seconds (int): 续约后的租约时长 (秒)。
+
+    返回:
+        set: 续约后仍由 owner 持有的对战ID；出错返回None。
+    """
+    if not battle_ids:
+        return set()
+    try:
+        now = datetime.now()
+        db.session.execute(
+            update(BattleJob)
+            .where(
+                BattleJob.battle_id.in_(battle_ids),
+                BattleJob.lease_owner == owner,
+                BattleJob.state.in_(["leased", "running"]),
+            )
+            .values(
+                lease_expires_at=now + timedelta(seconds=lease_seconds),
+                heartbeat_at=now,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        rows = (
+            db.session.query(BattleJob.battle_id)
+            .filter(
+                BattleJob.battle_id.in_(battle_ids),
+                BattleJob.lease_owner == owner,
+                BattleJob.state.in_(["leased", "running"]),
+            )
+            .all()
+        )
+        return {battle_id for (battle_id,) in rows}
+    except Exception as e:
+        logger.error(f"持久化队列任务续约失败: {e}", exc_info=True)
+        db.session.rollback()
+        return None
+
+
+def finish_battle_job(battle_id, owner, succeeded=True, error=None):
+    """
+    结束 owner 持有的任务，状态置为 done 或 failed。
+
+    返回:
+        bool: 租约仍由 owner 持有且更新成功返回True。
+    """
+    try:
+        result = db.session.execute(
+            update(BattleJob)
+            .where(
+                BattleJob.battle_id == battle_id,
+                BattleJob.lease_owner == owner,
+                BattleJob.state.in_(["leased", "running"]),
+            )
+            .values(
+                state="done" if succeeded else "failed",
+                lease_expires_at=None,
+                last_error=error,
+                updated_at=datetime.now(),
+            )
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        return result.rowcount == 1
+    except Exception as e:
+        logger.error(f"结束任务 {battle_id} 失败: {e}", exc_info=True)
+        db.session.rollback()
+        return False
+
+
+def requeue_expired_battle_jobs(max_attempts=3):
+    """
+    回收租约已过期的任务：尝试次数未达上限的重新入队，否则标记为 failed 并将对战标记为 error。
+
+    参数:
+        max_attempts (int): 任务最多被领取的次数。
+
+    返回:
+        tuple: (重新入队数, 失败数)。
+    """
+    requeued, failed = 0, 0
+    try:
+        now = datetime.now()
+        expired_jobs = BattleJob.query.filter(
+            BattleJob.state.in_(["leased", "running"]),
+            BattleJob.lease_expires_at < now,
+        ).all()
+        for job in expired_jobs:
+            give_up = job.attempts >= max_attempts
+            error = f"租约过期 (持有者: {job.lease_owner}，第 {job.attempts} 次尝试)"
+            # 带条件更新，避免覆盖刚刚完成续约的任务
+            result = db.session.execute(
+                update(BattleJob)
+                .where(
+                    BattleJob.id == job.id,
+                    BattleJob.state == job.state,
+                    BattleJob.lease_expires_at < now,
+                )
+                .values(
+                    state="failed" if give_up else "queued",
+                    lease_owner=None,
+                    lease_expires_at=None,
+                    last_error=error,
+                    updated_at=now,
+                )
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount != 1:
+                continue
+
+            battle = get_battle_by_id(job.battle_id)
+            if give_up:
+                failed += 1
+                if battle and battle.status in ["waiting", "playing"]:
+                    battle.status = "error"
+                    battle.ended_at = now
+                    battle.results = json.dumps({"error": f"对战多次执行中断: {error}"})
+            else:
+                requeued += 1
+                if battle and battle.status == "playing":
+                    battle.status = "waiting"  # 将重新执行
+        db.session.commit()
+        if requeued or failed:
+            logger.warning(f"回收过期任务：重新入队 {requeued} 个，失败 {failed} 个")
+        return requeued, failed
+    except Exception as e:
+        logger.error(f"回收过期任务失败: {e}", exc_info=True)
+        db.session.rollback()
+        return requeued, failed
+
+
+def count_queued_battle_jobs():
+    """获取持久化队列中排队中的任务数"""
+    try:
+        return BattleJob.query.filter_by(state="queued").count()
+    except Exception as e:
+        logger.error(f"统计排队任务数失败: {e}", exc_info=True)
+        return 0
+
+
+def get_battle_job_position(battle_id):
+    """
+    获取排队中任务的位置 (从1开始，按领取顺序)。
+
+    返回:
+        int: 排队位置，任务不在排队中返回None。
+    """
+    try:
+        job = BattleJob.query.filter_by(battle_id=battle_id, state="queued").first()
+        if not job:
+            return None
+        return BattleJob.query.filter(
+            BattleJob.state == "queued",
+            or_(
+                BattleJob.priority < job.priority,
+                and_(BattleJob.priority == job.priority, BattleJob.id <= job.id),
+            ),
+        ).count()
+    except Exception as e:
+        logger.error(f"获取任务 {battle_id} 排队位置失败: {e}", exc_info=True)
+        return None
+
+
+def heartbeat_battle_runner(runner_id, hostname, pid, capacity, active_battles, status):
+    """
+    登记或更新对战执行进程的容量与心跳。
+
+    参数:
+        runner_id (str): 执行进程标识 (与任务租约持有者一致)。
+        hostname (str): 主机名。
+        pid (int): 进程号。
+        capacity (int): 可同时执行的对战数。
+        active_battles (int): 正在执行的对战数。
+        status (str): active, draining 或 stopped。
+
+    返回:
+        bool: 更新是否成功。
+    """
+    try:
+        runner = BattleRunner.query.get(runner_id)
+        if runner is None:
+            runner = BattleRunner(id=runner_id, hostname=hostname, pid=pid)
+            db.session.add(runner)
+        runner.capacity = capacity
+        runner.active_battles = active_battles
+        runner.status = status
+        runner.heartbeat_at = datetime.now()
+        return safe_commit()
+    except Exception as e:
+        logger.error(f"更新执行进程 {runner_id} 心跳失败: {e}", exc_info=True)
+        db.session.rollback()
+        return False
+
+
+def get_battle_runners(ttl_seconds=180):
+    """
+    获取最近 ttl_seconds 秒内有心跳且未停止的执行进程。
+
+    返回:
+        list: BattleRunner 对象列表。
+    """
+    try:
+        since = datetime.now() - timedelta(seconds=ttl_seconds)
+        return (
+            BattleRunner.query.filter(
+                BattleRunner.heartbeat_at >= since, BattleRunner.status != "stopped"
+            )
+            .order_by(BattleRunner.hostname, BattleRunner.started_at)
+            .all()
+        )
+    except Exception as e:
+        logger.error(f"获取执行进程列表失败: {e}", exc_info=True)
+        return []
+
+
+def prune_battle_runners(ttl_seconds=86400):
+    """删除超过 ttl_seconds 秒没有心跳的执行进程登记，返回删除数"""
+    try:
+        since = datetime.now() - timedelta(seconds=ttl_seconds)
+        count = BattleRunner.query.filter(BattleRunner.heartbeat_at < since).delete(
+            synchronize_session=False
+        )
+        db.session.commit()
+        return count
+    except Exception as e:
+        logger.error(f"清理执行进程登记失败: {e}", exc_info=True)
+        db.session.rollback()
+        return 0
+
+
+# -----------------------------------------------------------------------------------------
+# 自动对战运行状态 (AutoMatchRun) 操作
+# 每个排行榜一行；持有租约的进程推进自动对战并定期保存进度，其他进程只读或请求停止
+
+
+def claim_automatch_run(
+    ranking_id,
+    owner,
+    lease_seconds,
+    resume=False,
+    parallel_games=20,
+    priority=1,
+    target_battles=None,
+):
+    """
+    获取排行榜自动对战的租约。
+    通过带条件的原子 UPDATE 抢占，多个进程同时获取时只有一个成功。
+
+    参数:
+        ranking_id (int): 排行榜ID。
+        owner (str): 租约持有者标识。
+        lease_seconds (int): 租约时长 (秒)。
+        resume (bool): 为True时接管状态为 running 的运行并保留进度，
+            否则开始新的运行 (进度清零，使用传入的参数)。
+        parallel_games, priority, target_battles: 新运行的参数。
+
+    返回:
+        AutoMatchRun: 获取成功后的运行记录；运行正由其他进程持有 (租约未过期)、
+        resume 时没有可接管的运行或出错时返回None。
+    """
+    try:
+        now = datetime.now()
+        run = AutoMatchRun.query.get(ranking_id)
+        if run is None:
+            if resume:
+                return None
+            run = AutoMatchRun(ranking_id=ranking_id)
+            db.session.add(run)
+            db.session.flush()  # 并发插入时主键冲突，由下方的异常处理返回None
+        elif run.is_active(now) and run.owner != owner:
+            return None
+        elif resume and run.status != "running":
+            return None
+
+        values = {
+            "status": "running",
+            "owner": owner,
+            "lease_expires_at": now + timedelta(seconds=lease_seconds),
+            "heartbeat_at": now,
+        }
+        if not resume:
+            values.update(
+                parallel_games=parallel_games,
+                priority=priority,
+                target_battles=target_battles,
+                started_count=0,
+                completed_count=0,
+                in_flight="[]",
+                started_at=now,
+            )
+        # 读取之后租约可能已被其他进程获取：只有持有者与租约均未变化时才更新
+        result = db.session.execute(
+            update(AutoMatchRun)
+            .where(
+                AutoMatchRun.ranking_id == ranking_id,
+                (
+                    AutoMatchRun.owner.is_(None)
+                    if run.owner is None
+                    else AutoMatchRun.owner == run.owner
+                ),
+                (
+                    AutoMatchRun.lease_expires_at.is_(None)
+                    if run.lease_expires_at is None
+                    else AutoMatchRun.lease_expires_at == run.lease_expires_at
+                ),
+            )
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        if result.rowcount != 1:
+            return None
+        db.session.expire_all()
+        return AutoMatchRun.query.get(ranking_id)
+    except Exception as e:
+        logger.error(f"获取榜单 {ranking_id} 自动对战租约失败: {e}", exc_info=True)
+        db.session.rollback()
+        return None
+
+
+def save_automatch_run(ranking_id, owner, lease_seconds, **progress):
+    """
+    保存 owner 持有的运行进度并续约。
+
+    参数:
+        ranking_id (int): 排行榜ID。
+        owner (str): 租约持有者标识。
+        lease_seconds (int): 续约后的租约时长 (秒)。
+        progress: started_count, completed_count, in_flight (list),
+            participants (list), status 等需要更新的字段。
+
+    返回:
+        bool: 运行仍由 owner 持有且状态为 running 时返回True；
+        已被其他进程接管或被请求停止时返回False，调用方应停止推进；出错返回None。
+    """
+    try:
+        now = datetime.now()
+        values = dict(progress)
+        for key in ("in_flight", "participants"):
+            if key in values:
+                values[key] = json.dumps(list(values[key]))
+        values.update(
+            lease_expires_at=now + timedelta(seconds=lease_seconds),
+            heartbeat_at=now,
+            updated_at=now,
+        )
+        result = db.session.execute(
+            update(AutoMatchRun)
+            .where(
+                AutoMatchRun.ranking_id == ranking_id,
+                AutoMatchRun.owner == owner,
+                AutoMatchRun.status == "running",
+            )
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        return result.rowcount == 1
+    except Exception as e:
+        logger.error(f"保存榜单 {ranking_id} 自动对战进度失败: {e}", exc_info=True)
+        db.session.rollback()
+        return None
+
+
+def release_automatch_run(ranking_id, owner, status="stopped"):
+    """
+    owner 结束运行并释放租约。
+
+    参数:
+        status (str): stopped (手动停止) 或 finished (已达到目标局数)。
+
+    返回:
+        bool: 运行仍由 owner 持有且更新成功返回True。
+    """
+    try:
+        result = db.session.execute(
+            update(AutoMatchRun)
+            .where(AutoMatchRun.ranking_id == ranking_id, AutoMatchRun.owner == owner)
+            .values(
+                status=status,
+                owner=None,
+                lease_expires_at=None,
+                updated_at=datetime.now(),
+            )
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        return result.rowcount == 1
+    except Exception as e:
+        logger.error(f"释放榜单 {ranking_id} 自动对战租约失败: {e}", exc_info=True)
+        db.session.rollback()
+        return False
+
+
+def request_automatch_run_stop(ranking_id):
+    """
+    从任意进程请求停止排行榜的自动对战：状态置为 stopped，
+    持有进程在下一次保存进度时发现并停止。
+
+    返回:
+        bool: 存在运行中的记录并更新成功返回True。
+    """
+    try:
+        result = db.session.execute(
+            update(AutoMatchRun)
+            .where(
+                AutoMatchRun.ranking_id == ranking_id,
+                AutoMatchRun.status == "running",
+            )
+            .values(status="stopped", updated_at=datetime.now())
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        return result.rowcount == 1
+    except Exception as e:
+        logger.error(f"请求停止榜单 {ranking_id} 自动对战失败: {e}", exc_info=True)
+        db.session.rollback()
+        return False
+
+
+def get_automatch_runs(ranking_ids=None):
+    """
+    获取自动对战运行记录。
+
+    参数:
+        ranking_ids (list): 需要的排行榜ID，为空时返回全部。
+
+    返回:
+        list: AutoMatchRun 对象列表。
+    """
+    try:
+        query = AutoMatchRun.query
+        if ranking_ids is not None:
+            query = query.filter(AutoMatchRun.ranking_id.in_(list(ranking_ids)))
+        return query.order_by(AutoMatchRun.ranking_id).all()
+    except Exception as e:
+        logger.error(f"获取自动对战运行记录失败: {e}", exc_info=True)
+        return []
+
+
+def get_orphaned_automatch_runs():
+    """获取状态为 running 但租约已过期 (持有进程已退出) 的运行记录"""
+    try:
+        return AutoMatchRun.query.filter(
+            AutoMatchRun.status == "running",
+            or_(
+                AutoMatchRun.lease_expires_at.is_(None),
+                AutoMatchRun.lease_expires_at <= datetime.now(),
+            ),
+        ).all()
+    except Exception as e:
+        logger.error(f"获取待接管的自动对战运行记录失败: {e}", exc_info=True)
+        return []
+
+
+def get_battle_statuses(battle_ids):
+    """
+    批量获取对战状态。
+
+    返回:
+        dict: {battle_id: status}，不存在的对战不在结果中；出错返回None。
+    """
+    if not battle_ids:
+        return {}
+    try:
+        rows = (
+            db.session.query(Battle.id, Battle.status)
+            .filter(Battle.id.in_(list(battle_ids)))
+            .all()
+        )
+        return {battle_id: status for battle_id, status in rows}
+    except Exception as e:
+        logger.error(f"批量获取对战状态失败: {e}", exc_info=True)
+        return None
+
+
+def get_battle_results(battle_ids):
+    """
+    批量获取对战状态与结果（由任一执行进程写回数据库的结果）。
+
+    返回:
+        dict: {battle_id: (status, results)}，results 为解析后的字典，没有或无法解析时为 None；
+            不存在的对战不在结果中；出错返回None。
+    """
+    if not battle_ids:
+        return {}
+    try:
+        rows = (
+            db.session.query(Battle.id, Battle.status, Battle.results)
+            .filter(Battle.id.in_(list(battle_ids)))
+            .all()
+        )
+        results = {}
+        for battle_id, status, raw in rows:
+            try:
+                parsed = json.loads(raw) if raw else None
+            except (json.JSONDecodeError, TypeError):
+                parsed = None
+            results[battle_id] = (status, parsed)
+        return results
+    except Exception as e:
+        logger.error(f"批量获取对战结果失败: {e}", exc_info=True)
+        return None
+
+
 # -----------------------------------------------------------------------------------------
 # Flask-Login User 加载函数 (从 models.py 移到此处或其他合适的数据加载模块)
 
@@ -0,0 +1,245 @@
+"""
+对战列表摘要的维护：battle_summaries 为每场已结束的对战保存参与者（用户名、AI 名称、位置、
+胜负、ELO 变化）、胜方与错误标记，对战列表与对战历史随对战一起读取摘要（joinedload），
+一页对战只需一次查询，不再逐场查询参与者、用户与 AI 代码，也不再逐场解析 results。
+
+维护方式：每次 flush 后记录本次写入涉及的对战（对战的状态/结果变化，或其参与者的增删改），
+提交前为其中已结束的对战重写摘要（同一事务中每场只写一次）。结算分多次提交时
+（如先标记 error 再处理 ELO），每次提交都会重写，最终与 battle_players 一致。
+这些写入与触发它们的改动在同一个事务中提交或回滚。
+
+摘要中的用户名与 AI 名称是写入时的快照：用户改名或被删除、AI 改名或被删除时，
+flush 后把该用户/AI 参与过且已有摘要的对战一并记为待重写，提交前按当前数据重写。
+绕过 ORM 事件的批量修改（Query.update/delete）需要调用 mark_battle_summaries_stale 登记受影响的对战。
+
+升级前已结束的对战没有摘要，部署后运行一次 backfill_battle_summaries.py 分批补建
+（不在应用启动时执行，避免每个 gunicorn worker 各自补建）；
+没有摘要的对战（未结束或尚未补建）在列表中按原方式逐场读取参与者。
+"""
+
+import json
+import logging
+from datetime import datetime
+
+from sqlalchemy import delete, event, insert, inspect, select
+from sqlalchemy.orm import Session
+
+from .base import db
+from .models import AICode, Battle, BattlePlayer, BattleSummary, User
+
+logger = logging.getLogger("BattleSummary")
+
+summaries = BattleSummary.__table__
+FINISHED_STATUSES = ("completed", "error", "cancelled")
+BATTLE_COLUMNS = ("status", "results")
+PLAYER_COLUMNS = ("user_id", "selected_ai_code_id", "position", "outcome")
+PLAYER_STAT_COLUMNS = ("initial_elo", "elo_change")
+USER_COLUMNS = ("username",)
+AI_CODE_COLUMNS = ("name",)
+PENDING_KEY = "battle_summary_pending"  # session.info 中待提交前重写摘要的对战
+
+
+def _parse_results(results):
+    if not results:
+        return {}
+    try:
+        parsed = json.loads(results)
+    except (json.JSONDecodeError, TypeError):
+        return {}
+    return parsed if isinstance(parsed, dict) else {}
+
+
+def write_battle_summaries(connection, battle_ids) -> int:
+    """为给定对战中已结束的重写摘要，返回写入的行数"""
+    battle_ids = list(set(battle_ids))
+    if not battle_ids:
+        return 0
+    battles = connection.execute(
+        select(Battle.id, Battle.status, Battle.ranking_id, Battle.results).where(
+            Battle.id.in_(battle_ids), Battle.status.in_(FINISHED_STATUSES)
+        )
+    ).all()
+    connection.execute(delete(summaries).where(summaries.c.battle_id.in_(battle_ids)))
+    if not battles:
+        return 0
+
+    participants = {battle.id: [] for battle in battles}
+    players = connection.execute(
+        select(
+            BattlePlayer.id,
+            BattlePlayer.battle_id,
+            BattlePlayer.user_id,
+            User.username,
+            BattlePlayer.selected_ai_code_id,
+            AICode.name,
+            BattlePlayer.position,
+            BattlePlayer.outcome,
+            BattlePlayer.initial_elo,
+            BattlePlayer.elo_change,
+            BattlePlayer.join_time,
+        )
+        .outerjoin(User, User.id == BattlePlayer.user_id)
+        .outerjoin(AICode, AICode.id == BattlePlayer.selected_ai_code_id)
+        .where(BattlePlayer.battle_id.in_(list(participants)))
+        .order_by(BattlePlayer.battle_id, BattlePlayer.position)
+    ).all()
+    for row in players:
+        participant = {
+            "id": row.id,
+            "battle_id": row.battle_id,
+            "user_id": row.user_id,
+            "username": row.username or "未知用户",
+            "selected_ai_code_id": row.selected_ai_code_id,
+            "position": row.position,
+            "outcome": row.outcome,
+            "initial_elo": row.initial_elo,
+            "elo_change": row.elo_change,
+            "join_time": row.join_time.isoformat() if row.join_time else None,
+        }
+        # 与 BattlePlayer.to_dict 一致：AI 记录被删除时给出提示
+        if row.selected_ai_code_id is not None:
+            participant["selected_ai_code_name"] = row.name or "AI Not Found"
+        participants[row.battle_id].append(participant)
+
+    now = datetime.now()
+    rows = []
+    for battle in battles:
+        results = _parse_results(battle.results)
+        rows.append(
+            {
+                "battle_id": battle.id,
+                "status": battle.status,
+                "ranking_id": battle.ranking_id or 0,
+                "winner": results.get("winner"),
+                "has_error": battle.status == "error" or bool(results.get("error")),
+                "participants": json.dumps(participants[battle.id], ensure_ascii=False),
+                "updated_at": now,
+            }
+        )
+    connection.execute(insert(summaries), rows)
+    return len(rows)
+
+
+def _columns_changed(obj, keys) -> bool:
+    state = inspect(obj)
+    return any(state.attrs[key].history.has_changes() for key in keys)
+
+
+def _summarized_battles_of(session, column, ids) -> set:
+    """给定用户/AI 参与过且已有摘要的对战（Core 查询，不触发 autoflush）"""
+    if not ids:
+        return set()
+    rows = session.connection().execute(
+        select(BattlePlayer.battle_id)
+        .join(summaries, summaries.c.battle_id == BattlePlayer.battle_id)
+        .where(column.in_(list(ids)))
+        .distinct()
+    )
+    return set(rows.scalars())
+
+
+def _collect_renamed(session) -> set:
+    """改名或删除的用户与 AI 涉及的对战：摘要中的名称快照需要按当前数据重写"""
+    user_ids, ai_code_ids = set(), set()
+    for obj in session.dirty:
+        if isinstance(obj, User) and _columns_changed(obj, USER_COLUMNS):
+            user_ids.add(obj.id)
+        elif isinstance(obj, AICode) and _columns_changed(obj, AI_CODE_COLUMNS):
+            ai_code_ids.add(obj.id)
+    for obj in session.deleted:
+        if isinstance(obj, User):
+            user_ids.add(obj.id)
+        elif isinstance(obj, AICode):
+            ai_code_ids.add(obj.id)
+    return _summarized_battles_of(
+        session, BattlePlayer.user_id, user_ids
+    ) | _summarized_battles_of(session, BattlePlayer.selected_ai_code_id, ai_code_ids)
+
+
+def _collect_battle_ids(session) -> set:
+    battle_ids = _collect_renamed(session)
+    for obj in session.new:
+        if isinstance(obj, Battle):
+            if obj.status in FINISHED_STATUSES:
+                battle_ids.add(obj.id)
+        elif isinstance(obj, BattlePlayer):
+            battle_ids.add(obj.battle_id)
+    for obj in session.dirty:
+        if isinstance(obj, Battle):
+            if _columns_changed(obj, BATTLE_COLUMNS):
+                battle_ids.add(obj.id)
+        elif isinstance(obj, BattlePlayer):
+            if _columns_changed(obj, PLAYER_COLUMNS + PLAYER_STAT_COLUMNS):
+                battle_ids.add(obj.battle_id)
+    for obj in session.deleted:
+        if isinstance(obj, BattlePlayer):
+            battle_ids.add(obj.battle_id)
+    battle_ids.discard(None)
+    return battle_ids
+
+
+def mark_battle_summaries_stale(session, battle_ids):
+    """
+    登记需要在本事务提交前重写摘要的对战。
+    用于 ORM 事件看不到的批量修改，例如先用 Query.delete 删除参与者再删除用户
+    """
+    battle_ids = set(battle_ids)
+    battle_ids.discard(None)
+    if battle_ids:
+        session.info.setdefault(PENDING_KEY, set()).update(battle_ids)
+
+
+@event.listens_for(Session, "after_flush")
+def _record_changed_battles(session, flush_context):
+    mark_battle_summaries_stale(session, _collect_battle_ids(session))
+
+
+@event.listens_for(Session, "before_commit")
+def _write_pending_summaries(session):
+    # 提交前的最后一次 flush 也可能涉及对战
+    session.flush()
+    pending = session.info.pop(PENDING_KEY, None)
+    if not pending:
+        return
+    count = write_battle_summaries(session.connection(), pending)
+    if count:
+        logger.debug(f"已写入 {count} 场对战的列表摘要")
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_pending_summaries(session, previous_transaction):
+    # 回滚保存点时保留外层事务已登记的对战，提交前按当前数据重写
+    if previous_transaction.nested:
+        return
+    session.info.pop(PENDING_KEY, None)
+
+
+def backfill_battle_summaries(batch_size=500) -> int:
+    """
+    为已结束但还没有摘要的对战分批补建摘要（需要应用上下文），返回补建的场数。
+    出错时记录日志并返回 None（已提交的批次保留，重新运行时继续补建）
+    """
+    missing = (
+        select(Battle.id)
+        .where(
+            Battle.status.in_(FINISHED_STATUSES),
+            ~select(summaries.c.battle_id)
+            .where(summaries.c.battle_id == Battle.id)
+            .exists(),
+        )
+        .limit(batch_size)
+    )
+    total = 0
+    try:
+        while True:
+            with db.engine.begin() as connection:
+                battle_ids = connection.execute(missing).scalars().all()
+                if not battle_ids:
+                    break
+                total += write_battle_summaries(connection, battle_ids)
+    except Exception as e:
+        logger.error(f"补建对战列表摘要失败（已补建 {total} 场）: {e}", exc_info=True)
+        return None
+    if total:
+        logger.info(f"已为 {total} 场历史对战补建列表摘要")
+    return total
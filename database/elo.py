@@ -0,0 +1,79 @@
+"""
+七人对局的 ELO 更新规则（纯函数，不访问数据库）。
+
+process_battle_results_and_update_stats 逐场结算时使用；离线重算工具
+database/elo_recompute.py 按同样的规则批量重放历史对局，修改这里的常量或公式后
+可用它从历史记录重新计算排行榜。
+"""
+
+K_FACTOR = 100
+MAX_TOKEN_ALLOWED = 3000  # 人均 token 用量（标准化后）在此以下不惩罚
+MIN_ELO = 100
+
+# 代码错误惩罚：基础惩罚加队伍差距的10%，按错误类型放大，再加上错误方法的附加惩罚
+ERROR_BASE_PENALTY = 30
+ERROR_TEAM_DIFF_RATIO = 0.1
+ERROR_TYPE_MULTIPLIERS = {
+    "critical_player_ERROR": 1.5,  # 严重错误
+    "player_ruturn_ERROR": 1.2,  # 返回值错误
+}
+ERROR_METHOD_PENALTIES = {
+    "walk": 10,  # 移动错误
+    "decide_mission_member": 15,  # 队伍选择错误
+    "mission_vote2": 20,  # 投票错误
+}
+ERROR_PENALTY_RANGE = (20, 100)
+
+
+def team_rating(scores) -> float:
+    """队伍评分：成员 ELO 的调和平均，给有大蠢蛋参与队伍的强者发点补助"""
+    return len(scores) / sum([min(1, 1 / score) for score in scores])  # 防止分母为0
+
+
+def expected_score(own_rating: float, opponent_rating: float) -> float:
+    return 1 / (1 + 10 ** ((opponent_rating - own_rating) / 400))
+
+
+def token_proportions(tokens) -> list:
+    """
+    各座位 token 用量占人均用量的比例
+    tokens: 按座位排列的 [{"input": int, "output": int}, ...]，一倍输入和三倍输出的和为标准用量
+    """
+    tokens_standard = [(t["input"] + 3 * t["output"]) / 4 for t in tokens]
+    tokens_avg = max(MAX_TOKEN_ALLOWED, sum(tokens_standard) / len(tokens_standard))
+    return [token / tokens_avg for token in tokens_standard]
+
+
+def elo_delta(actual: float, expected: float, proportion: float) -> float:
+    """
+    看玩家tokens数占全局tokens比例proportion,
+    若proportion<1,按照1计算，>1,
+    则胜率 = min{1, 胜率 * (1 + (max{proportion,1} - 1) / 3)}
+    """
+    return K_FACTOR * (actual - min(1, expected * (0.9 + (max(proportion - 1, 0) / 3))))
+
+
+def apply_delta(elo: int, delta: float) -> int:
+    return max(round(elo + delta), MIN_ELO)
+
+
+def error_penalty(
+    blue_avg: float, red_avg: float, error_type: str = None, error_method: str = None
+):
+    """
+    代码错误玩家的扣分，blue_avg / red_avg 为两队 ELO 的算术平均
+    返回 (扣分, 各项明细)
+    """
+    team_diff_penalty = abs(blue_avg - red_avg) * ERROR_TEAM_DIFF_RATIO
+    type_multiplier = ERROR_TYPE_MULTIPLIERS.get(error_type, 1.0)
+    method_penalty = ERROR_METHOD_PENALTIES.get(error_method, 0)
+    total = round(
+        (ERROR_BASE_PENALTY + team_diff_penalty) * type_multiplier + method_penalty
+    )
+    low, high = ERROR_PENALTY_RANGE
+    return max(low, min(total, high)), {
+        "base": ERROR_BASE_PENALTY,
+        "team_diff": team_diff_penalty,
+        "type_multiplier": type_multiplier,
+        "method_penalty": method_penalty,
+    }
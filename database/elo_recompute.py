@@ -0,0 +1,407 @@
+"""
+离线 ELO 重算：按 database/elo.py 的规则，从历史对局重新计算一个排行榜的 ELO。
+
+修改 K 值、队伍评分或 token/错误惩罚后，用它代替逐场经 ORM 重放历史对局：
+1. 两次查询读出排行榜中所有已结算对局（completed/error，非 ELO 豁免）及其座位，按结束时间排序，
+   转换为 NumPy 数组（对局 × 7 座位的玩家下标、队伍、token 比例）；
+2. 不依赖评分的量（token 比例、胜负）对全部对局一次性向量化计算；
+3. 按时间顺序重放。没有共同玩家的对局互不影响，因此把对局分层：每场对局的层号为其玩家上一场
+   对局层号的最大值加一，同层对局没有共同玩家，整层一起向量化更新，与逐场重放结果一致；
+4. 生成差异报告（每位玩家的旧/新 ELO 与名次），确认后批量写回 GameStats.elo_score。
+
+结算摘要（results["summary"]）中没有 token 数据的旧对局会读取一遍公共日志，日志已删除时按 0 计算。
+只改写 GameStats.elo_score，BattlePlayer 中每场的 initial_elo / elo_change 保留原值。
+命令行入口见 recompute_elo.py，需要 NumPy（仅此工具使用）。
+"""
+
+import json
+import logging
+import os
+from time import time
+
+from sqlalchemy import select, update
+
+from .base import db
+from .elo import (
+    K_FACTOR,
+    MAX_TOKEN_ALLOWED,
+    MIN_ELO,
+    apply_delta,
+    error_penalty,
+)
+from .leaderboard import rebuild_leaderboard
+from .models import Battle, BattlePlayer, GameStats, User
+from .result_summary import summarize_public_log
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger("EloRecompute")
+
+SEATS = 7
+DEFAULT_INITIAL_ELO = 1200
+RED_ROLES = ("Morgana", "Assassin", "Oberon")
+DEFAULT_RED_SEATS = (5, 6, 7)  # 缺少角色信息时，与结算一致：前4个座位为蓝方
+
+KIND_SKIP, KIND_NORMAL, KIND_ERROR = 0, 1, 2
+
+
+def _parse_results(raw):
+    try:
+        results = json.loads(raw) if raw else {}
+    except (TypeError, ValueError):
+        return {}
+    return results if isinstance(results, dict) else {}
+
+
+def _load_battles(ranking_id: int):
+    """读出排行榜的已结算对局（按结算顺序排列）及其座位，返回 (对局行, {battle_id: {座位: (用户, 结果, 初始ELO)}})"""
+    # 直接在连接上执行 Core 查询，不经过 ORM 的结果装载
+    connection = db.session.connection()
+    settled = (
+        Battle.ranking_id == ranking_id,
+        Battle.status.in_(("completed", "error")),
+        Battle.is_elo_exempt.is_(False),
+    )
+    battle_rows = connection.execute(
+        select(Battle.id, Battle.status, Battle.results)
+        .where(*settled)
+        .order_by(Battle.ended_at, Battle.created_at, Battle.id)
+    ).all()
+    seat_rows = connection.execute(
+        select(
+            BattlePlayer.battle_id,
+            BattlePlayer.user_id,
+            BattlePlayer.position,
+            BattlePlayer.outcome,
+            BattlePlayer.initial_elo,
+        )
+        .join(Battle, Battle.id == BattlePlayer.battle_id)
+        .where(*settled)
+    ).all()
+
+    seats = {}
+    for battle_id, user_id, position, outcome, initial_elo in seat_rows:
+        if position is not None and 1 <= position <= SEATS:
+            seats.setdefault(battle_id, {})[position] = (user_id, outcome, initial_elo)
+    return battle_rows, seats
+
+
+def _battle_summary(battle_id: str, results: dict, read_logs: bool):
+    """返回 (结算摘要, 是否读取了公共日志)；摘要中没有 token 数据的旧对局读取一遍公共日志"""
+    summary = results.get("summary") or {}
+    if summary.get("tokens") or not read_logs:
+        return summary, False
+    path = results.get("public_log_file")
+    if not path or not os.path.exists(path):
+        return summary, False
+    try:
+        return summarize_public_log(path, results), True
+    except Exception as e:
+        logger.warning(f"[Battle {battle_id}] 读取公共日志失败: {str(e)}")
+        return summary, False
+
+
+def _seat_teams(results: dict, summary: dict) -> list:
+    """各座位是否为红方（与结算一致：角色不在红方角色中即为蓝方）"""
+    roles = {}
+    for pid, role in (summary.get("roles") or results.get("roles") or {}).items():
+        try:
+            roles[int(pid)] = role
+        except (TypeError, ValueError):
+            continue
+    if not roles:
+        return [seat in DEFAULT_RED_SEATS for seat in range(1, SEATS + 1)]
+    return [roles.get(seat) in RED_ROLES for seat in range(1, SEATS + 1)]
+
+
+def _classify(status: str, results: dict, summary: dict, seats: dict):
+    """返回 (对局类型, 错误座位)，与结算时的分支一致"""
+    if len(seats) != SEATS:
+        return KIND_SKIP, None  # 玩家数量异常的对局结算时直接失败
+    if status == "error":
+        error = summary.get("error") or {}
+        pid = error.get("pid")
+        if isinstance(pid, int) and 1 <= pid <= SEATS:
+            return KIND_ERROR, pid
+        # 旧对局没有摘要时，以结算记录的唯一失败者作为错误玩家
+        losers = [pos for pos, (_, outcome, _) in seats.items() if outcome == "loss"]
+        if len(losers) == 1:
+            return KIND_ERROR, losers[0]
+        return KIND_SKIP, None
+    if "error" not in results and results.get("winner") in ("red", "blue"):
+        return KIND_NORMAL, None
+    return KIND_SKIP, None
+
+
+def _token_proportions(tokens):
+    """向量化的 elo.token_proportions，tokens 形状为 (对局数, 7, 2)"""
+    standard = (tokens[:, :, 0] + 3 * tokens[:, :, 1]) / 4
+    average = np.maximum(MAX_TOKEN_ALLOWED, standard.sum(axis=1) / SEATS)
+    return standard / average[:, None]
+
+
+def _replay_normal(ratings, players, present, red, teams, valid, actual, factor):
+    """
+    向量化重放一层正常结算的对局（同层对局没有共同玩家）
+    与 process_battle_results_and_update_stats 中的正常分支一致，见 database/elo.py；
+    与评分无关的量（队伍人数、胜负、token 系数）已在分层前对全部对局算好
+    """
+    elos = ratings[players].astype(float)
+    inverse = np.minimum(1, 1 / elos)
+    red_count, red_present, blue_count, blue_present = teams
+    with np.errstate(divide="ignore", invalid="ignore"):
+        red_avg = red_count / (inverse * red_present).sum(axis=1)
+        blue_avg = blue_count / (inverse * blue_present).sum(axis=1)
+    red_expected = 1 / (1 + 10 ** ((blue_avg - red_avg) / 400))
+    blue_expected = 1 / (1 + 10 ** ((red_avg - blue_avg) / 400))
+    expected = np.where(red, red_expected[:, None], blue_expected[:, None])
+    delta = K_FACTOR * (actual - np.minimum(1, expected * factor))
+    new_elos = np.maximum(np.rint(elos + delta), MIN_ELO)
+    update_mask = present & valid[:, None]
+    ratings[players[update_mask]] = new_elos[update_mask]
+
+
+def _replay_error(ratings, players, red, err_seat, error):
+    """重放一场代码错误对局：只扣除错误玩家的 ELO，与结算的错误分支一致"""
+    err_player = players[err_seat - 1]
+    if err_player < 0:
+        return False
+    present = players >= 0
+    red_elos = ratings[players[present & red]]
+    blue_elos = ratings[players[present & ~red]]
+    red_avg = red_elos.sum() / len(red_elos) if len(red_elos) else 0
+    blue_avg = blue_elos.sum() / len(blue_elos) if len(blue_elos) else 0
+    reduction, _ = error_penalty(
+        float(blue_avg), float(red_avg), error.get("type"), error.get("method")
+    )
+    ratings[err_player] = apply_delta(int(ratings[err_player]), -reduction)
+    return True
+
+
+def recompute_ranking_elo(ranking_id: int, apply: bool = False, read_logs=True):
+    """
+    按当前规则重新计算排行榜的 ELO
+    apply: 为 True 时将结果写回 GameStats（默认只生成报告）
+    read_logs: 摘要中缺少 token 数据时是否读取公共日志
+
+    返回差异报告 dict；出错时返回 None
+    """
+    if np is None:
+        logger.error("离线 ELO 重算需要 NumPy，请先安装: pip install numpy")
+        return None
+    started = time()
+    try:
+        stats_rows = (
+            db.session.connection()
+            .execute(
+                select(
+                    GameStats.id, GameStats.user_id, GameStats.elo_score, User.username
+                )
+                .join(User, User.id == GameStats.user_id)
+                .where(GameStats.ranking_id == ranking_id)
+            )
+            .all()
+        )
+        battle_rows, battle_seats = _load_battles(ranking_id)
+    except Exception as e:
+        logger.error(f"读取排行榜 {ranking_id} 的对局失败: {str(e)}", exc_info=True)
+        return None
+    loaded_at = time()
+
+    # 只重算当前仍在榜的玩家，与结算时跳过已注销玩家一致
+    index = {row.user_id: i for i, row in enumerate(stats_rows)}
+    # 逐场整理为扁平列表（避免大量小对象拖慢垃圾回收），最后一次性转换为数组
+    player_flat, red_flat, token_flat, red_won, kinds, levels = [], [], [], [], [], []
+    err_seats, errors = {}, {}
+    initial = {}
+    last_level = [-1] * len(stats_rows)
+    log_reads = missing_tokens = 0
+    no_tokens = [0] * (SEATS * 2)
+
+    for battle_id, status, raw in battle_rows:
+        seats = battle_seats.get(battle_id, {})
+        results = _parse_results(raw)
+        summary, log_read = _battle_summary(battle_id, results, read_logs)
+        log_reads += log_read
+        kind, err_seat = _classify(status, results, summary, seats)
+        if kind == KIND_SKIP:
+            continue
+        row = [-1] * SEATS
+        for position, (user_id, _, initial_elo) in seats.items():
+            i = index.get(user_id)
+            if i is None:
+                continue
+            row[position - 1] = i
+            if i not in initial and initial_elo is not None:
+                initial[i] = initial_elo
+        members = [i for i in row if i >= 0]
+        if not members:
+            continue  # 玩家均已不在榜
+        # 分层：层号为其玩家上一场对局层号的最大值加一
+        level = max(last_level[i] for i in members) + 1
+        for i in members:
+            last_level[i] = level
+
+        b = len(kinds)
+        player_flat.extend(row)
+        red_flat.extend(_seat_teams(results, summary))
+        kinds.append(kind)
+        levels.append(level)
+        red_won.append(1.0 if results.get("winner") == "red" else 0.0)
+        seat_tokens = summary.get("tokens") or []
+        if kind == KIND_ERROR:
+            err_seats[b] = err_seat
+            errors[b] = summary.get("error") or {}
+            token_flat.extend(no_tokens)
+        elif len(seat_tokens) >= SEATS:
+            for t in seat_tokens[:SEATS]:
+                token_flat.append(t["input"])
+                token_flat.append(t["output"])
+        else:
+            missing_tokens += 1
+            token_flat.extend(no_tokens)
+
+    players = np.array(player_flat, dtype=np.int64).reshape(-1, SEATS)
+    red = np.array(red_flat, dtype=bool).reshape(-1, SEATS)
+    proportion = _token_proportions(
+        np.array(token_flat, dtype=float).reshape(-1, SEATS, 2)
+    )
+    red_won, kinds = np.array(red_won, dtype=float), np.array(kinds, dtype=np.int8)
+
+    # 初始 ELO 取玩家在本榜第一场对局前的分数
+    ratings = np.array(
+        [initial.get(i, DEFAULT_INITIAL_ELO) for i in range(len(stats_rows))],
+        dtype=np.int64,
+    )
+    # 按层排列后，每层是一段连续切片
+    levels = np.array(levels, dtype=np.int64)
+    active = np.argsort(levels, kind="stable")
+    levels = levels[active]
+    boundaries = np.flatnonzero(np.diff(levels)) + 1
+    starts = np.concatenate(([0], boundaries)).tolist()
+    ends = np.concatenate((boundaries, [len(active)])).tolist()
+
+    # 与评分无关的量一次性算好（某一方没有在榜玩家时，结算会因调和平均分母为0而失败，跳过）
+    players, red = players[active], red[active]
+    present = players >= 0
+    red_present, blue_present = present & red, present & ~red
+    red_count, blue_count = red_present.sum(axis=1), blue_present.sum(axis=1)
+    normal = kinds[active] == KIND_NORMAL
+    valid = normal & (red_count > 0) & (blue_count > 0)
+    won = red_won[active][:, None]
+    actual = np.where(red, won, 1.0 - won)
+    factor = 0.9 + np.maximum(proportion[active] - 1, 0) / 3
+    safe_players = np.where(present, players, 0)
+    error_rows = np.flatnonzero(kinds[active] == KIND_ERROR).tolist()
+
+    replayed = int(valid.sum())
+    next_error = 0
+    for start, end in zip(starts, ends):
+        if valid[start:end].any():
+            _replay_normal(
+                ratings,
+                safe_players[start:end],
+                present[start:end],
+                red[start:end],
+                (
+                    red_count[start:end],
+                    red_present[start:end],
+                    blue_count[start:end],
+                    blue_present[start:end],
+                ),
+                valid[start:end],
+                actual[start:end],
+                factor[start:end],
+            )
+        while next_error < len(error_rows) and error_rows[next_error] < end:
+            row = error_rows[next_error]
+            b = int(active[row])
+            replayed += _replay_error(
+                ratings, players[row], red[row], err_seats[b], errors[b]
+            )
+            next_error += 1
+
+    # 玩家在重算中没有任何对局时保留原分数
+    played = np.zeros(len(stats_rows), dtype=bool)
+    played[players[present]] = True
+    old = np.array([row.elo_score or 0 for row in stats_rows], dtype=np.int64)
+    new = np.where(played, ratings, old)
+    report = _build_report(ranking_id, stats_rows, old, new)
+    report.update(
+        {
+            "battles": len(battle_rows),
+            "replayed": replayed,
+            "skipped": len(battle_rows) - replayed,
+            "levels": int(levels.max()) + 1 if len(levels) else 0,
+            "log_reads": log_reads,
+            "missing_tokens": missing_tokens,
+            "query_seconds": round(loaded_at - started, 3),
+            "compute_seconds": round(time() - loaded_at, 3),
+            "applied": False,
+        }
+    )
+
+    if apply:
+        report["applied"] = _write_back(ranking_id, stats_rows, old, new)
+    return report
+
+
+def _ranks(values) -> list:
+    """按 ELO 降序排名（1 起），同分同名次"""
+    ordered = sorted(values, reverse=True)
+    first = {}
+    for position, value in enumerate(ordered, start=1):
+        first.setdefault(value, position)
+    return [first[value] for value in values]
+
+
+def _build_report(ranking_id, stats_rows, old, new) -> dict:
+    old_list, new_list = old.tolist(), new.tolist()
+    old_ranks, new_ranks = _ranks(old_list), _ranks(new_list)
+    players = [
+        {
+            "user_id": row.user_id,
+            "username": row.username,
+            "old_elo": old_list[i],
+            "new_elo": new_list[i],
+            "diff": new_list[i] - old_list[i],
+            "old_rank": old_ranks[i],
+            "new_rank": new_ranks[i],
+        }
+        for i, row in enumerate(stats_rows)
+    ]
+    players.sort(key=lambda p: (-abs(p["diff"]), p["new_rank"]))
+    diffs = np.abs(new - old)
+    return {
+        "ranking_id": ranking_id,
+        "players": players,
+        "changed": int((diffs > 0).sum()),
+        "rank_changed": sum(1 for p in players if p["old_rank"] != p["new_rank"]),
+        "mean_abs_diff": float(diffs.mean()) if len(diffs) else 0.0,
+        "max_abs_diff": int(diffs.max()) if len(diffs) else 0,
+    }
+
+
+def _write_back(ranking_id, stats_rows, old, new) -> bool:
+    """按主键批量更新有变化的 GameStats.elo_score，并重建该榜单的排行榜快照"""
+    changes = [
+        {"id": row.id, "elo_score": int(new[i])}
+        for i, row in enumerate(stats_rows)
+        if new[i] != old[i]
+    ]
+    if not changes:
+        return True
+    try:
+        db.session.execute(update(GameStats), changes)
+        # 批量更新绕过了 ORM，排行榜快照不会自动维护
+        rebuild_leaderboard(ranking_id, db.session.connection())
+        db.session.commit()
+        logger.info(f"已写回 {len(changes)} 条 GameStats 的 ELO")
+        return True
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"写回重算的 ELO 失败: {str(e)}", exc_info=True)
+        return False
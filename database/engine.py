@@ -0,0 +1,137 @@
+"""
+数据库引擎调优：连接池大小与 SQLite 连接参数（WAL、busy_timeout、synchronous、缓存）。
+
+默认部署使用 SQLite platform.db，写入来自请求线程、对战工作线程、自动对战线程等。
+默认的 rollback 日志模式下读写互斥，写锁等待又只有 5 秒，负载高时出现 database is locked。
+启用后每个新连接都切换到 WAL（读不阻塞写、写不阻塞读），并设置等待写锁的超时与缓存；
+连接池按进程配置（gunicorn 的每个 worker 与对战执行进程各自拥有一个连接池）。
+
+config.yaml 配置示例：
+
+DATABASE_ENGINE:
+  enabled: false           # 默认使用 Flask-SQLAlchemy 的默认引擎参数
+  pool_size: 10            # 每个进程常驻的连接数
+  max_overflow: 64         # 高峰时每个进程额外创建的连接数（对战工作线程较多时调大）
+  pool_timeout: 30         # 连接池耗尽时等待连接的秒数
+  busy_timeout_ms: 15000   # 等待 SQLite 写锁的毫秒数
+  synchronous: NORMAL      # WAL 下 NORMAL 不会损坏数据库，只可能丢失掉电前最后的事务
+  cache_size_kb: 65536     # 每个连接的页缓存大小
+  mmap_size_mb: 256        # 内存映射读取的大小，0 为关闭
+
+串行化写入见 database/writer.py（DATABASE_WRITER）。
+"""
+
+import logging
+import os
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+from config.config import BASE_DIR, Config
+
+logger = logging.getLogger("DatabaseEngine")
+
+SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+
+def get_engine_config() -> dict:
+    config = dict(Config._yaml_config.get("DATABASE_ENGINE") or {})
+    config.setdefault("enabled", False)
+    config.setdefault("pool_size", 10)
+    config.setdefault("max_overflow", 64)
+    config.setdefault("pool_timeout", 30)
+    config.setdefault("busy_timeout_ms", 15000)
+    config.setdefault("synchronous", "NORMAL")
+    config.setdefault("cache_size_kb", 65536)
+    config.setdefault("mmap_size_mb", 256)
+    return config
+
+
+def is_sqlite_uri(uri: str) -> bool:
+    return make_url(uri).get_backend_name() == "sqlite"
+
+
+def sqlite_database_path(uri: str = None):
+    """
+    SQLite 数据库文件的绝对路径，非 SQLite 或内存数据库时返回 None。
+    相对路径与 Flask-SQLAlchemy 一致，相对于应用的 instance 目录。
+    """
+    url = make_url(uri or Config.SQLALCHEMY_DATABASE_URI)
+    if url.get_backend_name() != "sqlite":
+        return None
+    database = url.database
+    if not database or database == ":memory:":
+        return None
+    if url.query.get("uri") and database.startswith("file:"):
+        database = database[5:].split("?", 1)[0]
+    if not os.path.isabs(database):
+        database = os.path.join(BASE_DIR, "instance", database)
+    return database
+
+
+def build_engine_options(app) -> dict:
+    """按配置生成 SQLALCHEMY_ENGINE_OPTIONS，未启用时返回空字典"""
+    config = get_engine_config()
+    uri = app.config["SQLALCHEMY_DATABASE_URI"]
+    if not config["enabled"]:
+        return {}
+    if is_sqlite_uri(uri) and sqlite_database_path(uri) is None:
+        return {}  # 内存数据库使用 StaticPool，不设置连接池
+
+    options = {
+        "pool_size": int(config["pool_size"]),
+        "max_overflow": int(config["max_overflow"]),
+        "pool_timeout": float(config["pool_timeout"]),
+    }
+    if is_sqlite_uri(uri):
+        options["connect_args"] = {
+            # pysqlite 的 timeout 即 busy handler 的等待时间（秒）
+            "timeout": int(config["busy_timeout_ms"]) / 1000,
+            # 连接由连接池在线程间复用
+            "check_same_thread": False,
+        }
+    return options
+
+
+def configure_engine(app):
+    """在 db.init_app 之前调用：把连接池参数写入应用配置（已显式配置的不覆盖）"""
+    options = build_engine_options(app)
+    if not options:
+        return
+    merged = dict(options)
+    merged.update(app.config.get("SQLALCHEMY_ENGINE_OPTIONS") or {})
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = merged
+
+
+def install_sqlite_pragmas(engine):
+    """在 db.init_app 之后调用：为引擎的每个新连接设置 WAL 等 PRAGMA"""
+    config = get_engine_config()
+    if not config["enabled"] or engine.dialect.name != "sqlite":
+        return
+
+    synchronous = str(config["synchronous"]).upper()
+    if synchronous not in SYNCHRONOUS_MODES:
+        logger.warning(f"未知的 synchronous 模式 {synchronous}，使用 NORMAL")
+        synchronous = "NORMAL"
+    pragmas = [
+        "PRAGMA journal_mode=WAL",
+        f"PRAGMA busy_timeout={int(config['busy_timeout_ms'])}",
+        f"PRAGMA synchronous={synchronous}",
+        f"PRAGMA cache_size=-{int(config['cache_size_kb'])}",
+        "PRAGMA temp_store=MEMORY",
+        f"PRAGMA mmap_size={int(config['mmap_size_mb']) * 1024 * 1024}",
+    ]
+
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+    logger.info(
+        f"SQLite 已启用 WAL，busy_timeout={config['busy_timeout_ms']}ms，"
+        f"synchronous={synchronous}，连接池 {config['pool_size']}+{config['max_overflow']}"
+    )
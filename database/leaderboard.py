@@ -0,0 +1,260 @@
+"""
+排行榜快照的维护：leaderboard_entries 按榜单保存每个玩家的名次、ELO 与战绩，
+排行榜页面按名次区间或名次键集读取，查询某个玩家的名次只需一次主键查找，各 gunicorn worker 共享同一份数据。
+
+维护方式：每次 flush 后检查本次写入的 GameStats——
+- 只有 ELO/战绩变化（对局结算）：更新这些玩家的快照行，并只重排新旧 ELO 覆盖的分数区间
+  （区间之外的玩家相对顺序与上方人数都不变，名次不变）；
+- 新增、删除 GameStats 或改变其所属榜单、删除用户：在提交前重建该榜单的快照（同一事务中只重建一次）；
+- 修改用户名：同步快照中的用户名。
+这些写入与触发它们的改动在同一个事务中提交或回滚。绕过 ORM 直接批量更新 GameStats 的代码
+（如 database/elo_recompute.py 的写回）需自行调用 rebuild_leaderboard。
+名次按 ELO 降序、用户ID升序排列，从1开始连续。
+
+并发：重排与重建按当前快照计算名次，同一榜单的两次结算在各自的事务里交错执行会得到重复或缺失的名次。
+PostgreSQL 上修改快照前先获取该榜单的事务级 advisory lock（提交或回滚时释放），
+同一榜单的维护按事务串行执行；SQLite 同一时间只有一个写事务，不需要加锁。
+"""
+
+import logging
+
+from sqlalchemy import bindparam, delete, event, func, insert, inspect, select
+from sqlalchemy.orm import Session
+
+from .base import db
+from .models import GameStats, LeaderboardEntry, User
+
+logger = logging.getLogger("Leaderboard")
+
+entries = LeaderboardEntry.__table__
+STAT_COLUMNS = ("elo_score", "games_played", "wins", "losses", "draws")
+PENDING_REBUILD_KEY = "leaderboard_rebuild"  # session.info 中待提交前重建的榜单
+LOCK_NAMESPACE = 0x4C42  # advisory lock 的第一个键，与其他用途的锁区分
+
+
+def _lock_ranking(connection, ranking_id):
+    """在当前事务中获取榜单快照的写锁（PostgreSQL），事务结束时释放"""
+    if connection.dialect.name == "postgresql":
+        connection.execute(
+            select(func.pg_advisory_xact_lock(LOCK_NAMESPACE, int(ranking_id)))
+        )
+
+
+def rebuild_leaderboard(ranking_id, connection):
+    """从 GameStats 重建一个榜单的快照，返回行数"""
+    _lock_ranking(connection, ranking_id)
+    rows = connection.execute(
+        select(
+            GameStats.user_id,
+            User.username,
+            GameStats.elo_score,
+            GameStats.games_played,
+            GameStats.wins,
+            GameStats.losses,
+            GameStats.draws,
+        )
+        .join(User, User.id == GameStats.user_id)
+        .where(GameStats.ranking_id == ranking_id)
+        .order_by(GameStats.elo_score.desc(), GameStats.user_id)
+    ).all()
+    connection.execute(delete(entries).where(entries.c.ranking_id == ranking_id))
+    if rows:
+        connection.execute(
+            insert(entries),
+            [
+                {
+                    "ranking_id": ranking_id,
+                    "user_id": user_id,
+                    "rank": rank,
+                    "username": username,
+                    "elo_score": elo_score or 0,
+                    "games_played": games_played or 0,
+                    "wins": wins or 0,
+                    "losses": losses or 0,
+                    "draws": draws or 0,
+                }
+                for rank, (
+                    user_id,
+                    username,
+                    elo_score,
+                    games_played,
+                    wins,
+                    losses,
+                    draws,
+                ) in enumerate(rows, start=1)
+            ],
+        )
+    return len(rows)
+
+
+def _rerank(connection, ranking_id, low, high):
+    """重排 ELO 在 [low, high] 内的玩家；其上方的人数决定起始名次"""
+    above = connection.execute(
+        select(func.count())
+        .select_from(entries)
+        .where(entries.c.ranking_id == ranking_id, entries.c.elo_score > high)
+    ).scalar()
+    rows = connection.execute(
+        select(entries.c.user_id, entries.c.rank)
+        .where(
+            entries.c.ranking_id == ranking_id,
+            entries.c.elo_score.between(low, high),
+        )
+        .order_by(entries.c.elo_score.desc(), entries.c.user_id)
+    ).all()
+    changes = [
+        {"b_user_id": user_id, "b_rank": rank}
+        for rank, (user_id, old_rank) in enumerate(rows, start=above + 1)
+        if rank != old_rank
+    ]
+    if changes:
+        connection.execute(
+            entries.update()
+            .where(
+                entries.c.ranking_id == ranking_id,
+                entries.c.user_id == bindparam("b_user_id"),
+            )
+            .values(rank=bindparam("b_rank")),
+            changes,
+        )
+
+
+def _old_value(state, key):
+    history = state.attrs[key].history
+    return history.deleted[0] if history.deleted else state.attrs[key].value
+
+
+def _collect_changes(session):
+    """返回 (需要重建的榜单, {榜单: [(GameStats, 旧ELO)]}, [(用户ID, 新用户名)])"""
+    rebuild, updated, renamed = set(), {}, []
+    for obj in session.new:
+        if isinstance(obj, GameStats):
+            rebuild.add(obj.ranking_id)
+    for obj in session.deleted:
+        if isinstance(obj, GameStats):
+            rebuild.add(_old_value(inspect(obj), "ranking_id"))
+        elif isinstance(obj, User):
+            rebuild.update(
+                session.connection()
+                .execute(
+                    select(entries.c.ranking_id).where(entries.c.user_id == obj.id)
+                )
+                .scalars()
+            )
+    for obj in session.dirty:
+        if isinstance(obj, GameStats):
+            state = inspect(obj)
+            old_ranking_id = _old_value(state, "ranking_id")
+            if old_ranking_id != obj.ranking_id:
+                rebuild.update((old_ranking_id, obj.ranking_id))
+            elif any(state.attrs[key].history.has_changes() for key in STAT_COLUMNS):
+                updated.setdefault(obj.ranking_id, []).append(
+                    (obj, _old_value(state, "elo_score"))
+                )
+        elif isinstance(obj, User):
+            if inspect(obj).attrs.username.history.has_changes():
+                renamed.append((obj.id, obj.username))
+    return rebuild, updated, renamed
+
+
+def _apply_updates(connection, ranking_id, changes) -> bool:
+    """更新快照行并重排受影响的区间；快照缺少其中的玩家时返回 False（需要重建）"""
+    # 加锁后再读取区间上方的人数与区间内的名次，避免与其他事务的重排交错
+    _lock_ranking(connection, ranking_id)
+    bounds = []
+    for stats, old_elo in changes:
+        result = connection.execute(
+            entries.update()
+            .where(
+                entries.c.ranking_id == ranking_id,
+                entries.c.user_id == stats.user_id,
+            )
+            .values(**{key: getattr(stats, key) or 0 for key in STAT_COLUMNS})
+        )
+        if result.rowcount != 1:
+            return False
+        if old_elo != stats.elo_score:
+            bounds.extend((old_elo or 0, stats.elo_score or 0))
+    if bounds:
+        _rerank(connection, ranking_id, min(bounds), max(bounds))
+    return True
+
+
+@event.listens_for(Session, "after_flush")
+def _maintain_leaderboard(session, flush_context):
+    rebuild, updated, renamed = _collect_changes(session)
+    if not (rebuild or updated or renamed):
+        return
+    connection = session.connection()
+    pending = session.info.setdefault(PENDING_REBUILD_KEY, set())
+    pending.update(rebuild)
+    # 按榜单ID顺序加锁，同时结算多个榜单的事务之间不会互相等待成环
+    for ranking_id, changes in sorted(updated.items()):
+        if ranking_id not in pending and not _apply_updates(
+            connection, ranking_id, changes
+        ):
+            pending.add(ranking_id)
+    for user_id, username in renamed:
+        connection.execute(
+            entries.update()
+            .where(entries.c.user_id == user_id)
+            .values(username=username)
+        )
+
+
+@event.listens_for(Session, "before_commit")
+def _rebuild_pending_leaderboards(session):
+    # 提交前的最后一次 flush 也可能产生需要重建的榜单
+    session.flush()
+    pending = session.info.pop(PENDING_REBUILD_KEY, None)
+    if not pending:
+        return
+    connection = session.connection()
+    for ranking_id in sorted(pending):
+        count = rebuild_leaderboard(ranking_id, connection)
+        logger.debug(f"排行榜 {ranking_id} 快照已重建 ({count} 人)")
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_pending_leaderboards(session, previous_transaction):
+    # 回滚保存点（如批量结果写入中的单场失败）时保留外层事务已登记的重建，
+    # 多登记的榜单在提交前按当前数据重建，结果不变
+    if previous_transaction.nested:
+        return
+    session.info.pop(PENDING_REBUILD_KEY, None)
+
+
+def ensure_leaderboard(ranking_id) -> bool:
+    """
+    榜单已有 GameStats 但还没有快照时（首次部署或快照被清空）建立快照。
+    快照在独立的连接与事务中建立并提交，不提交调用方会话中的改动（读取路径也会调用）。
+    返回快照是否可用（榜单为空时也返回 True）
+    """
+    # 不触发 autoflush：调用方的改动不在这里写入，SQLite 上也不会因此持有写锁、阻塞下面的独立连接
+    with db.session.no_autoflush:
+        has_entries = db.session.execute(
+            select(entries.c.rank).where(entries.c.ranking_id == ranking_id).limit(1)
+        ).first()
+        if has_entries:
+            return True
+        has_stats = db.session.execute(
+            select(GameStats.id).where(GameStats.ranking_id == ranking_id).limit(1)
+        ).first()
+    if not has_stats:
+        return True
+    try:
+        with db.engine.begin() as connection:
+            _lock_ranking(connection, ranking_id)
+            # 加锁后再次检查，其他进程可能已经建立了快照
+            if connection.execute(
+                select(entries.c.rank)
+                .where(entries.c.ranking_id == ranking_id)
+                .limit(1)
+            ).first():
+                return True
+            count = rebuild_leaderboard(ranking_id, connection)
+        logger.info(f"排行榜 {ranking_id} 快照已建立 ({count} 人)")
+        return True
+    except Exception as e:
+        logger.error(f"建立排行榜 {ranking_id} 快照失败: {e}", exc_info=True)
+        return False
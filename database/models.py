@@ -8,6 +8,7 @@ from werkzeug.security import generate_password_hash, check_password_hash
 
 from .base import db, login_manager
 from datetime import datetime
+import json
 import uuid
 
 
@@ -215,6 +216,14 @@ class Battle(db.Model):
     players = db.relationship(
         "BattlePlayer", backref="battle", lazy="dynamic", cascade="all, delete-orphan"
     )
+    # job: 持久化队列中对应的执行任务 (一对一 Battle -> BattleJob)，仅在启用持久化队列时存在
+    job = db.relationship(
+        "BattleJob", backref="battle", uselist=False, cascade="all, delete-orphan"
+    )
+    # summary: 结束时写入的列表摘要 (一对一 Battle -> BattleSummary)，见 database/battle_summary.py
+    summary = db.relationship(
+        "BattleSummary", backref="battle", uselist=False, cascade="all, delete-orphan"
+    )
 
     __table_args__ = (
         db.Index("idx_battles_status", status),
@@ -222,6 +231,9 @@ class Battle(db.Model):
         db.Index("idx_battles_created_at", created_at.desc()),
         db.Index("idx_battles_ended_at", ended_at.desc()),
         db.Index("idx_battles_type", battle_type),
+        # 对战列表与对战历史按 (created_at, id) 键集分页
+        db.Index("idx_battles_created_id", created_at, id),
+        db.Index("idx_battles_status_created_id", status, created_at, id),
     )
 
     def __repr__(self):
@@ -255,6 +267,43 @@ class Battle(db.Model):
         return self.players.filter_by(user_id=user_id).first()
 
 
+# 对战列表摘要：对战结束时写入一次的参与者、胜方、ELO 变化与错误标记，
+# 对战列表与对战历史读取一行即可渲染，无需逐场查询参与者 (见 database/battle_summary.py)
+class BattleSummary(db.Model):
+    __tablename__ = "battle_summaries"
+
+    battle_id = db.Column(db.String(36), db.ForeignKey("battles.id"), primary_key=True)
+    status = db.Column(db.String(20), nullable=False)  # completed, error, cancelled
+    ranking_id = db.Column(db.Integer, nullable=False, default=0)
+    winner = db.Column(db.String(10), nullable=True)  # red, blue，没有胜方时为空
+    has_error = db.Column(db.Boolean, nullable=False, default=False)
+    # JSON: 按位置排列的参与者，每项与 BattlePlayer.to_dict() 的格式一致
+    participants = db.Column(db.Text, nullable=False, default="[]")
+    updated_at = db.Column(db.DateTime, default=datetime.now)
+
+    def get_participants(self):
+        return json.loads(self.participants or "[]")
+
+    def participant(self, user_id):
+        """指定用户在此对战中的参与记录 (字典)，未参与时返回 None"""
+        return next(
+            (p for p in self.get_participants() if p["user_id"] == user_id), None
+        )
+
+    def to_dict(self):
+        return {
+            "battle_id": self.battle_id,
+            "status": self.status,
+            "ranking_id": self.ranking_id,
+            "winner": self.winner,
+            "has_error": self.has_error,
+            "participants": self.get_participants(),
+        }
+
+    def __repr__(self):
+        return f"<BattleSummary {self.battle_id} - {self.status}>"
+
+
 # 对战参与者模型 (直接挂载在 Battle 下)
 class BattlePlayer(db.Model):
     __tablename__ = "battle_players"
@@ -344,7 +393,212 @@ class BattlePlayer(db.Model):
         return f"<BattlePlayer {self.id} for User {user_info} in Battle {battle_info} Outcome: {self.outcome}>"
 
 
+# 持久化对战队列任务 (进程重启后仍可恢复的对战执行任务)
+class BattleJob(db.Model):
+    __tablename__ = "battle_jobs"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)  # 自增，即入队顺序
+    battle_id = db.Column(
+        db.String(36), db.ForeignKey("battles.id"), unique=True, nullable=False
+    )
+    participant_data = db.Column(db.Text, nullable=False)  # JSON存储补全后的参与者数据
+    priority = db.Column(db.Integer, nullable=False, default=1)  # 数值越小越优先
+    # 公平调度的租户：发起用户 "user:<id>" 或自动对战的排行榜 "ranking:<id>"
+    tenant = db.Column(db.String(64), nullable=False, default="")
+    state = db.Column(
+        db.String(20), nullable=False, default="queued"
+    )  # queued, leased, running, done, failed
+
+    # 租约：持有者需定期心跳续约，过期后任务重新入队
+    lease_owner = db.Column(db.String(128), nullable=True)
+    lease_expires_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)  # 已被领取的次数
+    last_error = db.Column(db.Text, nullable=True)
+
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+    __table_args__ = (
+        # 优化领取任务查询
+        db.Index("idx_battlejobs_state_priority", state, priority, id),
+        # 优化按租户统计排队与执行中的任务
+        db.Index("idx_battlejobs_state_tenant", state, tenant, id),
+        # 优化过期租约扫描
+        db.Index("idx_battlejobs_lease_expires", lease_expires_at),
+    )
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "battle_id": self.battle_id,
+            "participant_data": json.loads(self.participant_data),
+            "priority": self.priority,
+            "tenant": self.tenant,
+            "state": self.state,
+            "lease_owner": self.lease_owner,
+            "attempts": self.attempts,
+        }
+
+    def __repr__(self):
+        return (
+            f"<BattleJob {self.id} for Battle {self.battle_id} - State: {self.state}>"
+        )
+
+
+# 对战执行进程登记 (多节点部署时每个执行进程定期上报容量与心跳)
+class BattleRunner(db.Model):
+    __tablename__ = "battle_runners"
+
+    id = db.Column(db.String(128), primary_key=True)  # 与 BattleJob.lease_owner 一致
+    hostname = db.Column(db.String(128), nullable=False)
+    pid = db.Column(db.Integer, nullable=False)
+    capacity = db.Column(db.Integer, nullable=False, default=0)  # 可同时执行的对战数
+    active_battles = db.Column(db.Integer, nullable=False, default=0)
+    status = db.Column(
+        db.String(20), nullable=False, default="active"
+    )  # active, draining, stopped
+
+    started_at = db.Column(db.DateTime, default=datetime.now)
+    heartbeat_at = db.Column(db.DateTime, default=datetime.now)
+
+    __table_args__ = (db.Index("idx_battlerunners_heartbeat", heartbeat_at),)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "hostname": self.hostname,
+            "pid": self.pid,
+            "capacity": self.capacity,
+            "active_battles": self.active_battles,
+            "status": self.status,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "heartbeat_at": (
+                self.heartbeat_at.isoformat() if self.heartbeat_at else None
+            ),
+        }
+
+    def __repr__(self):
+        return f"<BattleRunner {self.id} - {self.active_battles}/{self.capacity}>"
+
+
 # 用户加载函数 (用于 Flask-Login)
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(user_id)
+
+
+# 自动对战运行状态 (每个排行榜一行，进程重启或换进程后可继续或查看)
+class AutoMatchRun(db.Model):
+    __tablename__ = "automatch_runs"
+
+    ranking_id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(
+        db.String(20), nullable=False, default="running"
+    )  # running, stopped, finished
+    parallel_games = db.Column(db.Integer, nullable=False, default=20)
+    priority = db.Column(db.Integer, nullable=False, default=1)
+    target_battles = db.Column(db.Integer, nullable=True)  # 为空表示不限局数
+
+    # 进度
+    started_count = db.Column(db.Integer, nullable=False, default=0)  # 已启动的对局数
+    completed_count = db.Column(db.Integer, nullable=False, default=0)  # 已结束的对局数
+    in_flight = db.Column(db.Text, nullable=False, default="[]")  # JSON: 未结束的对战ID
+    participants = db.Column(db.Text, nullable=False, default="[]")  # JSON: AI代码ID
+
+    # 租约：只有持有者推进该榜单的自动对战，持有进程退出后租约过期，其他进程可以接管
+    owner = db.Column(db.String(128), nullable=True)
+    lease_expires_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+
+    started_at = db.Column(db.DateTime, default=datetime.now)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+    __table_args__ = (
+        db.Index("idx_automatchruns_status_lease", status, lease_expires_at),
+    )
+
+    def is_active(self, now=None):
+        """是否正在由某个进程推进 (状态为 running 且租约未过期)"""
+        now = now or datetime.now()
+        return (
+            self.status == "running"
+            and self.lease_expires_at is not None
+            and self.lease_expires_at > now
+        )
+
+    def to_dict(self):
+        return {
+            "ranking_id": self.ranking_id,
+            "status": self.status,
+            "parallel_games": self.parallel_games,
+            "priority": self.priority,
+            "target_battles": self.target_battles,
+            "started_count": self.started_count,
+            "completed_count": self.completed_count,
+            "in_flight": json.loads(self.in_flight or "[]"),
+            "participants": json.loads(self.participants or "[]"),
+            "owner": self.owner,
+            "lease_expires_at": (
+                self.lease_expires_at.isoformat() if self.lease_expires_at else None
+            ),
+            "heartbeat_at": (
+                self.heartbeat_at.isoformat() if self.heartbeat_at else None
+            ),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+        }
+
+    def __repr__(self):
+        return f"<AutoMatchRun Rank-{self.ranking_id} - {self.status} ({self.started_count} started)>"
+
+
+# 排行榜快照：按榜单物化的名次表，随 GameStats 的变化增量维护 (见 database/leaderboard.py)
+class LeaderboardEntry(db.Model):
+    __tablename__ = "leaderboard_entries"
+
+    ranking_id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String(36), db.ForeignKey("users.id"), primary_key=True)
+    rank = db.Column(
+        db.Integer, nullable=False
+    )  # 按 ELO 降序、用户ID升序的名次，从1开始连续
+    username = db.Column(db.String(64), nullable=False)
+    elo_score = db.Column(db.Integer, nullable=False)
+    games_played = db.Column(db.Integer, nullable=False, default=0)
+    wins = db.Column(db.Integer, nullable=False, default=0)
+    losses = db.Column(db.Integer, nullable=False, default=0)
+    draws = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        # 按名次区间取页、按名次键集翻页
+        db.Index("idx_leaderboard_rank", ranking_id, rank),
+        # ELO 变化后重排受影响的分数区间
+        db.Index("idx_leaderboard_elo", ranking_id, elo_score.desc(), user_id),
+    )
+
+    def to_dict(self):
+        """与 get_leaderboard 原有的返回格式一致"""
+        wins, losses, draws = self.wins or 0, self.losses or 0, self.draws or 0
+        games_played = self.games_played or 0
+
+        def rate(count):
+            return round(count / games_played * 100, 1) if games_played > 0 else 0
+
+        return {
+            "rank": self.rank,
+            "user_id": self.user_id,
+            "username": self.username,
+            "elo_score": self.elo_score,
+            "wins": wins,
+            "losses": losses,
+            "draws": draws,
+            "games_played": games_played,
+            "win_rate": (
+                round(wins / (losses + wins) * 100, 1) if (losses + wins) > 0 else 0
+            ),
+            "draw_rate_for_container": rate(draws),
+            "loss_rate_for_container": rate(losses),
+            "win_rate_for_container": rate(wins),
+        }
+
+    def __repr__(self):
+        return f"<LeaderboardEntry Rank-{self.ranking_id} #{self.rank} {self.username}>"
@@ -0,0 +1,70 @@
+"""
+对战列表的键集分页：按 (created_at, id) 降序翻页，游标记录上一页最后一场对战的这两个值，
+下一页只读取排在它之后的行，翻到多深都只走一次索引范围扫描（OFFSET 分页需要先跳过前面所有行）。
+
+游标对调用方不透明（base64 编码的 JSON），只应原样传回。
+总数统计可选：精确 count()、有上限的近似计数（超过上限只报告"至少 N 条"）或不统计。
+"""
+
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import func, select, tuple_
+
+COUNT_MODES = ("exact", "approximate", "none")
+APPROXIMATE_COUNT_CAP = 10000  # 近似计数最多数到的行数
+
+
+def encode_cursor(created_at: datetime, battle_id: str) -> str:
+    payload = json.dumps([created_at.isoformat(), battle_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """解析游标为 (created_at, battle_id)，格式无效时抛出 ValueError"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, battle_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created_at), str(battle_id)
+    except Exception as e:
+        raise ValueError(f"无效的分页游标: {cursor}") from e
+
+
+def keyset_page(query, created_column, id_column, cursor=None, per_page=10):
+    """
+    对已筛选的查询按 (created_column, id_column) 降序取一页。
+    返回 (本页行, 下一页游标；没有下一页时为 None)
+    """
+    if cursor:
+        created_at, battle_id = decode_cursor(cursor)
+        query = query.filter(
+            tuple_(created_column, id_column) < tuple_(created_at, battle_id)
+        )
+    rows = (
+        query.order_by(created_column.desc(), id_column.desc())
+        .limit(per_page + 1)
+        .all()
+    )
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        next_cursor = encode_cursor(last.created_at, last.id)
+    return rows, next_cursor
+
+
+def count_rows(session, query, mode="exact"):
+    """
+    按 mode 统计查询的行数，返回 (总数, 是否为下限)。
+    approximate 最多数 APPROXIMATE_COUNT_CAP 行，超过时返回该上限并标记为下限；none 返回 (None, False)
+    """
+    if mode == "none":
+        return None, False
+    if mode == "approximate":
+        capped = query.order_by(None).limit(APPROXIMATE_COUNT_CAP + 1).subquery()
+        total = session.execute(select(func.count()).select_from(capped)).scalar()
+        if total > APPROXIMATE_COUNT_CAP:
+            return APPROXIMATE_COUNT_CAP, True
+        return total, False
+    return query.order_by(None).count(), False
@@ -0,0 +1,127 @@
+"""
+对战结果摘要：结算所需的少量数据（各玩家错误数、token 用量、胜负、角色、轮数、判罚的错误事件）。
+
+裁判每记录一条公共日志事件就同步累积摘要，随对战结果一起返回（results_data["summary"]），
+结算时直接使用，不再读取公共日志；没有摘要的旧结果按流式方式读一遍公共日志生成同样的摘要，
+内存占用只与单条事件大小有关，与日志总长度无关。
+"""
+
+import json
+import re
+
+PLAYER_COUNT = 7
+PLAYER_ERROR_TYPES = ("critical_player_ERROR", "player_ruturn_ERROR")
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def _valid_pid(pid) -> bool:
+    return isinstance(pid, int) and 1 <= pid <= PLAYER_COUNT
+
+
+class ResultSummaryBuilder:
+    """按日志顺序逐条接收公共日志事件，累积结算摘要"""
+
+    def __init__(self):
+        self.errors = [0] * PLAYER_COUNT  # 各玩家（按 PID 1-7）的错误事件数
+        self.tokens = None  # 最后一条 tokens 事件的结果
+        self._last_valid_error = None  # 最后一条 PID 有效的玩家错误
+        self._first_error = None  # 第一条玩家错误（没有 PID 有效的错误时使用）
+        self._last_event = None
+
+    def feed(self, event: dict):
+        if not isinstance(event, dict):
+            return
+        self._last_event = event
+        event_type = event.get("type")
+        if event_type == "tokens":
+            self.tokens = event.get("result", [])
+        elif event_type in PLAYER_ERROR_TYPES:
+            error = {
+                "type": event_type,
+                "pid": event.get("error_code_pid"),
+                "method": event.get("error_code_method"),
+                "msg": event.get("error_msg"),
+            }
+            if self._first_error is None:
+                self._first_error = error
+            if _valid_pid(error["pid"]):
+                self.errors[error["pid"] - 1] += 1
+                self._last_valid_error = error
+
+    def _extract_error_from_last_event(self):
+        """最后一条事件带有非标准的 error 字段时，尝试从消息中提取出错玩家"""
+        message = (self._last_event or {}).get("error")
+        if not isinstance(message, str) or "Player" not in message:
+            return None
+        match = re.search(r"Player (\d+)", message)
+        if not match:
+            return None
+        method_match = re.search(r"method '([^']+)'|executing ([^ ]+)", message)
+        return {
+            "type": "extracted_error",
+            "pid": int(match.group(1)),
+            "method": (
+                method_match.group(1) or method_match.group(2) if method_match else None
+            ),
+            "msg": message,
+        }
+
+    def error(self):
+        """
+        结算时判罚的错误：最后一条 PID 有效的玩家错误；
+        没有时尝试解析最后一条非标准错误记录，仍没有则返回第一条玩家错误（PID 无效，不扣分）
+        """
+        if self._last_valid_error is not None:
+            return self._last_valid_error
+        return self._extract_error_from_last_event() or self._first_error
+
+    def build(self, result: dict = None) -> dict:
+        result = result or {}
+        return {
+            "winner": result.get("winner"),
+            "roles": {
+                str(pid): role for pid, role in (result.get("roles") or {}).items()
+            },
+            "rounds": result.get("rounds_played"),
+            "errors": list(self.errors),
+            "tokens": self.tokens,
+            "error": self.error(),
+        }
+
+
+def iter_public_log(path: str, chunk_size: int = READ_CHUNK_SIZE):
+    """流式读取公共日志（JSON 数组），逐条产出事件"""
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buffer = f.read(chunk_size).lstrip()
+        if not buffer.startswith("["):
+            raise ValueError(f"公共日志不是 JSON 数组: {path}")
+        pos, eof = 1, False
+        while True:
+            # 跳过空白与分隔符
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buffer) and buffer[pos] == "]":
+                return
+            try:
+                if pos >= len(buffer):
+                    raise json.JSONDecodeError("需要更多数据", buffer, pos)
+                event, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # 事件跨越了读取块的边界，丢弃已处理部分后继续读取
+                if eof:
+                    raise
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buffer, pos = buffer[pos:] + chunk, 0
+                continue
+            yield event
+            pos = end
+
+
+def summarize_public_log(path: str, result: dict = None) -> dict:
+    """为没有摘要的旧对战结果读一遍公共日志生成摘要"""
+    builder = ResultSummaryBuilder()
+    for event in iter_public_log(path):
+        builder.feed(event)
+    return builder.build(result)
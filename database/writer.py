@@ -0,0 +1,215 @@
+"""
+串行化写入 - 本进程的数据库写操作交给单个写入线程执行，并把同时到达的写操作合并为一次提交
+
+SQLite 同一时刻只允许一个写事务。对战工作线程、自动对战线程等各自提交时，
+每次提交都要单独争抢写锁并等待一次 fsync，负载高时出现 database is locked 与长时间的提交卡顿。
+启用后这些写操作（BattleService 的写方法、自动对战与锦标赛的对战创建和进度保存）
+由生产者线程提交给写入线程并等待结果：写入线程取出当前排队的所有写操作，
+在一个事务中依次执行（每个写操作在自己的 SAVEPOINT 中，其中的 commit/rollback 只作用于该 SAVEPOINT），
+最后统一提交一次。整批提交失败时逐个按普通方式重新执行。读操作不经过写入线程，照常并发。
+
+请求线程中的写操作（蓝图中直接 db.session.commit() 的部分）仍在请求线程提交，
+依靠 DATABASE_ENGINE 的 WAL 与 busy_timeout 与写入线程共享写锁。
+
+config.yaml 配置示例：
+
+DATABASE_WRITER:
+  enabled: false          # 默认在调用线程中直接提交
+  max_batch_size: 100     # 一次提交最多合并的写操作数
+"""
+
+import functools
+import logging
+import queue
+import threading
+import time
+
+from flask_sqlalchemy.query import Query
+from sqlalchemy.orm import Session
+
+from config.config import Config
+
+from .base import db
+
+logger = logging.getLogger("DatabaseWriter")
+
+_writer = None
+
+
+def init_database_writer(app):
+    """根据配置为本进程创建写入器（写入线程在第一次写入时启动），未启用时不创建"""
+    global _writer
+
+    config = Config._yaml_config.get("DATABASE_WRITER") or {}
+    if not config.get("enabled"):
+        return None
+    if _writer is None:
+        _writer = DatabaseWriter(
+            app, max_batch_size=int(config.get("max_batch_size", 100))
+        )
+    return _writer
+
+
+def get_database_writer():
+    return _writer
+
+
+def in_writer_thread() -> bool:
+    return _writer is not None and _writer.is_writer_thread()
+
+
+def serialized_write(fn, *args, **kwargs):
+    """
+    执行一个写操作：启用写入器时交给写入线程执行并等待结果，否则在当前线程直接执行。
+    fn 在写入线程的应用上下文中运行，应返回普通数据而不是 ORM 对象（提交后会话即关闭）。
+    """
+    if _writer is None:
+        return fn(*args, **kwargs)
+    return _writer.call(fn, *args, **kwargs)
+
+
+def serialized(method):
+    """方法装饰器：该方法的调用都经过 serialized_write"""
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        return serialized_write(method, *args, **kwargs)
+
+    return wrapper
+
+
+class _WriteJob:
+    __slots__ = ("fn", "args", "kwargs", "result", "error", "done")
+
+    def __init__(self, fn, args, kwargs):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class DatabaseWriter:
+    """单线程的数据库写入器，按批合并提交"""
+
+    def __init__(self, app, max_batch_size: int = 100):
+        self.app = app
+        self.max_batch_size = max(1, max_batch_size)
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        # 统计：已执行的写操作数、提交次数与整批失败次数
+        self.jobs_written = 0
+        self.commits = 0
+        self.batch_failures = 0
+
+    def is_writer_thread(self) -> bool:
+        return threading.current_thread() is self._thread
+
+    def call(self, fn, *args, **kwargs):
+        """提交一个写操作并等待其完成，返回 fn 的返回值；fn 抛出的异常在调用线程重新抛出"""
+        if self.is_writer_thread():
+            # 写操作中嵌套的写操作直接在当前事务中执行
+            return fn(*args, **kwargs)
+        self._ensure_started()
+        job = _WriteJob(fn, args, kwargs)
+        self._queue.put(job)
+        job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, daemon=True, name="DatabaseWriter"
+                )
+                self._thread.start()
+                logger.info(
+                    f"数据库串行写入已启用，每次提交最多合并 {self.max_batch_size} 个写操作"
+                )
+
+    def _run(self):
+        with self.app.app_context():
+            while True:
+                try:
+                    batch = [self._queue.get(timeout=1.0)]
+                except queue.Empty:
+                    if self._stop_event.is_set():
+                        return
+                    continue
+                # 不额外等待：上一次提交期间到达的写操作自然组成下一批
+                while len(batch) < self.max_batch_size:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                self._write(batch)
+
+    def _write(self, batch: list):
+        started = time.time()
+        grouped = len(batch) > 1 and self._write_grouped(batch)
+        if not grouped:
+            for job in batch:
+                self._run_single(job)
+        self.jobs_written += len(batch)
+        self.commits += 1 if grouped else len(batch)
+        for job in batch:
+            job.done.set()
+        elapsed = time.time() - started
+        if elapsed > 1:
+            logger.warning(f"写入 {len(batch)} 个写操作耗时 {elapsed:.2f} 秒")
+
+    def _run_single(self, job: _WriteJob):
+        """按普通方式执行：写操作自己提交"""
+        job.result, job.error = None, None
+        try:
+            job.result = job.fn(*job.args, **job.kwargs)
+        except Exception as e:
+            job.error = e
+        finally:
+            db.session.remove()
+
+    def _write_grouped(self, batch: list) -> bool:
+        """在一个事务中执行整批写操作，成功提交返回 True；失败时回滚整批并返回 False"""
+        connection = db.engine.connect()
+        try:
+            transaction = connection.begin()
+            if connection.dialect.name == "sqlite":
+                # pysqlite 不会在 SAVEPOINT 前开启事务；显式开启并立即获取写锁，
+                # 避免读快照过期后升级写锁时不经等待直接失败
+                connection.exec_driver_sql("BEGIN IMMEDIATE")
+            # Flask-SQLAlchemy 的 Session 总是绑定到引擎，这里需要绑定到本连接的会话
+            session = Session(
+                bind=connection,
+                join_transaction_mode="create_savepoint",
+                query_cls=Query,
+            )
+            db.session.registry.set(session)
+            for job in batch:
+                try:
+                    job.result = job.fn(*job.args, **job.kwargs)
+                except Exception as e:
+                    job.error = e
+                # 丢弃写操作未提交的改动，与普通方式下会话关闭时的行为一致
+                session.rollback()
+            session.close()
+            transaction.commit()
+            return True
+        except Exception as e:
+            self.batch_failures += 1
+            logger.error(
+                f"合并提交 {len(batch)} 个写操作失败，逐个重新执行: {e}", exc_info=True
+            )
+            return False
+        finally:
+            db.session.remove()
+            connection.close()
+
+    def shutdown(self):
+        self._stop_event.set()
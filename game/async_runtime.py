@@ -0,0 +1,208 @@
+"""
+异步对战运行时 - 基于 asyncio 事件循环运行对战，使大量以 LLM I/O 为主的对局共享少量线程
+
+每局对战的裁判代码运行在独立的 greenlet 中，阻塞操作（数据库状态更新与查询、AI 模块导入、
+日志写入）通过 run_blocking 交给有界线程池执行并挂起该 greenlet，把事件循环让给其他对局。
+玩家代码可能长时间占用 CPU，通过 run_player_code 交给单独的有界线程池执行，不在事件循环线程上运行；
+玩家代码中的 askLLM 把异步请求提交到事件循环并在所在线程等待结果，请求本身仍由事件循环统一发起。
+
+config.yaml 配置示例：
+
+ASYNC_BATTLE_RUNTIME:
+  enabled: false                # 开启后 BattleManager 不再为每个并发对战启动工作线程
+  max_concurrent_battles: 2000  # 同时运行的对局上限
+  blocking_workers: 32          # 执行阻塞操作的线程数
+  player_workers: 64            # 执行玩家代码的线程数，即同时执行玩家代码（含等待 LLM 回复）的调用上限
+"""
+
+import asyncio
+import contextvars
+import functools
+import logging
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+
+try:
+    import greenlet
+
+    GREENLET_AVAILABLE = True
+except ImportError:
+    GREENLET_AVAILABLE = False
+
+
+logger = logging.getLogger("AsyncBattleRuntime")
+
+_player_thread = threading.local()  # 玩家代码线程所属的运行时
+
+
+if GREENLET_AVAILABLE:
+
+    class _BattleGreenlet(greenlet.greenlet):
+        """运行一局对战同步代码的 greenlet，记录驱动它的事件循环 greenlet"""
+
+        def __init__(self, fn, driver, runtime):
+            super().__init__(fn, driver)
+            self.driver = driver
+            self.runtime = runtime
+
+
+def _battle_greenlet():
+    if not GREENLET_AVAILABLE:
+        return None
+    current = greenlet.getcurrent()
+    return current if isinstance(current, _BattleGreenlet) else None
+
+
+def current_runtime():
+    """在对战 greenlet 或玩家代码线程中返回所属的 AsyncBattleRuntime，否则返回 None"""
+    context = _battle_greenlet()
+    if context is not None:
+        return context.runtime
+    return getattr(_player_thread, "runtime", None)
+
+
+async def _await(awaitable):
+    return await awaitable
+
+
+def await_only(awaitable):
+    """
+    等待 awaitable 在事件循环上完成并返回其结果：
+    在对战 greenlet 中挂起当前对局，在玩家代码线程中阻塞所在线程
+    """
+    context = _battle_greenlet()
+    if context is not None:
+        return context.driver.switch(awaitable)
+    runtime = getattr(_player_thread, "runtime", None)
+    if runtime is None:
+        raise RuntimeError("await_only() 只能在异步对战运行时中调用")
+    return asyncio.run_coroutine_threadsafe(_await(awaitable), runtime.loop).result()
+
+
+def _run_in_executor(executor, fn: Callable, *args, **kwargs):
+    """在对战 greenlet 中把 fn 交给线程池执行并挂起当前对局（沿用当前的 contextvars）"""
+    context = _battle_greenlet()
+    call = functools.partial(contextvars.copy_context().run, fn, *args, **kwargs)
+    return context.driver.switch(context.runtime.loop.run_in_executor(executor, call))
+
+
+def run_blocking(fn: Callable, *args, **kwargs):
+    """
+    执行阻塞操作：在对战 greenlet 中交给有界线程池并挂起当前对局，
+    在其他线程（含玩家代码线程）中直接调用
+    """
+    context = _battle_greenlet()
+    if context is None:
+        return fn(*args, **kwargs)
+    return _run_in_executor(context.runtime.executor, fn, *args, **kwargs)
+
+
+def run_player_code(fn: Callable, *args, **kwargs):
+    """
+    执行玩家代码：在对战 greenlet 中交给玩家代码线程池，避免占用事件循环线程，
+    在其他线程中直接调用
+    """
+    context = _battle_greenlet()
+    if context is None:
+        return fn(*args, **kwargs)
+    return _run_in_executor(context.runtime.player_executor, fn, *args, **kwargs)
+
+
+async def _run_in_greenlet(runtime, fn: Callable, *args, **kwargs):
+    """在新的对战 greenlet 中运行同步函数，代为等待其挂起时交出的 awaitable"""
+    context = _BattleGreenlet(fn, greenlet.getcurrent(), runtime)
+    result = context.switch(*args, **kwargs)
+    while not context.dead:
+        try:
+            value = await result
+        except BaseException:
+            result = context.throw(*sys.exc_info())
+        else:
+            result = context.switch(value)
+    return result
+
+
+class AsyncBattleRuntime:
+    """在单个事件循环线程上运行对战的运行时"""
+
+    def __init__(
+        self,
+        process_battle: Callable[[str, List[Dict[str, Any]]], Any],
+        max_concurrent_battles: int = 2000,
+        blocking_workers: int = 32,
+        player_workers: int = 64,
+    ):
+        if not GREENLET_AVAILABLE:
+            raise RuntimeError("异步对战运行时需要安装 greenlet")
+
+        self._process_battle = process_battle
+        self.max_concurrent_battles = max_concurrent_battles
+        self.executor = ThreadPoolExecutor(
+            max_workers=blocking_workers, thread_name_prefix="BattleBlocking"
+        )
+        self.player_executor = ThreadPoolExecutor(
+            max_workers=player_workers,
+            thread_name_prefix="BattlePlayer",
+            initializer=self._init_player_thread,
+        )
+        self._slots = threading.BoundedSemaphore(max_concurrent_battles)
+        self.active_battles = 0
+
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._run_loop, daemon=True, name="AsyncBattleRuntime"
+        )
+        self._thread.start()
+        logger.info(
+            f"异步对战运行时已启动，最大并发对局数：{max_concurrent_battles}，"
+            f"阻塞线程数：{blocking_workers}，玩家代码线程数：{player_workers}"
+        )
+
+    def _init_player_thread(self):
+        _player_thread.runtime = self
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(
+        self, battle_id: str, participant_data: List[Dict[str, Any]], timeout=None
+    ) -> bool:
+        """
+        占用一个并发槽位并在事件循环中启动对战
+        槽位已满时阻塞等待，超时返回 False
+        """
+        if not self._slots.acquire(timeout=timeout):
+            return False
+        asyncio.run_coroutine_threadsafe(
+            self._run_battle(battle_id, participant_data), self.loop
+        )
+        return True
+
+    async def _run_battle(self, battle_id: str, participant_data):
+        self.active_battles += 1
+        try:
+            await _run_in_greenlet(
+                self, self._process_battle, battle_id, participant_data
+            )
+        except Exception as e:
+            logger.exception(f"异步运行对战 {battle_id} 时发生异常: {str(e)}")
+        finally:
+            self.active_battles -= 1
+            self._slots.release()
+
+    def get_status(self) -> dict:
+        return {
+            "runtime": "asyncio",
+            "active_battles": self.active_battles,
+            "max_concurrent_battles": self.max_concurrent_battles,
+        }
+
+    def shutdown(self):
+        """停止事件循环，不等待仍在运行的对局"""
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.executor.shutdown(wait=False)
+        self.player_executor.shutdown(wait=False)
+        logger.info("异步对战运行时已关闭")
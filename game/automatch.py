@@ -1,9 +1,8 @@
+import json
 import logging
-from queue import (
-    Queue,
-    Empty,
-    Full,
-)  # Import Empty and Full for specific exception handling
+import os
+import socket
+import uuid
 from time import sleep, time
 from random import sample
 from typing import Dict, Any, Optional, List, Tuple, Set, FrozenSet
@@ -12,11 +11,27 @@ import threading
 from flask import Flask
 
 from database import (
-    create_battle as db_create_battle,
+    create_battles_bulk as db_create_battles_bulk,
+    mark_battle_as_cancelled as db_mark_battle_as_cancelled,
     get_active_ai_codes_by_ranking_ids,
+    get_ai_codes_by_ids,
+    get_ranking_ratings,
+    claim_automatch_run as db_claim_automatch_run,
+    save_automatch_run as db_save_automatch_run,
+    release_automatch_run as db_release_automatch_run,
+    request_automatch_run_stop as db_request_automatch_run_stop,
+    get_automatch_runs as db_get_automatch_runs,
+    get_orphaned_automatch_runs as db_get_orphaned_automatch_runs,
+    get_battle_statuses as db_get_battle_statuses,
+    serialized_write,
 )
-from database.models import AICode
+from database.models import AICode, AutoMatchRun
+from config.config import Config
 from utils.battle_manager_utils import get_battle_manager
+from game.client_manager import PRIORITY_NORMAL
+from game.battle_manager import BattleQueueFullError
+from game.pairing import create_pairing_engine
+from game.capacity import CapacityAllocator
 
 logger = logging.getLogger("AutoMatch")
 
@@ -25,32 +40,77 @@ MAX_RETRY_DELAY_SECONDS = 60
 INITIAL_RETRY_DELAY_SECONDS = 1
 PARTICIPANT_REFRESH_INTERVAL_BATTLES = 10  # Refresh participants every N battles
 LOOP_SHORT_SLEEP_SECONDS = 0.1  # Short sleep to prevent tight loops when no work
-LOOP_POST_BATCH_SLEEP_SECONDS = 1  # Sleep after creating a batch of battles
-QUEUE_WAIT_TIMEOUT_SECONDS = (
-    5  # Timeout for getting from queue if we expect it to unblock
-)
-BATTLE_STATUS_POLL_INTERVAL_SECONDS = (
-    0.5  # How often to check battle status when waiting
+THROTTLE_SLEEP_STEP_SECONDS = 1  # Granularity of throttling sleeps (to notice stop())
+DONE_WAIT_TIMEOUT_SECONDS = (
+    5  # Max time to block waiting for a battle to end, so stop() is noticed
 )
 
 MAX_AUTOMATCH_PARALLEL_GAMES_PER_RANKING = 20
 PARTICIPANTS = 7
 
+# Each ranking's run (counters, in-flight battle IDs, participants) is kept in the
+# automatch_runs table. The process holding a run's lease drives it and saves progress
+# on every loop iteration; any process can observe a run or request it to stop.
+# With resume enabled (the default), a process takes over runs whose owner died once their
+# lease expires, keeping the run's settings, progress and participant pool:
+#
+# AUTOMATCH_STATE:
+#   resume: true             # Take over orphaned runs at startup and every check_interval
+#   lease_seconds: 180       # Must exceed the longest sleep in the loop (throttling, retries)
+#   check_interval: 60       # Seconds between scans for orphaned runs
+ACTIVE_BATTLE_STATUSES = ("waiting", "playing")
+
+
+def get_automatch_state_config() -> dict:
+    config = dict(Config._yaml_config.get("AUTOMATCH_STATE") or {})
+    config.setdefault("resume", True)
+    config.setdefault("lease_seconds", 180)
+    config.setdefault("check_interval", 60)
+    return config
+
 
 class AutoMatchInstance:
-    def __init__(self, app: Flask, ranking_id: int, parallel_games: int):
+    def __init__(
+        self,
+        app: Flask,
+        ranking_id: int,
+        parallel_games: int,
+        priority: int = PRIORITY_NORMAL,
+        allocator: Optional[CapacityAllocator] = None,
+        owner: Optional[str] = None,
+        target_battles: Optional[int] = None,
+    ):
         self.app = app
         self.ranking_id = ranking_id
+        self.priority = priority  # LLM traffic priority of the battles we start
         self.is_on = False
-        self.battle_count = 0  # Total battles created by this instance since start
-        self.battle_queue = Queue(
-            parallel_games
-        )  # Stores IDs of battles that are supposed to be running
+        self.battle_count = 0  # Total battles started in this run
+        self.completed_count = 0  # Battles of this run that have ended
+        # Stop after this many battles; None = no limit
+        self.target_battles = target_battles
+        # Sliding window: keep up to parallel_games battles queued or running
+        self.parallel_games = parallel_games
+        self.in_flight: Set[str] = set()  # IDs of our battles that have not ended yet
+        # In-flight battles inherited from a resumed run; the local BattleManager may not
+        # know them, so they are tracked through the database instead of wait_for_any
+        self.adopted: Set[str] = set()
+        # Lease holder ID in automatch_runs; unique per process
+        self.owner = (
+            owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        )
+        self.lease_seconds = int(get_automatch_state_config()["lease_seconds"])
+        self._final_status = "stopped"  # Status recorded when the loop ends
+        # Shared across rankings; when enabled, our window is the share it grants us
+        self.allocator = allocator
+        self.window = parallel_games
         self.loop_thread: Optional[threading.Thread] = None
         self.min_participants = PARTICIPANTS
         self._instance_lock = threading.RLock()
         self.current_participants: List[AICode] = []
         self._battles_since_last_refresh = 0
+        # ELO/coverage-aware lineups when AUTOMATCH_PAIRING.strategy is "balanced",
+        # otherwise None and lineups are sampled at random
+        self.pairing_engine = create_pairing_engine(PARTICIPANTS)
 
         # Load participants once during initialization (initial load)
         self._refresh_participants()  # Call the new refresh method
@@ -63,9 +123,7 @@ class AutoMatchInstance:
                 fresh_participants = get_active_ai_codes_by_ranking_ids(
                     ranking_ids=[self.ranking_id]
                 )
-                with self._instance_lock:  # Protect assignment
-                    self.current_participants = fresh_participants
-                    self._battles_since_last_refresh = 0  # Reset counter
+                self._set_participants(fresh_participants)
                 logger.info(
                     f"[Rank-{self.ranking_id}] Refreshed participants. Loaded {len(self.current_participants)} active AI codes."
                 )
@@ -78,6 +136,52 @@ class AutoMatchInstance:
                 # with self._instance_lock:
                 #     self.current_participants = [] # Example: clear on error
 
+    def _set_participants(self, codes: List[AICode]):
+        """Install `codes` as the participant pool (needs an app context)."""
+        ratings = (
+            get_ranking_ratings(self.ranking_id)
+            if self.pairing_engine is not None
+            else {}
+        )
+        with self._instance_lock:  # Protect assignment
+            self.current_participants = codes
+            self._battles_since_last_refresh = 0  # Reset counter
+            if self.pairing_engine is not None:
+                default = (1200, 0)
+                self.pairing_engine.update_participants(
+                    {code.id: ratings.get(code.user_id, default)[0] for code in codes},
+                    games={
+                        code.id: ratings.get(code.user_id, default)[1] for code in codes
+                    },
+                )
+
+    def _restore_participants(self, participant_ids: List[str]) -> bool:
+        """
+        Reload the participant pool saved with a resumed run, so it continues with the same
+        field; later refreshes pick up changes as usual. Returns False if fewer than a
+        lineup's worth of those AI codes still exist, in which case the caller loads the
+        current pool instead.
+        """
+        with self.app.app_context():
+            try:
+                found = {code.id: code for code in get_ai_codes_by_ids(participant_ids)}
+                codes = [
+                    found[code_id] for code_id in participant_ids if code_id in found
+                ]
+                if len(codes) < self.min_participants:
+                    return False
+                self._set_participants(codes)
+            except Exception as e:
+                logger.error(
+                    f"[Rank-{self.ranking_id}] Error restoring saved participants: {str(e)}",
+                    exc_info=True,
+                )
+                return False
+        logger.info(
+            f"[Rank-{self.ranking_id}] Restored {len(codes)} participants saved with the run."
+        )
+        return True
+
     def _should_refresh_participants(self) -> bool:
         """Determines if participants should be refreshed."""
         with self._instance_lock:  # Access shared counter
@@ -98,6 +202,16 @@ class AutoMatchInstance:
 
             while self.is_on:
                 try:
+                    # 0. Save progress, which also renews our lease on the run. Stop if
+                    # another process took the run over or an admin stopped it elsewhere.
+                    self._poll_adopted()
+                    if self._save_progress() is False:
+                        logger.warning(
+                            f"[Rank-{self.ranking_id}] Run was stopped or taken over by another process, stopping."
+                        )
+                        self.is_on = False
+                        break
+
                     # 1. Refresh participants if needed
                     if self._should_refresh_participants():
                         self._refresh_participants()
@@ -107,6 +221,8 @@ class AutoMatchInstance:
                         num_current_participants = len(self.current_participants)
 
                     if num_current_participants < self.min_participants:
+                        # Hand our share of the global capacity to other rankings
+                        self._update_window(demand=0)
                         logger.info(
                             f"[Rank-{self.ranking_id}] Insufficient participants ({num_current_participants}/{self.min_participants}). "
                             f"Waiting {retry_delay}s before retrying participant check."
@@ -118,108 +234,58 @@ class AutoMatchInstance:
                     # Reset retry_delay if participant check was successful
                     retry_delay = INITIAL_RETRY_DELAY_SECONDS
 
-                    # 3. Create battles in batch if queue has space
-                    batch_size = 5
-                    battles_created_in_batch = 0
-
-                    # We can only create battles if the queue is not full.
-                    # qsize() is approximate, so loop while !full() is safer for adding.
-                    while (
-                        battles_created_in_batch < batch_size
-                        and not self.battle_queue.full()
-                    ):
-                        with self._instance_lock:  # For reading current_participants
-                            if len(self.current_participants) < self.min_participants:
-                                break  # Not enough participants for another battle in this batch
-                            # Sample from a copy to avoid issues if list changes during sampling (though lock helps)
-                            participants_ai_codes = sample(
-                                list(self.current_participants), self.min_participants
-                            )
-
-                        participant_data = [
-                            {"user_id": ai_code.user_id, "ai_code_id": ai_code.id}
-                            for ai_code in participants_ai_codes
-                        ]
-
-                        battle = db_create_battle(
-                            participant_data,
-                            ranking_id=self.ranking_id,
-                            status="waiting",
-                        )
-
-                        if not battle:
-                            logger.error(
-                                f"[Rank-{self.ranking_id}] Failed to create battle, db_create_battle returned None."
-                            )
-                            continue  # Try next battle creation in batch
-
-                        try:
-                            self.battle_queue.put_nowait(battle.id)  # Add to queue
-                            battles_created_in_batch += 1
-                            with self._instance_lock:
-                                self.battle_count += 1
-                                self._battles_since_last_refresh += 1
+                    # 3. Top up the sliding window of in-flight battles
+                    # Set when the BattleManager reports it is busy
+                    throttle_seconds = 0
 
+                    self._update_window(demand=self.parallel_games)
+                    needed = self.window - len(self.in_flight) - len(self.adopted)
+                    if self.target_battles is not None:
+                        needed = min(needed, self.target_battles - self.battle_count)
+                        if needed <= 0 and not self.in_flight and not self.adopted:
                             logger.info(
-                                f"[Rank-{self.ranking_id}] Started auto-match battle {self.battle_count} (ID: {battle.id}). "
-                                f"Queue size: {self.battle_queue.qsize()}"
-                            )
-                            battle_manager.start_battle(battle.id, participant_data)
-                        except Full:
-                            logger.warning(
-                                f"[Rank-{self.ranking_id}] Queue became full while trying to add battle {battle.id}. Batch interrupted."
+                                f"[Rank-{self.ranking_id}] Reached the target of {self.target_battles} battles."
                             )
-                            # If db_create_battle created a battle but we can't queue it, it's an orphan.
-                            # This scenario should be rare if `not self.battle_queue.full()` check is effective.
-                            # Consider how to handle such an orphaned battle (e.g., try to cancel it).
-                            break  # Exit batch creation loop
+                            self._final_status = "finished"
+                            self.is_on = False
+                            break
+                    if needed > 0:
+                        throttle_seconds = self._top_up(battle_manager, needed)
 
-                    # 4. If queue is full, wait for a slot to free up.
-                    if self.battle_queue.full():
-                        logger.debug(
-                            f"[Rank-{self.ranking_id}] Battle queue is full ({self.battle_queue.qsize()}). Waiting for a slot..."
+                    if throttle_seconds:
+                        logger.info(
+                            f"[Rank-{self.ranking_id}] BattleManager is busy, throttling for {throttle_seconds}s."
                         )
-                        try:
-                            # Get a battle ID from the queue. This blocks until an item is available.
-                            # This ID represents a battle that *was* considered active.
-                            finished_battle_id = self.battle_queue.get(
-                                block=True, timeout=QUEUE_WAIT_TIMEOUT_SECONDS
-                            )
+                        self._sleep_while_on(throttle_seconds)
+                        continue
 
-                            # Now, explicitly wait for this specific battle to finish if it's still running.
-                            # The slot in the queue is already "freed" by the .get() call.
-                            status = battle_manager.get_battle_status(
-                                finished_battle_id
-                            )
-                            logger.debug(
-                                f"[Rank-{self.ranking_id}] Polled battle {finished_battle_id} from queue (status: {status})."
-                            )
-
-                            while self.is_on and status in ["playing", "waiting"]:
-                                sleep(BATTLE_STATUS_POLL_INTERVAL_SECONDS)
-                                status = battle_manager.get_battle_status(
-                                    finished_battle_id
-                                )
-                            logger.debug(
-                                f"[Rank-{self.ranking_id}] Battle {finished_battle_id} (final status: {status}) finished processing. Slot available."
-                            )
-                        except Empty:
-                            logger.warning(
-                                f"[Rank-{self.ranking_id}] Timed out waiting for item from supposedly full queue. Inconsistency?"
-                            )
-                            # This case implies the queue became not-full while we were waiting, or qsize/full is tricky.
-                        # No need to put the ID back. .get() removes it.
-
-                    # 5. Brief sleep
                     if not self.is_on:
-                        break  # Check before sleep
-
-                    if battles_created_in_batch > 0:
-                        sleep(LOOP_POST_BATCH_SLEEP_SECONDS)
-                    else:
-                        # If no battles were created (e.g. queue was full, or not enough participants for a full batch but more than min)
-                        # Sleep a very short time to prevent tight spinning if conditions don't change immediately.
+                        break
+
+                    if not self.in_flight:
+                        if self.adopted:
+                            # Only inherited battles left; polled at the top of the loop
+                            self._sleep_while_on(DONE_WAIT_TIMEOUT_SECONDS)
+                            continue
+                        if self.window == 0:
+                            # No share of the global capacity right now; check again shortly
+                            self._sleep_while_on(THROTTLE_SLEEP_STEP_SECONDS)
+                            continue
+                        # Nothing to wait for (e.g. creation failed); avoid a tight loop
                         sleep(LOOP_SHORT_SLEEP_SECONDS)
+                        continue
+
+                    # 4. Block until any in-flight battle ends, then refill its slot right away.
+                    finished = battle_manager.wait_for_any(
+                        list(self.in_flight), timeout=DONE_WAIT_TIMEOUT_SECONDS
+                    )
+                    for battle_id in finished:
+                        self.in_flight.discard(battle_id)
+                        with self._instance_lock:
+                            self.completed_count += 1
+                        logger.debug(
+                            f"[Rank-{self.ranking_id}] Battle {battle_id} finished. Slot available."
+                        )
 
                 except Exception as e:
                     logger.error(
@@ -231,23 +297,212 @@ class AutoMatchInstance:
                     sleep(retry_delay)
                     retry_delay = min(retry_delay * 2, MAX_RETRY_DELAY_SECONDS)
 
+            if self.allocator is not None:
+                self.allocator.release(self.ranking_id)
+            # No-ops if another process owns the run by now
+            self._save_progress()
+            serialized_write(
+                db_release_automatch_run,
+                self.ranking_id,
+                self.owner,
+                status=self._final_status,
+            )
             logger.info(
                 f"[Rank-{self.ranking_id}] Auto-match loop thread '{threading.current_thread().name}' normally ended."
             )
 
-    def start(self) -> bool:
-        # ... (rest of the class methods are mostly fine, ensure locks if they access shared state) ...
+    def _save_progress(self) -> Optional[bool]:
+        """
+        Persist counters, in-flight IDs and participants to automatch_runs and renew our lease.
+        Returns False if we no longer own a running run, None on a database error.
+        """
+        with self._instance_lock:
+            participants = [code.id for code in self.current_participants]
+            started_count, completed_count = self.battle_count, self.completed_count
+        return serialized_write(
+            db_save_automatch_run,
+            self.ranking_id,
+            self.owner,
+            self.lease_seconds,
+            started_count=started_count,
+            completed_count=completed_count,
+            in_flight=sorted(self.in_flight | self.adopted),
+            participants=participants,
+        )
+
+    def _poll_adopted(self):
+        """Drop inherited in-flight battles that have ended, according to the database."""
+        if not self.adopted:
+            return
+        statuses = db_get_battle_statuses(self.adopted)
+        if statuses is None:
+            return
+        for battle_id in list(self.adopted):
+            status = statuses.get(battle_id)
+            if status in ACTIVE_BATTLE_STATUSES:
+                continue
+            self.adopted.discard(battle_id)
+            with self._instance_lock:
+                if status is None:
+                    # Deleted by the startup cleanup: it never ran, so it does not count
+                    self.battle_count -= 1
+                else:
+                    self.completed_count += 1
+
+    def _update_window(self, demand: int):
+        """
+        Set how many battles to keep in flight: our own parallel_games, or our share of the
+        global capacity when the allocator is enabled. A shrinking share never cancels
+        in-flight battles; we just stop refilling until enough of them end.
+        """
+        if self.allocator is None or not self.allocator.enabled:
+            self.window = self.parallel_games
+            return
+        self.window = self.allocator.report(
+            self.ranking_id, demand, in_flight=len(self.in_flight)
+        )
+
+    def _top_up(self, battle_manager, needed: int) -> float:
+        """
+        Create up to `needed` battles in one bulk insert and hand them to the BattleManager.
+        Returns the number of seconds to throttle for when the BattleManager is busy, else 0.
+        """
+        with self._instance_lock:  # For reading current_participants
+            if len(self.current_participants) < self.min_participants:
+                return 0
+            if self.pairing_engine is not None:
+                codes_by_id = {code.id: code for code in self.current_participants}
+                picked = [
+                    [codes_by_id[code_id] for code_id in lineup]
+                    for lineup in self.pairing_engine.next_lineups(needed)
+                ]
+            else:
+                # Sample from a copy to avoid issues if list changes during sampling (though lock helps)
+                picked = [
+                    sample(list(self.current_participants), self.min_participants)
+                    for _ in range(needed)
+                ]
+            lineups = [
+                [
+                    {"user_id": ai_code.user_id, "ai_code_id": ai_code.id}
+                    for ai_code in ai_codes
+                ]
+                for ai_codes in picked
+            ]
+
+        # Back off instead of creating battles the BattleManager cannot queue
+        try:
+            battle_manager.check_admission(needed)
+        except BattleQueueFullError as e:
+            return e.retry_after
+
+        battle_ids = serialized_write(
+            db_create_battles_bulk,
+            lineups,
+            ranking_id=self.ranking_id,
+            status="waiting",
+        )
+        if not battle_ids:
+            logger.error(
+                f"[Rank-{self.ranking_id}] Failed to create {needed} battles, db_create_battles_bulk returned {battle_ids}."
+            )
+            return 0
+
+        pending = [
+            (battle_id, participant_data)
+            for battle_id, participant_data in zip(battle_ids, lineups)
+            if battle_id
+        ]
+        for index, (battle_id, participant_data) in enumerate(pending):
+            try:
+                started = battle_manager.start_battle(
+                    battle_id,
+                    participant_data,
+                    priority=self.priority,
+                    ranking_id=self.ranking_id,
+                )
+            except BattleQueueFullError as e:
+                # The BattleManager cancelled this battle; cancel the ones not handed over yet
+                for unstarted_id, _ in pending[index + 1 :]:
+                    db_mark_battle_as_cancelled(unstarted_id, f"系统繁忙：{e}")
+                return e.retry_after
+
+            if not started:
+                logger.error(
+                    f"[Rank-{self.ranking_id}] BattleManager refused battle {battle_id}."
+                )
+                continue
+
+            self.in_flight.add(battle_id)
+            with self._instance_lock:
+                self.battle_count += 1
+                self._battles_since_last_refresh += 1
+
+            logger.info(
+                f"[Rank-{self.ranking_id}] Started auto-match battle {self.battle_count} (ID: {battle_id}). "
+                f"In flight: {len(self.in_flight)}/{self.window}"
+            )
+        return 0
+
+    def _sleep_while_on(self, seconds: float):
+        """Sleep up to `seconds`, returning early once the instance is stopped."""
+        deadline = time() + seconds
+        while self.is_on and time() < deadline:
+            sleep(min(THROTTLE_SLEEP_STEP_SECONDS, deadline - time()))
+
+    def start(self, resume: bool = False) -> bool:
+        """
+        Claim the ranking's run in automatch_runs and start the loop. With resume=True,
+        take over a running run whose owner is gone, keeping its settings and progress;
+        otherwise start a new run. Fails if another live process owns the run.
+        """
         if self.is_on:
             logger.warning(f"[Rank-{self.ranking_id}] Auto-match already running.")
             return False
 
+        with self.app.app_context():
+            run = db_claim_automatch_run(
+                self.ranking_id,
+                self.owner,
+                self.lease_seconds,
+                resume=resume,
+                parallel_games=self.parallel_games,
+                priority=self.priority,
+                target_battles=self.target_battles,
+            )
+        if run is None:
+            logger.warning(
+                f"[Rank-{self.ranking_id}] Could not claim the run; it is driven by another process."
+            )
+            return False
+
         self.is_on = True
+        self._final_status = "stopped"
+        saved_participants = []
         with self._instance_lock:  # Protect shared state
-            self.battle_count = 0
+            self.in_flight = set()
+            if resume:
+                self.parallel_games = run.parallel_games
+                self.priority = run.priority
+                self.target_battles = run.target_battles
+                self.battle_count = run.started_count
+                self.completed_count = run.completed_count
+                self.adopted = set(json.loads(run.in_flight or "[]"))
+                saved_participants = json.loads(run.participants or "[]")
+                logger.info(
+                    f"[Rank-{self.ranking_id}] Resuming run: {self.battle_count} started, "
+                    f"{self.completed_count} ended, {len(self.adopted)} inherited in flight."
+                )
+            else:
+                self.battle_count = 0
+                self.completed_count = 0
+                self.adopted = set()
             self._battles_since_last_refresh = 0
 
-        # Initial participant load on start, in case __init__ was long ago
-        self._refresh_participants()
+        # Initial participant load on start, in case __init__ was long ago;
+        # a resumed run keeps the pool it saved
+        if not (saved_participants and self._restore_participants(saved_participants)):
+            self._refresh_participants()
 
         logger.info(f"[Rank-{self.ranking_id}] Starting auto-match...")
         self.loop_thread = threading.Thread(
@@ -280,13 +535,17 @@ class AutoMatchInstance:
         with self._instance_lock:  # Ensure consistent read of shared data
             participants_count = len(self.current_participants)
             battle_c = self.battle_count
+            completed_c = self.completed_count
 
         return {
             "ranking_id": self.ranking_id,
             "is_on": self.is_on,
             "battle_count": battle_c,
-            "queue_size": self.battle_queue.qsize(),  # qsize is approximate but ok for status
-            "queue_max_size": self.battle_queue.maxsize,
+            "completed_count": completed_c,
+            "target_battles": self.target_battles,
+            "owner": self.owner,
+            "queue_size": len(self.in_flight) + len(self.adopted),  # battles in flight
+            "queue_max_size": self.window,
             "thread_alive": self.loop_thread.is_alive() if self.loop_thread else False,
             "current_participants_count": participants_count,
             "battles_since_last_refresh": self._battles_since_last_refresh,  # May need lock if read/write are not atomic
@@ -301,13 +560,32 @@ class AutoMatchManager:
         self.app = app
         self.instances: Dict[int, AutoMatchInstance] = {}
         self.lock = threading.Lock()  # 用于同步对 instances 字典的访问
+        # 本进程在 automatch_runs 中的租约持有者标识
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._resume_thread: Optional[threading.Thread] = None
+        # 在各榜单之间分配全局在途对局数（AUTOMATCH_CAPACITY.enabled 为 false 时不生效）
+        self.allocator = CapacityAllocator(
+            total_provider=self._battle_concurrency_limit
+        )
+
+    def _battle_concurrency_limit(self) -> int:
+        """BattleManager 当前允许同时执行的对战数，作为未配置 total_slots 时的总容量"""
+        with self.app.app_context():
+            return get_battle_manager().get_queue_status()["concurrency_limit"]
 
     def start_automatch_for_ranking(
         self,
         ranking_id: int,
         parallel_games: int = MAX_AUTOMATCH_PARALLEL_GAMES_PER_RANKING,
+        priority: Optional[int] = None,
+        target_battles: Optional[int] = None,
     ) -> bool:
-        """为指定的 ranking_id 启动自动对战"""
+        """
+        为指定的 ranking_id 启动自动对战
+        priority: 该榜单对局的LLM流量优先级，None 表示保持实例原有优先级
+        target_battles: 启动该局数后自动结束，None 表示不限
+        其他进程正在运行该榜单的自动对战时返回 False
+        """
         logger.info(f"尝试为 Ranking ID {ranking_id} 启动自动对战")
 
         with self.lock:
@@ -318,11 +596,23 @@ class AutoMatchManager:
                 logger.warning(f"Ranking ID {ranking_id} 的自动对战已在运行。")
                 return False
 
-            # 如果实例不存在，则创建新实例
-            if not instance:
-                instance = AutoMatchInstance(self.app, ranking_id, parallel_games)
+            # 如果实例不存在（或是已结束的锦标赛），则创建新实例
+            if not isinstance(instance, AutoMatchInstance):
+                instance = AutoMatchInstance(
+                    self.app,
+                    ranking_id,
+                    parallel_games,
+                    priority if priority is not None else PRIORITY_NORMAL,
+                    allocator=self.allocator,
+                    owner=self.owner,
+                    target_battles=target_battles,
+                )
                 self.instances[ranking_id] = instance
                 logger.info(f"为 Ranking ID {ranking_id} 创建新的自动对战实例。")
+            else:
+                instance.target_battles = target_battles
+                if priority is not None:
+                    instance.priority = priority
 
         # 实例已创建，尝试启动它（在锁外执行避免长时间持有锁）
         success = instance.start()
@@ -334,15 +624,66 @@ class AutoMatchManager:
 
         return success
 
+    def start_tournament_for_ranking(
+        self,
+        ranking_id: int,
+        priority: Optional[int] = None,
+        mode: Optional[str] = None,
+        full_ranking: bool = False,
+        **options,
+    ) -> bool:
+        """
+        为指定的 ranking_id 启动锦标赛（见 game/tournament.py），排名确定或预算用完后自动停止
+        锦标赛实例与自动对战实例共用 instances，停止、终止与状态查询的接口相同
+        mode: swiss / round_robin，None 表示按参赛人数选择
+        full_ranking: 是否需要确定完整排名（决赛），否则只确定晋级线
+        options: 覆盖 TOURNAMENT 配置中的 confidence_z / min_games / max_games / advance_ratio
+        """
+        # game.tournament 依赖 utils，延迟导入避免循环引用
+        from game.tournament import TournamentInstance
+
+        logger.info(f"尝试为 Ranking ID {ranking_id} 启动锦标赛")
+
+        with self.lock:
+            instance = self.instances.get(ranking_id)
+            if instance and instance.is_on:
+                logger.warning(f"Ranking ID {ranking_id} 的自动对战或锦标赛已在运行。")
+                return False
+            instance = TournamentInstance(
+                self.app,
+                ranking_id,
+                priority=priority if priority is not None else PRIORITY_NORMAL,
+                mode=mode,
+                full_ranking=full_ranking,
+                **options,
+            )
+            self.instances[ranking_id] = instance
+
+        success = instance.start()
+        if success:
+            logger.info(f"Ranking ID {ranking_id} 的锦标赛已成功启动。")
+        else:
+            logger.error(f"Ranking ID {ranking_id} 的锦标赛启动失败。")
+        return success
+
     def stop_automatch_for_ranking(self, ranking_id: int) -> bool:
-        """停止指定 ranking_id 的自动对战"""
+        """停止指定 ranking_id 的自动对战；由其他进程运行时请求其停止"""
         with self.lock:
             instance = self.instances.get(ranking_id)
             if not instance or not instance.is_on:
-                logger.warning(f"Ranking ID {ranking_id} 的自动对战未运行或不存在。")
-                return False
+                return self._request_remote_stop(ranking_id)
         return instance.stop()
 
+    def _request_remote_stop(self, ranking_id: int) -> bool:
+        """在数据库中把运行标记为 stopped，持有进程在下一次保存进度时停止"""
+        with self.app.app_context():
+            requested = db_request_automatch_run_stop(ranking_id)
+        if requested:
+            logger.info(f"已请求停止其他进程中 Ranking ID {ranking_id} 的自动对战。")
+        else:
+            logger.warning(f"Ranking ID {ranking_id} 的自动对战未运行或不存在。")
+        return requested
+
     def start_all_managed_automatch(self) -> Dict[int, bool]:
         """启动所有当前管理的（即已创建实例的）ranking_id的自动对战"""
         results = {}
@@ -379,19 +720,115 @@ class AutoMatchManager:
         return results
 
     def get_status_for_ranking(self, ranking_id: int) -> Optional[dict]:
-        with self.lock:
-            instance = self.instances.get(ranking_id)
-            if instance:
-                return instance.get_status()
-        return None
+        return self._collect_statuses([ranking_id]).get(ranking_id)
 
     def get_all_statuses(self) -> Dict[int, dict]:
+        return self._collect_statuses()
+
+    def _collect_statuses(
+        self, ranking_ids: Optional[List[int]] = None
+    ) -> Dict[int, dict]:
+        """
+        本进程正在运行的实例使用内存中的状态，其余榜单使用数据库中的运行记录
+        （可能由其他进程运行或已结束），都没有时使用本进程的空闲实例
+        """
         statuses = {}
         with self.lock:
             for ranking_id, instance in self.instances.items():
-                statuses[ranking_id] = instance.get_status()
+                if ranking_ids is None or ranking_id in ranking_ids:
+                    statuses[ranking_id] = instance.get_status()
+        with self.app.app_context():
+            for run in db_get_automatch_runs(ranking_ids):
+                local = statuses.get(run.ranking_id)
+                # 锦标赛不写入运行记录，结束后仍显示本进程的结果
+                if local is None or (
+                    not local["is_on"] and local.get("scheduler") != "tournament"
+                ):
+                    statuses[run.ranking_id] = self._run_status(run)
         return statuses
 
+    @staticmethod
+    def _run_status(run: AutoMatchRun) -> dict:
+        """由数据库中的运行记录构造与 AutoMatchInstance.get_status 相同结构的状态"""
+        data = run.to_dict()
+        return {
+            "ranking_id": run.ranking_id,
+            "is_on": run.is_active(),
+            "status": run.status,
+            "battle_count": run.started_count,
+            "completed_count": run.completed_count,
+            "target_battles": run.target_battles,
+            "owner": run.owner,
+            "queue_size": len(data["in_flight"]),
+            "queue_max_size": run.parallel_games,
+            "thread_alive": False,  # 不在本进程中运行
+            "current_participants_count": len(data["participants"]),
+            "heartbeat_at": data["heartbeat_at"],
+        }
+
+    def resume_orphaned_runs(self) -> List[int]:
+        """
+        接管状态为 running 但持有进程已退出（租约过期）的运行，保留其进度与在途对局
+        多个进程同时扫描时由租约保证只有一个进程接管，返回本进程接管的榜单ID
+        """
+        with self.app.app_context():
+            orphaned = [
+                (run.ranking_id, run.parallel_games, run.priority)
+                for run in db_get_orphaned_automatch_runs()
+            ]
+        resumed = []
+        for ranking_id, parallel_games, priority in orphaned:
+            with self.lock:
+                instance = self.instances.get(ranking_id)
+                if instance is not None and instance.is_on:
+                    continue
+                if not isinstance(instance, AutoMatchInstance):
+                    instance = AutoMatchInstance(
+                        self.app,
+                        ranking_id,
+                        parallel_games,
+                        priority,
+                        allocator=self.allocator,
+                        owner=self.owner,
+                    )
+                    self.instances[ranking_id] = instance
+            if instance.start(resume=True):
+                resumed.append(ranking_id)
+        if resumed:
+            logger.info(f"已接管榜单 {resumed} 的自动对战。")
+        return resumed
+
+    def start_resume_watcher(self) -> bool:
+        """
+        AUTOMATCH_STATE.resume 开启时，立即并每隔 check_interval 秒接管失去持有进程的运行
+        """
+        config = get_automatch_state_config()
+        if not config["resume"] or self._resume_thread is not None:
+            return False
+
+        def watch():
+            while True:
+                try:
+                    self.resume_orphaned_runs()
+                except Exception as e:
+                    logger.error(f"接管自动对战运行时出错: {e}", exc_info=True)
+                sleep(float(config["check_interval"]))
+
+        self._resume_thread = threading.Thread(
+            target=watch, name="Thread-AutoMatch-Resume", daemon=True
+        )
+        self._resume_thread.start()
+        return True
+
+    def get_capacity_status(self) -> dict:
+        """全局容量分配器的状态：总容量、各榜单的权重、需求、份额与在途对局数"""
+        return self.allocator.get_status()
+
+    def configure_capacity(self, **options) -> dict:
+        """调整全局容量分配器（参数见 CapacityAllocator.configure），返回调整后的状态"""
+        self.allocator.configure(**options)
+        return self.allocator.get_status()
+
     def is_on(self):
         statuses = self.get_all_statuses()
         for ranking_id in statuses:
@@ -425,7 +862,11 @@ class AutoMatchManager:
                 if rank_id not in self.instances:  # 双重检查
                     logger.info(f"为新的目标榜单 {rank_id} 创建自动对战实例。")
                     self.instances[rank_id] = AutoMatchInstance(
-                        self.app, rank_id, parallel_games_per_ranking
+                        self.app,
+                        rank_id,
+                        parallel_games_per_ranking,
+                        allocator=self.allocator,
+                        owner=self.owner,
                     )
 
             logger.info(f"当前管理的榜单: {list(self.instances.keys())}")
@@ -463,8 +904,8 @@ class AutoMatchManager:
 
         with self.lock:
             if ranking_id not in self.instances:
-                logger.warning(f"尝试终止不存在的榜单实例: Ranking ID {ranking_id}")
-                return False
+                # 可能由其他进程运行
+                return self._request_remote_stop(ranking_id)
 
             instance_to_terminate = self.instances[ranking_id]
             was_on = instance_to_terminate.is_on
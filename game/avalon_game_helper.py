@@ -6,15 +6,19 @@ import os
 import json
 import time
 import logging
-import threading
+import sys
 import signal
+import contextvars
 from typing import Dict, Any, List, Tuple, Optional
 from dotenv import load_dotenv
 from .decorator import DebugDecorator, settings
-from .client_manager import ClientManager, get_client_manager
+from .client_manager import ClientManager, get_client_manager, PRIORITY_NORMAL
+from .async_runtime import current_runtime, await_only, run_blocking
+from . import metrics
+from openai import RateLimitError
 from functools import wraps
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 # 配置日志
 logging.basicConfig(
@@ -35,6 +39,7 @@ _MAX_CALL_COUNT_PER_ROUND = 888  # 一轮最多调用 LLM 次数
 _TOP_P = 0.9  # 输出多样性控制
 _PRESENCE_PENALTY = 0.5  # 避免重复话题 (-2~2)
 _FREQUENCY_PENALTY = 0.5  # 避免重复用词 (-2~2)
+_LLM_TIMEOUT_SECONDS = 20  # 单次调用超时时间
 
 
 # 初始用户库JSON
@@ -48,7 +53,7 @@ INIT_PRIVA_LOG_DICT = {
 class GameHelper:
     """游戏辅助类，管理LLM调用和日志功能"""
 
-    def __init__(self, data_dir=None):
+    def __init__(self, data_dir=None, priority=PRIORITY_NORMAL):
         self.current_player_id = None
         self.game_session_id = None
         self.data_dir = data_dir or os.environ.get("AVALON_DATA_DIR", "./data")
@@ -56,6 +61,7 @@ class GameHelper:
         self.call_count_added = 0
         self.tokens = [{"input": 0, "output": 0} for i in range(7)]
         self.client_manager = get_client_manager()
+        self.priority = priority  # 对局优先级，决定获取client时的排队次序
         self.observer = None
         self.dec = None
 
@@ -187,7 +193,7 @@ class GameHelper:
     def _fetch_LLM_reply(self, history, cur_prompt) -> str:
         """
         从历史记录和当前提示中获取LLM回复。
-        添加了20秒超时重试机制。
+        添加了20秒超时重试机制；开启对冲时，慢请求会被复制到另一个client。
         """
         logger.info(
             f"Player {self.current_player_id} requesting LLM with prompt length {len(cur_prompt)}"
@@ -196,103 +202,86 @@ class GameHelper:
         client_instance, client_id, client_model_name = None, None, None
         max_retries = 3
         retry_count = 0
+        messages = history + [{"role": "user", "content": cur_prompt}]
+
+        # 预估本次请求的token消耗（与token统计口径一致，按字符数计），用于TPM配额
+        estimated_tokens = (
+            sum(len(message.get("content") or "") for message in history)
+            + len(cur_prompt)
+            + _MAX_OUTPUT_TOKENS
+        )
+
+        # 异步对战运行时中，通过异步client挂起当前对局而不是阻塞线程
+        if current_runtime() is not None:
+            return self._fetch_LLM_reply_async(messages, estimated_tokens)
 
         while retry_count < max_retries:
+            attempt_start = time.time()
+            attempt_client_id = None
             try:
-                # 获取客户端
+                # 获取客户端（配额不足时排队等待，超时返回None）
                 client_instance, client_id, client_model_name = (
-                    self.client_manager.get_client()
+                    self.client_manager.get_client(
+                        estimated_tokens=estimated_tokens, priority=self.priority
+                    )
                 )
 
                 if client_instance is None:
                     logger.error(
                         f"Player {self.current_player_id} failed to get an OpenAI client"
                     )
-                    return "LLM调用错误：没有可用的OpenAI客户端"
+                    self.client_manager.record_llm_outcome(
+                        time.time() - attempt_start, succeeded=False
+                    )
+                    return "LLM调用错误：没有可用的OpenAI客户端或等待速率配额超时"
 
+                attempt_client_id = client_id
                 logger.info(f"Player {self.current_player_id} using client {client_id}")
 
-                import time
-                import sys
-
-                start_time = time.time()
-
-                # 使用子线程和超时控制机制
-                response_content = None
-
-                def call_api():
-                    nonlocal response_content
-                    completion = client_instance.chat.completions.create(
-                        model=client_model_name,
-                        messages=history + [{"role": "user", "content": cur_prompt}],
-                        stream=False,
-                        temperature=_TEMPERATURE,
-                        max_tokens=_MAX_OUTPUT_TOKENS,
-                        top_p=_TOP_P,
-                        presence_penalty=_PRESENCE_PENALTY,
-                        frequency_penalty=_FREQUENCY_PENALTY,
-                    )
-                    response_content = completion.choices[0].message.content
-
                 # 检查解释器是否正在关闭
                 is_shutting_down = hasattr(sys, "is_finalizing") and sys.is_finalizing()
 
                 if is_shutting_down:
                     logger.warning("Python解释器正在关闭，不再创建新的线程任务")
-                    if client_id is not None:
-                        try:
-                            self.client_manager.release_client(client_id)
-                            logger.info(f"Released client {client_id} during shutdown")
-                        except Exception as e:
-                            logger.error(
-                                f"Error releasing client during shutdown: {str(e)}"
-                            )
                     return "LLM调用错误: 程序正在关闭"
 
                 # 创建线程执行API调用
                 try:
-                    with ThreadPoolExecutor(max_workers=1) as executor:
-                        future = executor.submit(call_api)
-
-                        # 等待执行，最多20秒
-                        timeout_seconds = 20
-                        timeout = False
-
-                        for _ in range(timeout_seconds):
-                            # 再次检查解释器是否正在关闭
-                            if hasattr(sys, "is_finalizing") and sys.is_finalizing():
-                                logger.warning(
-                                    "在等待API响应期间检测到Python解释器关闭"
-                                )
-                                timeout = True
-                                break
-
-                            if future.done():
-                                break
-                            time.sleep(1)
-                            elapsed = time.time() - start_time
-                            if elapsed > timeout_seconds:
-                                timeout = True
-                                break
+                    executor = ThreadPoolExecutor(max_workers=2)
+                    start_time = time.time()
+                    futures = {
+                        self._submit_completion(
+                            executor,
+                            client_instance,
+                            client_id,
+                            client_model_name,
+                            messages,
+                        ): client_id
+                    }
                 except RuntimeError as e:
                     if "after interpreter shutdown" in str(e):
                         logger.warning(f"解释器关闭后无法创建线程: {str(e)}")
-                        if client_id is not None:
-                            try:
-                                self.client_manager.release_client(client_id)
-                            except Exception:
-                                pass
                         return "LLM调用错误: 程序正在关闭"
                     raise
 
-                    # 如果没有超时但出现其他问题
-                    if not future.done():
-                        raise TimeoutError("API调用未完成且未超时，可能存在其他问题")
+                # 已提交的请求结束时由回调释放client
+                client_id = None
+                try:
+                    response_content = self._wait_for_completion(
+                        executor, futures, messages, estimated_tokens, start_time
+                    )
+                finally:
+                    # 不等待落败的对冲请求
+                    executor.shutdown(wait=False)
 
                 if response_content is None:
                     raise Exception("API调用完成但未返回内容")
 
                 elapsed = time.time() - start_time
+                self.client_manager.record_llm_outcome(
+                    time.time() - attempt_start,
+                    client_id_with_session=attempt_client_id,
+                )
                 token = len(response_content)
                 self.tokens[self.current_player_id - 1]["output"] += token
 
@@ -306,17 +295,11 @@ class GameHelper:
                 logger.error(
                     f"Player {self.current_player_id} error: {str(e)}", exc_info=True
                 )
-
-                # 发生异常时立即释放客户端
-                if client_id is not None:
-                    try:
-                        self.client_manager.release_client(client_id)
-                        logger.info(f"Released client {client_id} after exception")
-                        client_id = None  # 避免重复释放
-                    except Exception as release_e:
-                        logger.error(
-                            f"Error releasing client {client_id}: {str(release_e)}"
-                        )
+                self.client_manager.record_llm_outcome(
+                    time.time() - attempt_start,
+                    succeeded=False,
+                    client_id_with_session=attempt_client_id,
+                )
 
                 if retry_count < max_retries - 1:
                     retry_count += 1
@@ -328,7 +311,7 @@ class GameHelper:
                     return f"LLM调用错误(重试{max_retries}次后): {str(e)[:100]}..."
 
             finally:
-                # 确保客户端总是被释放
+                # 确保未提交请求的客户端总是被释放
                 if client_id is not None:
                     try:
                         self.client_manager.release_client(client_id)
@@ -340,6 +323,293 @@ class GameHelper:
 
         return "LLM调用多次失败，请稍后再试"
 
+    def _call_completion(self, client_instance, model_name, messages):
+        """执行一次API调用，返回 (回复内容, 实际token用量)"""
+        completion = client_instance.chat.completions.create(
+            model=model_name,
+            messages=messages,
+            stream=False,
+            temperature=_TEMPERATURE,
+            max_tokens=_MAX_OUTPUT_TOKENS,
+            top_p=_TOP_P,
+            presence_penalty=_PRESENCE_PENALTY,
+            frequency_penalty=_FREQUENCY_PENALTY,
+        )
+        tokens_used = None
+        if getattr(completion, "usage", None) is not None:
+            tokens_used = completion.usage.total_tokens
+        return completion.choices[0].message.content, tokens_used
+
+    def _submit_completion(
+        self, executor, client_instance, client_id, model_name, messages
+    ):
+        """
+        在线程池中提交API调用
+        调用结束（成功、失败或被取消）时自动释放client，成功时记录延迟
+        """
+        start_time = time.time()
+        future = executor.submit(
+            self._call_completion, client_instance, model_name, messages
+        )
+
+        def _on_done(done_future):
+            tokens_used = None
+            if not done_future.cancelled() and done_future.exception() is None:
+                tokens_used = done_future.result()[1]
+                self.client_manager.record_latency(client_id, time.time() - start_time)
+            try:
+                self.client_manager.release_client(client_id, tokens_used)
+            except Exception as e:
+                logger.error(f"Error releasing client {client_id}: {str(e)}")
+
+        future.add_done_callback(_on_done)
+        return future
+
+    def _wait_for_completion(
+        self, executor, futures, messages, estimated_tokens, start_time
+    ):
+        """
+        等待API调用返回，最多_LLM_TIMEOUT_SECONDS秒
+        主请求超过该client的自适应对冲延迟仍未返回时，向另一个client发出相同请求，
+        取先成功返回的结果，并取消另一个请求（已发出的请求无法中断，其结果被丢弃）
+        """
+        primary_client_id = next(iter(futures.values()))
+        hedge_delay = self.client_manager.get_hedge_delay(primary_client_id)
+        last_error = None
+
+        try:
+            while futures:
+                # 再次检查解释器是否正在关闭
+                if hasattr(sys, "is_finalizing") and sys.is_finalizing():
+                    logger.warning("在等待API响应期间检测到Python解释器关闭")
+                    break
+
+                elapsed = time.time() - start_time
+                if elapsed >= _LLM_TIMEOUT_SECONDS:
+                    break
+
+                if hedge_delay is not None and elapsed >= hedge_delay:
+                    hedge_delay = None  # 每次请求最多对冲一次
+                    self._start_hedge(executor, futures, messages, estimated_tokens)
+
+                wait_seconds = min(1.0, _LLM_TIMEOUT_SECONDS - elapsed)
+                if hedge_delay is not None:
+                    wait_seconds = min(wait_seconds, hedge_delay - elapsed)
+                done, _ = wait(
+                    list(futures), timeout=wait_seconds, return_when=FIRST_COMPLETED
+                )
+
+                for future in done:
+                    finished_client_id = futures.pop(future)
+                    error = future.exception()
+                    if error is None:
+                        return future.result()[0]
+                    last_error = error
+                    # 429：让该client进入冷却，重试时由ClientManager排队等待配额
+                    if isinstance(error, RateLimitError):
+                        self.client_manager.report_rate_limited(
+                            finished_client_id, _parse_retry_after(error)
+                        )
+        finally:
+            # 取消仍未完成的请求
+            for future in futures:
+                future.cancel()
+
+        if last_error is not None and not futures:
+            raise last_error
+        raise TimeoutError(f"API调用超过{_LLM_TIMEOUT_SECONDS}秒未返回")
+
+    def _acquire_hedge_client(self, used_client_ids, estimated_tokens):
+        """
+        在对冲预算允许时，立即获取一个未被本次请求使用过的client
+        返回 (client_instance, client_id, client_model_name)，无法对冲时返回None
+        """
+        if not self.client_manager.has_hedge_budget():
+            return None
+
+        used_client_ids = {client_id.split(":", 1)[0] for client_id in used_client_ids}
+        client_instance, client_id, client_model_name = self.client_manager.get_client(
+            estimated_tokens=estimated_tokens,
+            timeout=0,
+            priority=self.priority,
+            exclude_client_ids=used_client_ids,
+        )
+        if client_instance is None:
+            return None
+
+        self.client_manager.record_hedge()
+        logger.info(
+            f"Player {self.current_player_id} hedging slow LLM request with client {client_id}"
+        )
+        return client_instance, client_id, client_model_name
+
+    def _start_hedge(self, executor, futures, messages, estimated_tokens):
+        """在对冲预算允许时，向另一个client发出相同的请求"""
+        hedge = self._acquire_hedge_client(futures.values(), estimated_tokens)
+        if hedge is None:
+            return
+
+        client_instance, client_id, client_model_name = hedge
+        future = self._submit_completion(
+            executor, client_instance, client_id, client_model_name, messages
+        )
+        futures[future] = client_id
+
+    def _fetch_LLM_reply_async(self, messages, estimated_tokens) -> str:
+        """
+        异步对战运行时下的LLM调用：当前对局的greenlet挂起等待异步client返回，不占用线程
+        重试与对冲策略与同步版本一致
+        """
+        max_retries = 3
+        last_error = None
+
+        for retry_count in range(max_retries):
+            attempt_start = time.time()
+            # 先尝试立即获取client，需要排队等待配额时交给阻塞线程池
+            client_instance, client_id, client_model_name = (
+                self.client_manager.get_client(
+                    estimated_tokens=estimated_tokens,
+                    timeout=0,
+                    priority=self.priority,
+                )
+            )
+            if client_instance is None:
+                client_instance, client_id, client_model_name = run_blocking(
+                    self.client_manager.get_client,
+                    estimated_tokens=estimated_tokens,
+                    priority=self.priority,
+                )
+            if client_instance is None:
+                logger.error(
+                    f"Player {self.current_player_id} failed to get an OpenAI client"
+                )
+                self.client_manager.record_llm_outcome(
+                    time.time() - attempt_start, succeeded=False
+                )
+                return "LLM调用错误：没有可用的OpenAI客户端或等待速率配额超时"
+
+            try:
+                start_time = time.time()
+                response_content = await_only(
+                    self._async_completion_with_hedge(
+                        client_id, client_model_name, messages, estimated_tokens
+                    )
+                )
+                if response_content is None:
+                    raise Exception("API调用完成但未返回内容")
+
+                self.client_manager.record_llm_outcome(
+                    time.time() - attempt_start, client_id_with_session=client_id
+                )
+                self.tokens[self.current_player_id - 1]["output"] += len(
+                    response_content
+                )
+                logger.info(
+                    f"Player {self.current_player_id} received response in {time.time() - start_time:.2f}s"
+                )
+                return response_content or "LLM调用未返回有效结果"
+            except Exception as e:
+                last_error = e
+                logger.error(
+                    f"Player {self.current_player_id} error: {str(e)}", exc_info=True
+                )
+                self.client_manager.record_llm_outcome(
+                    time.time() - attempt_start,
+                    succeeded=False,
+                    client_id_with_session=client_id,
+                )
+                if retry_count < max_retries - 1:
+                    logger.info(
+                        f"Retrying LLM request, attempt {retry_count + 1}/{max_retries}"
+                    )
+
+        return f"LLM调用错误(重试{max_retries}次后): {str(last_error)[:100]}..."
+
+    async def _async_completion(self, client_id, model_name, messages):
+        """在事件循环上执行一次API调用，结束（含被取消）时释放client"""
+        start_time = time.time()
+        tokens_used = None
+        try:
+            client_instance = self.client_manager.get_async_client(client_id)
+            completion = await client_instance.chat.completions.create(
+                model=model_name,
+                messages=messages,
+                stream=False,
+                temperature=_TEMPERATURE,
+                max_tokens=_MAX_OUTPUT_TOKENS,
+                top_p=_TOP_P,
+                presence_penalty=_PRESENCE_PENALTY,
+                frequency_penalty=_FREQUENCY_PENALTY,
+            )
+            if getattr(completion, "usage", None) is not None:
+                tokens_used = completion.usage.total_tokens
+            self.client_manager.record_latency(client_id, time.time() - start_time)
+            return completion.choices[0].message.content
+        except RateLimitError as e:
+            # 429：让该client进入冷却，重试时由ClientManager排队等待配额
+            self.client_manager.report_rate_limited(client_id, _parse_retry_after(e))
+            raise
+        finally:
+            self.client_manager.release_client(client_id, tokens_used)
+
+    async def _async_completion_with_hedge(
+        self, client_id, model_name, messages, estimated_tokens
+    ):
+        """
+        等待异步API调用返回，最多_LLM_TIMEOUT_SECONDS秒
+        超过对冲延迟时向另一个client发出相同请求，取先成功者并真正取消落败的请求
+        """
+        loop = asyncio.get_running_loop()
+        start_time = loop.time()
+        tasks = {
+            asyncio.ensure_future(
+                self._async_completion(client_id, model_name, messages)
+            ): client_id
+        }
+        hedge_delay = self.client_manager.get_hedge_delay(client_id)
+        last_error = None
+
+        try:
+            while tasks:
+                elapsed = loop.time() - start_time
+                if elapsed >= _LLM_TIMEOUT_SECONDS:
+                    break
+
+                if hedge_delay is not None and elapsed >= hedge_delay:
+                    hedge_delay = None  # 每次请求最多对冲一次
+                    hedge = self._acquire_hedge_client(tasks.values(), estimated_tokens)
+                    if hedge is not None:
+                        _, hedge_client_id, hedge_model_name = hedge
+                        task = asyncio.ensure_future(
+                            self._async_completion(
+                                hedge_client_id, hedge_model_name, messages
+                            )
+                        )
+                        tasks[task] = hedge_client_id
+
+                wait_seconds = _LLM_TIMEOUT_SECONDS - elapsed
+                if hedge_delay is not None:
+                    wait_seconds = min(wait_seconds, hedge_delay - elapsed)
+                done, _ = await asyncio.wait(
+                    list(tasks),
+                    timeout=wait_seconds,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+
+                for task in done:
+                    tasks.pop(task)
+                    if task.exception() is None:
+                        return task.result()
+                    last_error = task.exception()
+        finally:
+            # 取消仍未完成的请求
+            for task in tasks:
+                task.cancel()
+
+        if last_error is not None and not tasks:
+            raise last_error
+        raise TimeoutError(f"API调用超过{_LLM_TIMEOUT_SECONDS}秒未返回")
+
     def _get_private_lib_content(self) -> dict:
         """
         获取私有库内容
@@ -384,8 +654,11 @@ class GameHelper:
         os.makedirs(os.path.dirname(private_file), exist_ok=True)
 
         # 打开文件，写回
+        write_start = time.time()
         with open(private_file, "w", encoding="utf-8") as f:
             json.dump(data, f, indent=2, ensure_ascii=False)
+            size = f.tell()
+        metrics.observe_log_write("private", time.time() - write_start, size)
 
     def read_private_lib(self) -> List[str]:
         """从私有库中读取内容"""
@@ -475,22 +748,33 @@ class GameHelper:
         logger.info("GameHelper实例已关闭")
 
 
-_thread_local = threading.local()
+def _parse_retry_after(error) -> Optional[float]:
+    """从429响应头中解析Retry-After秒数，解析失败返回None"""
+    try:
+        return float(error.response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+# 每个线程、每个异步对战greenlet各自拥有独立的上下文，互不干扰
+_current_helper = contextvars.ContextVar("avalon_game_helper")
 
 
 def get_current_helper():
-    """获取当前线程的 GameHelper 实例"""
-    if not hasattr(_thread_local, "helper"):
-        _thread_local.helper = GameHelper()
-    return _thread_local.helper
+    """获取当前线程（或异步对局）的 GameHelper 实例"""
+    helper = _current_helper.get(None)
+    if helper is None:
+        helper = GameHelper()
+        _current_helper.set(helper)
+    return helper
 
 
 def set_thread_helper(helper):
-    """设置当前线程的 GameHelper 实例"""
-    _thread_local.helper = helper
+    """设置当前线程（或异步对局）的 GameHelper 实例"""
+    _current_helper.set(helper)
 
 
-# 修改为使用线程本地存储的 helper 实例
+# 修改为使用上下文本地存储的 helper 实例
 def set_current_context(player_id: int, game_id: str) -> None:
     get_current_helper().set_current_context(player_id, game_id)
 
@@ -521,10 +805,11 @@ def read_public_lib() -> Dict[str, Any]:
 
 # 在模块级别添加shutdown函数
 def shutdown_helpers():
-    """关闭所有线程本地的Helper实例"""
-    if hasattr(_thread_local, "helper"):
+    """关闭当前上下文的Helper实例"""
+    helper = _current_helper.get(None)
+    if helper is not None:
         try:
-            _thread_local.helper.shutdown()
+            helper.shutdown()
         except Exception as e:
             logger.error(f"关闭helper时出错: {str(e)}")
 
@@ -0,0 +1,301 @@
+"""
+本机对战执行服务 - 多进程部署（gunicorn 多个 worker）时，本机只由一个进程执行对战
+
+该进程通过文件锁选举产生，持有唯一的 BattleManager（工作线程、观察者、快照都在其中），
+并在 Unix socket 上提供服务；其他进程使用 BattleServiceClient 代理 BattleManager 的
+启动、取消、状态查询与快照获取。执行进程退出后文件锁自动释放，
+下一个调用失败的进程会重新选举并接管。
+
+通信协议：每个连接发送一行 JSON 请求 {"method", "args", "kwargs"}，
+返回一行 JSON 响应 {"ok": true, "result"} 或 {"ok": false, "error"/"busy"}。
+
+config.yaml 配置示例：
+
+BATTLE_SERVICE:
+  mode: local                              # local: 每个进程各自执行对战（默认）
+                                           # host: 本机选举一个进程执行对战
+                                           # runner: 对战只在独立的 battle_runner.py 中执行
+  socket_path: ./data/battle_service.sock
+  lock_path: ./data/battle_service.lock
+  timeout: 10                              # 调用执行进程的超时（秒）
+  drain_seconds: 600                       # battle_runner.py 收到 SIGTERM 后的最长排空时间
+"""
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+from config.config import Config
+from .battle_manager import BattleQueueFullError
+from .client_manager import PRIORITY_NORMAL
+
+logger = logging.getLogger("BattleIPC")
+
+# 允许通过 socket 调用的 BattleManager 方法
+REMOTE_METHODS = frozenset(
+    [
+        "start_battle",
+        "cancel_battle",
+        "check_admission",
+        "get_battle_status",
+        "get_battle_result",
+        "get_snapshots_queue",
+        "get_snapshots_archive",
+        "get_all_battles",
+        "get_queue_position",
+        "get_queue_status",
+        "wait_for_any",
+    ]
+)
+
+
+def get_battle_service_config() -> dict:
+    config = dict(Config._yaml_config.get("BATTLE_SERVICE") or {})
+    data_dir = os.environ.get("AVALON_DATA_DIR", "./data")
+    config.setdefault("mode", "local")
+    config.setdefault("socket_path", os.path.join(data_dir, "battle_service.sock"))
+    config.setdefault("lock_path", os.path.join(data_dir, "battle_service.lock"))
+    config.setdefault("timeout", 10)
+    return config
+
+
+def _send_message(sock: socket.socket, message: dict):
+    sock.sendall(json.dumps(message, default=str).encode("utf-8") + b"\n")
+
+
+def _recv_message(sock: socket.socket) -> dict:
+    buffer = b""
+    while not buffer.endswith(b"\n"):
+        chunk = sock.recv(65536)
+        if not chunk:
+            raise ConnectionError("对战执行服务连接已关闭")
+        buffer += chunk
+    return json.loads(buffer)
+
+
+class HostElection:
+    """通过文件锁选出本机唯一的对战执行进程，锁随进程退出自动释放"""
+
+    def __init__(self, lock_path: str):
+        self.lock_path = lock_path
+        self._lock_file = None
+
+    @property
+    def is_host(self) -> bool:
+        return self._lock_file is not None
+
+    def try_acquire(self) -> bool:
+        if self._lock_file is not None:
+            return True
+        if not FCNTL_AVAILABLE:
+            return False
+        os.makedirs(os.path.dirname(os.path.abspath(self.lock_path)), exist_ok=True)
+        lock_file = open(self.lock_path, "a+")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(str(os.getpid()))
+        lock_file.flush()
+        self._lock_file = lock_file
+        logger.info(f"进程 {os.getpid()} 当选为本机对战执行进程")
+        return True
+
+
+class BattleServiceServer:
+    """在 Unix socket 上提供 BattleManager 方法调用"""
+
+    def __init__(self, manager, socket_path: str, app=None):
+        self.manager = manager
+        self.socket_path = socket_path
+        self.app = app
+        self._server_socket = None
+        self._stop_event = threading.Event()
+
+    def start(self):
+        if os.path.exists(self.socket_path):
+            # 上一个执行进程遗留的 socket 文件
+            os.unlink(self.socket_path)
+        os.makedirs(os.path.dirname(os.path.abspath(self.socket_path)), exist_ok=True)
+        self._server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server_socket.bind(self.socket_path)
+        self._server_socket.listen(128)
+        threading.Thread(
+            target=self._accept_loop, daemon=True, name="BattleServiceServer"
+        ).start()
+        logger.info(f"对战执行服务已在 {self.socket_path} 上监听")
+
+    def _accept_loop(self):
+        while not self._stop_event.is_set():
+            try:
+                conn, _ = self._server_socket.accept()
+            except OSError:
+                if self._stop_event.is_set():
+                    return
+                logger.exception("接受对战执行服务连接时出错")
+                time.sleep(0.1)
+                continue
+            threading.Thread(
+                target=self._handle_connection, args=(conn,), daemon=True
+            ).start()
+
+    def _handle_connection(self, conn: socket.socket):
+        with conn:
+            try:
+                request = _recv_message(conn)
+                _send_message(conn, self._dispatch(request))
+            except Exception as e:
+                logger.warning(f"处理对战执行服务请求时出错: {str(e)}")
+
+    def _dispatch(self, request: dict) -> dict:
+        method = request.get("method")
+        if method not in REMOTE_METHODS:
+            return {"ok": False, "error": f"不支持的方法: {method}"}
+        try:
+            handler = getattr(self.manager, method)
+            args = request.get("args") or []
+            kwargs = request.get("kwargs") or {}
+            # start_battle 等方法需要查询数据库
+            if self.app is not None:
+                with self.app.app_context():
+                    result = handler(*args, **kwargs)
+            else:
+                result = handler(*args, **kwargs)
+            return {"ok": True, "result": result}
+        except BattleQueueFullError as e:
+            return {"ok": False, "busy": e.to_dict()}
+        except Exception as e:
+            logger.exception(f"执行 {method} 时出错: {str(e)}")
+            return {"ok": False, "error": str(e)}
+
+    def shutdown(self):
+        self._stop_event.set()
+        if self._server_socket is not None:
+            self._server_socket.close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+class BattleServiceClient:
+    """
+    BattleManager 的代理，将调用转发给本机对战执行进程
+    连接失败时调用 on_disconnect 尝试重新选举：若本进程当选则返回本地 BattleManager 直接执行
+    """
+
+    def __init__(
+        self,
+        socket_path: str,
+        timeout: float = 10,
+        on_disconnect: Callable[[], Any] = None,
+        connect_retry_seconds: float = 2.0,
+    ):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.on_disconnect = on_disconnect
+        self.connect_retry_seconds = connect_retry_seconds
+
+    def _connect(self) -> socket.socket:
+        # 执行进程刚当选时可能尚未开始监听，短暂重试
+        deadline = time.time() + self.connect_retry_seconds
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.socket_path)
+                return sock
+            except OSError:
+                sock.close()
+                if time.time() >= deadline:
+                    raise
+                time.sleep(0.1)
+
+    def _call(self, method: str, *args, **kwargs):
+        try:
+            sock = self._connect()
+        except OSError as e:
+            logger.warning(f"无法连接对战执行服务 ({method}): {str(e)}")
+            local_manager = self.on_disconnect() if self.on_disconnect else None
+            if local_manager is not None:
+                return getattr(local_manager, method)(*args, **kwargs)
+            raise ConnectionError(f"对战执行服务不可用: {str(e)}") from e
+
+        # 请求已发出后出错不再重试，避免重复启动对战
+        with sock:
+            _send_message(
+                sock, {"method": method, "args": list(args), "kwargs": kwargs}
+            )
+            response = _recv_message(sock)
+
+        if response.get("ok"):
+            return response.get("result")
+        if "busy" in response:
+            busy = response["busy"]
+            raise BattleQueueFullError(
+                busy["queue_size"], busy["max_queue_size"], busy["retry_after"]
+            )
+        raise RuntimeError(response.get("error", "对战执行服务返回未知错误"))
+
+    def start_battle(
+        self,
+        battle_id: str,
+        participant_data: List[Dict[str, str]],
+        priority=PRIORITY_NORMAL,
+        owner_id=None,
+        ranking_id=None,
+    ) -> bool:
+        return self._call(
+            "start_battle",
+            battle_id,
+            participant_data,
+            priority,
+            owner_id=owner_id,
+            ranking_id=ranking_id,
+        )
+
+    def cancel_battle(self, battle_id: str, reason="Manually cancelled") -> bool:
+        return self._call("cancel_battle", battle_id, reason)
+
+    def check_admission(self, count: int = 1):
+        self._call("check_admission", count)
+
+    def get_battle_status(self, battle_id: str) -> Optional[str]:
+        return self._call("get_battle_status", battle_id)
+
+    def get_battle_result(self, battle_id: str) -> Optional[Dict[str, Any]]:
+        return self._call("get_battle_result", battle_id)
+
+    def get_snapshots_queue(self, battle_id: str) -> List[Dict[str, Any]]:
+        return self._call("get_snapshots_queue", battle_id)
+
+    def get_snapshots_archive(self, battle_id: str):
+        return self._call("get_snapshots_archive", battle_id)
+
+    def get_all_battles(self) -> List[Tuple[str, str]]:
+        return [tuple(item) for item in self._call("get_all_battles")]
+
+    def get_queue_position(self, battle_id: str) -> Optional[dict]:
+        return self._call("get_queue_position", battle_id)
+
+    def get_queue_status(self) -> dict:
+        return self._call("get_queue_status")
+
+    def wait_for_any(self, battle_ids: List[str], timeout: float = None) -> List[str]:
+        # 等待时间需短于 socket 超时，超时返回空列表，由调用方再次等待
+        wait_seconds = self.timeout / 2
+        if timeout is not None:
+            wait_seconds = min(timeout, wait_seconds)
+        return self._call("wait_for_any", list(battle_ids), wait_seconds)
@@ -1,22 +1,48 @@
 """
 对战管理器 - 单例模式设计的中央控制器
 负责创建、管理和监控所有对战
+
+同时执行的对战数由 AIMD 控制器按 LLM 调用的健康状况调整，config.yaml 配置示例：
+
+BATTLE_CONCURRENCY:
+  min: 4                    # 并发对战数下限
+  max: 192                  # 并发对战数上限（默认为工作线程数或异步运行时上限）
+  initial: 192              # 初始并发对战数（默认为上限）
+  target_p95_seconds: 10    # askLLM 延迟 p95 目标（秒）
+  max_error_rate: 0.05      # askLLM 错误率目标（超时、429 与其他异常）
+  increase_step: 2          # 未超标且满载时每次增加的并发数
+  decrease_factor: 0.7      # 超标时并发数乘以该系数
+  interval_seconds: 30      # 调整间隔
+  window_seconds: 120       # 统计窗口
+  min_samples: 20           # 窗口内样本不足时不调整
 """
 
 import os
+import shutil
 import uuid
 import logging
 import threading
 import multiprocessing
 import time
+import math
 import queue  # 确保在文件顶部已导入
-from queue import Queue
-from typing import Dict, Any, Optional, List, Tuple
+from typing import Dict, Any, Optional, List, Set, Tuple, Callable
 
 # 导入裁判和观察者
 from .referee import AvalonReferee  # 确保导入正确
 from .observer import Observer  # 确保导入正确
 from services.battle_service import BattleService
+from .client_manager import ClientManager, PRIORITY_NORMAL, normalize_priority
+from .async_runtime import AsyncBattleRuntime, GREENLET_AVAILABLE, run_blocking
+from .battle_queue import (
+    create_battle_queue,
+    get_fleet_config,
+    is_durable_queue_enabled,
+    make_tenant,
+)
+from .result_committer import create_result_committer
+from . import metrics
+from config.config import Config
 
 # 导入装饰器
 from .decorator import DebugDecorator, settings
@@ -26,14 +52,6 @@ from .decorator import DebugDecorator, settings
 logger = logging.getLogger("BattleManager")
 
 
-try:
-    import psutil
-
-    PSUTIL_AVAILABLE = True
-except ImportError:
-    PSUTIL_AVAILABLE = False
-
-
 def calculate_optimal_threads():
     """根据CPU核心数计算最佳线程数量"""
     cpu_count = multiprocessing.cpu_count()
@@ -43,60 +61,91 @@ def calculate_optimal_threads():
 
 
 MAX_CONCURRENT_BATTLES = calculate_optimal_threads()  # 默认最大并发对战数
+DEFAULT_BATTLE_QUEUE_MAX_SIZE = 100  # 默认等待队列长度，可由 BATTLE_QUEUE_MAX_SIZE 配置
+DEFAULT_BATTLE_DURATION_SECONDS = 300  # 尚无完成记录时用于估算ETA的单局时长
+REMOTE_STATUS_POLL_SECONDS = 5  # 持久化队列下 wait_for_any 向数据库核对对战状态的间隔
 
 
-# 添加自适应线程控制类
-class AdaptiveThreadPool:
-    """自适应线程池控制器"""
-
-    def __init__(self, initial_threads, min_threads=4, max_threads=32):
-        self.current_max_threads = initial_threads
-        self.min_threads = min_threads
-        self.max_threads = max_threads
-        self.active_threads = 0
-        self.last_adjustment_time = time.time()
+class BattleQueueFullError(Exception):
+    """对战队列已满，无法接纳新的对战。调用方应返回 HTTP 429 并带上 Retry-After"""
 
-    def adjust_thread_limit(self):
-        """根据系统负载调整线程限制"""
-        if not PSUTIL_AVAILABLE:
-            return
-
-        # 限制调整频率
-        current_time = time.time()
-        if current_time - self.last_adjustment_time < 30:  # 至少30秒一次调整
-            return
+    def __init__(self, queue_size: int, max_queue_size: int, retry_after: int):
+        self.queue_size = queue_size
+        self.max_queue_size = max_queue_size
+        self.retry_after = retry_after
+        super().__init__(
+            f"对战队列已满 ({queue_size}/{max_queue_size})，请在 {retry_after} 秒后重试"
+        )
 
-        self.last_adjustment_time = current_time
+    def to_dict(self) -> dict:
+        return {
+            "success": False,
+            "busy": True,
+            "message": str(self),
+            "queue_size": self.queue_size,
+            "max_queue_size": self.max_queue_size,
+            "retry_after": self.retry_after,
+        }
 
-        # 获取系统负载
-        cpu_usage = psutil.cpu_percent(interval=0.5)
-        memory_percent = psutil.virtual_memory().percent
 
-        # 根据负载调整线程数
-        if cpu_usage > 75 or memory_percent > 80:  # 高负载，减少线程
-            self._decrease_threads()
-        elif cpu_usage < 30 and memory_percent < 60:  # 低负载，增加线程
-            self._increase_threads()
+class AIMDConcurrencyController:
+    """
+    并发对战数控制器（加性增、乘性减）
+    对战的瓶颈是 LLM 服务商的延迟与限流而不是本机 CPU：
+    最近窗口内 askLLM 的 p95 延迟与错误率都低于目标且对战已满载时，上限增加 increase_step；
+    任一超标时上限乘以 decrease_factor
+    """
+
+    def __init__(self, health_provider, max_limit: int, config: dict = None):
+        config = config or {}
+        # health_provider(window_seconds, since) 返回 ClientManager.get_llm_health 的结果
+        self.health_provider = health_provider
+        self.max_limit = max(1, int(config.get("max", max_limit)))
+        self.min_limit = min(self.max_limit, max(1, int(config.get("min", 4))))
+        self.limit = min(
+            self.max_limit,
+            max(self.min_limit, int(config.get("initial", self.max_limit))),
+        )
+        self.target_p95_seconds = float(config.get("target_p95_seconds", 10))
+        self.max_error_rate = float(config.get("max_error_rate", 0.05))
+        self.increase_step = max(1, int(config.get("increase_step", 2)))
+        self.decrease_factor = float(config.get("decrease_factor", 0.7))
+        self.interval_seconds = float(config.get("interval_seconds", 30))
+        self.window_seconds = float(config.get("window_seconds", 120))
+        self.min_samples = int(config.get("min_samples", 20))
+        self.last_adjustment_time = time.monotonic()
+        self.last_health = None
+
+    def adjust(self, saturated: bool) -> bool:
+        """
+        根据最近的 LLM 调用情况调整并发上限，返回上限是否改变
+        saturated: 执行中的对战数是否已达上限（或仍有排队），未满载时不增加上限
+        """
+        # 只统计上次调整之后的调用，避免调整前的样本再次触发调整
+        health = self.health_provider(self.window_seconds, self.last_adjustment_time)
+        self.last_health = health
+        if health is None or health["samples"] < self.min_samples:
+            return False
 
-    def _increase_threads(self):
-        """增加线程数上限"""
-        if self.current_max_threads < self.max_threads:
-            self.current_max_threads = min(
-                self.current_max_threads + 2, self.max_threads
-            )
-            logger.info(f"系统负载低，增加最大线程数至 {self.current_max_threads}")
+        old_limit = self.limit
+        if (
+            health["p95_latency"] > self.target_p95_seconds
+            or health["error_rate"] > self.max_error_rate
+        ):
+            self.limit = max(self.min_limit, int(self.limit * self.decrease_factor))
+        elif saturated:
+            self.limit = min(self.max_limit, self.limit + self.increase_step)
+        else:
+            return False
 
-    def _decrease_threads(self):
-        """减少线程数上限"""
-        if self.current_max_threads > self.min_threads:
-            self.current_max_threads = max(
-                self.current_max_threads - 2, self.min_threads
+        self.last_adjustment_time = time.monotonic()
+        if self.limit != old_limit:
+            logger.info(
+                f"调整并发对战数：{old_limit} -> {self.limit}"
+                f"（p95 {health['p95_latency']:.1f}s，错误率 {health['error_rate']:.1%}，"
+                f"样本 {health['samples']}）"
             )
-            logger.info(f"系统负载高，减少最大线程数至 {self.current_max_threads}")
-
-    def get_max_threads(self):
-        """获取当前最大线程数"""
-        return self.current_max_threads
+        return self.limit != old_limit
 
 
 class BattleManager:
@@ -149,31 +198,93 @@ class BattleManager:
         self.battle_results: Dict[str, Dict] = {}
         self.battle_status: Dict[str, str] = {}
         self.battle_observers: Dict[str, Observer] = {}
+        self.battle_priorities: Dict[str, int] = {}  # 对战的LLM流量优先级
+        self._enqueued_at: Dict[str, float] = {}  # 本进程入队时间，用于统计排队耗时
+        # 对战结束回调 battle_id -> [callback(battle_id, status)]，见 add_done_callback
+        self._done_callbacks: Dict[str, List[Callable[[str, str], None]]] = {}
+        self._done_cond = threading.Condition()
+        # 已开始执行、结果尚未写入数据库的对战；写入后才结束持久化任务并通知等待方
+        self._unsettled: Set[str] = set()
+        # 结果已交给批量写入器的对战，由写入回调结束
+        self._settle_deferred: Set[str] = set()
+        # 持久化队列下对战可能由其他执行进程完成，本进程的 battle_status 不会更新，
+        # wait_for_any 定期向数据库核对这些对战的状态
+        self._poll_remote_statuses = is_durable_queue_enabled()
+        self._next_remote_poll = 0.0
         self.data_dir = os.environ.get("AVALON_DATA_DIR", "./data")
 
         # 添加线程控制信号量
         self._shutdown_event = threading.Event()
         self._thread_lock = threading.Lock()
-
-        # 修改：限制队列大小为100
-        self.battle_queue = Queue(maxsize=100)
+        # 已从队列取出、尚未处理完的对战数，用于停机时排空
+        self._active_count = 0
+        # 工作线程领取对战前占用的并发槽位数，不超过并发控制器的上限
+        self._slots_in_use = 0
+        self._active_cond = threading.Condition()
+
+        # 有界等待队列，满时 start_battle 立即拒绝而不是阻塞调用方
+        self.max_queue_size = int(
+            Config._yaml_config.get(
+                "BATTLE_QUEUE_MAX_SIZE", DEFAULT_BATTLE_QUEUE_MAX_SIZE
+            )
+        )
+        self.async_runtime = None  # 见下方 ASYNC_BATTLE_RUNTIME
+        # 默认为进程内队列；启用 DURABLE_BATTLE_QUEUE 后为数据库持久化队列
+        self.battle_queue = create_battle_queue(
+            self.battle_service, self.max_queue_size, stats_provider=self._runner_stats
+        )
+        # 启用 BATTLE_RESULT_COMMITTER 后对战结果由单个线程批量写入数据库
+        self.result_committer = create_result_committer(self.battle_service)
+        self._avg_battle_seconds = float(
+            Config._yaml_config.get(
+                "BATTLE_DEFAULT_DURATION_SECONDS", DEFAULT_BATTLE_DURATION_SECONDS
+            )
+        )  # 单局耗时的指数滑动平均，用于估算ETA
         self.worker_threads = []
 
-        # 添加自适应线程池控制
-        self.thread_pool = AdaptiveThreadPool(
-            initial_threads=max_concurrent_battles,
-            min_threads=4,
-            max_threads=max_concurrent_battles,
+        # 可选的异步运行时：所有对局共享一个事件循环线程，不再按并发数启动工作线程
+        async_config = Config._yaml_config.get("ASYNC_BATTLE_RUNTIME") or {}
+        if async_config.get("enabled"):
+            if GREENLET_AVAILABLE:
+                self.async_runtime = AsyncBattleRuntime(
+                    self._process_battle,
+                    max_concurrent_battles=int(
+                        async_config.get("max_concurrent_battles", 2000)
+                    ),
+                    blocking_workers=int(async_config.get("blocking_workers", 32)),
+                    player_workers=int(async_config.get("player_workers", 64)),
+                )
+            else:
+                logger.warning("未安装 greenlet，无法启用异步对战运行时，使用线程池")
+
+        # 按 LLM 延迟与错误率调整同时执行的对战数，工作线程数为其上限
+        self.concurrency_controller = AIMDConcurrencyController(
+            self._get_llm_health,
+            max_limit=(
+                self.async_runtime.max_concurrent_battles
+                if self.async_runtime is not None
+                else self.max_concurrent_battles
+            ),
+            config=Config._yaml_config.get("BATTLE_CONCURRENCY"),
         )
 
-        # 启动工作线程池
-        self._start_worker_threads()
+        if self.async_runtime is not None:
+            # 单个分发线程把队列中的对战交给异步运行时
+            dispatcher = threading.Thread(
+                target=self._async_dispatcher, name="BattleDispatcher", daemon=True
+            )
+            dispatcher.start()
+            self.worker_threads.append(dispatcher)
+        else:
+            # 启动工作线程池
+            self._start_worker_threads()
 
         # 添加监控线程
         self.monitor_thread = threading.Thread(
             target=self._monitor_system_load, daemon=True, name="LoadMonitor"
         )
         self.monitor_thread.start()
+        metrics.register_collector(self._collect_metrics)
 
         os.makedirs(self.data_dir, exist_ok=True)
         logger.info(
@@ -207,59 +318,195 @@ class BattleManager:
         while not self._shutdown_event.is_set():
             try:
                 # 使用超时，以便线程能够定期检查关闭信号
-                battle_id, participant_data = self.battle_queue.get(timeout=1.0)
+                battle_id, participant_data = self._take_from_queue(timeout=1.0)
                 try:
                     logger.info(f"工作线程开始处理对战 {battle_id}")
-                    self._execute_battle(battle_id, participant_data)
-                except Exception as e:
-                    logger.exception(f"处理对战 {battle_id} 时发生异常: {str(e)}")
-                    # 确保对战状态被标记为错误
-                    self.battle_status[battle_id] = "error"
-                    self.battle_results[battle_id] = {
-                        "error": f"处理对战任务时发生异常: {str(e)}"
-                    }
-                    self.battle_service.mark_battle_as_error(
-                        battle_id, {"error": f"对战任务处理异常: {str(e)}"}
-                    )
+                    self._process_battle(battle_id, participant_data)
                 finally:
                     self.battle_queue.task_done()
-                    logger.info(f"完成对战 {battle_id} 处理")
             except queue.Empty:  # 使用queue.Empty
-                # 队列为空，继续等待
+                # 队列为空或并发已达上限，继续等待
                 continue
 
-    def _adjust_worker_threads(self, target_count):
-        """根据目标线程数调整工作线程数量"""
-        with self._thread_lock:
-            current_count = len(self.worker_threads)
-
-            # 移除不活跃线程
-            self.worker_threads = [t for t in self.worker_threads if t.is_alive()]
-
-            if len(self.worker_threads) < target_count:
-                # 需要增加线程
-                for i in range(len(self.worker_threads), target_count):
-                    thread = threading.Thread(
-                        target=self._battle_worker,
-                        name=f"BattleWorker-{i}",
-                        daemon=True,
-                    )
-                    thread.start()
-                    self.worker_threads.append(thread)
-                    logger.info(
-                        f"已增加工作线程 {thread.name}，当前线程数: {len(self.worker_threads)}"
-                    )
+    def _take_from_queue(self, timeout: float):
+        """
+        占用一个并发槽位后从等待队列取出一个对战并记录其优先级
+        并发已达上限或队列为空时抛出 queue.Empty；槽位由 _process_battle 结束时释放
+        """
+        deadline = time.time() + timeout
+        with self._active_cond:
+            while self._slots_in_use >= self.concurrency_controller.limit:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise queue.Empty
+                self._active_cond.wait(remaining)
+            self._slots_in_use += 1
 
-            # 注意：不主动终止线程，而是让它们自然结束
-            # 当线程池缩小时，多余的线程会在处理完当前任务后自动退出
+        try:
+            battle_id, participant_data, priority, _ = self.battle_queue.get(
+                timeout=max(0.0, deadline - time.time())
+            )
+        except BaseException:
+            self._release_slot(active=False)
+            raise
+        with self._active_cond:
+            self._active_count += 1
+        self.battle_priorities[battle_id] = priority
+        enqueued_at = self._enqueued_at.pop(battle_id, None)
+        if enqueued_at is not None:
+            metrics.observe(
+                "avalon_battle_queue_wait_seconds", time.time() - enqueued_at
+            )
+        return battle_id, participant_data
 
-    def start_battle(
-        self, battle_id: str, participant_data: List[Dict[str, str]]
-    ) -> bool:
+    def _release_slot(self, active: bool = True):
+        with self._active_cond:
+            self._slots_in_use -= 1
+            if active:
+                self._active_count -= 1
+            self._active_cond.notify_all()
+
+    def _async_dispatcher(self):
+        """分发线程：从队列获取对战任务，交给异步运行时执行（运行时满载时阻塞）"""
+        while not self._shutdown_event.is_set():
+            try:
+                battle_id, participant_data = self._take_from_queue(timeout=1.0)
+            except queue.Empty:
+                continue
+            try:
+                logger.info(f"分发对战 {battle_id} 到异步运行时")
+                self.async_runtime.submit(battle_id, participant_data)
+            finally:
+                self.battle_queue.task_done()
+
+    def _process_battle(self, battle_id: str, participant_data: List[Dict[str, str]]):
+        """执行一个对战任务，未捕获的异常统一标记为错误（线程池与异步运行时共用）"""
+        try:
+            prepare_start = time.time()
+            prepared = self._prepare_battle(battle_id)
+            self._observe_phase("prepare", prepare_start)
+            if prepared:
+                self._run_battle_task(battle_id, participant_data)
+        finally:
+            self._release_slot()
+
+    def _observe_phase(self, phase: str, start_time: float):
+        metrics.observe(
+            "avalon_battle_phase_seconds", time.time() - start_time, phase=phase
+        )
+
+    def _collect_metrics(self):
+        """写入指标快照前采样本进程的队列与并发状态"""
+        metrics.set_gauge("avalon_battle_queue_depth", self.battle_queue.qsize())
+        metrics.set_gauge("avalon_battles_resident", self._active_count)
+        metrics.set_gauge(
+            "avalon_battle_concurrency_limit", self.concurrency_controller.limit
+        )
+
+    def _run_battle_task(self, battle_id: str, participant_data: List[Dict[str, str]]):
+        start_time = time.time()
+        with self._done_cond:
+            self._unsettled.add(battle_id)
+        try:
+            self._execute_battle(battle_id, participant_data)
+            if self.battle_status.get(battle_id) == "completed":
+                # 只用正常完成的对局更新平均耗时
+                elapsed = time.time() - start_time
+                self._avg_battle_seconds = (
+                    0.9 * self._avg_battle_seconds + 0.1 * elapsed
+                )
+        except Exception as e:
+            logger.exception(f"处理对战 {battle_id} 时发生异常: {str(e)}")
+            # 确保对战状态被标记为错误
+            self.battle_status[battle_id] = "error"
+            self.battle_results[battle_id] = {
+                "error": f"处理对战任务时发生异常: {str(e)}"
+            }
+            self._record_result(
+                "error", battle_id, {"error": f"对战任务处理异常: {str(e)}"}
+            )
+        finally:
+            run_blocking(self._publish_battle_logs, battle_id)
+            with self._done_cond:
+                deferred = battle_id in self._settle_deferred
+                self._settle_deferred.discard(battle_id)
+            if not deferred:
+                run_blocking(self._settle_battle, battle_id)
+            logger.info(f"完成对战 {battle_id} 处理")
+
+    def _settle_battle(self, battle_id: str, recorded: bool = True):
         """
-        将对战添加到队列中等待处理
-        返回：是否成功加入队列
+        对战结果已写入数据库（或无需写入）：结束持久化任务、计数并通知等待方。
+        启用批量写入时由写入回调调用，保证任务结束前结果已经提交，进程在写入前退出时任务会被重新执行
+        """
+        succeeded = recorded and self.battle_status.get(battle_id) == "completed"
+        error = None
+        if not recorded:
+            error = "对战结果写入数据库失败"
+        elif not succeeded:
+            error = str((self.battle_results.get(battle_id) or {}).get("error", ""))
+        try:
+            self.battle_queue.finish(battle_id, succeeded, error)
+        except Exception as e:
+            logger.error(f"结束对战 {battle_id} 的队列任务失败: {str(e)}")
+        metrics.inc(
+            "avalon_battles_finished_total",
+            status=self.battle_status.get(battle_id, "unknown"),
+        )
+        with self._done_cond:
+            self._unsettled.discard(battle_id)
+        self._notify_done(battle_id)
+
+    def _publish_battle_logs(self, battle_id: str):
+        """
+        多节点部署时把本机的对局日志复制到 BATTLE_FLEET.shared_log_dir，
+        使 web 进程（DATA_DIR 指向共享目录）能读取其他节点执行的对局
+        """
+        shared_dir = get_fleet_config().get("shared_log_dir")
+        if not shared_dir:
+            return
+        target = os.path.join(shared_dir, battle_id)
+        # 裁判日志写在 data_dir，观察者快照写在 DATA_DIR，两者可能不同
+        source_dirs = {
+            os.path.abspath(os.path.join(self.data_dir, battle_id)),
+            os.path.abspath(
+                os.path.join(Config._yaml_config.get("DATA_DIR", "./data"), battle_id)
+            ),
+        }
+        for source in source_dirs:
+            if source == os.path.abspath(target) or not os.path.isdir(source):
+                continue
+            try:
+                shutil.copytree(source, target, dirs_exist_ok=True)
+            except Exception as e:
+                logger.error(f"复制对战 {battle_id} 日志到共享目录失败: {str(e)}")
+
+    def _prepare_battle(self, battle_id: str) -> bool:
+        """
+        执行前的幂等检查：对战可能是重启后从持久化队列恢复的，或已被取消
+        已结束的对战不再执行；由其他进程入队的对战在本进程补建观察者
         """
+        status = run_blocking(self.battle_service.get_battle_status, battle_id)
+        if status in ["completed", "error", "cancelled"]:
+            logger.info(f"对战 {battle_id} 状态为 {status}，跳过执行")
+            run_blocking(self.battle_queue.finish, battle_id, True)
+            self.battles.pop(battle_id, None)
+            self.battle_priorities.pop(battle_id, None)
+            self.battle_status[battle_id] = status
+            self._notify_done(battle_id)
+            return False
+        if not run_blocking(self.battle_queue.mark_running, battle_id):
+            logger.warning(f"对战 {battle_id} 的租约已被其他进程接管，跳过执行")
+            self.battle_priorities.pop(battle_id, None)
+            return False
+
+        self.battles[battle_id] = True
+        self.battle_status[battle_id] = "waiting"
+        if battle_id not in self.battle_observers:
+            self.battle_observers[battle_id] = self._create_observer(battle_id)
+        return True
+
+    def _create_observer(self, battle_id: str) -> Observer:
         battle_observer = Observer(battle_id)
 
         # 装饰器
@@ -268,7 +515,27 @@ class BattleManager:
             dec = DebugDecorator(battle_id)
             battle_observer = dec.decorate_instance(battle_observer)
 
-        self.battle_observers[battle_id] = battle_observer
+        return battle_observer
+
+    def start_battle(
+        self,
+        battle_id: str,
+        participant_data: List[Dict[str, str]],
+        priority=PRIORITY_NORMAL,
+        owner_id=None,
+        ranking_id=None,
+    ) -> bool:
+        """
+        将对战添加到队列中等待处理
+        priority: 对战优先级（PRIORITY_HIGH/NORMAL/LOW），随GameHelper传递到client获取
+        owner_id / ranking_id: 公平调度的租户，用户发起的对战传 owner_id，自动对战传 ranking_id
+        返回：是否成功加入队列
+        队列已满或正在停机排空时不阻塞：将对战标记为已取消并抛出 BattleQueueFullError
+        """
+        if self._shutdown_event.is_set():
+            self._reject_battle(battle_id, self._make_busy_error())
+
+        self.battle_observers[battle_id] = self._create_observer(battle_id)
 
         self.battle_observers[battle_id].make_snapshot(
             "BattleManager", (0, "adding battle to queue")
@@ -348,9 +615,29 @@ class BattleManager:
             return False
 
         # 添加到队列 - 使用补全后的参与者数据
-        self.battle_queue.put((battle_id, enhanced_participant_data))
+        self.battle_priorities[battle_id] = normalize_priority(priority)
         self.battle_status[battle_id] = "waiting"
         self.battles[battle_id] = True  # 标记为有效对战，但不再存储线程对象
+        try:
+            priority = self.battle_priorities[battle_id]
+            tenant = make_tenant(owner_id, ranking_id)
+            self._enqueued_at[battle_id] = time.time()
+            self.battle_queue.put_nowait(
+                (battle_id, enhanced_participant_data, priority, tenant)
+            )
+        except queue.Full:
+            self._enqueued_at.pop(battle_id, None)
+            self._reject_battle(battle_id, self._make_busy_error())
+        except Exception as e:
+            logger.error(f"对战 {battle_id} 加入队列失败: {str(e)}")
+            self._enqueued_at.pop(battle_id, None)
+            self.battle_priorities.pop(battle_id, None)
+            self.battles.pop(battle_id, None)
+            self.battle_status[battle_id] = "error"
+            self.battle_service.mark_battle_as_error(
+                battle_id, {"error": f"加入队列失败: {str(e)}"}
+            )
+            return False
 
         logger.info(
             f"对战 {battle_id} 已加入队列，当前队列大小: {self.battle_queue.qsize()}"
@@ -361,16 +648,30 @@ class BattleManager:
         )
         return True
 
+    def _reject_battle(self, battle_id: str, busy_error: BattleQueueFullError):
+        """拒绝无法接纳的对战：标记为已取消并抛出 busy_error"""
+        logger.warning(f"对战 {battle_id} 无法加入队列：{busy_error}")
+        self.battle_priorities.pop(battle_id, None)
+        self.battles.pop(battle_id, None)
+        self.battle_status[battle_id] = "cancelled"
+        self.battle_service.mark_battle_as_cancelled(
+            battle_id, {"cancellation_reason": f"系统繁忙：{busy_error}"}
+        )
+        self._notify_done(battle_id)
+        raise busy_error
+
     def _execute_battle(self, battle_id: str, participant_data: List[Dict[str, str]]):
         """
         执行对战的核心逻辑
-        由工作线程调用，不直接暴露给外部
+        由工作线程或异步运行时调用，不直接暴露给外部
+        阻塞的数据库与文件操作通过 run_blocking 执行，异步运行时下不会阻塞事件循环
         """
         battle_observer = self.battle_observers.get(battle_id)
+        phase, phase_start = "setup", time.time()
 
         try:
             # 1. 更新状态为 playing
-            if not self.battle_service.mark_battle_as_playing(battle_id):
+            if not run_blocking(self.battle_service.mark_battle_as_playing, battle_id):
                 self.battle_status[battle_id] = "error"
                 self.battle_results[battle_id] = {
                     "error": "无法更新数据库状态为 playing"
@@ -397,18 +698,22 @@ class BattleManager:
                 user_id = p_data.get("user_id")
                 ai_code_id = p_data.get("ai_code_id")
                 if user_id and ai_code_id:
-                    full_path = self.battle_service.get_ai_code_path(ai_code_id)
+                    full_path = run_blocking(
+                        self.battle_service.get_ai_code_path, ai_code_id
+                    )
                     if full_path:
                         player_index = participant_data.index(p_data) + 1
                         player_code_paths[player_index] = full_path
 
-            # 3. 初始化裁判
-            referee = AvalonReferee(
+            # 3. 初始化裁判（会导入AI模块并写日志文件）
+            referee = run_blocking(
+                AvalonReferee,
                 battle_id=battle_id,
                 participant_data=participant_data,  # 传递参与者数据列表
                 config={
                     "data_dir": self.data_dir,
                     "player_code_paths": player_code_paths,
+                    "priority": self.battle_priorities.get(battle_id, PRIORITY_NORMAL),
                 },  # 配置字典
                 observer=battle_observer,  # 观察者对象
                 battle_service=self.battle_service,  # 服务对象
@@ -421,38 +726,43 @@ class BattleManager:
                 referee = dec.decorate_instance(referee)
 
             # 4. 运行游戏
+            self._observe_phase(phase, phase_start)
+            phase, phase_start = "game", time.time()
             result_data = referee.run_game()
+            self._observe_phase(phase, phase_start)
+            phase, phase_start = "finalize", time.time()
 
             # 5. 记录内存结果
             self.battle_results[battle_id] = result_data
 
+            # 租约已失效时对战已由其他进程重新执行，放弃写入结果，避免重复计算ELO
+            if not run_blocking(self.battle_queue.confirm_lease, battle_id):
+                logger.warning(f"对战 {battle_id} 的租约已失效，放弃写入结果")
+                self.battle_status[battle_id] = "cancelled"
+                return
+
             # 检查结果是否正常完成
             if "error" not in result_data and result_data.get("winner") is not None:
                 # 正常完成
                 self.battle_status[battle_id] = "completed"
-                self.get_snapshots_archive(battle_id)  # 保存快照
+                run_blocking(self.get_snapshots_archive, battle_id)  # 保存快照
                 self.battle_service.log_info(
                     f"对战 {battle_id} 结果已保存到 {self.data_dir}"
                 )
 
                 # 更新数据库
-                if self.battle_service.mark_battle_as_completed(battle_id, result_data):
-                    self.battle_service.log_info(f"对战 {battle_id} 完成，结果已处理")
-                else:
-                    self.battle_service.log_error(
-                        f"对战 {battle_id} 完成，但结果处理或数据库更新失败"
-                    )
+                self._record_result("completed", battle_id, result_data)
             else:
                 # 非正常完成
                 self.battle_service.log_info(
                     f"对战 {battle_id} 非正常结束，保持原状态，结果已记录"
                 )
-                self.get_snapshots_archive(battle_id)
+                run_blocking(self.get_snapshots_archive, battle_id)
 
                 # 错误处理
                 if "error" in result_data:
                     self.battle_status[battle_id] = "error"
-                    self.battle_service.mark_battle_as_error(battle_id, result_data)
+                    self._record_result("error", battle_id, result_data)
                 else:
                     self.battle_service.log_info(
                         f"对战 {battle_id} 非正常结束，但未发现错误，保持原状态"
@@ -467,12 +777,15 @@ class BattleManager:
             self.battle_status[battle_id] = "error"
             error_result = {"error": f"对战执行失败: {str(e)}"}
             self.battle_results[battle_id] = error_result
-            self.battle_service.mark_battle_as_error(battle_id, error_result)
+            self._record_result("error", battle_id, error_result)
 
         finally:
+            if phase == "finalize":
+                self._observe_phase(phase, phase_start)
             # 清理
             if battle_id in self.battles:
                 del self.battles[battle_id]
+            self.battle_priorities.pop(battle_id, None)
             self.battle_service.log_info(f"对战 {battle_id} 处理完成")
             # 确保线程退出前清理所有资源
             try:
@@ -494,19 +807,207 @@ class BattleManager:
             except Exception as cleanup_e:
                 logger.warning(f"Error during thread cleanup: {cleanup_e}")
 
+    def _record_result(self, kind: str, battle_id: str, result_data: dict):
+        """
+        写入对战结果（kind 为 "completed" 或 "error"）
+        启用批量写入时交给写入线程后立即返回，否则在当前对局中直接提交
+        """
+        if self.result_committer is not None:
+            with self._done_cond:
+                self._settle_deferred.add(battle_id)
+            self.result_committer.submit(
+                kind,
+                battle_id,
+                result_data,
+                callback=lambda succeeded: self._on_result_recorded(
+                    kind, battle_id, succeeded, settle=True
+                ),
+            )
+            return
+        if kind == "completed":
+            succeeded = run_blocking(
+                self.battle_service.mark_battle_as_completed, battle_id, result_data
+            )
+        else:
+            succeeded = run_blocking(
+                self.battle_service.mark_battle_as_error, battle_id, result_data
+            )
+        self._on_result_recorded(kind, battle_id, succeeded)
+
+    def _on_result_recorded(
+        self, kind: str, battle_id: str, succeeded: bool, settle: bool = False
+    ):
+        if kind == "completed":
+            if succeeded:
+                self.battle_service.log_info(f"对战 {battle_id} 完成，结果已处理")
+            else:
+                self.battle_service.log_error(
+                    f"对战 {battle_id} 完成，但结果处理或数据库更新失败"
+                )
+        if settle:
+            self._settle_battle(battle_id, recorded=succeeded)
+
+    def _runner_stats(self) -> dict:
+        """随持久化队列心跳上报到 battle_runners 表的容量信息"""
+        return {
+            "capacity": self._get_capacity(),
+            "active_battles": self._active_count,
+            "status": "draining" if self._shutdown_event.is_set() else "active",
+        }
+
+    def _get_capacity(self) -> int:
+        """当前可同时执行的对战数（并发控制器的上限）"""
+        return max(1, self.concurrency_controller.limit)
+
+    def _get_llm_health(self, window_seconds: float, since: float = None):
+        """本进程 ClientManager 统计的 askLLM 延迟与错误率，尚未创建时返回 None"""
+        client_manager = ClientManager._instance
+        if client_manager is None or not getattr(client_manager, "_initialized", False):
+            return None
+        return client_manager.get_llm_health(window_seconds, since)
+
+    def _estimate_wait_seconds(self, position: int) -> int:
+        """估算排在第 position 位的对战开始执行前需等待的秒数"""
+        rounds = math.ceil(position / self._get_capacity())
+        return int(rounds * self._avg_battle_seconds)
+
+    def _make_busy_error(self) -> BattleQueueFullError:
+        # 队列满时，大约每 平均耗时/并发数 秒空出一个位置
+        retry_after = max(1, math.ceil(self._avg_battle_seconds / self._get_capacity()))
+        return BattleQueueFullError(
+            self.battle_queue.qsize(), self.max_queue_size, retry_after
+        )
+
+    def check_admission(self, count: int = 1):
+        """
+        检查等待队列是否还能容纳 count 场对战，不能时抛出 BattleQueueFullError
+        调用方可在创建数据库记录之前调用，避免产生无法入队的对战
+        """
+        if self._shutdown_event.is_set():
+            raise self._make_busy_error()
+        if self.battle_queue.qsize() + count > self.max_queue_size:
+            raise self._make_busy_error()
+
+    def get_queue_position(self, battle_id: str) -> Optional[dict]:
+        """获取排队中对战的位置（从1开始）与预计开始时间，不在队列中时返回 None"""
+        position = self.battle_queue.position(battle_id)
+        if position is None:
+            return None
+        return {
+            "position": position,
+            "eta_seconds": self._estimate_wait_seconds(position),
+        }
+
     def get_queue_status(self) -> dict:
         """获取队列状态信息"""
-        return {
-            "queue_size": self.battle_queue.qsize(),
+        queue_size = self.battle_queue.qsize()
+        status = {
+            "queue_size": queue_size,
+            "max_queue_size": self.max_queue_size,
+            "accepting": queue_size < self.max_queue_size,
             "worker_threads": len(self.worker_threads),
             "max_concurrent_battles": self.max_concurrent_battles,
+            "concurrency_limit": self.concurrency_controller.limit,
+            "llm_health": self.concurrency_controller.last_health,
+            "avg_battle_seconds": round(self._avg_battle_seconds, 1),
+            "eta_seconds": self._estimate_wait_seconds(queue_size + 1),
         }
+        if self.async_runtime is not None:
+            status.update(self.async_runtime.get_status())
+        runners = self.battle_queue.get_runners()
+        if runners:
+            # 多节点部署时汇总所有在线执行进程的容量
+            status["runners"] = runners
+            status["fleet_capacity"] = sum(r["capacity"] for r in runners)
+            status["fleet_active_battles"] = sum(r["active_battles"] for r in runners)
+        return status
 
     # 以下方法保持不变
     def get_battle_status(self, battle_id: str) -> Optional[str]:
         """获取对战状态 (优先从内存获取)"""
         return self.battle_status.get(battle_id)
 
+    def _is_battle_done(self, battle_id: str) -> bool:
+        if battle_id in self._unsettled:
+            return False
+        return self.battle_status.get(battle_id) not in ("waiting", "playing")
+
+    def add_done_callback(self, battle_id: str, callback: Callable[[str, str], None]):
+        """
+        注册对战结束（完成、出错或取消）时的回调 callback(battle_id, status)
+        对战已结束时立即调用；否则由结束该对战的工作线程调用，回调应尽快返回
+        """
+        with self._done_cond:
+            if not self._is_battle_done(battle_id):
+                self._done_callbacks.setdefault(battle_id, []).append(callback)
+                return
+        callback(battle_id, self.battle_status.get(battle_id))
+
+    def wait_for_any(self, battle_ids: List[str], timeout: float = None) -> List[str]:
+        """
+        阻塞直到 battle_ids 中至少一场对战结束或超时，返回已结束的对战ID
+        （状态不再是 waiting/playing，本进程不认识的对战也视为已结束）
+        持久化队列下每 REMOTE_STATUS_POLL_SECONDS 秒向数据库核对一次，发现由其他执行进程结束的对战
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            with self._done_cond:
+                finished = [b for b in battle_ids if self._is_battle_done(b)]
+                if finished or not battle_ids:
+                    return finished
+                now = time.time()
+                if deadline is not None and now >= deadline:
+                    return []
+                wait = None if deadline is None else deadline - now
+                if self._poll_remote_statuses:
+                    poll_in = max(0.0, self._next_remote_poll - now)
+                    wait = poll_in if wait is None else min(wait, poll_in)
+                if wait is None or wait > 0:
+                    self._done_cond.wait(wait)
+                    continue
+            self._sync_remote_statuses(battle_ids)
+
+    def _sync_remote_statuses(self, battle_ids: List[str]):
+        """
+        持久化队列下向数据库核对本进程没有在执行的未结束对战：
+        由其他执行进程完成的对战更新本地状态并通知等待方
+        """
+        self._next_remote_poll = time.time() + REMOTE_STATUS_POLL_SECONDS
+        with self._done_cond:
+            candidates = [
+                b
+                for b in battle_ids
+                if b not in self._unsettled and not self._is_battle_done(b)
+            ]
+        if not candidates:
+            return
+        statuses = run_blocking(self.battle_service.get_battle_statuses, candidates)
+        if statuses is None:
+            return
+        for battle_id in candidates:
+            # 数据库中已不存在的对战视为已取消
+            status = statuses.get(battle_id, "cancelled")
+            if status in ("waiting", "playing"):
+                continue
+            with self._done_cond:
+                if battle_id in self._unsettled or self._is_battle_done(battle_id):
+                    continue
+                self.battle_status[battle_id] = status
+            logger.info(f"对战 {battle_id} 已由其他执行进程结束，状态为 {status}")
+            self._notify_done(battle_id)
+
+    def _notify_done(self, battle_id: str):
+        """对战结束：唤醒 wait_for_any 并调用已注册的回调"""
+        with self._done_cond:
+            callbacks = self._done_callbacks.pop(battle_id, [])
+            self._done_cond.notify_all()
+        status = self.battle_status.get(battle_id)
+        for callback in callbacks:
+            try:
+                callback(battle_id, status)
+            except Exception as e:
+                logger.error(f"对战 {battle_id} 的结束回调出错: {str(e)}")
+
     def get_snapshots_queue(self, battle_id: str) -> List[Dict[str, Any]]:
         """获取并清空游戏快照队列"""
         battle_observer = self.battle_observers.get(battle_id)
@@ -566,47 +1067,63 @@ class BattleManager:
         # 更新内存状态
         self.battle_status[battle_id] = "cancelled"
         self.battle_results[battle_id] = cancel_data
+        self._notify_done(battle_id)
 
         logger.info(f"对战 {battle_id} 已成功取消：{reason}")
         return True
 
     def _monitor_system_load(self):
-        """监控系统负载并调整线程池大小"""
-        while True:
+        """定期根据 LLM 调用的延迟与错误率调整并发对战数"""
+        while not self._shutdown_event.is_set():
             try:
-                self.thread_pool.adjust_thread_limit()
-                # 动态调整工作线程数量
-                current_max = self.thread_pool.get_max_threads()
-                if current_max != self.max_concurrent_battles:
-                    old_max = self.max_concurrent_battles
-                    self.max_concurrent_battles = current_max
-                    logger.info(
-                        f"调整最大并发对战数：{old_max} -> {self.max_concurrent_battles}"
-                    )
-
-                    # 调整实际工作线程数量
-                    self._adjust_worker_threads(self.max_concurrent_battles)
-
-                # 定期清理已结束的线程
-                if len(self.worker_threads) > self.max_concurrent_battles:
-                    with self._thread_lock:
-                        self.worker_threads = [
-                            t for t in self.worker_threads if t.is_alive()
-                        ]
-                    logger.info(f"清理后的工作线程数量: {len(self.worker_threads)}")
-
-                time.sleep(60)  # 每分钟检查一次
+                controller = self.concurrency_controller
+                saturated = (
+                    self._active_count >= controller.limit
+                    or self.battle_queue.qsize() > 0
+                )
+                if controller.adjust(saturated):
+                    with self._active_cond:
+                        # 上限提高时唤醒等待槽位的工作线程
+                        self._active_cond.notify_all()
+                self._shutdown_event.wait(controller.interval_seconds)
             except Exception as e:
-                logger.error(f"监控系统负载时出错: {str(e)}")
-                time.sleep(120)  # 出错时延长休眠时间
+                logger.error(f"调整并发对战数时出错: {str(e)}")
+                self._shutdown_event.wait(120)  # 出错时延长休眠时间
+
+    def drain(self, timeout: float = None) -> bool:
+        """
+        停止领取新的对战，等待已取出的对战执行完毕（独立执行进程收到 SIGTERM 时调用）
+        返回是否在超时前全部结束；持久化队列中尚未领取的对战保留给其他或下次启动的执行进程
+        """
+        logger.info("对战管理器开始排空，不再接受新的对战...")
+        self._shutdown_event.set()
+        deadline = None if timeout is None else time.time() + timeout
+        with self._active_cond:
+            while self._active_count > 0:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    logger.warning(f"排空超时，仍有 {self._active_count} 场对战在执行")
+                    return False
+                self._active_cond.wait(remaining)
+        if self.result_committer is not None:
+            remaining = None if deadline is None else max(0, deadline - time.time())
+            if not self.result_committer.flush(remaining):
+                return False
+        logger.info(
+            f"对战管理器已排空，队列中剩余 {self.battle_queue.qsize()} 场对战未执行"
+        )
+        return True
 
     def shutdown(self):
         """优雅关闭对战管理器"""
         logger.info("正在关闭对战管理器...")
         self._shutdown_event.set()
 
-        # 等待所有任务完成
+        # 等待所有任务完成（持久化队列只等待本进程已领取的任务）
         self.battle_queue.join()
+        self.battle_queue.shutdown()
+        if self.result_committer is not None:
+            self.result_committer.shutdown()
 
         # 等待所有线程结束
         for thread in self.worker_threads:
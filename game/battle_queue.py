@@ -0,0 +1,508 @@
+"""
+对战等待队列 - BattleManager 使用的两种队列实现
+
+MemoryBattleQueue: 进程内队列，进程重启后排队中的对战全部丢失（默认）
+DurableBattleQueue: 基于 battle_jobs 表的持久化队列，多个进程共享，
+    任务通过原子 UPDATE 领取并持有租约，持有进程定期心跳续约；
+    进程崩溃或重启后租约过期，任务会被重新入队并由任意进程继续执行
+
+两者的接口一致，队列元素为 (battle_id, participant_data, priority, tenant)。
+
+公平调度：租户为发起对战的用户 "user:<id>"，或自动对战所属排行榜 "ranking:<id>"。
+MemoryBattleQueue 中每个 (优先级, 租户) 一个子队列，按加权差额轮询（DRR）出队，
+新出现的租户先于持续积压的租户得到服务，少量手动对战不必排在上千场自动对战之后；
+DurableBattleQueue 在所有节点范围内优先领取 执行中任务数/权重 最小的租户的任务。
+两者都会跳过执行中对战数已达上限的租户。
+
+多节点部署：多台机器上的执行进程（battle_runner.py）指向同一个数据库即可共享队列，
+每个进程在 battle_runners 表中登记并随租约续约上报容量与心跳；
+某个节点宕机后其租约过期，任务由其他节点重新领取。
+本地可用同一个 SQLite 文件启动多个执行进程测试（各自使用不同的 --socket-path 与 --lock-path）。
+
+config.yaml 配置示例：
+
+DURABLE_BATTLE_QUEUE:
+  enabled: false        # 开启后使用持久化队列，重启不会丢弃排队中的对战
+  lease_seconds: 60     # 租约时长，持有进程每 1/3 租约时长续约一次
+  poll_interval: 1.0    # 空闲时轮询数据库的间隔（秒）
+  max_attempts: 3       # 任务因租约过期被重新执行的次数上限，超过后对战标记为 error
+
+BATTLE_FAIRNESS:
+  weights:                    # 各优先级租户每轮可出队的对战数
+    high: 4
+    normal: 2
+    low: 1
+  max_running_per_user: 8     # 每个用户同时执行的对战上限，0 表示不限制
+  max_running_per_ranking: 0  # 每个排行榜的自动对战同时执行的上限，0 表示不限制
+
+BATTLE_FLEET:
+  runner_ttl_seconds: 180       # 超过该时间未心跳的执行进程视为离线
+  runner_retention_seconds: 86400  # 离线超过该时间的执行进程登记被删除（每小时检查一次）
+  shared_log_dir: /mnt/avalon   # 可选，对局结束后把日志复制到该目录（web 进程的 DATA_DIR）
+"""
+
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config.config import Config
+from .client_manager import PRIORITY_NAMES
+
+logger = logging.getLogger("BattleQueue")
+
+RUNNER_PRUNE_INTERVAL_SECONDS = 3600  # 清理离线执行进程登记的间隔
+
+
+def get_durable_queue_config() -> dict:
+    return Config._yaml_config.get("DURABLE_BATTLE_QUEUE") or {}
+
+
+def is_durable_queue_enabled() -> bool:
+    return bool(get_durable_queue_config().get("enabled"))
+
+
+def get_fleet_config() -> dict:
+    return Config._yaml_config.get("BATTLE_FLEET") or {}
+
+
+DEFAULT_PRIORITY_WEIGHTS = {"high": 4, "normal": 2, "low": 1}
+
+
+def get_fairness_config() -> dict:
+    """
+    公平调度参数：weights 为 优先级数值 -> 权重，
+    max_running_per_user / max_running_per_ranking 为 0 时不限制
+    """
+    config = Config._yaml_config.get("BATTLE_FAIRNESS") or {}
+    weights = dict(DEFAULT_PRIORITY_WEIGHTS)
+    weights.update(config.get("weights") or {})
+    return {
+        "weights": {
+            PRIORITY_NAMES[name]: max(1, int(weight))
+            for name, weight in weights.items()
+            if name in PRIORITY_NAMES
+        },
+        "max_running_per_user": int(config.get("max_running_per_user", 8)),
+        "max_running_per_ranking": int(config.get("max_running_per_ranking", 0)),
+    }
+
+
+def make_tenant(owner_id=None, ranking_id=None) -> str:
+    """用户发起的对战按用户计，自动对战按排行榜计"""
+    if owner_id is not None:
+        return f"user:{owner_id}"
+    return f"ranking:{ranking_id or 0}"
+
+
+def _tenant_limit(tenant: str, fairness: dict) -> int:
+    if tenant.startswith("user:"):
+        return fairness["max_running_per_user"]
+    if tenant.startswith("ranking:"):
+        return fairness["max_running_per_ranking"]
+    return 0
+
+
+def create_battle_queue(
+    battle_service, maxsize: int, stats_provider: Callable[[], dict] = None
+):
+    """
+    根据配置创建对战等待队列
+    stats_provider: 返回 {"capacity", "active_battles", "status"}，持久化队列随心跳上报
+    """
+    config = get_durable_queue_config()
+    if config.get("enabled"):
+        lease_seconds = int(config.get("lease_seconds", 60))
+        return DurableBattleQueue(
+            battle_service,
+            maxsize,
+            lease_seconds=lease_seconds,
+            poll_interval=float(config.get("poll_interval", 1.0)),
+            max_attempts=int(config.get("max_attempts", 3)),
+            stats_provider=stats_provider,
+            runner_ttl_seconds=int(
+                get_fleet_config().get("runner_ttl_seconds", lease_seconds * 3)
+            ),
+            runner_retention_seconds=int(
+                get_fleet_config().get("runner_retention_seconds", 86400)
+            ),
+            fairness=get_fairness_config(),
+        )
+    return MemoryBattleQueue(maxsize, fairness=get_fairness_config())
+
+
+class MemoryBattleQueue:
+    """
+    进程内的有界公平等待队列
+    每个 (优先级, 租户) 一个子队列：新租户先进入 _new_tenants，用完本轮额度后
+    移到 _old_tenants 队尾并按权重补充额度（差额轮询）；执行中对战数达到上限的租户暂时跳过
+    """
+
+    def __init__(self, maxsize: int, fairness: dict = None):
+        self.maxsize = maxsize
+        self.fairness = fairness or get_fairness_config()
+        self.mutex = threading.Lock()
+        self.not_empty = threading.Condition(self.mutex)
+        self._tenant_queues: Dict[Tuple[int, str], deque] = {}
+        self._deficits: Dict[Tuple[int, str], int] = {}
+        self._new_tenants = deque()
+        self._old_tenants = deque()
+        self._queued_battles: Dict[str, Tuple[int, str]] = {}  # 排队中的对战 -> 子队列
+        self._running = defaultdict(int)  # 租户 -> 已取出尚未结束的对战数
+        self._taken: Dict[str, str] = {}  # 已取出尚未结束的对战 -> 租户
+
+    def _weight(self, key: Tuple[int, str]) -> int:
+        return self.fairness["weights"].get(key[0], 1)
+
+    def _at_limit(self, key: Tuple[int, str]) -> bool:
+        limit = _tenant_limit(key[1], self.fairness)
+        return bool(limit) and self._running[key[1]] >= limit
+
+    def put_nowait(self, item):
+        """加入对应租户的子队列，排队数已达上限时抛出 queue.Full"""
+        battle_id, participant_data, priority, tenant = item
+        with self.mutex:
+            if len(self._queued_battles) >= self.maxsize:
+                raise queue.Full
+            key = (priority, tenant)
+            if key not in self._tenant_queues:
+                self._tenant_queues[key] = deque()
+                self._deficits[key] = self._weight(key)
+                self._new_tenants.append(key)
+            self._tenant_queues[key].append(item)
+            self._queued_battles[battle_id] = key
+            self.not_empty.notify()
+
+    def _select(self) -> Optional[Tuple[int, str]]:
+        """按差额轮询选出下一个出队的子队列，没有可出队的子队列时返回 None"""
+        for tenants in (self._new_tenants, self._old_tenants):
+            skipped = 0
+            while skipped < len(tenants):
+                key = tenants[0]
+                if not self._tenant_queues[key]:
+                    # 子队列已空，租户下次入队时重新作为新租户
+                    tenants.popleft()
+                    del self._tenant_queues[key]
+                    del self._deficits[key]
+                    continue
+                if self._at_limit(key):
+                    tenants.rotate(-1)
+                    skipped += 1
+                    continue
+                if self._deficits[key] > 0:
+                    self._deficits[key] -= 1
+                    return key
+                # 本轮额度用完：补充额度并移到 _old_tenants 队尾
+                tenants.popleft()
+                self._deficits[key] += self._weight(key)
+                self._old_tenants.append(key)
+                skipped = 0
+        return None
+
+    def get(self, timeout: float = None):
+        """取出下一个对战，超时仍没有可出队的对战时抛出 queue.Empty"""
+        deadline = None if timeout is None else time.time() + timeout
+        with self.not_empty:
+            while True:
+                key = self._select() if self._queued_battles else None
+                if key is not None:
+                    break
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise queue.Empty
+                self.not_empty.wait(remaining)
+            item = self._tenant_queues[key].popleft()
+            battle_id, tenant = item[0], item[3]
+            del self._queued_battles[battle_id]
+            self._running[tenant] += 1
+            self._taken[battle_id] = tenant
+            return item
+
+    def task_done(self):
+        # 租户的执行中计数由 finish() 减少
+        pass
+
+    def qsize(self) -> int:
+        with self.mutex:
+            return len(self._queued_battles)
+
+    def position(self, battle_id: str) -> Optional[int]:
+        """
+        估算的排队位置（从1开始），不在队列中时返回 None
+        按各租户轮流出队估算：本对战出队前，其他租户最多各出队 轮数×权重 场
+        """
+        with self.mutex:
+            key = self._queued_battles.get(battle_id)
+            if key is None:
+                return None
+            index = next(
+                i
+                for i, item in enumerate(self._tenant_queues[key])
+                if item[0] == battle_id
+            )
+            rounds = index // self._weight(key) + 1
+            ahead = sum(
+                min(len(items), rounds * self._weight(other))
+                for other, items in self._tenant_queues.items()
+                if other != key
+            )
+            return ahead + index + 1
+
+    def finish(self, battle_id: str, succeeded: bool, error: str = None):
+        """对战结束，释放所属租户的执行名额"""
+        with self.mutex:
+            tenant = self._taken.pop(battle_id, None)
+            if tenant is not None:
+                self._running[tenant] -= 1
+                if not self._running[tenant]:
+                    del self._running[tenant]
+                self.not_empty.notify_all()
+
+    def join(self):
+        """等待已取出的对战执行完毕"""
+        with self.not_empty:
+            while self._taken:
+                self.not_empty.wait()
+
+    # 进程内队列没有租约，以下方法只为与 DurableBattleQueue 保持接口一致
+    def mark_running(self, battle_id: str) -> bool:
+        return True
+
+    def confirm_lease(self, battle_id: str) -> bool:
+        return True
+
+    def get_runners(self) -> List[dict]:
+        return []
+
+    def shutdown(self):
+        pass
+
+
+class DurableBattleQueue:
+    """基于数据库 battle_jobs 表的持久化等待队列"""
+
+    def __init__(
+        self,
+        battle_service,
+        maxsize: int,
+        lease_seconds: int = 60,
+        poll_interval: float = 1.0,
+        max_attempts: int = 3,
+        stats_provider: Callable[[], dict] = None,
+        runner_ttl_seconds: int = 180,
+        fairness: dict = None,
+        runner_retention_seconds: int = 86400,
+    ):
+        self.battle_service = battle_service
+        self.maxsize = maxsize
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.stats_provider = stats_provider
+        self.runner_ttl_seconds = runner_ttl_seconds
+        # 每个执行进程启动时登记一行，离线超过 runner_retention_seconds 的登记由租约线程定期删除
+        self.runner_retention_seconds = max(
+            runner_ttl_seconds, runner_retention_seconds
+        )
+        self._next_prune_at = 0.0
+        self.fairness = fairness or get_fairness_config()
+        # 租约持有者标识：主机名 + 进程号 + 随机后缀（防止进程号复用），同时作为执行进程登记ID
+        self.hostname = socket.gethostname()
+        self.owner = f"{self.hostname}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+        self._owned = set()  # 本进程持有租约的对战ID
+        self._owned_cond = threading.Condition()
+        # 同一进程内同时只有一个线程访问数据库领取任务，空闲时按 poll_interval 限制轮询频率
+        self._claim_lock = threading.Lock()
+        self._next_poll_at = 0.0
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+
+        self._lease_thread = threading.Thread(
+            target=self._maintain_leases, daemon=True, name="BattleJobLease"
+        )
+        self._lease_thread.start()
+        logger.info(
+            f"持久化对战队列已启用，持有者：{self.owner}，租约时长：{lease_seconds} 秒"
+        )
+
+    def put_nowait(self, item):
+        """
+        写入持久化队列，排队数已达上限时抛出 queue.Full
+        上限为所有进程共享的软限制，并发入队时可能略微超出
+        """
+        battle_id, participant_data, priority, tenant = item
+        if self.qsize() >= self.maxsize:
+            raise queue.Full
+        if not self.battle_service.enqueue_battle_job(
+            battle_id, participant_data, priority, tenant
+        ):
+            raise RuntimeError(f"对战 {battle_id} 无法写入持久化队列")
+        self._wakeup.set()
+
+    def get(self, timeout: float = None):
+        """按租户公平地领取一个任务并获得租约，超时仍无任务时抛出 queue.Empty"""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            job = self._try_claim()
+            if job is not None:
+                with self._owned_cond:
+                    self._owned.add(job["battle_id"])
+                return (
+                    job["battle_id"],
+                    job["participant_data"],
+                    job["priority"],
+                    job["tenant"],
+                )
+
+            wait_seconds = self.poll_interval
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise queue.Empty
+                wait_seconds = min(wait_seconds, remaining)
+            self._wakeup.wait(wait_seconds)
+
+    def _try_claim(self) -> Optional[dict]:
+        with self._claim_lock:
+            now = time.time()
+            if now < self._next_poll_at and not self._wakeup.is_set():
+                return None
+            self._wakeup.clear()
+            job = self.battle_service.claim_battle_job(
+                self.owner, self.lease_seconds, **self.fairness
+            )
+            if job is None:
+                self._next_poll_at = now + self.poll_interval
+            else:
+                logger.info(
+                    f"领取对战 {job['battle_id']}（第 {job['attempts']} 次尝试）"
+                )
+            return job
+
+    def task_done(self):
+        # 任务的完成由 finish() 记录到数据库
+        pass
+
+    def qsize(self) -> int:
+        """所有进程共享的排队任务数"""
+        return self.battle_service.count_queued_battle_jobs()
+
+    def position(self, battle_id: str) -> Optional[int]:
+        return self.battle_service.get_battle_job_position(battle_id)
+
+    def mark_running(self, battle_id: str) -> bool:
+        """开始执行前确认租约，返回 False 时任务已被其他进程接管，不应执行"""
+        if self.battle_service.mark_battle_job_running(battle_id, self.owner):
+            return True
+        self._release(battle_id)
+        return False
+
+    def confirm_lease(self, battle_id: str) -> bool:
+        """
+        写入对战结果前续约并确认租约仍归本进程所有，
+        避免租约过期后被重新执行的同一对战重复写入结果
+        """
+        owned = self.battle_service.heartbeat_battle_jobs(
+            self.owner, [battle_id], self.lease_seconds
+        )
+        if owned is None:
+            # 数据库暂不可用，后续写入结果时同样会失败，交由其处理
+            return True
+        return battle_id in owned
+
+    def finish(self, battle_id: str, succeeded: bool, error: str = None):
+        """记录任务结束并释放租约"""
+        try:
+            self.battle_service.finish_battle_job(
+                battle_id, self.owner, succeeded, error
+            )
+        finally:
+            self._release(battle_id)
+
+    def _release(self, battle_id: str):
+        with self._owned_cond:
+            self._owned.discard(battle_id)
+            self._owned_cond.notify_all()
+
+    def join(self):
+        """等待本进程持有的任务执行完毕，排队中的任务保留在数据库中"""
+        with self._owned_cond:
+            while self._owned:
+                self._owned_cond.wait()
+
+    def _report_runner(self, status: str = None):
+        """在 battle_runners 表中上报本进程的容量、正在执行的对战数与心跳"""
+        stats = self.stats_provider() if self.stats_provider else {}
+        with self._owned_cond:
+            active_battles = stats.get("active_battles", len(self._owned))
+        self.battle_service.heartbeat_battle_runner(
+            self.owner,
+            self.hostname,
+            os.getpid(),
+            int(stats.get("capacity", 0)),
+            int(active_battles),
+            status or stats.get("status", "active"),
+        )
+
+    def get_runners(self) -> List[dict]:
+        """所有在线执行进程的登记信息"""
+        return self.battle_service.get_battle_runners(self.runner_ttl_seconds)
+
+    def _maintain_leases(self):
+        """后台线程：为持有的任务续约、上报心跳，并回收其他进程遗留的过期任务"""
+        interval = max(1.0, self.lease_seconds / 3)
+        while True:
+            try:
+                self._report_runner()
+            except Exception as e:
+                logger.error(f"上报执行进程心跳时出错: {str(e)}")
+            if self._stop_event.wait(interval):
+                return
+            try:
+                with self._owned_cond:
+                    battle_ids = list(self._owned)
+                if battle_ids:
+                    owned = self.battle_service.heartbeat_battle_jobs(
+                        self.owner, battle_ids, self.lease_seconds
+                    )
+                    if owned is not None and len(owned) < len(battle_ids):
+                        logger.warning(
+                            f"以下对战的租约已失效：{set(battle_ids) - owned}"
+                        )
+
+                requeued, _ = self.battle_service.requeue_expired_battle_jobs(
+                    self.max_attempts
+                )
+                if requeued:
+                    self._wakeup.set()
+            except Exception as e:
+                logger.error(f"维护任务租约时出错: {str(e)}")
+            self._prune_runners()
+
+    def _prune_runners(self):
+        """按 RUNNER_PRUNE_INTERVAL_SECONDS 的低频率删除长期离线的执行进程登记"""
+        now = time.time()
+        if now < self._next_prune_at:
+            return
+        self._next_prune_at = now + RUNNER_PRUNE_INTERVAL_SECONDS
+        try:
+            pruned = self.battle_service.prune_battle_runners(
+                self.runner_retention_seconds
+            )
+            if pruned:
+                logger.info(f"已删除 {pruned} 个离线执行进程的登记")
+        except Exception as e:
+            logger.error(f"清理执行进程登记时出错: {str(e)}")
+
+    def shutdown(self):
+        self._stop_event.set()
+        try:
+            self._report_runner(status="stopped")
+        except Exception as e:
+            logger.error(f"上报执行进程停止时出错: {str(e)}")
@@ -0,0 +1,198 @@
+"""
+自动对战容量分配 - 在同时运行的多个榜单之间分配全局并发对局数
+
+每个 AutoMatchInstance 原本各自保持至多 parallel_games 局在途对局，多个榜单同时运行时
+容易超出 BattleManager 与 LLM 密钥的承载能力，而某个榜单停下后它的份额又会闲置。
+启用后由 CapacityAllocator 统一分配：
+- 总容量 total_slots 未配置时跟随 BattleManager 当前的并发上限（随 LLM 健康度自适应）；
+- 各榜单上报需求（参赛者不足或暂停时为 0），按权重水位分配：需求小于应得份额的榜单
+  只拿需求量，剩余部分继续按权重分给其他榜单；每个有需求的榜单至少分得 1 局；
+- 榜单停止或需求变化时立即重新计算，其他榜单在下一次循环（至多 DONE_WAIT_TIMEOUT_SECONDS 秒）
+  读取新的份额；份额缩小时不取消在途对局，只是不再补充。
+
+管理员可在后台的自动对战控制中开关分配器、调整总容量与各榜单权重（不写回配置文件）。
+
+config.yaml 配置示例：
+
+AUTOMATCH_CAPACITY:
+  enabled: false           # 默认关闭，各榜单按自身 parallel_games 运行
+  total_slots:             # 全局在途对局上限，留空表示跟随 BattleManager 的并发上限
+  weights:                 # 榜单权重，未列出的榜单为 1
+    21: 3
+"""
+
+import logging
+import math
+import threading
+from time import time
+from typing import Callable, Dict, Optional
+
+from config.config import Config
+
+logger = logging.getLogger("CapacityAllocator")
+
+DEFAULT_WEIGHT = 1.0
+TOTAL_REFRESH_SECONDS = 5  # 跟随 BattleManager 并发上限时的刷新间隔
+FALLBACK_TOTAL_SLOTS = 20  # 无法获取 BattleManager 并发上限时使用
+
+
+def get_capacity_config() -> dict:
+    config = dict(Config._yaml_config.get("AUTOMATCH_CAPACITY") or {})
+    config.setdefault("enabled", False)
+    config.setdefault("total_slots", None)
+    config["weights"] = {
+        int(ranking_id): float(weight)
+        for ranking_id, weight in (config.get("weights") or {}).items()
+    }
+    return config
+
+
+def allocate(total: int, demands: Dict[int, int], weights: Dict[int, float]) -> dict:
+    """
+    按权重水位分配 total 个名额，每个榜单不超过自身需求
+    返回 {ranking_id: 名额}，没有需求的榜单为 0
+    """
+    quotas = {ranking_id: 0 for ranking_id in demands}
+    active = {rid for rid, demand in demands.items() if demand > 0}
+    remaining = max(0, int(total))
+
+    # 先保证每个有需求的榜单至少 1 局（总容量不足时按权重优先）
+    for ranking_id in sorted(active, key=lambda rid: -weights.get(rid, DEFAULT_WEIGHT)):
+        if remaining <= 0:
+            break
+        quotas[ranking_id] = 1
+        remaining -= 1
+    active = {rid for rid in active if quotas[rid] < demands[rid]}
+
+    while active and remaining > 0:
+        weight_sum = sum(weights.get(rid, DEFAULT_WEIGHT) for rid in active)
+        shares = {
+            rid: remaining * weights.get(rid, DEFAULT_WEIGHT) / weight_sum
+            for rid in active
+        }
+        # 需求不超过份额的榜单直接满足，剩余名额下一轮重新按权重分配
+        satisfied = [rid for rid in active if demands[rid] - quotas[rid] <= shares[rid]]
+        if satisfied:
+            for rid in satisfied:
+                remaining -= demands[rid] - quotas[rid]
+                quotas[rid] = demands[rid]
+                active.discard(rid)
+            continue
+        # 所有榜单的需求都超过份额：取整后余数按小数部分从大到小分配
+        floors = {rid: int(math.floor(share)) for rid, share in shares.items()}
+        for rid, value in floors.items():
+            quotas[rid] += value
+        leftover = remaining - sum(floors.values())
+        by_fraction = sorted(active, key=lambda rid: floors[rid] - shares[rid])
+        for rid in by_fraction[:leftover]:
+            quotas[rid] += 1
+        remaining = 0
+    return quotas
+
+
+class CapacityAllocator:
+    """
+    全局对局容量分配器，由 AutoMatchManager 持有，各 AutoMatchInstance 每轮循环上报需求并读取份额
+    """
+
+    def __init__(self, total_provider: Callable[[], int] = None):
+        """
+        total_provider: 未配置 total_slots 时用于获取总容量（如 BattleManager 的并发上限）
+        """
+        config = get_capacity_config()
+        self.enabled = bool(config["enabled"])
+        self.total_slots: Optional[int] = (
+            int(config["total_slots"]) if config["total_slots"] else None
+        )
+        self.weights: Dict[int, float] = config["weights"]
+        self.total_provider = total_provider
+        self._demands: Dict[int, int] = {}
+        self._in_flight: Dict[int, int] = {}
+        self._quotas: Dict[int, int] = {}
+        self._provided_total = FALLBACK_TOTAL_SLOTS
+        self._provided_at = 0.0
+        self._lock = threading.Lock()
+
+    def _total(self) -> int:
+        if self.total_slots is not None:
+            return self.total_slots
+        if self.total_provider is not None and (
+            time() - self._provided_at > TOTAL_REFRESH_SECONDS
+        ):
+            self._provided_at = time()
+            try:
+                self._provided_total = int(self.total_provider())
+            except Exception as e:
+                logger.warning(f"获取 BattleManager 并发上限失败: {str(e)}")
+        return self._provided_total
+
+    def _rebalance(self):
+        self._quotas = allocate(self._total(), self._demands, self.weights)
+
+    def report(self, ranking_id: int, demand: int, in_flight: int = 0) -> int:
+        """上报榜单当前需求与在途对局数，返回该榜单的份额"""
+        with self._lock:
+            changed = self._demands.get(ranking_id) != demand
+            self._demands[ranking_id] = demand
+            self._in_flight[ranking_id] = in_flight
+            if changed or self.total_slots is None:
+                self._rebalance()
+            return self._quotas.get(ranking_id, 0)
+
+    def release(self, ranking_id: int):
+        """榜单停止后释放其份额"""
+        with self._lock:
+            self._demands.pop(ranking_id, None)
+            self._in_flight.pop(ranking_id, None)
+            self._rebalance()
+
+    def configure(
+        self,
+        enabled: Optional[bool] = None,
+        total_slots: Optional[int] = None,
+        follow_battle_manager: bool = False,
+        weights: Optional[Dict[int, float]] = None,
+    ):
+        """
+        在运行时调整分配器
+        follow_battle_manager: 为 True 时清除 total_slots，改为跟随 BattleManager 的并发上限
+        weights: 需要修改的榜单权重，权重不大于 0 的条目恢复为默认值
+        """
+        with self._lock:
+            if enabled is not None:
+                self.enabled = bool(enabled)
+            if follow_battle_manager:
+                self.total_slots = None
+                self._provided_at = 0.0
+            elif total_slots is not None:
+                if int(total_slots) < 1:
+                    raise ValueError("total_slots 必须为正整数")
+                self.total_slots = int(total_slots)
+            for ranking_id, weight in (weights or {}).items():
+                if float(weight) > 0:
+                    self.weights[int(ranking_id)] = float(weight)
+                else:
+                    self.weights.pop(int(ranking_id), None)
+            self._rebalance()
+        logger.info(
+            f"容量分配器已更新: enabled={self.enabled}, total_slots={self.total_slots}, "
+            f"weights={self.weights}"
+        )
+
+    def get_status(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "total_slots": self._total(),
+                "follows_battle_manager": self.total_slots is None,
+                "weights": dict(self.weights),
+                "rankings": {
+                    ranking_id: {
+                        "weight": self.weights.get(ranking_id, DEFAULT_WEIGHT),
+                        "demand": demand,
+                        "quota": self._quotas.get(ranking_id, 0),
+                        "in_flight": self._in_flight.get(ranking_id, 0),
+                    }
+                    for ranking_id, demand in self._demands.items()
+                },
+            }
@@ -8,9 +8,11 @@ from dataclasses import dataclass, field
 from typing import Dict, List, Any, Optional, Tuple
 import logging
 import atexit
-from collections import defaultdict
-from openai import OpenAI
+from collections import defaultdict, deque
+from openai import OpenAI, AsyncOpenAI
 from dotenv import load_dotenv
+from config.config import Config
+from . import metrics
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
@@ -40,7 +42,122 @@ OPENAI_MODEL_NAME_2=
 .......
 
 可以无限增加列表
+
+多节点部署时，各节点共用同一份 .env，可通过本机环境变量限定本节点使用的key，
+使每个节点的配额互不干扰（0 表示无后缀的默认配置）：
+
+AVALON_LLM_KEY_SUFFIXES=1,3,5
+"""
+
+
 """
+config.yaml 中的速率限制配置示例（不配置则不限速）：
+
+LLM_RATE_LIMITS:
+  default:            # 所有client的默认配额
+    rpm: 60           # 每分钟请求数
+    tpm: 60000        # 每分钟token数（按字符数估算，与token统计口径一致）
+  clients:            # 按client_id单独覆盖
+    client_2:
+      rpm: 120
+      tpm: 120000
+  burst_seconds: 10   # 令牌桶容量，相当于多少秒的配额，用于平滑突发流量
+  max_wait_seconds: 60  # 排队等待配额的最长时间
+  cooldown_seconds: 5   # 收到429后该client的冷却时间（无Retry-After时使用）
+
+LLM_PRIORITY:
+  reserved_fraction: 0.2  # 为高优先级流量预留的配额比例（令牌桶与max_active）
+  max_queued: 500         # 排队请求上限，超出时抢占最低优先级的排队请求
+
+LLM_HEDGING:              # 对冲请求：慢请求复制一份发往另一个client，取先返回者
+  enabled: false
+  percentile: 90          # 对冲延迟取该client成功请求延迟的分位数
+  min_samples: 20         # 样本不足时不对冲
+  min_delay: 2            # 对冲延迟下限（秒）
+  max_delay: 15           # 对冲延迟上限（秒）
+  max_fraction: 0.1       # 对冲请求数占总请求数的比例上限
+"""
+
+# LLM流量优先级，数值越小优先级越高
+PRIORITY_HIGH = 0  # 决赛等需要稳定延迟的对局
+PRIORITY_NORMAL = 1  # 常规自动对战
+PRIORITY_LOW = 2  # 用户发起的测试对局
+PRIORITY_NAMES = {"high": PRIORITY_HIGH, "normal": PRIORITY_NORMAL, "low": PRIORITY_LOW}
+
+
+def normalize_priority(priority):
+    """将优先级名称或数值统一转换为数值，无法识别时视为普通优先级"""
+    if isinstance(priority, str):
+        return PRIORITY_NAMES.get(priority.lower(), PRIORITY_NORMAL)
+    if priority in PRIORITY_NAMES.values():
+        return priority
+    return PRIORITY_NORMAL
+
+
+class TokenBucket:
+    """
+    令牌桶，按每分钟配额匀速补充令牌
+    容量只取若干秒的配额，避免配额恢复后所有请求同时涌向服务商
+    """
+
+    def __init__(self, per_minute, burst_seconds=10):
+        self.per_minute = per_minute
+        self.rate = per_minute / 60.0 if per_minute else None  # 每秒补充量
+        # 容量至少为1，保证单个请求总能被满足
+        self.capacity = max(1.0, self.rate * burst_seconds) if self.rate else None
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    @property
+    def unlimited(self):
+        return self.rate is None
+
+    def _refill(self, now):
+        if self.unlimited:
+            return
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated_at = now
+
+    def time_until(self, amount, now, reserve=0.0):
+        """
+        距离可以取出amount个令牌还需等待的秒数，0表示立即可用
+        reserve: 取出后需保留的容量比例（为高优先级预留）
+        """
+        if self.unlimited:
+            return 0.0
+        self._refill(now)
+        # 超过容量的请求只要求桶满即可放行，多出部分以欠账形式记入
+        needed = min(amount + reserve * self.capacity, self.capacity)
+        if self.tokens >= needed:
+            return 0.0
+        return (needed - self.tokens) / self.rate
+
+    def consume(self, amount, now):
+        if self.unlimited:
+            return
+        self._refill(now)
+        self.tokens -= amount
+
+    def refund(self, amount):
+        """按实际用量修正预估值，amount为负数时表示补扣"""
+        if self.unlimited:
+            return
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+    def drain(self, now):
+        """清空令牌（收到429时使用）"""
+        if self.unlimited:
+            return
+        self._refill(now)
+        self.tokens = min(self.tokens, 0.0)
+
+    def snapshot(self, now):
+        if self.unlimited:
+            return None
+        self._refill(now)
+        return {"per_minute": self.per_minute, "available": round(self.tokens, 2)}
 
 
 class ClientManager:
@@ -48,8 +165,7 @@ class ClientManager:
     用于管理游戏中的openai client实例
     该类实现了单例模式，确保在整个游戏中只有一个管理器实例。
     该实例负责创建和管理与OpenAI API的连接。
-    该类使用一个优先队列来存储和管理多个client实例。
-    优先队列按照每个client的使用状态进行排序，以便在需要时快速获取最少使用的client实例。
+    获取client时在配额允许的client中选择当前活跃使用次数最少的一个（见 _select_client）。
     该类还提供了获取和释放client实例的方法，以便在游戏中进行API调用。
     初始化的时候读取多个OPENAI_API_KEY,OPENAI_BASE_URL,OPENAI_MODEL_NAME以创建client实例
     该类还提供了一个方法来获取当前可用的client实例列表。
@@ -60,9 +176,9 @@ class ClientManager:
     _instance = None
     _lock = threading.RLock()
 
-    @dataclass(order=True)
+    @dataclass
     class _ClientItem:
-        """用于在优先队列中存储client的数据类"""
+        """存储一个client及其使用状态、配额的数据类"""
 
         active_count: int = field(default=0)  # 当前活跃使用次数，作为排序依据
         total_count: int = field(default=0, compare=False)  # 累计使用次数
@@ -71,6 +187,15 @@ class ClientManager:
         client_name: str = field(default="", compare=False)  # 客户端名称
         client_model_name: str = field(default="", compare=False)  # 客户端模型名称
         # 不再需要在客户端项中存储时间
+        rpm_bucket: Any = field(default=None, compare=False)  # 每分钟请求数令牌桶
+        tpm_bucket: Any = field(default=None, compare=False)  # 每分钟token数令牌桶
+        cooldown_until: float = field(default=0.0, compare=False)  # 429冷却截止时间
+        api_key: str = field(default="", compare=False, repr=False)
+        base_url: str = field(default="", compare=False)
+        async_client: Any = field(default=None, compare=False)  # 异步运行时使用
+        latencies: Any = field(
+            default_factory=lambda: deque(maxlen=200), compare=False
+        )  # 最近成功请求的延迟（秒）
 
     def __new__(cls, *args, **kwargs):
         """实现单例模式"""
@@ -90,7 +215,6 @@ class ClientManager:
 
         with self._lock:
             logger.info("Initializing client manager")
-            self._clients_heap = []  # 优先队列，存储可用的client
             self._clients_map = {}  # 所有client的字典，键为client_id
 
             # 添加使用时间跟踪
@@ -103,6 +227,31 @@ class ClientManager:
             self._log_write_interval = 10  # 每10次释放操作写入一次文件
             self._log_write_counter = 0
 
+            # 速率限制：按client的令牌桶，配额不足时请求按到达顺序排队
+            self._rate_limits = Config._yaml_config.get("LLM_RATE_LIMITS") or {}
+            self._max_wait_seconds = float(
+                self._rate_limits.get("max_wait_seconds", 60)
+            )
+            self._rate_cond = threading.Condition(self._lock)
+            self._waiters = []  # 等待配额的请求 (优先级, 票据) 小顶堆，堆顶优先
+            self._preempted = set()  # 被高优先级请求抢占的排队票据
+            self._ticket_seq = 0
+
+            # 优先级：低于最高优先级的请求不能使用预留配额
+            priority_config = Config._yaml_config.get("LLM_PRIORITY") or {}
+            self._reserved_fraction = float(
+                priority_config.get("reserved_fraction", 0.2)
+            )
+            self._max_queued = int(priority_config.get("max_queued", 500))
+
+            # 对冲请求配置与预算计数
+            self._hedging = Config._yaml_config.get("LLM_HEDGING") or {}
+            self._request_count = 0
+            self._hedge_count = 0
+
+            # 最近的 askLLM 调用结果 (时间, 耗时, 是否成功)，供对战并发控制器计算延迟与错误率
+            self._llm_outcomes = deque(maxlen=5000)
+
             # 注册退出处理函数
             atexit.register(self._write_logs_on_exit)
 
@@ -121,6 +270,14 @@ class ClientManager:
             )
             self._monitor_thread.start()
 
+    @staticmethod
+    def _get_allowed_key_suffixes():
+        """本节点允许使用的key后缀集合，未设置 AVALON_LLM_KEY_SUFFIXES 时返回 None（不限制）"""
+        raw = os.environ.get("AVALON_LLM_KEY_SUFFIXES", "").strip()
+        if not raw:
+            return None
+        return {int(part) for part in raw.split(",") if part.strip().isdigit()}
+
     def _init_clients(self):
         """初始化client实例，按后缀匹配环境变量创建多个client实例"""
         logger.info("Starting client instances initialization")
@@ -151,11 +308,16 @@ class ClientManager:
                     )
                 # 先尝试加载无后缀的客户端配置
         client_count = 0
+        allowed_suffixes = self._get_allowed_key_suffixes()
+        if allowed_suffixes is not None:
+            logger.info(f"This node only uses key suffixes {sorted(allowed_suffixes)}")
         api_key = os.environ.get("OPENAI_API_KEY")
         base_url = os.environ.get("OPENAI_BASE_URL")
         model_name = os.environ.get("OPENAI_MODEL_NAME")
 
-        if api_key and base_url and model_name:
+        if allowed_suffixes is not None and 0 not in allowed_suffixes:
+            logger.info("Default OpenAI configuration is not assigned to this node")
+        elif api_key and base_url and model_name:
             logger.info(f"Found default OpenAI configuration without suffix")
             try:
                 logger.info(f"Creating default client with model: {model_name}")
@@ -172,7 +334,7 @@ class ClientManager:
                 # 创建client_id
                 client_count += 1
                 client_id = f"client_{client_count}"
-                self._add_client(client_id, new_client, model_name)
+                self._add_client(client_id, new_client, model_name, api_key, base_url)
                 logger.info(
                     f"Successfully created default client, client_id={client_id}"
                 )
@@ -214,6 +376,11 @@ class ClientManager:
                 logger.info(f"No more configurations found after suffix {suffix_num}")
                 break
 
+            if allowed_suffixes is not None and suffix_num not in allowed_suffixes:
+                # 该key分配给其他节点
+                suffix_num += 1
+                continue
+
             try:
                 logger.info(
                     f"Creating client with suffix {suffix_num}, model: {model_name}"
@@ -230,7 +397,7 @@ class ClientManager:
                 # 创建client_id
                 client_count += 1
                 client_id = f"client_{client_count}"
-                self._add_client(client_id, new_client, model_name)
+                self._add_client(client_id, new_client, model_name, api_key, base_url)
                 logger.info(
                     f"Successfully created client with suffix {suffix_num}, client_id={client_id}"
                 )
@@ -245,44 +412,150 @@ class ClientManager:
 
         logger.info(f"Client initialization complete. Created {client_count} clients.")
 
-    def _add_client(self, client_id, client_instance, model_name):
+    def _add_client(
+        self, client_id, client_instance, model_name, api_key="", base_url=""
+    ):
         """将client实例添加到管理器中"""
         with self._lock:
             logger.info(f"Adding client {client_id} with model {model_name} to pool")
 
             # 创建客户端项
+            limits = self._get_client_limits(client_id)
+            burst_seconds = float(self._rate_limits.get("burst_seconds", 10))
             client_item = self._ClientItem(
                 active_count=0,
                 total_count=0,
                 client_id=client_id,
                 client=client_instance,
                 client_model_name=model_name,
+                rpm_bucket=TokenBucket(limits.get("rpm"), burst_seconds),
+                tpm_bucket=TokenBucket(limits.get("tpm"), burst_seconds),
+                api_key=api_key,
+                base_url=base_url,
             )
 
-            # 添加到堆和字典中
-            heapq.heappush(self._clients_heap, client_item)
             self._clients_map[client_id] = client_item
 
             logger.info(
                 f"Client {client_id} added to pool. Pool size now: {len(self._clients_map)}"
             )
 
-    def get_client(self):
+    def _get_client_limits(self, client_id):
+        """合并默认配额与该client的单独配额"""
+        limits = dict(self._rate_limits.get("default") or {})
+        limits.update((self._rate_limits.get("clients") or {}).get(client_id) or {})
+        return limits
+
+    def _select_client(
+        self, estimated_tokens, now, priority=PRIORITY_NORMAL, exclude_client_ids=()
+    ):
+        """
+        在配额允许的client中选出活跃数最少的一个
+        非最高优先级的请求需为高优先级流量保留reserved_fraction的配额
+        返回 (client_item, 0) 或 (None, 最短等待秒数)
+        """
+        reserve = self._reserved_fraction if priority > PRIORITY_HIGH else 0.0
+        min_wait = None
+        candidates = sorted(
+            (
+                item
+                for item in self._clients_map.values()
+                if item.client_id not in exclude_client_ids
+            ),
+            key=lambda x: (x.active_count, x.total_count),
+        )
+        for item in candidates:
+            # 并发上限没有可预测的恢复时间，等待释放时的唤醒
+            max_active = self._get_client_limits(item.client_id).get("max_active")
+            if max_active and item.active_count >= max(
+                1, int(max_active * (1 - reserve))
+            ):
+                continue
+            wait = max(
+                item.cooldown_until - now,
+                item.rpm_bucket.time_until(1, now, reserve),
+                item.tpm_bucket.time_until(estimated_tokens, now, reserve),
+            )
+            if wait <= 0:
+                return item, 0.0
+            if min_wait is None or wait < min_wait:
+                min_wait = wait
+        return None, min_wait
+
+    def get_client(
+        self,
+        estimated_tokens=0,
+        timeout=None,
+        priority=PRIORITY_NORMAL,
+        exclude_client_ids=(),
+    ):
         """
         获取一个client实例
+        estimated_tokens: 本次请求预估消耗的token数，用于TPM配额
+        timeout: 等待配额的最长秒数，默认取配置中的max_wait_seconds
+        priority: 请求优先级，高优先级请求排在低优先级之前
+        exclude_client_ids: 不参与选择的client_id（对冲请求需使用不同的client）
         返回一个元组: (client_instance, client_id, client_model_name)
+        超时、被抢占或没有client时返回 (None, None, None)
         """
         with self._lock:
-            if not self._clients_heap:
+            if not self._clients_map:
                 logger.error("No available OpenAI clients in pool")
                 return None, None, None
 
-            # 取出使用次数最少的client
-            client_item = heapq.heappop(self._clients_heap)
+            if timeout is None:
+                timeout = self._max_wait_seconds
+            deadline = time.monotonic() + timeout
+
+            # 排队等待配额：只有堆顶请求可以取令牌，同优先级内先到先得
+            priority = normalize_priority(priority)
+            self._ticket_seq += 1
+            entry = (priority, self._ticket_seq)
+            heapq.heappush(self._waiters, entry)
+            self._preempt_overflow()
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = None
+                    if entry in self._preempted:
+                        logger.warning(
+                            f"LLM request with priority {priority} preempted by higher priority traffic"
+                        )
+                        return None, None, None
+                    if self._waiters[0] == entry:
+                        client_item, wait = self._select_client(
+                            estimated_tokens, now, priority, exclude_client_ids
+                        )
+                        if client_item is not None:
+                            break
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        if timeout <= 0:
+                            return None, None, None
+                        logger.warning(
+                            f"Timed out after {timeout:.1f}s waiting for LLM rate limit budget "
+                            f"({len(self._waiters)} requests queued)"
+                        )
+                        return None, None, None
+                    self._rate_cond.wait(
+                        remaining if wait is None else min(wait, remaining)
+                    )
+            finally:
+                self._preempted.discard(entry)
+                if entry in self._waiters:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                # 唤醒下一个队首请求
+                self._rate_cond.notify_all()
+
+            # 扣除配额
+            client_item.rpm_bucket.consume(1, now)
+            client_item.tpm_bucket.consume(estimated_tokens, now)
 
             # 增加使用计数
             client_item.active_count += 1
             client_item.total_count += 1
+            self._request_count += 1
 
             # 创建会话ID并记录开始时间
             session_id = str(uuid.uuid4())
@@ -293,14 +566,12 @@ class ClientManager:
                 "client_id": client_item.client_id,
                 "start_time": start_time,
                 "model": client_item.client_model_name,
+                "estimated_tokens": estimated_tokens,
             }
 
             # 添加到客户端活跃会话列表
             self._client_sessions[client_item.client_id].append(session_id)
 
-            # 将client_item放回优先队列
-            heapq.heappush(self._clients_heap, client_item)
-
             logger.info(
                 f"Retrieved client {client_item.client_id} (model: {client_item.client_model_name}). "
                 f"Active count: {client_item.active_count}, Total: {client_item.total_count}, "
@@ -314,8 +585,134 @@ class ClientManager:
                 client_item.client_model_name,
             )
 
-    def release_client(self, client_id_with_session):
-        """释放一个client实例"""
+    def get_async_client(self, client_id_with_session):
+        """获取与该client相同配置的AsyncOpenAI实例（供异步对战运行时使用），按需创建"""
+        client_id = client_id_with_session.split(":", 1)[0]
+        with self._lock:
+            client_item = self._clients_map.get(client_id)
+            if client_item is None:
+                return None
+            if client_item.async_client is None:
+                client_item.async_client = AsyncOpenAI(
+                    api_key=client_item.api_key, base_url=client_item.base_url
+                )
+            return client_item.async_client
+
+    def record_latency(self, client_id_with_session, seconds):
+        """记录一次成功请求的延迟，用于计算对冲延迟"""
+        client_id = client_id_with_session.split(":", 1)[0]
+        with self._lock:
+            client_item = self._clients_map.get(client_id)
+            if client_item is not None:
+                client_item.latencies.append(seconds)
+
+    def record_llm_outcome(self, seconds, succeeded=True, client_id_with_session=None):
+        """
+        记录一次 askLLM 调用（含排队等待配额与对冲）的耗时与结果
+        超时、429 与其他异常都记为失败；未获取到client时 client_id_with_session 为None
+        """
+        with self._lock:
+            self._llm_outcomes.append((time.monotonic(), seconds, succeeded))
+        client = (client_id_with_session or "none").split(":", 1)[0]
+        metrics.observe("avalon_llm_request_seconds", seconds, client=client)
+        metrics.inc(
+            "avalon_llm_requests_total",
+            client=client,
+            status="ok" if succeeded else "error",
+        )
+
+    def get_llm_health(self, window_seconds=120, since=None):
+        """
+        最近 window_seconds 秒内 askLLM 调用的样本数、p95延迟与错误率
+        since: time.monotonic() 时间戳，只统计此后的调用（如并发调整之后）
+        """
+        start = time.monotonic() - window_seconds
+        if since is not None:
+            start = max(start, since)
+        with self._lock:
+            outcomes = [item for item in self._llm_outcomes if item[0] >= start]
+        if not outcomes:
+            return {"samples": 0, "p95_latency": None, "error_rate": 0.0}
+        latencies = sorted(item[1] for item in outcomes)
+        failures = sum(1 for item in outcomes if not item[2])
+        return {
+            "samples": len(outcomes),
+            "p95_latency": latencies[int(round(0.95 * (len(latencies) - 1)))],
+            "error_rate": failures / len(outcomes),
+        }
+
+    def get_hedge_delay(self, client_id_with_session):
+        """
+        获取该client的对冲延迟（延迟分位数，按上下限截断）
+        未开启对冲、只有一个client或样本不足时返回None
+        """
+        if not self._hedging.get("enabled"):
+            return None
+        client_id = client_id_with_session.split(":", 1)[0]
+        with self._lock:
+            client_item = self._clients_map.get(client_id)
+            if client_item is None or len(self._clients_map) < 2:
+                return None
+            samples = sorted(client_item.latencies)
+        if len(samples) < int(self._hedging.get("min_samples", 20)):
+            return None
+        percentile = float(self._hedging.get("percentile", 90))
+        delay = samples[int(round(percentile / 100 * (len(samples) - 1)))]
+        return min(
+            max(delay, float(self._hedging.get("min_delay", 2))),
+            float(self._hedging.get("max_delay", 15)),
+        )
+
+    def has_hedge_budget(self):
+        """对冲请求数是否仍低于总请求数的max_fraction"""
+        with self._lock:
+            max_fraction = float(self._hedging.get("max_fraction", 0.1))
+            return self._hedge_count + 1 <= max_fraction * self._request_count
+
+    def record_hedge(self):
+        """记录一次对冲请求，计数较大时减半，使预算反映近期流量"""
+        with self._lock:
+            self._hedge_count += 1
+            if self._request_count > 10000:
+                self._request_count //= 2
+                self._hedge_count //= 2
+
+    def _preempt_overflow(self):
+        """排队请求超出上限时，抢占优先级最低、到达最晚的排队请求"""
+        while len(self._waiters) > self._max_queued:
+            victim = max(self._waiters)
+            self._waiters.remove(victim)
+            heapq.heapify(self._waiters)
+            self._preempted.add(victim)
+            self._rate_cond.notify_all()
+
+    def report_rate_limited(self, client_id_with_session, retry_after=None):
+        """
+        上报服务商返回的429，清空该client的请求令牌并进入冷却
+        之后的请求会自动等待或改用其他client，而不是立即重试
+        """
+        client_id = client_id_with_session.split(":", 1)[0]
+        with self._lock:
+            client_item = self._clients_map.get(client_id)
+            if client_item is None:
+                return
+            now = time.monotonic()
+            if retry_after is None:
+                retry_after = float(self._rate_limits.get("cooldown_seconds", 5))
+            client_item.rpm_bucket.drain(now)
+            metrics.inc("avalon_llm_rate_limited_total", client=client_id)
+            client_item.cooldown_until = max(
+                client_item.cooldown_until, now + retry_after
+            )
+            logger.warning(
+                f"Client {client_id} rate limited by provider, cooling down for {retry_after:.1f}s"
+            )
+
+    def release_client(self, client_id_with_session, tokens_used=None):
+        """
+        释放一个client实例
+        tokens_used: 本次请求实际消耗的token数，用于修正获取时的预估值
+        """
         with self._lock:
             # 解析client_id和session_id
             try:
@@ -342,6 +739,16 @@ class ClientManager:
                 end_time = time.time()
                 usage_time = end_time - session_data["start_time"]
 
+                # 按实际用量修正TPM配额
+                if tokens_used is not None:
+                    metrics.inc(
+                        "avalon_llm_tokens_total", tokens_used, client=client_id
+                    )
+                    client_item.tpm_bucket.refund(
+                        session_data.get("estimated_tokens", 0) - tokens_used
+                    )
+                    self._rate_cond.notify_all()
+
                 # 从活跃会话列表中移除
                 if session_id in self._client_sessions[client_id]:
                     self._client_sessions[client_id].remove(session_id)
@@ -379,6 +786,7 @@ class ClientManager:
             # 减少活跃使用计数
             if client_item.active_count > 0:
                 client_item.active_count -= 1
+                self._rate_cond.notify_all()
                 logger.info(
                     f"Released client {client_id}. Active count: {client_item.active_count}"
                 )
@@ -494,11 +902,15 @@ class ClientManager:
     def get_client_stats(self):
         """获取所有client的统计信息"""
         with self._lock:
+            now = time.monotonic()
             stats = {
                 client_id: {
                     "active_count": item.active_count,
                     "total_count": item.total_count,
                     "model_name": item.client_model_name,
+                    "rpm": item.rpm_bucket.snapshot(now),
+                    "tpm": item.tpm_bucket.snapshot(now),
+                    "cooling_down": item.cooldown_until > now,
                 }
                 for client_id, item in self._clients_map.items()
             }
@@ -512,10 +924,22 @@ class ClientManager:
             logger.info(f"Total client count: {count}")
             return count
 
+    def _is_available(self, item, now):
+        """client当前是否可以接受新请求：不在429冷却中、未达到并发上限且RPM配额未耗尽"""
+        max_active = self._get_client_limits(item.client_id).get("max_active")
+        if max_active and item.active_count >= max_active:
+            return False
+        return item.cooldown_until <= now and item.rpm_bucket.time_until(1, now) <= 0
+
     def get_available_count(self):
         """获取当前可用的client数量"""
         with self._lock:
-            count = len(self._clients_heap)
+            now = time.monotonic()
+            count = sum(
+                1
+                for item in self._clients_map.values()
+                if self._is_available(item, now)
+            )
             logger.info(f"Available client count: {count}")
             return count
 
@@ -524,7 +948,7 @@ class ClientManager:
         with self._lock:
             logger.info("======== CLIENT MANAGER STATUS ========")
             logger.info(f"Total clients: {len(self._clients_map)}")
-            logger.info(f"Available clients: {len(self._clients_heap)}")
+            logger.info(f"Available clients: {self.get_available_count()}")
 
             # 按照活跃度排序的客户端列表
             sorted_clients = sorted(
@@ -0,0 +1,420 @@
+"""
+运行指标 - 计数器、仪表与直方图，通过 /metrics 以 Prometheus 文本格式输出
+
+每个进程只在内存中累加指标（记录一次指标是一次加锁的字典更新），
+后台线程每 flush_interval 秒把本进程的快照原子写入 METRICS.dir/<pid>_<随机后缀>.json；
+/metrics 读取同一目录下所有进程的快照并汇总，gunicorn 的多个 worker 与独立执行进程
+（battle_runner.py）的指标因此合并在一起：
+- 计数器与直方图求和；已退出进程的快照过期（retention_seconds）后，其累计值并入本机的
+  retired.agg 再删除快照，汇总后的计数器不会因 worker 回收而下降（Prometheus 不会误判为计数器重置）；
+- 仪表只汇总仍存活的进程。
+
+config.yaml 配置示例：
+
+METRICS:
+  enabled: true                # 默认开启
+  dir: ./data/metrics          # 本机所有进程共享的快照目录，默认为 AVALON_DATA_DIR/metrics
+  flush_interval: 5            # 快照写入间隔（秒）
+  retention_seconds: 86400     # 已退出进程的快照保留时长，过期后其累计值并入 retired.agg
+  token:                       # 可选，设置后访问 /metrics 需要 Authorization: Bearer <token>
+"""
+
+import atexit
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from typing import Callable, Dict, List, Tuple
+
+try:
+    import fcntl
+
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+from config.config import Config
+
+logger = logging.getLogger("Metrics")
+
+# 已删除快照的进程的累计值，及合并时使用的文件锁（不以 .json 结尾，不会被当作进程快照读取）
+RETIRED_FILENAME = "retired.agg"
+RETIRED_LOCK_FILENAME = "retired.lock"
+
+# 直方图分桶（秒）
+FAST_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+LLM_BUCKETS = (0.5, 1, 2, 3, 5, 8, 10, 15, 20, 30, 60)
+BATTLE_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+
+# 指标名 -> (类型, 说明, 分桶)
+METRIC_DEFINITIONS = {
+    "avalon_battle_queue_depth": ("gauge", "排队中的对战数", None),
+    "avalon_battles_resident": ("gauge", "已从队列取出、尚未结束的对战数", None),
+    "avalon_battle_concurrency_limit": ("gauge", "当前允许同时执行的对战数", None),
+    "avalon_battle_queue_wait_seconds": (
+        "histogram",
+        "对战从入队到开始执行的等待时间",
+        BATTLE_BUCKETS,
+    ),
+    "avalon_battle_phase_seconds": (
+        "histogram",
+        "对战各阶段耗时（prepare/setup/game/finalize）",
+        BATTLE_BUCKETS,
+    ),
+    "avalon_battles_finished_total": ("counter", "按最终状态统计的对战数", None),
+    "avalon_safe_execute_seconds": (
+        "histogram",
+        "裁判调用玩家代码方法的耗时",
+        FAST_BUCKETS,
+    ),
+    "avalon_llm_request_seconds": (
+        "histogram",
+        "askLLM 单次尝试的耗时（含排队等待配额与对冲）",
+        LLM_BUCKETS,
+    ),
+    "avalon_llm_requests_total": ("counter", "askLLM 尝试次数", None),
+    "avalon_llm_rate_limited_total": ("counter", "服务商返回429的次数", None),
+    "avalon_llm_tokens_total": ("counter", "服务商返回的token用量", None),
+    "avalon_log_write_seconds": ("histogram", "对局日志写入耗时", FAST_BUCKETS),
+    "avalon_log_write_bytes_total": ("counter", "对局日志写入字节数", None),
+}
+
+# 各进程采样的是同一个全局值的 gauge（持久化队列下每个进程的 qsize 都是数据库中的排队总数），
+# 汇总时取最大值而不是求和；单进程执行对战时两者相同
+MAX_AGGREGATED_GAUGES = {"avalon_battle_queue_depth"}
+
+_lock = threading.Lock()
+_counters: Dict[Tuple, float] = defaultdict(float)
+_gauges: Dict[Tuple, float] = {}
+_histograms: Dict[Tuple, list] = {}  # key -> [各分桶计数..., 总和, 样本数]
+_collectors: List[Callable[[], None]] = []
+_flush_thread = None
+_snapshot_path = None
+
+
+def get_metrics_config() -> dict:
+    config = dict(Config._yaml_config.get("METRICS") or {})
+    config.setdefault("enabled", True)
+    config.setdefault(
+        "dir", os.path.join(os.environ.get("AVALON_DATA_DIR", "./data"), "metrics")
+    )
+    config.setdefault("flush_interval", 5)
+    config.setdefault("retention_seconds", 86400)
+    return config
+
+
+_config = get_metrics_config()
+ENABLED = bool(_config["enabled"])
+
+
+def _key(name: str, labels: dict) -> Tuple:
+    return (name,) + tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels):
+    """计数器加 value"""
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] += value
+    _ensure_flushing()
+
+
+def set_gauge(name: str, value: float, **labels):
+    """设置本进程的仪表值"""
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = value
+    _ensure_flushing()
+
+
+def observe(name: str, value: float, **labels):
+    """记录一个直方图样本"""
+    if not ENABLED:
+        return
+    buckets = METRIC_DEFINITIONS[name][2]
+    key = _key(name, labels)
+    index = bisect.bisect_left(buckets, value)
+    with _lock:
+        data = _histograms.get(key)
+        if data is None:
+            data = _histograms[key] = [0] * (len(buckets) + 2)
+        if index < len(buckets):
+            data[index] += 1
+        data[-2] += value
+        data[-1] += 1
+    _ensure_flushing()
+
+
+def observe_log_write(kind: str, seconds: float, size: int):
+    """记录一次对局日志写入"""
+    observe("avalon_log_write_seconds", seconds, kind=kind)
+    inc("avalon_log_write_bytes_total", size, kind=kind)
+
+
+def register_collector(collector: Callable[[], None]):
+    """注册在写入快照前调用的函数，用于采样队列长度等仪表"""
+    _collectors.append(collector)
+    _ensure_flushing()
+
+
+def _ensure_flushing():
+    global _flush_thread
+    if _flush_thread is not None:
+        return
+    with _lock:
+        if _flush_thread is not None:
+            return
+        _flush_thread = threading.Thread(
+            target=_flush_loop, daemon=True, name="MetricsFlush"
+        )
+        _flush_thread.start()
+
+
+def _flush_loop():
+    while True:
+        time.sleep(float(_config["flush_interval"]))
+        flush()
+
+
+def flush():
+    """把本进程的指标快照原子写入共享目录"""
+    global _snapshot_path
+    if not ENABLED or _flush_thread is None:
+        # 本进程尚未记录过任何指标
+        return
+    for collector in list(_collectors):
+        try:
+            collector()
+        except Exception as e:
+            logger.warning(f"采集指标时出错: {str(e)}")
+
+    with _lock:
+        snapshot = {
+            "pid": os.getpid(),
+            "time": time.time(),
+            "counters": [[list(k), v] for k, v in _counters.items()],
+            "gauges": [[list(k), v] for k, v in _gauges.items()],
+            "histograms": [[list(k), list(v)] for k, v in _histograms.items()],
+        }
+    try:
+        os.makedirs(_config["dir"], exist_ok=True)
+        if _snapshot_path is None:
+            _snapshot_path = os.path.join(
+                _config["dir"], f"{os.getpid()}_{uuid.uuid4().hex[:8]}.json"
+            )
+        temp_path = f"{_snapshot_path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f)
+        os.replace(temp_path, _snapshot_path)
+    except Exception as e:
+        logger.warning(f"写入指标快照失败: {str(e)}")
+
+
+def _reset_after_fork():
+    """fork 出的子进程（如 gunicorn worker）从空指标开始，使用自己的快照文件"""
+    global _lock, _flush_thread, _snapshot_path
+    _lock = threading.Lock()
+    _counters.clear()
+    _gauges.clear()
+    _histograms.clear()
+    _collectors.clear()
+    _flush_thread = None
+    _snapshot_path = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+atexit.register(flush)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _load_snapshots() -> List[dict]:
+    snapshots = []
+    directory = _config["dir"]
+    if not os.path.isdir(directory):
+        return snapshots
+    now = time.time()
+    expired = []
+    for filename in os.listdir(directory):
+        if not filename.endswith(".json"):
+            continue
+        path = os.path.join(directory, filename)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        snapshot["alive"] = _pid_alive(snapshot["pid"])
+        if (
+            not snapshot["alive"]
+            and now - snapshot["time"] > _config["retention_seconds"]
+        ):
+            expired.append(path)
+            continue
+        snapshot["path"] = path
+        snapshots.append(snapshot)
+    if expired:
+        _retire_snapshots(expired)
+    retired = _read_retired(directory)
+    # 读取期间可能有其他进程把临近过期的快照并入了 retired.agg，不再重复计入
+    snapshots = [
+        snapshot
+        for snapshot in snapshots
+        if snapshot["alive"] or os.path.exists(snapshot["path"])
+    ]
+    if retired is not None:
+        snapshots.append({**retired, "gauges": [], "alive": False})
+    return snapshots
+
+
+def _read_retired(directory: str):
+    try:
+        with open(
+            os.path.join(directory, RETIRED_FILENAME), "r", encoding="utf-8"
+        ) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"读取已退出进程的指标累计值失败: {str(e)}")
+        return None
+
+
+def _merge_series(target: dict, series: list, histogram: bool):
+    for key, value in series:
+        merged_key = json.dumps(key)
+        if not histogram:
+            target[merged_key] = target.get(merged_key, 0) + value
+            continue
+        merged = target.get(merged_key)
+        if merged is None:
+            target[merged_key] = list(value)
+        elif len(merged) == len(value):
+            target[merged_key] = [a + b for a, b in zip(merged, value)]
+
+
+def _retire_snapshots(paths: List[str]):
+    """
+    把过期快照的计数器与直方图并入 retired.agg 后删除快照。
+    多个进程可能同时渲染 /metrics，合并在文件锁内进行，每个快照只并入一次
+    """
+    directory = _config["dir"]
+    try:
+        with open(os.path.join(directory, RETIRED_LOCK_FILENAME), "a+") as lock_file:
+            if FCNTL_AVAILABLE:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            retired = _read_retired(directory) or {"counters": [], "histograms": []}
+            counters, histograms = {}, {}
+            _merge_series(counters, retired["counters"], histogram=False)
+            _merge_series(histograms, retired["histograms"], histogram=True)
+            folded = []
+            for path in paths:
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        snapshot = json.load(f)
+                except FileNotFoundError:
+                    continue  # 已由其他进程并入
+                except (OSError, ValueError):
+                    continue
+                _merge_series(counters, snapshot["counters"], histogram=False)
+                _merge_series(histograms, snapshot["histograms"], histogram=True)
+                folded.append(path)
+            if not folded:
+                return
+            retired_path = os.path.join(directory, RETIRED_FILENAME)
+            temp_path = f"{retired_path}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(
+                    {
+                        "counters": [[json.loads(k), v] for k, v in counters.items()],
+                        "histograms": [
+                            [json.loads(k), v] for k, v in histograms.items()
+                        ],
+                    },
+                    f,
+                )
+            os.replace(temp_path, retired_path)
+            for path in folded:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+    except Exception as e:
+        logger.warning(f"合并已退出进程的指标快照失败: {str(e)}")
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: List, extra: Tuple = ()) -> str:
+    pairs = [tuple(pair) for pair in labels] + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def render() -> str:
+    """汇总本机所有进程的快照，输出 Prometheus 文本格式"""
+    flush()
+    counters = defaultdict(float)
+    gauges = defaultdict(float)
+    histograms = {}
+    for snapshot in _load_snapshots():
+        for key, value in snapshot["counters"]:
+            counters[tuple(map(tuple, key[1:])), key[0]] += value
+        if snapshot["alive"]:
+            for key, value in snapshot["gauges"]:
+                merged_key = (tuple(map(tuple, key[1:])), key[0])
+                if key[0] in MAX_AGGREGATED_GAUGES:
+                    gauges[merged_key] = max(gauges.get(merged_key, value), value)
+                else:
+                    gauges[merged_key] += value
+        for key, value in snapshot["histograms"]:
+            merged_key = (tuple(map(tuple, key[1:])), key[0])
+            merged = histograms.setdefault(merged_key, [0] * len(value))
+            if len(merged) == len(value):
+                histograms[merged_key] = [a + b for a, b in zip(merged, value)]
+
+    lines = []
+    for name, (metric_type, help_text, buckets) in METRIC_DEFINITIONS.items():
+        if metric_type == "histogram":
+            series = {k: v for k, v in histograms.items() if k[1] == name}
+        else:
+            source = counters if metric_type == "counter" else gauges
+            series = {k: v for k, v in source.items() if k[1] == name}
+        if not series:
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for (labels, _), value in sorted(series.items()):
+            if metric_type != "histogram":
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets, value):
+                cumulative += count
+                le = _format_labels(labels, (("le", bound),))
+                lines.append(f"{name}_bucket{le} {cumulative}")
+            le = _format_labels(labels, (("le", "+Inf"),))
+            lines.append(f"{name}_bucket{le} {value[-1]}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {value[-2]}")
+            lines.append(f"{name}_count{_format_labels(labels)} {value[-1]}")
+    return "\n".join(lines) + "\n"
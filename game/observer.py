@@ -12,6 +12,7 @@ from threading import Lock
 import json
 import os
 from config.config import Config
+from . import metrics
 from copy import deepcopy
 import logging
 
@@ -214,12 +215,15 @@ class Observer:
             archive_data.append(snapshot)
 
             # 安全写入（先写入临时文件，再重命名）
+            write_start = time.time()
             temp_file = f"{self.archive_file_path}.tmp"
             with open(temp_file, "w", encoding="utf-8") as f:
                 json.dump(archive_data, f, ensure_ascii=False)
+                size = f.tell()
 
             # 确保写入完成后再重命名
             os.replace(temp_file, self.archive_file_path)
+            metrics.observe_log_write("archive", time.time() - write_start, size)
 
         except Exception as e:
             logger.error(f"对局 {self.battle_id} 写入快照到归档文件失败: {str(e)}")
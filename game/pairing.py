@@ -0,0 +1,188 @@
+"""
+自动对战配对引擎 - 为排行榜挑选信息量大的7人对局
+
+随机抽样时，ELO 相近的强者可能很多局都碰不到面，排名收敛慢。配对引擎按以下规则组局：
+- 场次最少的参与者作为锚点，保证各参与者的场次接近；
+- 其余玩家从锚点 ELO 附近的候选窗口中挑选，优先选择与已选成员同场次数少的参与者
+  （未充分采样的配对优先），并对 ELO 差距施加惩罚；
+- 座位按各参与者的历史座位分布分配，坐得最少的座位优先。角色由裁判随机分配，期望上均衡。
+
+参与者按 ELO 排序一次（O(n log n)），之后每组一局为 O(log n + window * lineup_size)。
+ELO 不逐局更新：自动对战每隔若干局刷新参与者时（update_participants）整体换成数据库中的最新 ELO。
+模拟对比见 _for_developers/pairing_simulation.py。
+
+config.yaml 配置示例：
+
+AUTOMATCH_PAIRING:
+  strategy: random     # random: 随机抽样（默认）；balanced: 使用配对引擎
+  window: 28           # 锚点附近的候选人数
+  elo_scale: 200       # ELO 差距惩罚的尺度，越大越不在意 ELO 差距
+  pair_weight: 1.0     # 重复配对惩罚的权重
+"""
+
+import bisect
+import heapq
+import random
+from collections import defaultdict
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+from config.config import Config
+
+DEFAULT_LINEUP_SIZE = 7
+
+
+def get_pairing_config() -> dict:
+    config = dict(Config._yaml_config.get("AUTOMATCH_PAIRING") or {})
+    config.setdefault("strategy", "random")
+    config.setdefault("window", 28)
+    config.setdefault("elo_scale", 200)
+    config.setdefault("pair_weight", 1.0)
+    return config
+
+
+def create_pairing_engine(lineup_size: int = DEFAULT_LINEUP_SIZE):
+    """根据配置创建配对引擎，strategy 不是 balanced 时返回 None（使用随机抽样）"""
+    config = get_pairing_config()
+    if config["strategy"] != "balanced":
+        return None
+    return PairingEngine(
+        lineup_size=lineup_size,
+        window=int(config["window"]),
+        elo_scale=float(config["elo_scale"]),
+        pair_weight=float(config["pair_weight"]),
+    )
+
+
+def _pair_key(a, b) -> Tuple:
+    return (a, b) if a < b else (b, a)
+
+
+class PairingEngine:
+    """
+    按 ELO 邻近、配对覆盖与座位均衡组局
+    参与者用可比较、可哈希的键（如 AI 代码ID）表示；引擎只在内存中维护场次、配对与座位计数
+    """
+
+    def __init__(
+        self,
+        lineup_size: int = DEFAULT_LINEUP_SIZE,
+        window: int = 28,
+        elo_scale: float = 200.0,
+        pair_weight: float = 1.0,
+        rng: Optional[random.Random] = None,
+    ):
+        self.lineup_size = lineup_size
+        self.window = max(window, lineup_size)
+        self.elo_scale = elo_scale
+        self.pair_weight = pair_weight
+        self.rng = rng or random.Random()
+
+        self._ratings: Dict[Hashable, float] = {}
+        self._sorted: List[Tuple[float, Hashable]] = []  # (elo, key) 升序
+        self._games: Dict[Hashable, int] = defaultdict(int)
+        self._pairs: Dict[Tuple, int] = defaultdict(int)
+        self._seats: Dict[Hashable, List[int]] = {}
+        # (场次, 随机数, key) 的小顶堆，场次变化后旧条目惰性删除
+        self._heap: List[Tuple[int, float, Hashable]] = []
+
+    def update_participants(
+        self, ratings: Dict[Hashable, float], games: Dict[Hashable, int] = None
+    ):
+        """
+        替换参与者集合及其 ELO；games 为数据库中的已赛场次，只会调高内存中的计数
+        已退出的参与者的配对记录保留，重新加入时继续使用
+        """
+        self._ratings = dict(ratings)
+        self._sorted = sorted((elo, key) for key, elo in self._ratings.items())
+        for key, count in (games or {}).items():
+            if key in self._ratings and count > self._games[key]:
+                self._games[key] = count
+        self._heap = [(self._games[key], self.rng.random(), key) for key in ratings]
+        heapq.heapify(self._heap)
+
+    def __len__(self) -> int:
+        return len(self._ratings)
+
+    def _pop_anchor(self) -> Hashable:
+        while self._heap:
+            games, _, key = heapq.heappop(self._heap)
+            if key in self._ratings and games == self._games[key]:
+                return key
+        raise ValueError("没有可用的参与者")
+
+    def _window_around(self, key: Hashable) -> List[Hashable]:
+        """锚点 ELO 附近的 window 个候选（不含锚点）"""
+        index = bisect.bisect_left(self._sorted, (self._ratings[key], key))
+        start = max(0, index - self.window // 2)
+        end = min(len(self._sorted), start + self.window + 1)
+        start = max(0, end - self.window - 1)
+        return [k for _, k in self._sorted[start:end] if k != key]
+
+    def _score(self, candidate, anchor_elo: float, chosen: List[Hashable]) -> float:
+        # 分数越低越优先：场次少、与已选成员同场少、ELO 接近
+        elo_gap = (self._ratings[candidate] - anchor_elo) / self.elo_scale
+        repeats = sum(self._pairs[_pair_key(candidate, m)] for m in chosen)
+        return (
+            self._games[candidate]
+            + self.pair_weight * repeats
+            + elo_gap * elo_gap
+            + self.rng.random() * 0.5
+        )
+
+    def _assign_seats(self, members: List[Hashable]) -> List[Hashable]:
+        """按历史座位计数贪心分配座位，返回按座位排列的成员"""
+        options = []
+        for key in members:
+            seats = self._seats.get(key) or [0] * self.lineup_size
+            for seat, count in enumerate(seats):
+                options.append((count, self.rng.random(), seat, key))
+        options.sort()
+        lineup = [None] * self.lineup_size
+        placed = set()
+        for _, _, seat, key in options:
+            if lineup[seat] is None and key not in placed:
+                lineup[seat] = key
+                placed.add(key)
+        return lineup
+
+    def next_lineup(self) -> List[Hashable]:
+        """组一局并记录，返回按座位排列的参与者"""
+        if len(self._ratings) < self.lineup_size:
+            raise ValueError(
+                f"参与者不足 ({len(self._ratings)}/{self.lineup_size})，无法组局"
+            )
+        anchor = self._pop_anchor()
+        anchor_elo = self._ratings[anchor]
+        chosen = [anchor]
+        candidates = self._window_around(anchor)
+        while len(chosen) < self.lineup_size:
+            best = min(candidates, key=lambda c: self._score(c, anchor_elo, chosen))
+            candidates.remove(best)
+            chosen.append(best)
+        lineup = self._assign_seats(chosen)
+        self.record(lineup)
+        return lineup
+
+    def next_lineups(self, count: int) -> List[List[Hashable]]:
+        return [self.next_lineup() for _ in range(count)]
+
+    def record(self, lineup: Iterable[Hashable]):
+        """记录一局（按座位排列）的场次、配对与座位"""
+        lineup = list(lineup)
+        for seat, key in enumerate(lineup):
+            self._games[key] += 1
+            self._seats.setdefault(key, [0] * self.lineup_size)[seat] += 1
+            if key in self._ratings:
+                heapq.heappush(self._heap, (self._games[key], self.rng.random(), key))
+        for i, a in enumerate(lineup):
+            for b in lineup[i + 1 :]:
+                self._pairs[_pair_key(a, b)] += 1
+
+    def get_stats(self) -> dict:
+        games = [self._games[key] for key in self._ratings]
+        return {
+            "participants": len(self._ratings),
+            "min_games": min(games) if games else 0,
+            "max_games": max(games) if games else 0,
+            "distinct_pairs": len(self._pairs),
+        }
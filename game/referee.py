@@ -24,11 +24,16 @@ from .observer import Observer
 from .avalon_game_helper import INIT_PRIVA_LOG_DICT
 from .restrictor import RESTRICTED_BUILTINS
 from .avalon_game_helper import GameHelper
+from .client_manager import PRIORITY_NORMAL
+from . import metrics
+from .async_runtime import run_blocking, run_player_code
 from database.models import Battle
 from database.base import db
 from database import (
     get_battle_by_id as db_get_battle_by_id,
 )
+from database.result_summary import ResultSummaryBuilder
+from database.engine import sqlite_database_path
 
 # 配置日志
 logging.basicConfig(
@@ -116,41 +121,14 @@ class BattleStatusChecker:
             except Exception as e:
                 logger.debug(f"无法从battle_manager获取状态: {str(e)}")
 
-            # 方法2: 使用原始SQL查询
-            import sqlite3
-            from os import path
-
-            # 尝试多个可能的数据库位置
-            possible_paths = [
-                "./database.sqlite",
-                "./platform/database.sqlite",
-                "../database.sqlite",
-                "../../database.sqlite",
-                os.path.join(
-                    os.path.dirname(os.path.abspath(__file__)), "../../database.sqlite"
-                ),
-            ]
-
-            db_path = None
-            for p in possible_paths:
-                if path.exists(p):
-                    db_path = p
-                    break
-
-            if not db_path:
+            # 方法2: 使用原始SQL查询，以只读方式打开配置的 SQLite 数据库
+            db_path = sqlite_database_path()
+            if not db_path or not os.path.exists(db_path):
                 logger.warning(f"无法找到数据库文件进行状态检查")
                 return self.last_known_status
 
-            # 连接数据库
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
-
-            # 执行查询
-            cursor.execute("SELECT status FROM battles WHERE id = ?", (self.battle_id,))
-            result = cursor.fetchone()
-
-            # 关闭连接
-            conn.close()
+            # 异步运行时下交给阻塞线程池，等待写锁时不阻塞事件循环
+            result = run_blocking(self._query_database_status, db_path)
 
             if result:
                 self.last_known_status = result[0]
@@ -164,6 +142,21 @@ class BattleStatusChecker:
 
         return self.last_known_status
 
+    def _query_database_status(self, db_path):
+        import sqlite3
+        from pathlib import Path
+
+        # 连接数据库（WAL 下只读连接不阻塞写入；写锁持有期间最多等待 timeout 秒）
+        conn = sqlite3.connect(f"{Path(db_path).as_uri()}?mode=ro", uri=True, timeout=5)
+        try:
+            cursor = conn.cursor()
+            # 执行查询
+            cursor.execute("SELECT status FROM battles WHERE id = ?", (self.battle_id,))
+            return cursor.fetchone()
+        finally:
+            # 关闭连接
+            conn.close()
+
     def should_abort(self):
         """检查对战是否应该中止"""
         status = self.get_battle_status(force=True)  # 强制刷新状态
@@ -205,6 +198,7 @@ class AvalonReferee:
         self.blue_wins = 0  # 蓝方胜利次数
         self.red_wins = 0  # 红方胜利次数
         self.public_log = []  # 公共日志
+        self.result_summary = ResultSummaryBuilder()  # 结算摘要，随公共日志同步累积
         self.leader_index = random.randint(1, PLAYER_COUNT)  # 随机选择初始队长
         # 获取数据目录设置
         self.data_dir = config.get("data_dir", "./data")
@@ -221,7 +215,9 @@ class AvalonReferee:
         )
 
         # 为这个referee创建一个专用的GameHelper实例
-        self.game_helper = GameHelper(data_dir=self.data_dir)
+        self.game_helper = GameHelper(
+            data_dir=self.data_dir, priority=config.get("priority", PRIORITY_NORMAL)
+        )
 
         # 装饰器
         if settings["avalon_game_helper.GameHelper"] == 1:
@@ -1630,7 +1626,14 @@ class AvalonReferee:
     def run_game(self) -> Dict[str, Any]:
         """
         运行游戏，返回游戏结果
+        结果中的 summary 为结算摘要（各玩家错误数与 token 用量、胜负、角色、轮数），
+        结算时直接使用，无需再读取公共日志
         """
+        game_result = self._play_game()
+        return {**game_result, "summary": self.result_summary.build(game_result)}
+
+    def _play_game(self) -> Dict[str, Any]:
+        """运行游戏流程，返回不含结算摘要的游戏结果"""
         logger.info(f"===== Starting Game {self.game_id} =====")
         self.battle_observer.make_snapshot("GameStart", self.game_id)
 
@@ -1914,7 +1917,7 @@ class AvalonReferee:
             return error_result
         finally:
             # 无论游戏如何结束（正常、终止或出错），都执行清理操作
-            self._cleanup_battle_ai_modules()
+            run_blocking(self._cleanup_battle_ai_modules)
             logger.info(f"AI modules for battle {self.game_id} have been cleaned up")
 
     def safe_execute(self, player_id: int, method_name: str, *args, **kwargs):
@@ -1954,6 +1957,7 @@ class AvalonReferee:
                 "critical_player_ERROR", player_id, method_name, error_msg
             )
 
+        start_time = None
         try:
             # 设置当前上下文
             # 1. 设置referee实例的上下文
@@ -1983,8 +1987,12 @@ class AvalonReferee:
             # stdout_capture = StringIO()
             # stderr_capture = StringIO()
             # with redirect_stdout(stdout_capture), redirect_stderr(stderr_capture):
-            result = method(*args, **kwargs)
+            # 异步运行时下玩家代码在单独的线程池中执行，不占用事件循环线程
+            result = run_player_code(method, *args, **kwargs)
             execution_time = time.time() - start_time
+            metrics.observe(
+                "avalon_safe_execute_seconds", execution_time, method=method_name
+            )
             post_context_player_id = self.game_helper.get_current_player_id()
             if post_context_player_id != player_id:
                 error_msg = f"Context player ID changed during execution: expected {player_id}, got {post_context_player_id}"
@@ -2016,6 +2024,12 @@ class AvalonReferee:
         except Exception as e:  # 玩家代码运行过程中报错
             import traceback
 
+            if start_time is not None:
+                metrics.observe(
+                    "avalon_safe_execute_seconds",
+                    time.time() - start_time,
+                    method=method_name,
+                )
             tb_str = traceback.format_exc()
 
             logger.error(
@@ -2035,14 +2049,21 @@ class AvalonReferee:
         logger.debug(f"Logging public event: {event}")
         # 添加到内存中的日志
         self.public_log.append(event)
+        self.result_summary.feed(event)
+
+        # 写入公共日志文件（异步运行时下交给阻塞线程池）
+        run_blocking(self._write_public_log)
 
-        # 写入公共日志文件
+    def _write_public_log(self):
         public_log_file = os.path.join(
             self.data_dir, f"{self.game_id}/public_game_{self.game_id}.json"
         )
         try:
+            write_start = time.time()
             with open(public_log_file, "w", encoding="utf-8") as f:
                 json.dump(self.public_log, f, ensure_ascii=False, indent=2)
+                size = f.tell()
+            metrics.observe_log_write("public", time.time() - write_start, size)
         except Exception as e:
             logger.error(f"Error writing public log: {str(e)}")
 
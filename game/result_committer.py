@@ -0,0 +1,131 @@
+"""
+对战结果批量写入 - 对局结束后，结果交给单个写入线程按批提交
+
+每场对战的结果处理（对战状态、玩家对战记录、GameStats 与 ELO）原本在工作线程中各自提交，
+自动对战负载下这些提交在 SQLite 的写锁上串行，阻塞工作线程。
+启用后工作线程只把结果放入队列即返回；写入线程按到达顺序把一批结果放在一个事务中提交，
+同一排行榜的 ELO 更新顺序与对战完成顺序一致。整批失败时逐场重试。
+
+config.yaml 配置示例：
+
+BATTLE_RESULT_COMMITTER:
+  enabled: false          # 默认在工作线程中逐场提交
+  max_batch_size: 50      # 每个事务最多写入的对战数
+  max_delay_seconds: 0.5  # 收到一场结果后最多等待多久以凑满一批
+"""
+
+import logging
+import queue
+import threading
+import time
+from typing import Callable, Optional
+
+from config.config import Config
+
+logger = logging.getLogger("BattleResultCommitter")
+
+
+def create_result_committer(battle_service) -> Optional["BattleResultCommitter"]:
+    """根据配置创建批量写入器，未启用时返回 None"""
+    config = Config._yaml_config.get("BATTLE_RESULT_COMMITTER") or {}
+    if not config.get("enabled"):
+        return None
+    return BattleResultCommitter(
+        battle_service,
+        max_batch_size=int(config.get("max_batch_size", 50)),
+        max_delay_seconds=float(config.get("max_delay_seconds", 0.5)),
+    )
+
+
+class BattleResultCommitter:
+    """单线程的对战结果批量写入器"""
+
+    def __init__(
+        self, battle_service, max_batch_size: int = 50, max_delay_seconds: float = 0.5
+    ):
+        self.battle_service = battle_service
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_delay_seconds = max_delay_seconds
+        self._queue = queue.Queue()
+        self._pending = 0  # 已提交给写入器、尚未写入数据库的结果数
+        self._pending_cond = threading.Condition()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, daemon=True, name="BattleResultCommitter"
+        )
+        self._thread.start()
+        logger.info(
+            f"对战结果批量写入已启用，每批最多 {self.max_batch_size} 场，最长等待 {max_delay_seconds} 秒"
+        )
+
+    def submit(
+        self,
+        kind: str,
+        battle_id: str,
+        results_data: dict,
+        callback: Callable[[bool], None] = None,
+    ):
+        """
+        提交一场对战的结果，不等待写入
+        kind: "completed" 或 "error"；callback(succeeded) 在写入后由写入线程调用
+        """
+        with self._pending_cond:
+            self._pending += 1
+        self._queue.put((kind, battle_id, results_data, callback))
+
+    def _run(self):
+        while True:
+            try:
+                batch = [self._queue.get(timeout=1.0)]
+            except queue.Empty:
+                if self._stop_event.is_set():
+                    return
+                continue
+
+            deadline = time.time() + self.max_delay_seconds
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._commit(batch)
+
+    def _commit(self, batch: list):
+        try:
+            outcomes = self.battle_service.record_battle_results(
+                [(kind, battle_id, data) for kind, battle_id, data, _ in batch]
+            )
+        except Exception as e:
+            logger.exception(f"写入 {len(batch)} 场对战结果时出错: {str(e)}")
+            outcomes = [False] * len(batch)
+
+        for (_, battle_id, _, callback), succeeded in zip(batch, outcomes):
+            if callback is None:
+                continue
+            try:
+                callback(succeeded)
+            except Exception as e:
+                logger.error(f"对战 {battle_id} 结果写入回调出错: {str(e)}")
+
+        with self._pending_cond:
+            self._pending -= len(batch)
+            self._pending_cond.notify_all()
+
+    def flush(self, timeout: float = None) -> bool:
+        """等待已提交的结果全部写入，返回是否在超时前完成"""
+        deadline = None if timeout is None else time.time() + timeout
+        with self._pending_cond:
+            while self._pending > 0:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    logger.warning(f"仍有 {self._pending} 场对战结果未写入")
+                    return False
+                self._pending_cond.wait(remaining)
+        return True
+
+    def shutdown(self, timeout: float = None):
+        self.flush(timeout)
+        self._stop_event.set()
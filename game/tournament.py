@@ -0,0 +1,462 @@
+"""
+锦标赛调度 - 按轮次安排对局，排名在统计上确定或对局预算用完时自动停止
+
+与开放式的自动对战不同，锦标赛每轮根据当前战绩只为名次未定的参赛者安排对局，全部结束后再安排下一轮：
+- 瑞士轮（参赛者较多时）：每局至多 3 名待定参赛者，其余座位从全体参赛者中随机补位；
+- 循环赛（参赛者较少，如决赛）：每轮全员参赛，用配对引擎让场次、同场次数与座位尽量均衡。
+
+每位参赛者的胜率附带 Wilson 置信区间。
+需要确定晋级线时（advance_ratio），区间已完全落在晋级线一侧的参赛者视为已确定；
+需要完整排名时（决赛），与相邻名次的区间都不重叠视为已确定。
+已确定或达到单人对局上限的参赛者不再作为待定参赛者安排对局，
+全部确定、都达到上限或用完对局预算后停止。
+
+config.yaml 配置示例：
+
+TOURNAMENT:
+  round_robin_max_field: 14   # 参赛者不超过该人数时使用循环赛，否则使用瑞士轮
+  confidence_z: 1.96          # 置信区间的 z 值
+  min_games: 7                # 每位参赛者至少完成的对局数，之前不视为已确定
+  max_games: 2000             # 对局预算（含出错的对局）
+  max_games_per_participant: 60  # 单人对局上限，达到后即使区间仍重叠也不再安排（实力过于接近）
+  advance_ratio: 0.5          # 需要确定的晋级比例；决赛榜单要求完整排名
+"""
+
+import logging
+import math
+import random
+import threading
+from time import sleep, time
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from flask import Flask
+
+from config.config import Config
+from database import (
+    create_battles_bulk,
+    get_active_ai_codes_by_ranking_ids,
+    get_battle_results,
+    mark_battle_as_cancelled,
+    serialized_write,
+)
+from utils.battle_manager_utils import get_battle_manager
+from game.battle_manager import BattleQueueFullError
+from game.client_manager import PRIORITY_NORMAL
+from game.pairing import PairingEngine
+
+logger = logging.getLogger("Tournament")
+
+LINEUP_SIZE = 7
+RED_ROLES = ("Morgana", "Assassin", "Oberon")
+MODE_SWISS = "swiss"
+MODE_ROUND_ROBIN = "round_robin"
+ANCHORS_PER_LINEUP = 3  # 瑞士轮每局安排的待定参赛者人数，其余座位随机补位
+DONE_WAIT_TIMEOUT_SECONDS = 5
+SLEEP_STEP_SECONDS = 0.5  # 等待期间检查是否已停止的间隔
+
+
+def get_tournament_config() -> dict:
+    config = dict(Config._yaml_config.get("TOURNAMENT") or {})
+    config.setdefault("round_robin_max_field", 14)
+    config.setdefault("confidence_z", 1.96)
+    config.setdefault("min_games", 7)
+    config.setdefault("max_games", 2000)
+    config.setdefault("max_games_per_participant", 60)
+    config.setdefault("advance_ratio", 0.5)
+    return config
+
+
+def wilson_interval(score: float, games: int, z: float) -> Tuple[float, float]:
+    """胜率的 Wilson 置信区间，没有对局时为 (0, 1)"""
+    if games <= 0:
+        return 0.0, 1.0
+    p = score / games
+    denominator = 1 + z * z / games
+    center = (p + z * z / (2 * games)) / denominator
+    margin = z * math.sqrt(p * (1 - p) / games + z * z / (4 * games * games))
+    margin /= denominator
+    return max(0.0, center - margin), min(1.0, center + margin)
+
+
+class TournamentScheduler:
+    """
+    锦标赛的轮次安排与战绩统计，不访问数据库
+    参赛者用可比较、可哈希的键（如 AI 代码ID）表示
+    """
+
+    def __init__(
+        self,
+        participants: List[Hashable],
+        mode: str = None,
+        advance_count: Optional[int] = None,
+        z: float = 1.96,
+        min_games: int = 7,
+        max_games: int = 2000,
+        max_games_per_participant: int = 60,
+        round_robin_max_field: int = 14,
+        rng: random.Random = None,
+    ):
+        """
+        mode: MODE_SWISS / MODE_ROUND_ROBIN，None 时按参赛人数选择
+        advance_count: 需要确定的晋级人数，None 表示需要确定完整排名
+        """
+        if len(participants) < LINEUP_SIZE:
+            raise ValueError(f"参赛者不足 ({len(participants)}/{LINEUP_SIZE})")
+        self.participants = list(participants)
+        if mode is None:
+            mode = (
+                MODE_ROUND_ROBIN
+                if len(self.participants) <= round_robin_max_field
+                else MODE_SWISS
+            )
+        self.mode = mode
+        self.advance_count = advance_count
+        self.z = z
+        self.min_games = min_games
+        self.max_games = max_games
+        self.max_games_per_participant = max_games_per_participant
+        self.rng = rng or random.Random()
+
+        self.games: Dict[Hashable, int] = {key: 0 for key in self.participants}
+        self.scores: Dict[Hashable, float] = {key: 0.0 for key in self.participants}
+        self.games_scheduled = 0  # 已安排的对局数（含出错的），受 max_games 限制
+        self.rounds = 0
+        self._engine = None
+        if self.mode == MODE_ROUND_ROBIN:
+            # 忽略 ELO，只均衡场次、同场次数与座位
+            self._engine = PairingEngine(
+                lineup_size=LINEUP_SIZE,
+                window=len(self.participants),
+                elo_scale=1e9,
+                rng=self.rng,
+            )
+            self._engine.update_participants({key: 0 for key in self.participants})
+
+    def rate(self, key: Hashable) -> float:
+        games = self.games[key]
+        return self.scores[key] / games if games else 0.5
+
+    def standings(self) -> List[dict]:
+        """按得分率排序的战绩表，含置信区间与是否已确定"""
+        ordered = sorted(
+            self.participants, key=lambda k: (-self.rate(k), -self.games[k], k)
+        )
+        rows = []
+        for key in ordered:
+            lower, upper = wilson_interval(self.scores[key], self.games[key], self.z)
+            rows.append(
+                {
+                    "key": key,
+                    "games": self.games[key],
+                    "score": self.scores[key],
+                    "rate": round(self.rate(key), 4),
+                    "lower": round(lower, 4),
+                    "upper": round(upper, 4),
+                }
+            )
+        self._mark_settled(rows)
+        return rows
+
+    def _mark_settled(self, rows: List[dict]):
+        if self.advance_count is not None and 0 < self.advance_count < len(rows):
+            k = self.advance_count
+            min_lower_inside = min(row["lower"] for row in rows[:k])
+            max_upper_outside = max(row["upper"] for row in rows[k:])
+            for index, row in enumerate(rows):
+                if index < k:
+                    row["settled"] = row["lower"] > max_upper_outside
+                else:
+                    row["settled"] = row["upper"] < min_lower_inside
+        else:
+            for index, row in enumerate(rows):
+                above_clear = index == 0 or row["upper"] < rows[index - 1]["lower"]
+                below_clear = (
+                    index == len(rows) - 1 or row["lower"] > rows[index + 1]["upper"]
+                )
+                row["settled"] = above_clear and below_clear
+        for row in rows:
+            row["capped"] = (
+                not row["settled"] and row["games"] >= self.max_games_per_participant
+            )
+            if row["games"] < self.min_games:
+                row["settled"] = False
+
+    def is_finished(self) -> Tuple[bool, Optional[str]]:
+        if self.games_scheduled >= self.max_games:
+            return True, "budget_exhausted"
+        rows = self.standings()
+        if all(row["settled"] for row in rows):
+            return True, "standings_settled"
+        if all(row["settled"] or row["capped"] for row in rows):
+            return True, "participant_cap_reached"
+        return False, None
+
+    def plan_round(self) -> List[List[Hashable]]:
+        """安排下一轮对局，返回按座位排列的参赛者列表"""
+        rows = self.standings()
+        contested = [
+            row["key"] for row in rows if not row["settled"] and not row["capped"]
+        ]
+        if not contested:
+            return []
+        if self.mode == MODE_ROUND_ROBIN:
+            count = math.ceil(len(self.participants) / LINEUP_SIZE)
+        else:
+            count = math.ceil(len(contested) / ANCHORS_PER_LINEUP)
+        count = min(count, self.max_games - self.games_scheduled)
+        if count <= 0:
+            return []
+
+        if self.mode == MODE_ROUND_ROBIN:
+            lineups = self._engine.next_lineups(count)
+        else:
+            lineups = self._anchored_lineups(contested, count)
+        self.games_scheduled += len(lineups)
+        self.rounds += 1
+        return lineups
+
+    def _anchored_lineups(
+        self, contested: List[Hashable], count: int
+    ) -> List[List[Hashable]]:
+        """
+        每局由至多 ANCHORS_PER_LINEUP 名待定参赛者与从全体参赛者中随机抽取的补位者组成
+        按得分率分组（经典瑞士轮）会让每个人的胜率都趋向 50%，置信区间无法分开；
+        随机补位使所有人面对的队友与对手水平期望相同，胜率之间可以直接比较
+        """
+        anchors = list(contested)
+        self.rng.shuffle(anchors)
+        lineups = []
+        for index in range(count):
+            chosen = anchors[
+                index * ANCHORS_PER_LINEUP : (index + 1) * ANCHORS_PER_LINEUP
+            ]
+            others = [key for key in self.participants if key not in chosen]
+            lineup = chosen + self.rng.sample(others, LINEUP_SIZE - len(chosen))
+            self.rng.shuffle(lineup)  # 随机座位
+            lineups.append(lineup)
+        return lineups
+
+    def record_result(self, lineup: List[Hashable], result: Optional[dict]):
+        """
+        记录一局结果：lineup 按座位排列，result 为裁判返回的结果（含 winner 与 roles）
+        没有胜方的对局不计入战绩
+        """
+        if not result or result.get("winner") not in ("red", "blue"):
+            return
+        roles = result.get("roles") or {}
+        for seat, key in enumerate(lineup, start=1):
+            role = roles.get(seat, roles.get(str(seat)))
+            team = "red" if role in RED_ROLES else "blue"
+            self.games[key] += 1
+            if team == result["winner"]:
+                self.scores[key] += 1.0
+
+
+class TournamentInstance:
+    """
+    为单个榜单运行锦标赛的后台线程，接口与 AutoMatchInstance 一致，由 AutoMatchManager 管理
+    """
+
+    def __init__(
+        self,
+        app: Flask,
+        ranking_id: int,
+        priority: int = PRIORITY_NORMAL,
+        mode: str = None,
+        full_ranking: bool = False,
+        **options,
+    ):
+        if mode not in (None, MODE_SWISS, MODE_ROUND_ROBIN):
+            raise ValueError(f"未知的锦标赛模式: {mode}")
+        self.app = app
+        self.ranking_id = ranking_id
+        self.priority = priority
+        self.mode = mode
+        self.full_ranking = full_ranking
+        self.config = get_tournament_config()
+        self.config.update({k: v for k, v in options.items() if v is not None})
+        self.is_on = False
+        self.battle_count = 0
+        self.in_flight: Dict[str, List] = {}  # battle_id -> 按座位排列的AI代码ID
+        self.scheduler: Optional[TournamentScheduler] = None
+        self.finish_reason: Optional[str] = None
+        self.loop_thread: Optional[threading.Thread] = None
+        self._participants = {}  # AI代码ID -> AICode
+
+    def _create_scheduler(self) -> Optional[TournamentScheduler]:
+        codes = get_active_ai_codes_by_ranking_ids(ranking_ids=[self.ranking_id])
+        self._participants = {code.id: code for code in codes}
+        if len(codes) < LINEUP_SIZE:
+            logger.warning(
+                f"[Rank-{self.ranking_id}] 参赛者不足 ({len(codes)}/{LINEUP_SIZE})，无法开始锦标赛"
+            )
+            return None
+        advance_count = None
+        if not self.full_ranking:
+            advance_count = math.ceil(len(codes) * float(self.config["advance_ratio"]))
+        return TournamentScheduler(
+            list(self._participants),
+            mode=self.mode,
+            advance_count=advance_count,
+            z=float(self.config["confidence_z"]),
+            min_games=int(self.config["min_games"]),
+            max_games=int(self.config["max_games"]),
+            max_games_per_participant=int(self.config["max_games_per_participant"]),
+            round_robin_max_field=int(self.config["round_robin_max_field"]),
+        )
+
+    def _loop(self):
+        with self.app.app_context():
+            try:
+                battle_manager = get_battle_manager()
+                self.scheduler = self._create_scheduler()
+                if self.scheduler is None:
+                    self.finish_reason = "insufficient_participants"
+                    return
+                logger.info(
+                    f"[Rank-{self.ranking_id}] 锦标赛开始：{self.scheduler.mode}，"
+                    f"{len(self._participants)} 名参赛者"
+                )
+                while self.is_on:
+                    finished, reason = self.scheduler.is_finished()
+                    if finished:
+                        self.finish_reason = reason
+                        break
+                    lineups = self.scheduler.plan_round()
+                    if not lineups:
+                        self.finish_reason = "nothing_to_schedule"
+                        break
+                    self._start_round(battle_manager, lineups)
+                    self._wait_round(battle_manager)
+                if self.finish_reason:
+                    logger.info(
+                        f"[Rank-{self.ranking_id}] 锦标赛结束（{self.finish_reason}），"
+                        f"共 {self.scheduler.rounds} 轮 {self.battle_count} 场"
+                    )
+            except Exception as e:
+                logger.error(f"[Rank-{self.ranking_id}] 锦标赛出错: {e}", exc_info=True)
+                self.finish_reason = f"error: {e}"
+            finally:
+                self.is_on = False
+
+    def _start_round(self, battle_manager, lineups: List[List]):
+        participant_lineups = [
+            [
+                {
+                    "user_id": self._participants[code_id].user_id,
+                    "ai_code_id": code_id,
+                }
+                for code_id in lineup
+            ]
+            for lineup in lineups
+        ]
+        while self.is_on:
+            try:
+                battle_manager.check_admission(len(lineups))
+                break
+            except BattleQueueFullError as e:
+                logger.info(
+                    f"[Rank-{self.ranking_id}] BattleManager 繁忙，{e.retry_after} 秒后重试"
+                )
+                self._sleep_while_on(e.retry_after)
+        if not self.is_on:
+            return
+
+        battle_ids = serialized_write(
+            create_battles_bulk,
+            participant_lineups,
+            ranking_id=self.ranking_id,
+            status="waiting",
+        )
+        if not battle_ids:
+            logger.error(f"[Rank-{self.ranking_id}] 批量创建本轮对战失败")
+            return
+        for index, battle_id in enumerate(battle_ids):
+            if not battle_id:
+                continue
+            try:
+                if battle_manager.start_battle(
+                    battle_id,
+                    participant_lineups[index],
+                    priority=self.priority,
+                    ranking_id=self.ranking_id,
+                ):
+                    self.in_flight[battle_id] = lineups[index]
+                    self.battle_count += 1
+            except BattleQueueFullError as e:
+                # 本局与本轮剩余的对局不再启动，对应参赛者下一轮重新安排
+                for unstarted_id in battle_ids[index:]:
+                    if unstarted_id:
+                        mark_battle_as_cancelled(unstarted_id, f"系统繁忙：{e}")
+                break
+
+    def _wait_round(self, battle_manager):
+        """等待本轮对局全部结束并记录结果"""
+        while self.is_on and self.in_flight:
+            finished = battle_manager.wait_for_any(
+                list(self.in_flight), timeout=DONE_WAIT_TIMEOUT_SECONDS
+            )
+            if not finished:
+                continue
+            # 结果在通知结束前已写回数据库；持久化队列或独立执行进程下
+            # 对局可能由其他进程执行，本进程内存中没有结果
+            records = get_battle_results(finished) or {}
+            for battle_id in finished:
+                lineup = self.in_flight.pop(battle_id)
+                status, result = records.get(battle_id, (None, None))
+                if status is None:
+                    status = battle_manager.get_battle_status(battle_id)
+                    result = battle_manager.get_battle_result(battle_id)
+                if status == "completed":
+                    self.scheduler.record_result(lineup, result)
+
+    def _sleep_while_on(self, seconds: float):
+        """等待至多 seconds 秒，锦标赛停止后立即返回"""
+        deadline = time() + seconds
+        while self.is_on and time() < deadline:
+            sleep(min(SLEEP_STEP_SECONDS, deadline - time()))
+
+    def start(self) -> bool:
+        if self.is_on:
+            logger.warning(f"[Rank-{self.ranking_id}] 锦标赛已在运行。")
+            return False
+        self.is_on = True
+        self.finish_reason = None
+        self.loop_thread = threading.Thread(
+            target=self._loop,
+            name=f"Thread-Tournament-Rank-{self.ranking_id}",
+            daemon=True,
+        )
+        self.loop_thread.start()
+        return True
+
+    def stop(self) -> bool:
+        if not self.is_on:
+            logger.warning(f"[Rank-{self.ranking_id}] 锦标赛未在运行。")
+            return False
+        self.is_on = False
+        self.finish_reason = "stopped"
+        if self.loop_thread and self.loop_thread.is_alive():
+            self.loop_thread.join(timeout=10)
+        logger.info(f"[Rank-{self.ranking_id}] 锦标赛已停止。")
+        return True
+
+    def get_status(self) -> dict:
+        scheduler = self.scheduler
+        standings = scheduler.standings() if scheduler is not None else []
+        return {
+            "ranking_id": self.ranking_id,
+            "is_on": self.is_on,
+            "scheduler": "tournament",
+            "mode": scheduler.mode if scheduler is not None else self.mode,
+            "battle_count": self.battle_count,
+            "rounds": scheduler.rounds if scheduler is not None else 0,
+            "max_games": int(self.config["max_games"]),
+            "settled_count": sum(1 for row in standings if row["settled"]),
+            "capped_count": sum(1 for row in standings if row["capped"]),
+            "finish_reason": self.finish_reason,
+            "queue_size": len(self.in_flight),
+            "thread_alive": self.loop_thread.is_alive() if self.loop_thread else False,
+            "current_participants_count": len(self._participants),
+            "standings": [{"ai_code_id": row.pop("key"), **row} for row in standings],
+        }
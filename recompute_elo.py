@@ -0,0 +1,79 @@
+# 离线 ELO 重算入口
+"""
+recompute-elo：按 database/elo.py 的当前规则，从历史对局重新计算一个排行榜的 ELO
+
+修改 K 值、队伍评分或 token/错误惩罚后使用。默认只打印差异报告，加 --apply 才写回 GameStats；
+写回前请先停止该排行榜的自动对战，避免与正在结算的对局交错。实现见 database/elo_recompute.py。
+
+用法：
+    python recompute_elo.py RANKING_ID [--apply] [--no-logs] [--top N] [--output report.json]
+"""
+
+import argparse
+import json
+import sys
+
+from app import create_script_app
+from database.elo_recompute import recompute_ranking_elo
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="按当前规则离线重算排行榜 ELO")
+    parser.add_argument("ranking_id", type=int, help="排行榜ID")
+    parser.add_argument(
+        "--apply",
+        action="store_true",
+        help="将重算结果写回 GameStats（默认只生成报告）",
+    )
+    parser.add_argument(
+        "--no-logs",
+        action="store_true",
+        help="旧对局缺少结算摘要时不读取公共日志（token 用量按 0 计算）",
+    )
+    parser.add_argument("--top", type=int, default=20, help="打印变化最大的前 N 名玩家")
+    parser.add_argument("--output", help="将完整差异报告写入 JSON 文件")
+    return parser.parse_args()
+
+
+def print_report(report: dict, top: int):
+    print(
+        f"排行榜 {report['ranking_id']}：对局 {report['battles']} 场，重放 {report['replayed']} 场，"
+        f"跳过 {report['skipped']} 场，分层 {report['levels']} 层；"
+        f"读取公共日志 {report['log_reads']} 份，缺少 token 数据 {report['missing_tokens']} 场"
+    )
+    print(
+        f"耗时：查询 {report['query_seconds']}s，解析与重算 {report['compute_seconds']}s"
+    )
+    print(
+        f"ELO 变化 {report['changed']}/{len(report['players'])} 人，名次变化 {report['rank_changed']} 人，"
+        f"平均变化 {report['mean_abs_diff']:.1f}，最大变化 {report['max_abs_diff']}"
+    )
+    for player in report["players"][:top]:
+        if player["diff"] == 0:
+            break
+        print(
+            f"  {player['username']:<20} {player['old_elo']:>5} -> {player['new_elo']:>5} "
+            f"({player['diff']:+d})  名次 {player['old_rank']} -> {player['new_rank']}"
+        )
+    print("已写回 GameStats" if report["applied"] else "未写回（使用 --apply 写回）")
+
+
+def main():
+    args = parse_args()
+    app = create_script_app()
+    with app.app_context():
+        report = recompute_ranking_elo(
+            args.ranking_id, apply=args.apply, read_logs=not args.no_logs
+        )
+    if report is None:
+        sys.exit(1)
+    print_report(report, args.top)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.apply and not report["applied"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
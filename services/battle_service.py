@@ -1,18 +1,33 @@
 import logging
 import json
+from contextlib import nullcontext
 from flask import Flask  # 导入 Flask
-from typing import Optional
+from typing import List, Optional
 from database import (
     get_battle_by_id,
     update_battle,
     process_battle_results_and_update_stats,
+    record_battle_results_batch,
     get_ai_code_path_full,
     mark_battle_as_cancelled,  # 新增: 导入处理取消状态的函数
     handle_cancelled_battle_stats,  # 新增: 导入处理取消对战统计的函数
+    enqueue_battle_job,
+    claim_battle_job,
+    mark_battle_job_running,
+    heartbeat_battle_jobs,
+    finish_battle_job,
+    requeue_expired_battle_jobs,
+    count_queued_battle_jobs,
+    get_battle_job_position,
+    heartbeat_battle_runner,
+    get_battle_runners,
+    prune_battle_runners,
+    get_battle_statuses,
 )
 from database.models import (
     Battle,
 )
+from database.writer import serialized, in_writer_thread
 
 logger = logging.getLogger(__name__)
 
@@ -28,21 +43,31 @@ class BattleService:
             raise ValueError("Flask app instance is required for BattleService")
         self.app = app  # 存储 app 实例
 
+    def _app_context(self):
+        """
+        数据库操作的应用上下文。写方法经 serialized 交给写入线程（启用 DATABASE_WRITER 时），
+        在写入线程中复用其应用上下文，使同一批写操作共用一个事务
+        """
+        if in_writer_thread():
+            return nullcontext()
+        return self.app.app_context()
+
     def get_ai_code_path(self, ai_code_id: str) -> Optional[str]:
         """获取 AI 代码的完整路径。"""
         try:
             # 数据库操作需要 app context
-            with self.app.app_context():
+            with self._app_context():
                 return get_ai_code_path_full(ai_code_id)
         except Exception as e:
             logger.error(f"获取 AI 代码路径失败 (ID: {ai_code_id}): {e}")
             return None
 
+    @serialized
     def mark_battle_as_playing(self, battle_id: str) -> bool:
         """将数据库中的对战状态更新为 'playing'。"""
         try:
             # 使用 self.app 创建上下文
-            with self.app.app_context():
+            with self._app_context():
                 battle = get_battle_by_id(battle_id)
                 if battle:
                     if update_battle(battle, status="playing"):
@@ -61,11 +86,12 @@ class BattleService:
             logger.exception(f"更新对战 {battle_id} 状态为 playing 时出错: {e}")
             return False
 
+    @serialized
     def mark_battle_as_completed(self, battle_id: str, result_data: dict) -> bool:
         """处理对战完成，更新数据库状态和统计信息。"""
         try:
             # 使用 self.app 创建上下文
-            with self.app.app_context():
+            with self._app_context():
                 if process_battle_results_and_update_stats(battle_id, result_data):
                     logger.info(f"数据库：对战 {battle_id} 结果处理和统计更新成功")
                     return True
@@ -86,7 +112,7 @@ class BattleService:
             logger.exception(f"处理对战 {battle_id} 完成状态时出错: {e}")
             # 尝试在新的上下文中标记为 error
             try:
-                with self.app.app_context():
+                with self._app_context():
                     self.mark_battle_as_error(
                         battle_id, {"error": f"完成处理时出错: {str(e)}"}
                     )
@@ -96,11 +122,12 @@ class BattleService:
                 )
             return False
 
+    @serialized
     def mark_battle_as_error(self, battle_id: str, error_details: dict) -> bool:
         """将数据库中的对战状态更新为 'error'。"""
         try:
             # 使用 self.app 创建上下文
-            with self.app.app_context():
+            with self._app_context():
                 battle = get_battle_by_id(battle_id)
                 if battle:
                     if update_battle(
@@ -126,7 +153,33 @@ class BattleService:
             logger.exception(f"更新对战 {battle_id} 状态为 error 时出错: {e}")
             return False
 
+    @serialized
+    def record_battle_results(self, items: list) -> List[bool]:
+        """
+        在一个事务中写入一批已结束对战的结果，items 为 [(kind, battle_id, results_data)]，
+        kind 为 "completed" 或 "error"。整批失败时逐个按单场方式重试，返回每项是否成功。
+        """
+        try:
+            with self._app_context():
+                outcomes = record_battle_results_batch(items)
+            if outcomes is not None:
+                logger.info(f"数据库：批量写入 {len(items)} 场对战结果")
+                return outcomes
+        except Exception as e:
+            logger.exception(f"批量写入对战结果时出错: {e}")
+
+        logger.warning(f"批量写入失败，逐个写入 {len(items)} 场对战结果")
+        return [
+            (
+                self.mark_battle_as_completed(battle_id, results_data)
+                if kind == "completed"
+                else bool(self.mark_battle_as_error(battle_id, results_data))
+            )
+            for kind, battle_id, results_data in items
+        ]
+
     # 新增方法：标记对战为已取消状态
+    @serialized
     def mark_battle_as_cancelled(self, battle_id: str, cancel_data: dict) -> bool:
         """
         将数据库中的对战状态更新为 'cancelled'，并处理相关统计。
@@ -140,7 +193,7 @@ class BattleService:
         """
         try:
             # 使用 self.app 创建上下文
-            with self.app.app_context():
+            with self._app_context():
                 # 先检查对战是否存在
                 battle = get_battle_by_id(battle_id)
                 if not battle:
@@ -172,6 +225,148 @@ class BattleService:
             logger.exception(f"取消对战 {battle_id} 时出错: {e}")
             return False
 
+    def get_battle_status(self, battle_id: str) -> Optional[str]:
+        """获取数据库中的对战状态，对战不存在时返回 None。"""
+        try:
+            with self._app_context():
+                battle = get_battle_by_id(battle_id)
+                return battle.status if battle else None
+        except Exception as e:
+            logger.error(f"获取对战 {battle_id} 状态失败: {e}")
+            return None
+
+    def get_battle_statuses(self, battle_ids: List[str]) -> Optional[dict]:
+        """批量获取数据库中的对战状态 {battle_id: status}，出错时返回 None。"""
+        try:
+            with self._app_context():
+                return get_battle_statuses(battle_ids)
+        except Exception as e:
+            logger.error(f"批量获取对战状态失败: {e}")
+            return None
+
+    # 持久化对战队列：以下方法均在 app context 中执行，返回普通数据而非 ORM 对象
+    @serialized
+    def enqueue_battle_job(
+        self, battle_id: str, participant_data: list, priority: int, tenant: str = ""
+    ) -> bool:
+        """将对战写入持久化队列。"""
+        try:
+            with self._app_context():
+                return (
+                    enqueue_battle_job(battle_id, participant_data, priority, tenant)
+                    is not None
+                )
+        except Exception as e:
+            logger.exception(f"对战 {battle_id} 写入持久化队列时出错: {e}")
+            return False
+
+    @serialized
+    def claim_battle_job(
+        self, owner: str, lease_seconds: int, **fairness
+    ) -> Optional[dict]:
+        """按租户公平地领取一个排队中的任务，返回任务数据字典。"""
+        try:
+            with self._app_context():
+                job = claim_battle_job(owner, lease_seconds, **fairness)
+                return job.to_dict() if job else None
+        except Exception as e:
+            logger.exception(f"领取持久化队列任务时出错: {e}")
+            return None
+
+    @serialized
+    def mark_battle_job_running(self, battle_id: str, owner: str) -> bool:
+        try:
+            with self._app_context():
+                return mark_battle_job_running(battle_id, owner)
+        except Exception as e:
+            logger.exception(f"标记任务 {battle_id} 为 running 时出错: {e}")
+            return False
+
+    @serialized
+    def heartbeat_battle_jobs(
+        self, owner: str, battle_ids: list, lease_seconds: int
+    ) -> Optional[set]:
+        try:
+            with self._app_context():
+                return heartbeat_battle_jobs(owner, battle_ids, lease_seconds)
+        except Exception as e:
+            logger.exception(f"持久化队列任务续约时出错: {e}")
+            return None
+
+    @serialized
+    def finish_battle_job(
+        self, battle_id: str, owner: str, succeeded: bool, error: str = None
+    ) -> bool:
+        try:
+            with self._app_context():
+                return finish_battle_job(battle_id, owner, succeeded, error)
+        except Exception as e:
+            logger.exception(f"结束任务 {battle_id} 时出错: {e}")
+            return False
+
+    @serialized
+    def requeue_expired_battle_jobs(self, max_attempts: int) -> tuple:
+        try:
+            with self._app_context():
+                return requeue_expired_battle_jobs(max_attempts)
+        except Exception as e:
+            logger.exception(f"回收过期任务时出错: {e}")
+            return 0, 0
+
+    def count_queued_battle_jobs(self) -> int:
+        try:
+            with self._app_context():
+                return count_queued_battle_jobs()
+        except Exception as e:
+            logger.exception(f"统计排队任务数时出错: {e}")
+            return 0
+
+    def get_battle_job_position(self, battle_id: str) -> Optional[int]:
+        try:
+            with self._app_context():
+                return get_battle_job_position(battle_id)
+        except Exception as e:
+            logger.exception(f"获取任务 {battle_id} 排队位置时出错: {e}")
+            return None
+
+    @serialized
+    def heartbeat_battle_runner(
+        self,
+        runner_id: str,
+        hostname: str,
+        pid: int,
+        capacity: int,
+        active_battles: int,
+        status: str,
+    ) -> bool:
+        """上报执行进程的容量与心跳。"""
+        try:
+            with self._app_context():
+                return heartbeat_battle_runner(
+                    runner_id, hostname, pid, capacity, active_battles, status
+                )
+        except Exception as e:
+            logger.exception(f"上报执行进程 {runner_id} 心跳时出错: {e}")
+            return False
+
+    def get_battle_runners(self, ttl_seconds: int) -> list:
+        """获取在线的执行进程列表（字典形式）。"""
+        try:
+            with self._app_context():
+                return [runner.to_dict() for runner in get_battle_runners(ttl_seconds)]
+        except Exception as e:
+            logger.exception(f"获取执行进程列表时出错: {e}")
+            return []
+
+    @serialized
+    def prune_battle_runners(self, ttl_seconds: int) -> int:
+        try:
+            with self._app_context():
+                return prune_battle_runners(ttl_seconds)
+        except Exception as e:
+            logger.exception(f"清理执行进程登记时出错: {e}")
+            return 0
+
     # 可以添加包装好的日志方法，如果希望 BattleManager 完全不依赖 logging
     def log_info(self, message: str):
         logger.info(message)
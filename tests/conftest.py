@@ -0,0 +1,54 @@
+"""
+测试公共夹具：每个测试使用 tmp_path 下独立的 SQLite 数据库，应用由 create_script_app 创建
+（只初始化数据库，不启动对战管理器等后台服务）。
+
+在仓库根目录运行：python -m pytest -q
+"""
+
+import pytest
+
+import utils  # noqa: F401  先于 database 导入，避免 database.action 与 utils 的循环导入
+from app import create_script_app
+from config.config import Config
+from database.base import db
+from database.models import AICode, GameStats, User
+
+
+@pytest.fixture
+def app(tmp_path):
+    """在应用上下文中运行的测试应用，数据库为空表"""
+
+    class TestConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'test.db'}"
+
+    app = create_script_app(TestConfig)
+    with app.app_context():
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def make_players(app):
+    """创建 count 个带 AI 代码与 GameStats 的用户，返回 [(user_id, ai_code_id)]"""
+
+    def make(count, ranking_id=1, elo_score=1200):
+        players = []
+        start = User.query.count()
+        for i in range(start, start + count):
+            user = User(
+                username=f"user{i}", email=f"user{i}@example.com", password_hash="x"
+            )
+            db.session.add(user)
+            db.session.flush()
+            ai_code = AICode(user_id=user.id, name=f"ai{i}", code_path=f"ai{i}.py")
+            db.session.add(ai_code)
+            db.session.add(
+                GameStats(user_id=user.id, ranking_id=ranking_id, elo_score=elo_score)
+            )
+            db.session.flush()
+            players.append((user.id, ai_code.id))
+        db.session.commit()
+        return players
+
+    return make
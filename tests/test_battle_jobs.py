@@ -0,0 +1,82 @@
+"""持久化队列任务的领取、租约过期回收与重试上限（database/action.py）"""
+
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import update
+
+from database import (
+    claim_battle_job,
+    create_battle,
+    enqueue_battle_job,
+    finish_battle_job,
+    heartbeat_battle_jobs,
+    requeue_expired_battle_jobs,
+)
+from database.base import db
+from database.models import Battle, BattleJob
+
+
+@pytest.fixture
+def battle_id(make_players):
+    players = make_players(7)
+    battle = create_battle([{"user_id": u, "ai_code_id": c} for u, c in players])
+    assert enqueue_battle_job(battle.id, [], priority=1, tenant="user:1")
+    return battle.id
+
+
+def expire_leases():
+    db.session.execute(
+        update(BattleJob).values(lease_expires_at=datetime.now() - timedelta(seconds=1))
+    )
+    db.session.commit()
+
+
+def test_leased_job_is_not_claimed_twice(battle_id):
+    job = claim_battle_job("runner-a", lease_seconds=60)
+    assert job.battle_id == battle_id
+    assert job.state == "leased" and job.lease_owner == "runner-a"
+    assert job.attempts == 1
+    assert claim_battle_job("runner-b", lease_seconds=60) is None
+    # 租约未过期时不会被回收
+    assert requeue_expired_battle_jobs() == (0, 0)
+
+
+def test_expired_lease_is_requeued_for_another_runner(battle_id):
+    claim_battle_job("runner-a", lease_seconds=60)
+    expire_leases()
+    assert requeue_expired_battle_jobs(max_attempts=3) == (1, 0)
+
+    job = claim_battle_job("runner-b", lease_seconds=60)
+    assert job.battle_id == battle_id
+    assert job.lease_owner == "runner-b"
+    assert job.attempts == 2
+    # 原持有者失去租约后既不能续约也不能结束任务
+    assert heartbeat_battle_jobs("runner-a", [battle_id], 60) == set()
+    assert not finish_battle_job(battle_id, "runner-a")
+    assert heartbeat_battle_jobs("runner-b", [battle_id], 60) == {battle_id}
+    assert finish_battle_job(battle_id, "runner-b")
+    assert db.session.get(BattleJob, job.id).state == "done"
+
+
+def test_heartbeat_keeps_lease(battle_id):
+    claim_battle_job("runner-a", lease_seconds=60)
+    expire_leases()
+    assert heartbeat_battle_jobs("runner-a", [battle_id], 60) == {battle_id}
+    assert requeue_expired_battle_jobs() == (0, 0)
+
+
+def test_job_fails_after_max_attempts(battle_id):
+    for attempt in range(2):
+        assert claim_battle_job(f"runner-{attempt}", lease_seconds=60)
+        expire_leases()
+        assert requeue_expired_battle_jobs(max_attempts=2) == (
+            (1, 0) if attempt == 0 else (0, 1)
+        )
+
+    assert claim_battle_job("runner-x", lease_seconds=60) is None
+    job = BattleJob.query.filter_by(battle_id=battle_id).one()
+    assert job.state == "failed"
+    battle = db.session.get(Battle, battle_id)
+    assert battle.status == "error"
+    assert battle.ended_at is not None
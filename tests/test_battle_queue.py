@@ -0,0 +1,104 @@
+"""MemoryBattleQueue 的差额轮询公平出队（game/battle_queue.py）"""
+
+import queue
+from collections import Counter
+
+import pytest
+
+from game.battle_queue import MemoryBattleQueue
+from game.client_manager import PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NORMAL
+
+WEIGHTS = {PRIORITY_HIGH: 4, PRIORITY_NORMAL: 2, PRIORITY_LOW: 1}
+
+
+def make_queue(max_running_per_user=0, max_running_per_ranking=0):
+    return MemoryBattleQueue(
+        1000,
+        fairness={
+            "weights": WEIGHTS,
+            "max_running_per_user": max_running_per_user,
+            "max_running_per_ranking": max_running_per_ranking,
+        },
+    )
+
+
+def put(battle_queue, tenant, count, priority=PRIORITY_NORMAL):
+    for i in range(count):
+        battle_queue.put_nowait((f"{tenant}-{i}", [], priority, tenant))
+
+
+def take(battle_queue, count):
+    """依次出队 count 场并立即结束，返回出队顺序中的租户"""
+    tenants = []
+    for _ in range(count):
+        battle_id, _, _, tenant = battle_queue.get(timeout=0)
+        battle_queue.finish(battle_id, succeeded=True)
+        tenants.append(tenant)
+    return tenants
+
+
+def test_new_tenant_is_not_stuck_behind_backlog():
+    battle_queue = make_queue()
+    put(battle_queue, "ranking:1", 100)
+    take(battle_queue, 5)
+    put(battle_queue, "user:7", 2)
+    # 新租户在积压租户的一轮额度内出队，而不是排在剩余 95 场之后
+    order = take(battle_queue, 4)
+    assert order.count("user:7") == 2
+    assert order[:2] == ["user:7", "user:7"]
+
+
+def test_backlogged_tenants_share_by_weight():
+    battle_queue = make_queue()
+    put(battle_queue, "ranking:1", 50, PRIORITY_HIGH)
+    put(battle_queue, "ranking:2", 50, PRIORITY_LOW)
+    put(battle_queue, "ranking:3", 50, PRIORITY_NORMAL)
+    counts = Counter(take(battle_queue, 70))
+    assert counts == {"ranking:1": 40, "ranking:2": 10, "ranking:3": 20}
+
+
+def test_same_weight_tenants_alternate():
+    battle_queue = make_queue()
+    put(battle_queue, "user:1", 10)
+    put(battle_queue, "user:2", 10)
+    order = take(battle_queue, 8)
+    assert order == ["user:1", "user:1", "user:2", "user:2"] * 2
+
+
+def test_tenant_at_running_limit_is_skipped():
+    battle_queue = make_queue(max_running_per_user=1)
+    put(battle_queue, "user:1", 3)
+    put(battle_queue, "user:2", 1)
+    first = battle_queue.get(timeout=0)
+    assert first[3] == "user:1"
+    # user:1 已有一场执行中，跳过它的其余对战
+    assert battle_queue.get(timeout=0)[3] == "user:2"
+    with pytest.raises(queue.Empty):
+        battle_queue.get(timeout=0)
+    battle_queue.finish(first[0], succeeded=True)
+    assert battle_queue.get(timeout=0)[3] == "user:1"
+
+
+def test_drained_tenant_returns_as_new_tenant():
+    battle_queue = make_queue()
+    put(battle_queue, "ranking:1", 100)
+    put(battle_queue, "user:1", 1)
+    assert "user:1" in take(battle_queue, 4)
+    take(battle_queue, 10)
+    # 子队列清空后重新入队的租户再次作为新租户优先出队
+    battle_queue.put_nowait(("again", [], PRIORITY_NORMAL, "user:1"))
+    assert take(battle_queue, 1) == ["user:1"]
+
+
+def test_full_queue_rejects():
+    battle_queue = MemoryBattleQueue(
+        2,
+        fairness={
+            "weights": WEIGHTS,
+            "max_running_per_user": 0,
+            "max_running_per_ranking": 0,
+        },
+    )
+    put(battle_queue, "user:1", 2)
+    with pytest.raises(queue.Full):
+        battle_queue.put_nowait(("extra", [], PRIORITY_NORMAL, "user:1"))
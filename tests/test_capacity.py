@@ -0,0 +1,53 @@
+"""自动对战容量的权重水位分配（game/capacity.py）"""
+
+import random
+
+from game.capacity import allocate
+
+
+def test_enough_capacity_meets_every_demand():
+    assert allocate(20, {1: 3, 2: 5, 3: 0}, {}) == {1: 3, 2: 5, 3: 0}
+
+
+def test_leftover_of_small_demand_goes_to_others_by_weight():
+    # 榜单1只需要2局，剩余18局按 1:2 分给榜单2与榜单3
+    assert allocate(20, {1: 2, 2: 100, 3: 100}, {3: 2.0}) == {1: 2, 2: 6, 3: 12}
+
+
+def test_equal_weights_split_evenly():
+    quotas = allocate(10, {1: 50, 2: 50, 3: 50}, {})
+    assert sorted(quotas.values()) == [3, 3, 4]
+
+
+def test_every_active_ranking_gets_at_least_one_slot():
+    quotas = allocate(10, {1: 100, 2: 100, 3: 1}, {1: 100.0})
+    assert quotas[2] >= 1 and quotas[3] == 1
+    assert sum(quotas.values()) == 10
+
+
+def test_scarce_capacity_prefers_heavier_rankings():
+    assert allocate(2, {1: 5, 2: 5, 3: 5}, {2: 3.0, 3: 2.0}) == {1: 0, 2: 1, 3: 1}
+
+
+def test_zero_total():
+    assert allocate(0, {1: 5, 2: 0}, {}) == {1: 0, 2: 0}
+
+
+def test_invariants_on_random_inputs():
+    rng = random.Random(7)
+    for _ in range(500):
+        demands = {
+            rid: rng.choice([0, 1, 2, 5, 40]) for rid in range(rng.randint(1, 6))
+        }
+        weights = {rid: rng.choice([0.5, 1.0, 3.0]) for rid in demands}
+        total = rng.randint(0, 60)
+        quotas = allocate(total, demands, weights)
+
+        assert set(quotas) == set(demands)
+        # 不超过需求与总容量；容量足够时全部分出
+        assert all(0 <= quotas[rid] <= demands[rid] for rid in demands)
+        assert sum(quotas.values()) == min(total, sum(demands.values()))
+        # 容量不少于有需求的榜单数时，每个有需求的榜单至少1局
+        active = [rid for rid, demand in demands.items() if demand]
+        if total >= len(active):
+            assert all(quotas[rid] >= 1 for rid in active)
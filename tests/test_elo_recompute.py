@@ -0,0 +1,105 @@
+"""离线 ELO 重算与逐场结算一致（database/elo_recompute.py）"""
+
+import json
+import random
+
+import pytest
+
+pytest.importorskip("numpy")
+
+import database.elo_recompute as elo_recompute
+from database import create_battle, process_battle_results_and_update_stats
+from database.base import db
+from database.elo_recompute import recompute_ranking_elo
+from database.models import Battle, GameStats, LeaderboardEntry
+from database.result_summary import ResultSummaryBuilder
+
+ROLES = ["Merlin", "Percival", "Knight", "Knight", "Morgana", "Assassin", "Oberon"]
+ERROR_TYPES = ["critical_player_ERROR", "player_ruturn_ERROR"]
+
+
+def play_history(players, count, log_dir, seed=2):
+    """逐场结算 count 场随机对局：每10场有1场代码错误，每3场有1场只有公共日志没有摘要"""
+    rng = random.Random(seed)
+    for game in range(count):
+        lineup = rng.sample(players, 7)
+        battle = create_battle(
+            [{"user_id": u, "ai_code_id": c} for u, c in lineup], ranking_id=1
+        )
+        results = {
+            "roles": dict(zip(range(1, 8), rng.sample(ROLES, 7))),
+            "rounds_played": 4,
+            "winner": rng.choice(["red", "blue"]),
+        }
+        events = [
+            {
+                "type": "tokens",
+                "result": [
+                    {"input": rng.randint(0, 8000), "output": rng.randint(0, 3000)}
+                    for _ in range(7)
+                ],
+            }
+        ]
+        if game % 10 == 0:
+            events.append(
+                {
+                    "type": rng.choice(ERROR_TYPES),
+                    "error_code_pid": rng.randint(1, 7),
+                    "error_code_method": rng.choice(["walk", "say", "mission_vote2"]),
+                    "error_msg": "boom",
+                }
+            )
+            del results["winner"]
+            results["error"] = "player error"
+            db.session.get(Battle, battle.id).status = "error"
+        if game % 3 == 0:
+            path = log_dir / f"public_{game}.json"
+            path.write_text(json.dumps(events), "utf-8")
+            results["public_log_file"] = str(path)
+        else:
+            builder = ResultSummaryBuilder()
+            for event in events:
+                builder.feed(event)
+            results["summary"] = builder.build(results)
+        assert process_battle_results_and_update_stats(
+            battle.id, json.loads(json.dumps(results))
+        )
+
+
+@pytest.fixture
+def history(make_players, tmp_path):
+    players = make_players(20)
+    play_history(players, 60, tmp_path)
+    return players
+
+
+def current_elos():
+    return {s.user_id: s.elo_score for s in GameStats.query.filter_by(ranking_id=1)}
+
+
+def test_recompute_matches_sequential_settlement(history):
+    elos = current_elos()
+    report = recompute_ranking_elo(1)
+
+    assert report["battles"] == 60
+    assert report["replayed"] == 60
+    assert report["log_reads"] > 0
+    assert report["levels"] > 1
+    assert report["changed"] == 0
+    assert {p["user_id"]: p["new_elo"] for p in report["players"]} == elos
+    assert not report["applied"]
+
+
+def test_apply_writes_back_and_rebuilds_leaderboard(history, monkeypatch):
+    monkeypatch.setattr(elo_recompute, "K_FACTOR", 50)
+    report = recompute_ranking_elo(1, apply=True)
+    assert report["applied"]
+    assert report["changed"] > 0
+    db.session.remove()
+
+    elos = current_elos()
+    assert {p["user_id"]: p["new_elo"] for p in report["players"]} == elos
+    snapshot = {
+        e.user_id: e.elo_score for e in LeaderboardEntry.query.filter_by(ranking_id=1)
+    }
+    assert snapshot == elos
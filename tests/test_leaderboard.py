@@ -0,0 +1,94 @@
+"""排行榜快照的增量重排与完整重建一致（database/leaderboard.py）"""
+
+import random
+
+import pytest
+from sqlalchemy import select
+
+from database.base import db
+from database.leaderboard import entries, rebuild_leaderboard
+from database.models import GameStats, User
+
+
+def snapshot(ranking_id=1):
+    return db.session.execute(
+        select(
+            entries.c.rank,
+            entries.c.user_id,
+            entries.c.username,
+            entries.c.elo_score,
+            entries.c.games_played,
+            entries.c.wins,
+        )
+        .where(entries.c.ranking_id == ranking_id)
+        .order_by(entries.c.rank)
+    ).all()
+
+
+def rebuilt(ranking_id=1):
+    """在回滚的事务中完整重建一次快照，返回重建结果"""
+    rebuild_leaderboard(ranking_id, db.session.connection())
+    rows = snapshot(ranking_id)
+    db.session.rollback()
+    return rows
+
+
+@pytest.fixture
+def ranking(make_players):
+    make_players(30)
+    make_players(5, ranking_id=2)
+    rng = random.Random(5)
+    # 初始 ELO 集中在少数几个分数上，制造大量同分
+    for stats in GameStats.query.filter_by(ranking_id=1):
+        stats.elo_score = rng.choice([1150, 1200, 1200, 1250])
+    db.session.commit()
+    return rng
+
+
+def test_initial_snapshot_matches_rebuild(ranking):
+    rows = snapshot()
+    assert [row.rank for row in rows] == list(range(1, 31))
+    assert rows == rebuilt()
+
+
+def test_settlements_keep_ranks_equal_to_rebuild(ranking):
+    rng = ranking
+    other_ranking = snapshot(2)
+    for _ in range(60):
+        # 一场结算：若干玩家的 ELO 与战绩变化，有时跨越大段分数区间，有时落到同分
+        for stats in rng.sample(GameStats.query.filter_by(ranking_id=1).all(), 7):
+            stats.elo_score = max(
+                100, stats.elo_score + rng.choice([-300, -16, -1, 0, 1, 16, 300])
+            )
+            stats.games_played += 1
+            stats.wins += rng.choice([0, 1])
+        db.session.commit()
+        assert snapshot() == rebuilt()
+    assert snapshot(2) == other_ranking
+
+
+def test_membership_changes_and_renames(ranking):
+    stats = GameStats.query.filter_by(ranking_id=1).first()
+    stats.ranking_id = 2
+    db.session.commit()
+    assert len(snapshot()) == 29 and len(snapshot(2)) == 6
+    assert snapshot() == rebuilt() and snapshot(2) == rebuilt(2)
+
+    user = db.session.get(User, stats.user_id)
+    user.username = "renamed"
+    db.session.commit()
+    assert "renamed" in [row.username for row in snapshot(2)]
+
+    db.session.delete(stats)
+    db.session.commit()
+    assert len(snapshot(2)) == 5
+    assert snapshot(2) == rebuilt(2)
+
+
+def test_rolled_back_settlement_leaves_snapshot(ranking):
+    before = snapshot()
+    for stats in GameStats.query.filter_by(ranking_id=1).limit(7):
+        stats.elo_score += 500
+    db.session.flush()
+    db.session.rollback()
+    assert snapshot() == before
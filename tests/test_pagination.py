@@ -0,0 +1,115 @@
+"""对战列表与对战历史的键集分页游标（database/pagination.py）"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from blueprints.profile import profile_bp
+from database.action import get_battles_after, get_user_battle_history_after
+from database.base import db
+from database.models import Battle, BattlePlayer
+from database.pagination import decode_cursor, encode_cursor
+
+
+def test_cursor_round_trip():
+    created_at = datetime(2025, 5, 1, 12, 30, 15, 123456)
+    cursor = encode_cursor(created_at, "8f9c-battle")
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == (created_at, "8f9c-battle")
+
+
+# 空串、非 base64、JSON 形状不对（[] 与 {"a":1}）
+@pytest.mark.parametrize("cursor", ["", "not a cursor", "W10", "eyJhIjoxfQ"])
+def test_invalid_cursor(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+@pytest.fixture
+def battles(make_players):
+    """25 场对战，每 3 场的创建时间相同；用户0参加偶数场"""
+    (user, user_code), (other, other_code) = make_players(2)
+    base = datetime(2025, 5, 1)
+    created = []
+    for i in range(25):
+        battle = Battle(status="completed", created_at=base + timedelta(minutes=i // 3))
+        db.session.add(battle)
+        db.session.flush()
+        players = [(other, other_code)] + ([(user, user_code)] if i % 2 == 0 else [])
+        for position, (user_id, ai_code_id) in enumerate(players, start=1):
+            db.session.add(
+                BattlePlayer(
+                    battle_id=battle.id,
+                    user_id=user_id,
+                    selected_ai_code_id=ai_code_id,
+                    position=position,
+                )
+            )
+        created.append(battle)
+    db.session.commit()
+    newest_first = sorted(created, key=lambda b: (b.created_at, b.id), reverse=True)
+    return user, [b.id for b in newest_first]
+
+
+def walk(fetch, per_page):
+    """跟随 next_cursor 翻完所有页"""
+    seen, cursor = [], None
+    while True:
+        rows, cursor = fetch(cursor, per_page)
+        assert len(rows) <= per_page
+        seen.extend(row.id for row in rows)
+        if cursor is None:
+            return seen
+
+
+@pytest.mark.parametrize("per_page", [1, 4, 7, 25, 100])
+def test_battle_list_pages_cover_every_battle_once(battles, per_page):
+    _, expected = battles
+
+    def fetch(cursor, per_page):
+        page = get_battles_after(cursor=cursor, per_page=per_page)
+        return page["battles"], page["next_cursor"]
+
+    assert walk(fetch, per_page) == expected
+
+
+@pytest.mark.parametrize("per_page", [1, 5, 13])
+def test_user_history_pages_cover_every_battle_once(battles, per_page):
+    user, all_battles = battles
+    expected = [
+        battle_id
+        for battle_id in all_battles
+        if BattlePlayer.query.filter_by(battle_id=battle_id, user_id=user).count()
+    ]
+    assert len(expected) == 13
+
+    def fetch(cursor, per_page):
+        return get_user_battle_history_after(user, cursor=cursor, per_page=per_page)
+
+    assert walk(fetch, per_page) == expected
+
+
+def test_profile_history_api(app, battles):
+    user, _ = battles
+    app.register_blueprint(profile_bp, url_prefix="/profile")
+    client = app.test_client()
+
+    seen, cursor = [], ""
+    while True:
+        data = client.get(
+            f"/profile/api/battle-history/{user}",
+            query_string={"per_page": 5, "cursor": cursor},
+        ).get_json()
+        assert data["success"]
+        seen.extend(data["battles"])
+        if not data["pagination"]["has_next"]:
+            break
+        cursor = data["pagination"]["next_cursor"]
+    assert len({battle["id"] for battle in seen}) == 13
+    assert all(battle["player"]["user_id"] == user for battle in seen)
+
+    data = client.get(
+        f"/profile/api/battle-history/{user}", query_string={"cursor": "garbage"}
+    ).get_json()
+    assert not data["success"]
+    assert client.get("/profile/api/battle-history/missing").status_code == 404
@@ -0,0 +1,61 @@
+"""自动对战配对引擎的组局规则（game/pairing.py）"""
+
+import random
+
+import pytest
+
+from game.pairing import PairingEngine
+
+
+def make_engine(count, spread=10, seed=0, **kwargs):
+    engine = PairingEngine(rng=random.Random(seed), **kwargs)
+    engine.update_participants({key: 1000 + spread * key for key in range(count)})
+    return engine
+
+
+def test_lineup_has_distinct_participants_in_every_seat():
+    engine = make_engine(30)
+    for _ in range(50):
+        lineup = engine.next_lineup()
+        assert len(lineup) == 7
+        assert len(set(lineup)) == 7
+        assert all(0 <= key < 30 for key in lineup)
+
+
+def test_games_and_seats_stay_balanced():
+    engine = make_engine(30)
+    engine.next_lineups(300)
+    stats = engine.get_stats()
+    assert stats["max_games"] - stats["min_games"] <= 2
+    # 每人约 70 局，每个座位约 10 次
+    for key in range(30):
+        assert max(engine._seats[key]) - min(engine._seats[key]) <= 4
+
+
+def test_lineup_stays_within_elo_window():
+    engine = make_engine(100, spread=50, window=14)
+    for _ in range(100):
+        lineup = engine.next_lineup()
+        # 参与者的 ELO 按下标递增，候选窗口覆盖锚点附近的 15 人
+        assert max(lineup) - min(lineup) <= 14
+
+
+def test_refresh_keeps_counts_and_adds_newcomers():
+    engine = make_engine(10)
+    engine.next_lineups(20)
+    games = dict(engine._games)
+
+    ratings = {key: 1000 + 10 * key for key in range(1, 10)}  # 0 号退出
+    ratings[99] = 1050  # 新参与者
+    engine.update_participants(ratings, games={1: 0, 2: games[2] + 5})
+    assert engine._games[1] == games[1]  # 数据库场次较少时不调低
+    assert engine._games[2] == games[2] + 5
+    # 场次最少的新参与者作为下一局的锚点
+    assert 99 in engine.next_lineup()
+    assert all(0 not in engine.next_lineup() for _ in range(20))
+
+
+def test_not_enough_participants():
+    engine = make_engine(6)
+    with pytest.raises(ValueError):
+        engine.next_lineup()
@@ -0,0 +1,103 @@
+"""流式读取公共日志与结算摘要（database/result_summary.py）"""
+
+import json
+import random
+
+import pytest
+
+from database.result_summary import (
+    ResultSummaryBuilder,
+    iter_public_log,
+    summarize_public_log,
+)
+
+RESULT = {
+    "winner": "blue",
+    "roles": {1: "Merlin", 2: "Assassin"},
+    "rounds_played": 5,
+}
+
+
+def make_events(count=300, seed=3):
+    rng = random.Random(seed)
+    events = [{"type": "game_start", "note": '开局 "引号" 与 [括号] {花括号}'}]
+    for i in range(count):
+        kind = rng.random()
+        if kind < 0.1:
+            events.append(
+                {
+                    "type": rng.choice(
+                        ["critical_player_ERROR", "player_ruturn_ERROR"]
+                    ),
+                    "error_code_pid": rng.choice([1, 4, 7, 9, None]),
+                    "error_code_method": "walk",
+                    "error_msg": "x" * rng.randint(0, 5000),
+                }
+            )
+        elif kind < 0.2:
+            events.append(
+                {
+                    "type": "tokens",
+                    "result": [
+                        {"input": rng.randint(0, 9000), "output": rng.randint(0, 900)}
+                        for _ in range(7)
+                    ],
+                }
+            )
+        else:
+            events.append(
+                {"type": "speech", "round": i, "text": "说" * rng.randint(0, 400)}
+            )
+    return events
+
+
+def write_log(path, events, indent=None):
+    path.write_text(json.dumps(events, ensure_ascii=False, indent=indent), "utf-8")
+    return str(path)
+
+
+@pytest.mark.parametrize("chunk_size", [7, 64, 4096, 1 << 20])
+@pytest.mark.parametrize("indent", [None, 2])
+def test_streaming_matches_full_parse(tmp_path, chunk_size, indent):
+    events = make_events()
+    path = write_log(tmp_path / "public.json", events, indent)
+    assert list(iter_public_log(path, chunk_size=chunk_size)) == events
+
+
+def test_summary_matches_feeding_every_event(tmp_path):
+    events = make_events()
+    path = write_log(tmp_path / "public.json", events)
+    builder = ResultSummaryBuilder()
+    for event in events:
+        builder.feed(event)
+    assert summarize_public_log(path, RESULT) == builder.build(RESULT)
+
+
+def test_summary_counts_errors_and_keeps_last_tokens(tmp_path):
+    events = [
+        {"type": "tokens", "result": [{"input": 1, "output": 1}] * 7},
+        {"type": "player_ruturn_ERROR", "error_code_pid": 9, "error_msg": "bad"},
+        {"type": "critical_player_ERROR", "error_code_pid": 3, "error_msg": "a"},
+        {"type": "critical_player_ERROR", "error_code_pid": 3, "error_msg": "b"},
+        {"type": "tokens", "result": [{"input": 2, "output": 5}] * 7},
+    ]
+    summary = summarize_public_log(write_log(tmp_path / "public.json", events), RESULT)
+    assert summary["errors"] == [0, 0, 2, 0, 0, 0, 0]
+    assert summary["tokens"] == [{"input": 2, "output": 5}] * 7
+    assert summary["error"]["msg"] == "b"
+    assert summary["roles"] == {"1": "Merlin", "2": "Assassin"}
+    assert summary["rounds"] == 5
+
+
+def test_empty_log(tmp_path):
+    assert list(iter_public_log(write_log(tmp_path / "public.json", []))) == []
+
+
+def test_rejects_non_array_and_truncated_logs(tmp_path):
+    path = tmp_path / "public.json"
+    path.write_text('{"type": "tokens"}', "utf-8")
+    with pytest.raises(ValueError):
+        list(iter_public_log(str(path)))
+    path.write_text('[{"type": "tokens"}, {"type": "spe', "utf-8")
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_public_log(str(path), chunk_size=8))
@@ -0,0 +1,115 @@
+"""批量写入对战结果：单项失败只回滚该项的保存点，异常回滚整批（database/action.py）"""
+
+import json
+
+import pytest
+
+import database.action as action
+from database import create_battle
+from database.action import record_battle_results_batch
+from database.base import db
+from database.models import Battle, BattlePlayer, GameStats
+from database.result_summary import ResultSummaryBuilder
+
+ROLES = ["Merlin", "Percival", "Knight", "Knight", "Morgana", "Assassin", "Oberon"]
+
+
+def make_results(winner):
+    results = {
+        "roles": dict(zip(range(1, 8), ROLES)),
+        "rounds_played": 4,
+        "winner": winner,
+        "game_log_uuid": "log-uuid",
+    }
+    builder = ResultSummaryBuilder()
+    builder.feed({"type": "tokens", "result": [{"input": 1, "output": 1}] * 7})
+    results["summary"] = builder.build(results)
+    # 与经过 IPC 传回的结果一致：键为字符串
+    return json.loads(json.dumps(results))
+
+
+@pytest.fixture
+def battles(make_players):
+    players = make_players(7)
+    return [
+        create_battle(
+            [{"user_id": u, "ai_code_id": c} for u, c in players], ranking_id=1
+        ).id
+        for _ in range(3)
+    ]
+
+
+def games_played():
+    return sorted(stats.games_played for stats in GameStats.query)
+
+
+def test_failed_item_rolls_back_only_its_savepoint(battles, monkeypatch):
+    first, broken, last = battles
+    process = action.process_battle_results_and_update_stats
+
+    def fail_after_writing(battle_id, results_data, commit=True):
+        # 模拟结算写完对战、玩家记录与 GameStats 后才失败
+        succeeded = process(battle_id, results_data, commit=commit)
+        return succeeded and battle_id != broken
+
+    monkeypatch.setattr(
+        action, "process_battle_results_and_update_stats", fail_after_writing
+    )
+    outcomes = record_battle_results_batch(
+        [
+            ("completed", first, make_results("red")),
+            ("completed", broken, make_results("red")),
+            ("completed", last, make_results("blue")),
+        ]
+    )
+    assert outcomes == [True, False, True]
+    db.session.remove()
+
+    assert games_played() == [2] * 7
+    for battle_id in (first, last):
+        battle = db.session.get(Battle, battle_id)
+        assert battle.status == "completed"
+        assert "error" not in json.loads(battle.results)
+        assert battle.summary is not None
+    # 失败项的写入随保存点回滚，只留下兜底的状态
+    battle = db.session.get(Battle, broken)
+    assert battle.status == "completed"
+    assert json.loads(battle.results)["error"] == "结果处理失败"
+    assert battle.game_log_uuid is None
+    players = BattlePlayer.query.filter_by(battle_id=broken).all()
+    assert all(p.outcome is None and p.elo_change is None for p in players)
+
+
+def test_invalid_winner_is_reported_per_item(battles):
+    first, broken, last = battles
+    outcomes = record_battle_results_batch(
+        [
+            ("completed", first, make_results("red")),
+            ("completed", broken, make_results("purple")),
+            ("completed", last, make_results("blue")),
+        ]
+    )
+    assert outcomes == [True, False, True]
+    db.session.remove()
+    assert games_played() == [2] * 7
+
+
+def test_exception_rolls_back_whole_batch(battles, monkeypatch):
+    process = action.process_battle_results_and_update_stats
+    calls = []
+
+    def failing_second_call(*args, **kwargs):
+        calls.append(args[0])
+        if len(calls) == 2:
+            raise RuntimeError("数据库连接中断")
+        return process(*args, **kwargs)
+
+    monkeypatch.setattr(
+        action, "process_battle_results_and_update_stats", failing_second_call
+    )
+    items = [("completed", battle_id, make_results("red")) for battle_id in battles]
+    assert record_battle_results_batch(items) is None
+    db.session.remove()
+
+    assert games_played() == [0] * 7
+    assert {battle.status for battle in Battle.query} == {"waiting"}
@@ -0,0 +1,70 @@
+"""TokenBucket 的补充与扣减（game/client_manager.py）"""
+
+import pytest
+
+from game.client_manager import TokenBucket
+
+
+@pytest.fixture
+def bucket():
+    # 每秒补充 1 个令牌，容量 10
+    bucket = TokenBucket(per_minute=60, burst_seconds=10)
+    bucket.updated_at = 0.0
+    return bucket
+
+
+def test_starts_full_and_debits(bucket):
+    assert bucket.capacity == 10
+    assert bucket.time_until(4, now=0.0) == 0.0
+    bucket.consume(4, now=0.0)
+    assert bucket.tokens == 6
+
+
+def test_refills_at_rate_up_to_capacity(bucket):
+    bucket.consume(10, now=0.0)
+    assert bucket.time_until(3, now=0.0) == pytest.approx(3.0)
+    assert bucket.time_until(3, now=2.0) == pytest.approx(1.0)
+    assert bucket.time_until(3, now=3.0) == 0.0
+    bucket._refill(100.0)
+    assert bucket.tokens == bucket.capacity
+
+
+def test_oversized_request_waits_for_full_bucket_and_goes_into_debt(bucket):
+    bucket.consume(5, now=0.0)
+    # 超过容量的请求只需等到桶满
+    assert bucket.time_until(25, now=0.0) == pytest.approx(5.0)
+    bucket.consume(25, now=5.0)
+    assert bucket.tokens == -15
+    assert bucket.time_until(1, now=5.0) == pytest.approx(16.0)
+
+
+def test_reserve_keeps_headroom(bucket):
+    bucket.consume(5, now=0.0)
+    assert bucket.time_until(1, now=0.0) == 0.0
+    # 保留 50% 容量时需要 1 + 5 个令牌
+    assert bucket.time_until(1, now=0.0, reserve=0.5) == pytest.approx(1.0)
+
+
+def test_refund_and_drain(bucket):
+    bucket.consume(8, now=0.0)
+    bucket.refund(3)
+    assert bucket.tokens == 5
+    bucket.refund(100)
+    assert bucket.tokens == bucket.capacity
+    bucket.refund(-4)  # 实际用量超过预估时补扣
+    assert bucket.tokens == 6
+    bucket.drain(now=0.0)
+    assert bucket.tokens == 0
+    assert bucket.time_until(2, now=0.0) == pytest.approx(2.0)
+
+
+def test_small_quota_still_admits_single_request():
+    bucket = TokenBucket(per_minute=3, burst_seconds=10)
+    assert bucket.capacity == 1.0
+
+
+def test_unlimited():
+    bucket = TokenBucket(per_minute=None)
+    assert bucket.unlimited
+    bucket.consume(1000, now=0.0)
+    assert bucket.time_until(1000, now=0.0) == 0.0
@@ -12,7 +12,7 @@ from .db_utils import (
 )
 
 # 从 battle_manager_utils 导入函数
-from .battle_manager_utils import get_battle_manager
+from .battle_manager_utils import get_battle_manager, busy_response
 from .automatch_utils import get_automatch
 
 # 定义 __all__ 以便 `from utils import *` 使用
@@ -25,6 +25,7 @@ __all__ = [
     "ensure_data_directories",
     # battle_manager_utils functions
     "get_battle_manager",
+    "busy_response",
     # automatch functions
     "get_automatch",
 ]
@@ -5,8 +5,15 @@
 
 
 import logging
-from flask import Flask  # 导入 Flask
-from game.battle_manager import BattleManager
+import threading
+from flask import Flask, jsonify  # 导入 Flask
+from game.battle_manager import BattleManager, BattleQueueFullError
+from game.battle_ipc import (
+    BattleServiceClient,
+    BattleServiceServer,
+    HostElection,
+    get_battle_service_config,
+)
 from services.battle_service import BattleService, get_battle_service
 
 # 配置日志
@@ -16,6 +23,10 @@ logger = logging.getLogger("BattleManagerUtils")
 _battle_manager = None
 _battle_service = None  # 缓存 service 实例
 _app_ref: Flask = None  # 用于存储 Flask app 实例的引用
+# BATTLE_SERVICE.mode 为 host 时使用：本机执行进程选举与服务端
+_host_election: HostElection = None
+_battle_server: BattleServiceServer = None
+_manager_lock = threading.RLock()
 
 
 def init_battle_manager_utils(app: Flask):
@@ -28,9 +39,13 @@ def init_battle_manager_utils(app: Flask):
 
 
 def get_battle_manager() -> BattleManager:
-    """获取对战管理器单例实例，并确保注入 BattleService"""
+    """
+    获取对战管理器单例实例，并确保注入 BattleService
+    BATTLE_SERVICE.mode 为 host 时，本机只有当选进程持有真正的 BattleManager，
+    其余进程获得转发调用的 BattleServiceClient；
+    mode 为 runner 时对战只在独立的 battle_runner.py 进程中执行，web 进程只获得 client
+    """
     global _battle_manager
-    global _battle_service
     global _app_ref
 
     if _app_ref is None:
@@ -40,32 +55,113 @@ def get_battle_manager() -> BattleManager:
         )
 
     if _battle_manager is None:
-        if _battle_service is None:
-            try:
-                # 将存储的 app 引用传递给工厂函数
-                _battle_service = get_battle_service(_app_ref)
-                logger.info("BattleService instance created.")
-            except Exception as e:
-                logger.exception("Failed to create BattleService instance.")
-                raise RuntimeError(
-                    "Could not initialize BattleService for BattleManager"
-                ) from e
-
-        # 创建 BattleManager 并注入 service
-        _battle_manager = BattleManager(battle_service=_battle_service)
-        logger.info("BattleManager instance created and injected with BattleService.")
+        with _manager_lock:
+            if _battle_manager is not None:
+                return _battle_manager
+            service_config = get_battle_service_config()
+            if service_config["mode"] == "host":
+                _battle_manager = _elect_battle_host() or BattleServiceClient(
+                    service_config["socket_path"],
+                    timeout=float(service_config["timeout"]),
+                    on_disconnect=_elect_battle_host,
+                )
+            elif service_config["mode"] == "runner":
+                _battle_manager = BattleServiceClient(
+                    service_config["socket_path"],
+                    timeout=float(service_config["timeout"]),
+                )
+            else:
+                _battle_manager = _create_local_battle_manager()
     # else: # 移除这个日志，因为它在每次获取时都会打印
     # logger.info("BattleManager instance reused.")
     return _battle_manager
 
 
+def _create_local_battle_manager() -> BattleManager:
+    global _battle_service
+
+    if _battle_service is None:
+        try:
+            # 将存储的 app 引用传递给工厂函数
+            _battle_service = get_battle_service(_app_ref)
+            logger.info("BattleService instance created.")
+        except Exception as e:
+            logger.exception("Failed to create BattleService instance.")
+            raise RuntimeError(
+                "Could not initialize BattleService for BattleManager"
+            ) from e
+
+    # 创建 BattleManager 并注入 service
+    manager = BattleManager(battle_service=_battle_service)
+    logger.info("BattleManager instance created and injected with BattleService.")
+    return manager
+
+
+def is_battle_host(lock_path: str = None) -> bool:
+    """尝试当选本机对战执行进程（已当选时直接返回 True），不启动 BattleManager"""
+    global _host_election
+
+    with _manager_lock:
+        if _host_election is None:
+            _host_election = HostElection(
+                lock_path or get_battle_service_config()["lock_path"]
+            )
+        return _host_election.try_acquire()
+
+
+def _elect_battle_host(socket_path: str = None, lock_path: str = None):
+    """
+    尝试成为本机对战执行进程。当选后创建本地 BattleManager 并在 Unix socket 上提供服务，
+    返回该 BattleManager；未当选返回 None
+    """
+    global _battle_manager, _battle_server
+
+    with _manager_lock:
+        if _battle_server is not None:
+            return _battle_manager
+        if not is_battle_host(lock_path):
+            return None
+
+        manager = _create_local_battle_manager()
+        _battle_server = BattleServiceServer(
+            manager,
+            socket_path or get_battle_service_config()["socket_path"],
+            app=_app_ref,
+        )
+        _battle_server.start()
+        _battle_manager = manager
+        return manager
+
+
+def start_battle_runner(socket_path: str = None, lock_path: str = None):
+    """
+    供 battle_runner.py 调用：以独立执行进程身份启动本地 BattleManager 与 socket 服务
+    同一 lock_path 已有执行进程时返回 None
+    """
+    return _elect_battle_host(socket_path, lock_path)
+
+
+def stop_battle_runner(drain_timeout: float = None) -> bool:
+    """排空本进程的 BattleManager 并关闭 socket 服务，返回是否在超时前排空"""
+    with _manager_lock:
+        manager, server = _battle_manager, _battle_server
+    drained = True
+    if isinstance(manager, BattleManager):
+        # 排空期间 socket 服务保持可用：状态与快照照常查询，新对战收到 429
+        drained = manager.drain(drain_timeout)
+        manager.battle_queue.shutdown()
+    if server is not None:
+        server.shutdown()
+    return drained
+
+
 def get_shared_battle_service() -> BattleService:
     """获取共享的 BattleService 实例"""
     global _battle_service
     global _app_ref
 
-    # 优先从已初始化的 manager 获取
-    if _battle_manager:
+    # 优先从已初始化的 manager 获取（BattleServiceClient 不持有 service）
+    if isinstance(_battle_manager, BattleManager):
         return _battle_manager.battle_service
     elif _battle_service:
         return _battle_service
@@ -91,3 +187,12 @@ def get_shared_battle_service() -> BattleService:
             raise RuntimeError(
                 "Cannot get BattleService: BattleManagerUtils not initialized with Flask app."
             )
+
+
+def busy_response(error: BattleQueueFullError):
+    """将对战队列已满的错误转换为 HTTP 429 响应，并带上 Retry-After 头"""
+    return (
+        jsonify(error.to_dict()),
+        429,
+        {"Retry-After": str(error.retry_after)},
+    )